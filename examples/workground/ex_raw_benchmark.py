@@ -0,0 +1,51 @@
+import logging
+from pathlib import Path
+import time
+
+from hyo2.abc.lib.logging import set_logging
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_formats import KongsbergDatagrams
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_formats import KmallDatagrams
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.reader import KongsbergKmall
+from hyo2.openbst.lib.raw.parsers.kongsberg.reader import Kongsberg
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams
+from hyo2.openbst.lib.raw.parsers.reson.reader import Reson
+
+set_logging(ns_list=["hyo2.openbst", ])
+logger = logging.getLogger(__name__)
+
+testing = TestingPaths(root_folder=Path(__file__).parents[2].resolve())
+
+# the datagrams read by the importers, for each reader
+benchmarks = [
+    (Reson, testing.download_data_folder().joinpath('reson', '20190321_185116.s7k'),
+     [ResonDatagrams.SONARSETTINGS, ResonDatagrams.RAWDETECTDATA, ResonDatagrams.BEAMGEO,
+      ResonDatagrams.ROLLPITCHHEAVE, ResonDatagrams.POSITION]),
+    (Kongsberg, testing.download_data_folder().joinpath('kongsberg', '0001_20190410_120000_EM2040.all'),
+     [KongsbergDatagrams.RUNTIME, KongsbergDatagrams.RAWRANGEANGLE78, KongsbergDatagrams.SEABEDIMAGE89,
+      KongsbergDatagrams.ATTITUDE, KongsbergDatagrams.POSITION]),
+    (KongsbergKmall, testing.download_data_folder().joinpath('kongsberg', '0001_20190410_120000_EM2040P.kmall'),
+     [KmallDatagrams.MULTIBEAMRAWRANGEDEPTH, KmallDatagrams.ATTITUDE, KmallDatagrams.POSITION]),
+]
+
+for reader, raw_path, dg_types in benchmarks:
+    if not raw_path.exists():
+        logger.warning("missing: %s" % raw_path)
+        continue
+
+    for use_mmap in (False, True):
+        with reader(raw_path, use_mmap=use_mmap) as raw:
+            start = time.perf_counter()
+            raw.data_map()
+            index_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            num_records = 0
+            for dg_type in dg_types:
+                num_records += len(raw.get_batch(dg_type=dg_type))
+            decode_time = time.perf_counter() - start
+
+            file_mb = raw.file_length / 1024 / 1024
+            logger.info("%s (mmap: %s): %.1f MB, %d datagrams, index %.3f s (%.0f MB/s), decode %d records %.3f s"
+                        % (raw_path.name, use_mmap, file_mb, raw.map.size, index_time, file_mb / index_time,
+                           num_records, decode_time))
@@ -9,7 +9,9 @@ import logging
 import sys, struct, pickle
 import numpy as np
 import matplotlib.pyplot as plt
-import time, calendar, math
+import time, math
+
+from hyo2.openbst.lib.raw.parsers.reson.dg_index import dg_seconds
 
 logger = logging.getLogger(__name__)
 
@@ -466,10 +468,8 @@ class DataFrame:
 
     def gettime(self):
         """Converts the header time to seconds in Unix time (1970?) and returns it"""
-        self.time_fmt = '%Y, %j, %H, %M'
-        self.temptime = str(self.header[6:8])[1:-1] + ', ' + str(self.header[9:11])[1:-1]
-        self.timestruct = time.strptime(self.temptime, self.time_fmt)
-        self.utctime = calendar.timegm(self.timestruct) + self.header[8]
+        self.utctime = float(dg_seconds(self.header[6], self.header[7], self.header[9], self.header[10],
+                                        self.header[8]))
         return self.utctime
 
     def display(self):
@@ -0,0 +1,157 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class DatagramBatch:
+    """Columnar decoding of many records of a single datagram type
+
+    - header: structured array with the record type header fields, one row per record
+    - data: dict of per-beam/per-sample arrays, either 2-D (record, beam) padded or flat (ragged)
+    - offsets: for the ragged data, the entries of record n are data[name][offsets[n]:offsets[n + 1]]
+    - sample_offsets: for ragged data with a further level (e.g., snippets), the samples of entry k are
+      data['samples'][sample_offsets[k]:sample_offsets[k + 1]]
+    - for the records packing many samples (e.g., attitude), data['time_offset'] has the milliseconds of each
+      sample from its record time
+    """
+
+    def __init__(self, dg_type, header: np.ndarray):
+        self.dg_type = dg_type
+        self.header = header
+        self.time = None
+        self.data = dict()
+        self.offsets = None
+        self.sample_offsets = None
+        self.beam_field = None  # the ragged data field with the beam numbers
+
+    def __len__(self):
+        return self.header.size
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name in self.data:
+            return self.data[name]
+        return self.header[name]
+
+    def __repr__(self):
+        msg = "<%s>\n" % self.__class__.__name__
+        msg += "  <type: %s>\n" % self.dg_type
+        msg += "  <records: %d>\n" % len(self)
+        msg += "  <data: %s>\n" % ", ".join(self.data.keys())
+        return msg
+
+    def record(self, name: str, index: int) -> np.ndarray:
+        """Return the ragged data of the index-th record (a view)"""
+        return self.data[name][self.offsets[index]:self.offsets[index + 1]]
+
+    def record_index(self) -> np.ndarray:
+        """Return the record (row) of each entry of the ragged data"""
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    def sample_time(self) -> np.ndarray:
+        """Return the time of each sample of the ragged data, as record time plus the sample time offset"""
+        return np.repeat(self.time, np.diff(self.offsets)) + self.data['time_offset']
+
+    def to_beams(self, name: str, num_beams: int, fill_value=np.nan) -> np.ndarray:
+        """Scatter a ragged per-beam field into a (record, beam) array, using the beam numbers"""
+        values = self.data[name]
+        out = np.full((len(self), num_beams), fill_value, dtype=np.result_type(values.dtype, np.float32))
+        out[self.record_index(), self.data[self.beam_field]] = values
+        return out
+
+
+def entry_index(offsets: np.ndarray) -> np.ndarray:
+    """Return the position of each ragged entry in its record (e.g., the beam number)"""
+    return np.arange(offsets[-1]) - np.repeat(offsets[:-1], np.diff(offsets))
+
+
+def join_batches(parts: list) -> DatagramBatch:
+    """Join the (rows, batch) parts of the records of a type, decoded apart, in a single batch in row order
+
+    The headers and the flat ragged data (with offsets) are joined, the times are left to the caller.
+    """
+    rows = np.concatenate([part_rows for part_rows, _ in parts])
+    order = np.argsort(rows, kind='stable')
+    first = parts[0][1]
+    batch = type(first)(first.dg_type, np.concatenate([part.header for _, part in parts])[order])
+    batch.beam_field = first.beam_field
+    if first.offsets is not None:
+        counts = np.concatenate([np.diff(part.offsets) for _, part in parts])[order]
+        batch.offsets = np.zeros(len(batch) + 1, dtype=np.int64)
+        np.cumsum(counts, out=batch.offsets[1:])
+        # the entries of each record stay in order, as they are contiguous in a single part
+        entry_order = np.argsort(np.concatenate([part_rows[part.record_index()] for part_rows, part in parts]),
+                                 kind='stable')
+        for name in first.data:
+            batch.data[name] = np.concatenate([part.data[name] for _, part in parts])[entry_order]
+    return batch
+
+
+def headers(chunks: list, dtype: np.dtype) -> np.ndarray:
+    """Decode the leading bytes of each chunk as one structured array"""
+    if any(len(chunk) < dtype.itemsize for chunk in chunks):
+        raise RuntimeError("Record shorter than its header: %d bytes" % dtype.itemsize)
+    return np.frombuffer(b''.join(chunk[:dtype.itemsize] for chunk in chunks), dtype=dtype)
+
+
+def gather(buffer, offsets, dtype: np.dtype) -> np.ndarray:
+    """Decode a dtype item at each offset of buffer, with a single fancy indexing (no per-record objects)"""
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if offsets.size > 0 and (offsets.min() < 0 or offsets.max() + dtype.itemsize > data.size):
+        raise RuntimeError("Record outside of the buffer")
+    return data[offsets[:, np.newaxis] + np.arange(dtype.itemsize)].view(dtype).reshape(-1)
+
+
+def merge_fields(*arrays) -> np.ndarray:
+    """Merge the fields (but the paddings) of structured arrays with the same length in a single one"""
+    names = [(array, name) for array in arrays for name in array.dtype.names if not name.startswith('padding')]
+    merged = np.empty(len(arrays[0]), dtype=[(name, array.dtype.fields[name][0]) for array, name in names])
+    for array, name in names:
+        merged[name] = array[name]
+    return merged
+
+
+def record_offsets(chunks: list) -> tuple:
+    """Return the chunks joined in a single buffer, with the start and the size of each of them"""
+    sizes = np.array([len(chunk) for chunk in chunks], dtype=np.int64)
+    starts = np.zeros(sizes.size, dtype=np.int64)
+    np.cumsum(sizes[:-1], out=starts[1:])
+    return b''.join(chunks), starts, sizes
+
+
+def ragged(chunks: list, starts, counts, dtype: np.dtype) -> tuple:
+    """Concatenate the counts[n] items found at starts[n] in each chunk, returning them with their offsets"""
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    starts = np.broadcast_to(np.asarray(starts, dtype=np.int64), counts.shape)
+    ends = starts + counts * dtype.itemsize
+    if any(len(chunk) < end for chunk, end in zip(chunks, ends.tolist())):
+        raise RuntimeError("Record shorter than its data section")
+    values = np.frombuffer(b''.join(chunk[start:end] for chunk, start, end in
+                                    zip(chunks, starts.tolist(), ends.tolist())), dtype=dtype)
+    return values, offsets
+
+
+def ragged_mixed(chunks: list, starts, counts, keys, dtypes: dict, out: np.ndarray) -> tuple:
+    """As ragged, for records with an item dtype depending on a key (e.g., a field size), converted into out"""
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    starts = np.broadcast_to(np.asarray(starts, dtype=np.int64), counts.shape)
+    keys = np.asarray(keys)
+
+    for key in np.unique(keys).tolist():
+        if key not in dtypes:
+            raise RuntimeError("Unrecognized data layout: %s" % key)
+        rows = np.flatnonzero(keys == key)
+        part, part_offsets = ragged([chunks[row] for row in rows.tolist()], starts[rows], counts[rows], dtypes[key])
+        positions = np.arange(part.size) + np.repeat(offsets[rows] - part_offsets[:-1], counts[rows])
+        if out.dtype.names is None:
+            out[positions] = part
+        else:
+            for name in part.dtype.names:
+                out[name][positions] = part[name]
+    return out, offsets
@@ -0,0 +1,152 @@
+import logging
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.batch import DatagramBatch, entry_index, headers, ragged
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_formats import KongsbergDatagrams, attitude_dtype, \
+    attitude_sample_dtype, position_dtype, range_angle_beam_dtype, range_angle_dtype, range_angle_sector_dtype, \
+    runtime_dtype, seabed_image_beam_dtype, seabed_image_dtype, xyz_beam_dtype, xyz_dtype
+
+logger = logging.getLogger(__name__)
+
+
+class KongsbergBatch(DatagramBatch):
+    """Columnar decoding of many .all datagrams of a single KongsbergDatagrams type
+
+    The data dict holds the scaled fields (degrees, metres, seconds, Hz, dB), taking precedence over the raw
+    header integers with the same name. For the raw range and angle datagrams, the tx sector fields are stored
+    as 'tx_' + name, with the sectors of record n at sector_offsets[n]:sector_offsets[n + 1].
+    """
+
+    def __init__(self, dg_type: KongsbergDatagrams, header: np.ndarray):
+        super().__init__(dg_type, header)
+        self.sector_offsets = None
+
+
+def scaled(batch: DatagramBatch, values: np.ndarray, names, scale: float):
+    """Store the passed fields of values, multiplied by scale, in the batch data"""
+    for name in names:
+        batch.data[name] = values[name] * scale
+
+
+def parse_batch(dg_type: KongsbergDatagrams, chunks: list) -> KongsbergBatch:
+    """Decode many data sections (after the common header) of dg_type into a KongsbergBatch"""
+    dtype = header_records.get(dg_type)
+    if dtype is not None:
+        return parse_header(dg_type, headers(chunks, dtype))
+
+    parser = batch_parsers.get(dg_type)
+    if parser is None:
+        raise RuntimeError("Batch decoding not supported for %s" % dg_type)
+    return parser(chunks)
+
+
+def parse_header(dg_type: KongsbergDatagrams, header: np.ndarray) -> KongsbergBatch:
+    """Wrap the decoded fixed part of the datagrams made of it only, scaling its fields"""
+    batch = KongsbergBatch(dg_type, header)
+    if dg_type is KongsbergDatagrams.POSITION:
+        batch.data['latitude'] = header['latitude'] / 20000000.0
+        batch.data['longitude'] = header['longitude'] / 10000000.0
+        scaled(batch, header, ('fix_quality', 'speed_over_ground', 'course', 'heading'), 0.01)
+    elif dg_type is KongsbergDatagrams.RUNTIME:
+        scaled(batch, header, ('absorption', ), 0.01)
+        scaled(batch, header, ('tx_beam_width', 'rx_beam_width', 'tx_along_tilt'), 0.1)
+        scaled(batch, header, ('tx_pulse_length', ), 1e-6)
+        scaled(batch, header, ('rx_band_width', ), 50.0)
+    return batch
+
+
+def parse_batch_attitude(chunks: list) -> KongsbergBatch:
+    """Attitude samples, ragged, with their time offsets in milliseconds"""
+    batch = KongsbergBatch(KongsbergDatagrams.ATTITUDE, headers(chunks, attitude_dtype))
+    samples, batch.offsets = ragged(chunks, attitude_dtype.itemsize, batch.header['num_samples'],
+                                    attitude_sample_dtype)
+    batch.data['time_offset'] = samples['time_offset'].astype(np.float64)
+    batch.data['sensor_status'] = np.ascontiguousarray(samples['sensor_status'])
+    scaled(batch, samples, ('roll', 'pitch', 'heave', 'heading'), 0.01)
+    return batch
+
+
+def parse_batch_range_angle(chunks: list) -> KongsbergBatch:
+    """Raw range and angle 78: tx sectors and rx beams, both ragged"""
+    batch = KongsbergBatch(KongsbergDatagrams.RAWRANGEANGLE78, headers(chunks, range_angle_dtype))
+    batch.beam_field = 'beam'
+    num_sectors = batch.header['num_tx_sectors'].astype(np.int64)
+    scaled(batch, batch.header, ('sound_speed', ), 0.1)
+
+    sectors, batch.sector_offsets = ragged(chunks, range_angle_dtype.itemsize, num_sectors,
+                                           range_angle_sector_dtype)
+    for name in range_angle_sector_dtype.names:
+        batch.data['tx_' + name] = np.ascontiguousarray(sectors[name])
+    batch.data['tx_tilt_angle'] = sectors['tilt_angle'] * 0.01
+    batch.data['tx_mean_absorption'] = sectors['mean_absorption'] * 0.01
+    batch.data['tx_focus_range'] = sectors['focus_range'] * 0.1
+
+    beams_start = range_angle_dtype.itemsize + num_sectors * range_angle_sector_dtype.itemsize
+    beams, batch.offsets = ragged(chunks, beams_start, batch.header['num_rx_beams'], range_angle_beam_dtype)
+    for name in range_angle_beam_dtype.names:
+        if name != 'spare':
+            batch.data[name] = np.ascontiguousarray(beams[name])
+    scaled(batch, beams, ('rx_angle', ), 0.01)
+    scaled(batch, beams, ('reflectivity', ), 0.1)
+    batch.data['beam'] = entry_index(batch.offsets)
+    return batch
+
+
+def parse_batch_xyz(chunks: list) -> KongsbergBatch:
+    """XYZ 88 soundings, ragged"""
+    batch = KongsbergBatch(KongsbergDatagrams.XYZ88, headers(chunks, xyz_dtype))
+    batch.beam_field = 'beam'
+    scaled(batch, batch.header, ('heading', ), 0.01)
+    scaled(batch, batch.header, ('sound_speed', ), 0.1)
+
+    beams, batch.offsets = ragged(chunks, xyz_dtype.itemsize, batch.header['num_beams'], xyz_beam_dtype)
+    for name in xyz_beam_dtype.names:
+        batch.data[name] = np.ascontiguousarray(beams[name])
+    scaled(batch, beams, ('incidence_adjustment', 'reflectivity'), 0.1)
+    batch.data['beam'] = entry_index(batch.offsets)
+    return batch
+
+
+def parse_batch_seabed_image(chunks: list) -> KongsbergBatch:
+    """Seabed image 89: ragged beams, with their samples (dB) back to back in increasing range order"""
+    batch = KongsbergBatch(KongsbergDatagrams.SEABEDIMAGE89, headers(chunks, seabed_image_dtype))
+    batch.beam_field = 'beam'
+    scaled(batch, batch.header, ('normal_incidence_bs', 'oblique_bs', 'tx_beam_width', 'tvg_crossover_angle'), 0.1)
+    num_beams = batch.header['num_beams'].astype(np.int64)
+
+    beams, batch.offsets = ragged(chunks, seabed_image_dtype.itemsize, num_beams, seabed_image_beam_dtype)
+    for name in seabed_image_beam_dtype.names:
+        batch.data[name] = np.ascontiguousarray(beams[name])
+    batch.data['beam'] = entry_index(batch.offsets)
+
+    num_samples = batch.data['num_samples'].astype(np.int64)
+    batch.sample_offsets = np.zeros(num_samples.size + 1, dtype=np.int64)
+    np.cumsum(num_samples, out=batch.sample_offsets[1:])
+    record_samples = np.diff(batch.sample_offsets[batch.offsets])
+    samples, _ = ragged(chunks, seabed_image_dtype.itemsize + num_beams * seabed_image_beam_dtype.itemsize,
+                        record_samples, np.dtype('<i2'))
+
+    # the beams sorted backwards (sorting direction -1) store their samples from the farthest
+    backwards = np.repeat(batch.data['sorting_direction'] < 0, num_samples)
+    if np.any(backwards):
+        sample_beam = np.repeat(np.arange(num_samples.size), num_samples)
+        positions = np.arange(samples.size)
+        mirrored = 2 * batch.sample_offsets[sample_beam] + num_samples[sample_beam] - 1 - positions
+        samples = samples[np.where(backwards, mirrored, positions)]
+    batch.data['samples'] = samples * np.float32(0.1)
+    return batch
+
+
+# datagrams of which only the fixed part is decoded, as a single structured array
+header_records = {
+    KongsbergDatagrams.POSITION: position_dtype,
+    KongsbergDatagrams.RUNTIME: runtime_dtype,
+}
+
+batch_parsers = {
+    KongsbergDatagrams.ATTITUDE: parse_batch_attitude,
+    KongsbergDatagrams.RAWRANGEANGLE78: parse_batch_range_angle,
+    KongsbergDatagrams.XYZ88: parse_batch_xyz,
+    KongsbergDatagrams.SEABEDIMAGE89: parse_batch_seabed_image,
+}
@@ -0,0 +1,112 @@
+from enum import Enum
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class KongsbergDatagrams(Enum):
+    """EM series .all datagram types, valued as their type identifier byte"""
+
+    ATTITUDE = 0x41                 # 'A'
+    CLOCK = 0x43                    # 'C'
+    DEPTH = 0x44                    # 'D'
+    SURFACESOUNDSPEED = 0x47        # 'G'
+    HEADING = 0x48                  # 'H'
+    INSTALLATIONSTART = 0x49        # 'I'
+    RAWRANGEANGLE78 = 0x4E          # 'N'
+    POSITION = 0x50                 # 'P'
+    RUNTIME = 0x52                  # 'R'
+    SEABEDIMAGE = 0x53              # 'S'
+    TIDE = 0x54                     # 'T'
+    SOUNDSPEEDPROFILE = 0x55        # 'U'
+    XYZ88 = 0x58                    # 'X'
+    SEABEDIMAGE89 = 0x59            # 'Y'
+    INSTALLATIONSTOP = 0x69         # 'i'
+    WATERCOLUMN = 0x6B              # 'k'
+    EXTRAPARAMETERS = 0x33          # '3'
+    NETWORKATTITUDE = 0x6E          # 'n'
+    REMOTEINFO = 0x72               # 'r'
+
+
+kongsberg_datagram_code = {dg_type: dg_type.value for dg_type in KongsbergDatagrams}
+
+# Common header, after the 4-byte datagram length: the counter is the ping counter for the ping datagrams
+header_dtype = np.dtype([('stx', 'u1'), ('datagram_type', 'u1'), ('em_model', '<u2'), ('date', '<u4'),
+                         ('time', '<u4'), ('counter', '<u2'), ('serial_number', '<u2')])
+
+# Attitude 'A': the samples follow the count, with their time in ms from the datagram time
+attitude_dtype = np.dtype([('num_samples', '<u2')])
+attitude_sample_dtype = np.dtype([('time_offset', '<u2'), ('sensor_status', '<u2'), ('roll', '<i2'),
+                                  ('pitch', '<i2'), ('heave', '<i2'), ('heading', '<u2')])
+
+# Position 'P': latitude in 1/20000000 deg, longitude in 1/10000000 deg, the input datagram follows
+position_dtype = np.dtype([('latitude', '<i4'), ('longitude', '<i4'), ('fix_quality', '<u2'),
+                           ('speed_over_ground', '<u2'), ('course', '<u2'), ('heading', '<u2'),
+                           ('position_system', 'u1'), ('input_size', 'u1')])
+
+# Runtime parameters 'R'
+runtime_dtype = np.dtype([('operator_station_status', 'u1'), ('processing_unit_status', 'u1'),
+                          ('bsp_status', 'u1'), ('sonar_head_status', 'u1'), ('mode', 'u1'),
+                          ('filter_identifier', 'u1'), ('min_depth', '<u2'), ('max_depth', '<u2'),
+                          ('absorption', '<u2'), ('tx_pulse_length', '<u2'), ('tx_beam_width', '<u2'),
+                          ('tx_power', 'i1'), ('rx_beam_width', 'u1'), ('rx_band_width', 'u1'),
+                          ('rx_fixed_gain', 'u1'), ('tvg_crossover_angle', 'u1'), ('sound_speed_source', 'u1'),
+                          ('max_port_swath', '<u2'), ('beam_spacing', 'u1'), ('max_port_coverage', 'u1'),
+                          ('stabilization_mode', 'u1'), ('max_starboard_coverage', 'u1'),
+                          ('max_starboard_swath', '<u2'), ('tx_along_tilt', '<i2'), ('filter_identifier_2', 'u1')])
+
+# Raw range and angle 78 'N': the tx sectors, then the rx beams
+range_angle_dtype = np.dtype([('sound_speed', '<u2'), ('num_tx_sectors', '<u2'), ('num_rx_beams', '<u2'),
+                              ('num_detections', '<u2'), ('sample_rate', '<f4'), ('d_scale', '<u4')])
+range_angle_sector_dtype = np.dtype([('tilt_angle', '<i2'), ('focus_range', '<u2'), ('signal_length', '<f4'),
+                                     ('sector_delay', '<f4'), ('center_frequency', '<f4'),
+                                     ('mean_absorption', '<u2'), ('waveform', 'u1'), ('sector', 'u1'),
+                                     ('bandwidth', '<f4')])
+range_angle_beam_dtype = np.dtype([('rx_angle', '<i2'), ('sector', 'u1'), ('detection_info', 'u1'),
+                                   ('detection_window', '<u2'), ('quality_factor', 'u1'), ('d_corr', 'i1'),
+                                   ('travel_time', '<f4'), ('reflectivity', '<i2'), ('cleaning_info', 'i1'),
+                                   ('spare', 'u1')])
+
+# XYZ 88 'X'
+xyz_dtype = np.dtype([('heading', '<u2'), ('sound_speed', '<u2'), ('tx_depth', '<f4'), ('num_beams', '<u2'),
+                      ('num_detections', '<u2'), ('sample_rate', '<f4'), ('scanning_info', 'u1'),
+                      ('spare', 'u1', (3, ))])
+xyz_beam_dtype = np.dtype([('depth', '<f4'), ('across_track', '<f4'), ('along_track', '<f4'),
+                           ('detection_window', '<u2'), ('quality_factor', 'u1'), ('incidence_adjustment', 'i1'),
+                           ('detection_info', 'u1'), ('cleaning_info', 'i1'), ('reflectivity', '<i2')])
+
+# Seabed image 89 'Y': the beams, then their samples (amplitudes in 0.1 dB) back to back
+seabed_image_dtype = np.dtype([('sample_rate', '<f4'), ('normal_incidence_range', '<u2'),
+                               ('normal_incidence_bs', '<i2'), ('oblique_bs', '<i2'), ('tx_beam_width', '<u2'),
+                               ('tvg_crossover_angle', '<u2'), ('num_beams', '<u2')])
+seabed_image_beam_dtype = np.dtype([('sorting_direction', 'i1'), ('detection_info', 'u1'), ('num_samples', '<u2'),
+                                    ('center_sample', '<u2')])
+
+# Installation 'I', 'i' and remote information 'r': ASCII "KEY=value," parameters follow
+installation_dtype = np.dtype([('secondary_serial_number', '<u2')])
+
+# the fixed part of the data section of the decoded datagrams
+datagram_dtypes = {
+    KongsbergDatagrams.ATTITUDE: attitude_dtype,
+    KongsbergDatagrams.POSITION: position_dtype,
+    KongsbergDatagrams.RUNTIME: runtime_dtype,
+    KongsbergDatagrams.RAWRANGEANGLE78: range_angle_dtype,
+    KongsbergDatagrams.XYZ88: xyz_dtype,
+    KongsbergDatagrams.SEABEDIMAGE89: seabed_image_dtype,
+    KongsbergDatagrams.INSTALLATIONSTART: installation_dtype,
+    KongsbergDatagrams.INSTALLATIONSTOP: installation_dtype,
+    KongsbergDatagrams.REMOTEINFO: installation_dtype,
+}
+
+
+def installation_parameters(chunk) -> dict:
+    """Decode the ASCII parameters of an installation datagram data section as a dict"""
+    text = bytes(chunk[installation_dtype.itemsize:]).split(b'\x00')[0].decode('ascii', errors='replace')
+    parameters = dict()
+    for item in text.replace('\r', '').replace('\n', ',').split(','):
+        key, sep, value = item.partition('=')
+        if sep:
+            parameters[key.strip()] = value.strip()
+    return parameters
@@ -0,0 +1,165 @@
+import logging
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_formats import header_dtype, KongsbergDatagrams
+from hyo2.openbst.lib.raw.parsers.reson import dg_index as reson_index
+from hyo2.openbst.lib.raw.parsers.reson.dg_index import load_index, save_index, select_records
+
+logger = logging.getLogger(__name__)
+
+# Datagram frame: length (u4, bytes after it), header (STX first), data, ETX (u1) and checksum (u2).
+# The checksum is the sum of the bytes between STX and ETX (both excluded), modulo 65536.
+length_size = 4
+header_size = length_size + header_dtype.itemsize
+footer_size = 3
+stx = 0x02
+etx = 0x03
+default_block_size = 16 * 1024 * 1024
+block_overlap = 1024 * 1024  # datagrams starting in a block and ending in its overlap are validated in bulk
+no_ping = 0xFFFFFFFF  # Ping number of the datagrams not related to a ping
+
+# Index sidecar (see reson.dg_index.save_index), keyed as the s7k ones
+source_key = reson_index.source_key
+sidecar_magic = b'OBSTALLI'
+sidecar_version = 1
+
+# One entry per datagram, in file order. The size includes the length field.
+index_dtype = np.dtype([('offset', '<u8'), ('size', '<u4'), ('datagram_type', 'u1'), ('em_model', '<u2'),
+                        ('date', '<u4'), ('time', '<u4'), ('counter', '<u2'), ('serial_number', '<u2')])
+
+# One entry per datagram, sorted by datagram type and time. Location and size refer to the data section.
+map_dtype = np.dtype([('location', '<u8'), ('time', '<f8'), ('size', '<u4'), ('record_type', '<u4'),
+                      ('device_id', '<u4'), ('ping_number', '<u4')])
+
+datagram_types = np.array(sorted(dg_type.value for dg_type in KongsbergDatagrams), dtype=np.uint8)
+
+# Datagrams whose header counter is the ping counter
+ping_records = np.array([KongsbergDatagrams.DEPTH.value, KongsbergDatagrams.RAWRANGEANGLE78.value,
+                         KongsbergDatagrams.RUNTIME.value, KongsbergDatagrams.SEABEDIMAGE.value,
+                         KongsbergDatagrams.XYZ88.value, KongsbergDatagrams.SEABEDIMAGE89.value,
+                         KongsbergDatagrams.WATERCOLUMN.value], dtype=np.uint8)
+
+
+def dg_time(date, time):
+    """Convert the header date (yyyymmdd) and time (ms since midnight), scalars or arrays, to milliseconds since
+    1970-01-01 UTC, as for the cf standard"""
+    date = np.asarray(date, dtype=np.int64)
+    months = (date // 10000 - 1970) * 12 + (date // 100) % 100 - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + date % 100 - 1
+    return days.astype(np.float64) * 86400000 + np.asarray(time, dtype=np.float64)
+
+
+def scan_block(block: np.ndarray, block_offset: int, owned_size: int, file_length: int) -> tuple:
+    """Return the plausible datagrams starting in the first owned_size bytes of a uint8 block
+
+    The headers are validated in bulk on STX, type, length, date and time. The datagrams ending in the block
+    are also validated on ETX and checksum, and returned as the first item; the ones ending past the block
+    are returned as the second item, to be validated by validate_records.
+    """
+    starts = np.flatnonzero(block[length_size:length_size + owned_size] == stx)  # STX at start + length_size
+    starts = starts[starts + header_size <= block.size]
+    starts = starts[np.isin(block[starts + length_size + 1], datagram_types)]
+
+    empty = np.empty(0, dtype=index_dtype)
+    if starts.size == 0:
+        return empty, empty
+
+    lengths = block[starts[:, np.newaxis] + np.arange(length_size)].view('<u4').ravel().astype(np.int64)
+    headers = block[starts[:, np.newaxis] + length_size + np.arange(header_dtype.itemsize)] \
+        .view(header_dtype).ravel()
+    date = headers['date'].astype(np.int64)
+    valid = (lengths >= header_dtype.itemsize + footer_size) \
+        & (block_offset + starts + length_size + lengths <= file_length) \
+        & (date // 10000 >= 1980) & (date // 10000 <= 2100) & ((date // 100) % 100 >= 1) \
+        & ((date // 100) % 100 <= 12) & (date % 100 >= 1) & (date % 100 <= 31) & (headers['time'] < 86400000)
+
+    starts = starts[valid]
+    lengths = lengths[valid]
+    headers = headers[valid]
+    index = np.empty(starts.size, dtype=index_dtype)
+    index['offset'] = block_offset + starts
+    index['size'] = length_size + lengths
+    for name in ('datagram_type', 'em_model', 'date', 'time', 'counter', 'serial_number'):
+        index[name] = headers[name]
+
+    ends = starts + length_size + lengths
+    inside = ends <= block.size
+    checked = np.zeros(starts.size, dtype=bool)
+    if np.any(inside):
+        # 16-bit running sum: the wrap-around gives the checksum modulo 65536
+        running = np.cumsum(block, dtype=np.uint16)
+        first = starts[inside] + length_size + 1  # after STX
+        last = ends[inside] - footer_size  # ETX
+        checksum = running[last - 1] - running[first - 1]
+        stored = block[ends[inside, np.newaxis] - 2 + np.arange(2)].view('<u2').ravel()
+        checked[inside] = (block[last] == etx) & (checksum == stored)
+
+    return index[checked], index[~inside]
+
+
+def validate_records(read, index: np.ndarray) -> np.ndarray:
+    """Return the mask of the index entries with valid ETX and checksum, reading each datagram"""
+    valid = np.zeros(index.size, dtype=bool)
+    for n, (offset, size) in enumerate(zip(index['offset'].tolist(), index['size'].tolist())):
+        datagram = np.frombuffer(read(offset, size), dtype=np.uint8)
+        if datagram.size != size:
+            continue
+        checksum = int(datagram[length_size + 1:size - footer_size].sum(dtype=np.uint64)) % 65536
+        valid[n] = datagram[size - footer_size] == etx and \
+            checksum == int(datagram[size - 2:].view('<u2')[0])
+    return valid
+
+
+def scan(read, start: int, stop: int, file_length: int, block_size: int = default_block_size) -> tuple:
+    """Return the candidate datagrams starting in the [start, stop) byte range, scanned by blocks, with the
+    mask of the ones still to be validated on ETX and checksum"""
+    parts = [np.empty(0, dtype=index_dtype)]
+    pending_parts = [np.empty(0, dtype=bool)]
+    for block_offset in range(start, stop, block_size):
+        owned_size = min(block_size, stop - block_offset)
+        chunk = read(block_offset, owned_size + block_overlap)
+        block = np.frombuffer(chunk, dtype=np.uint8)
+        checked, pending = scan_block(block=block, block_offset=block_offset, owned_size=owned_size,
+                                      file_length=file_length)
+        parts.extend((checked, pending))
+        pending_parts.extend((np.zeros(checked.size, dtype=bool), np.ones(pending.size, dtype=bool)))
+
+    candidates = np.concatenate(parts)
+    order = np.argsort(candidates['offset'], kind='stable')
+    return candidates[order], np.concatenate(pending_parts)[order]
+
+
+def build_index(read, file_length: int, block_size: int = default_block_size) -> np.ndarray:
+    """Scan the file by blocks and return the datagram index in file order
+
+    Only the datagrams with valid framing (STX, ETX and checksum) are kept, chained as for the s7k files. The
+    datagrams ending past their scanned block are validated once selected in the chain, so that a corrupted
+    length does not trigger a large read. Memory use is bounded by the block size.
+    """
+    candidates, pending = scan(read=read, start=0, stop=file_length, file_length=file_length,
+                               block_size=block_size)
+    while True:
+        selected = select_records(candidates, file_length=file_length)
+        to_validate = np.flatnonzero(selected & pending)
+        if to_validate.size == 0:
+            break
+        valid = validate_records(read=read, index=candidates[to_validate])
+        pending[to_validate[valid]] = False
+        candidates = np.delete(candidates, to_validate[~valid])
+        pending = np.delete(pending, to_validate[~valid])
+    index = candidates[selected]
+
+    unindexed = file_length - int(index['size'].sum(dtype=np.int64))
+    if unindexed != 0:
+        logger.warning("Datagram framing misalignment, %d Bytes outside of valid datagrams" % unindexed)
+    return index
+
+
+def save_all_index(path, index: np.ndarray, key: tuple) -> bool:
+    return save_index(path=path, index=index, key=key, magic=sidecar_magic, version=sidecar_version,
+                      dtype=index_dtype)
+
+
+def load_all_index(path, key: tuple):
+    return load_index(path=path, key=key, magic=sidecar_magic, version=sidecar_version, dtype=index_dtype)
@@ -0,0 +1,345 @@
+import logging
+
+from netCDF4 import Dataset
+import numpy as np
+from ogr import osr
+
+from hyo2.openbst.lib.nc_helper import NetCDFHelper
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_batch import KongsbergBatch
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_formats import KongsbergDatagrams, range_angle_dtype
+from hyo2.openbst.lib.raw.parsers.kongsberg.reader import Kongsberg
+from hyo2.openbst.lib.raw.snippets import Snippets
+
+logger = logging.getLogger(__name__)
+
+
+class RawImport:
+    """Import of the .all datagrams in the same groups as for the s7k files
+
+    The pings are the raw range and angle 78 datagrams. The .all format has no TVG curve (the gain is applied
+    by the system), so no time_varying_gain group is written. The datagrams are decoded by slabs of
+    raw.iter_chunk_size records in time order, each slab appended to its groups, so that the memory use does not
+    depend on the file size. The 78 datagrams are decoded once, for all the groups of the pings (get_pings).
+    """
+    fill_value = -9999
+    num_beams = 512  # at least, more if a 78 datagram has more beams
+    runtime_fields = ('frequency', 'sample_rate', 'rx_band_width', 'tx_pulse_width', 'source_level', 'static_gain',
+                      'tx_along_steering', 'tx_across_steering', 'tx_along_beam_width', 'tx_across_beam_width',
+                      'focus', 'rx_beam_width', 'absorption_gain', 'sound_velocity', 'spreading_gain')
+    stabilization_fields = ('roll_stabilization', 'pitch_stabilization', 'yaw_stabilization')
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def import_raw(cls, raw: Kongsberg, ds: Dataset):
+
+        imported = RawImport.get_pings(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_attitude(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_position(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        return imported
+
+    @classmethod
+    def append_rows(cls, grp, values: dict):
+        """Append the values (name -> array along the first dimension) after the rows of the group time"""
+        start = grp.variables["time"].shape[0]
+        for name, value in values.items():
+            grp.variables[name][start:start + len(value)] = value
+
+    @classmethod
+    def beam_count(cls, raw: Kongsberg) -> int:
+        """Return the size of the beam_number dimension, from the headers of the 78 datagrams only"""
+        dg_map = raw.get_map(KongsbergDatagrams.RAWRANGEANGLE78)
+        header = raw.read_array(locations=np.sort(dg_map['location']), dtype=range_angle_dtype)
+        return max(RawImport.num_beams, int(np.max(header['num_rx_beams'], initial=0)))
+
+    @classmethod
+    def get_runtime(cls, raw: Kongsberg) -> KongsbergBatch:
+        runtime = raw.get_batch(dg_type=KongsbergDatagrams.RUNTIME)
+        if len(runtime) == 0:
+            raise RuntimeError("No runtime parameters datagram")
+        return runtime
+
+    @classmethod
+    def ping_runtime(cls, runtime: KongsbergBatch, pings: KongsbergBatch) -> np.ndarray:
+        """Return, for each ping, the last runtime record at or before it
+
+        The runtime datagrams are only logged on changes. The pings before the first one use it as well.
+        """
+        records = np.searchsorted(runtime.time, pings.time, side='right') - 1
+        return np.maximum(records, 0)
+
+    @classmethod
+    def snippet_pings(cls, raw: Kongsberg) -> np.ndarray:
+        """Return the row of the 78 datagram of the same ping and system of each 89 datagram (-1 without), from
+        the map"""
+        pings = raw.get_map(KongsbergDatagrams.RAWRANGEANGLE78)
+        snippets = raw.get_map(KongsbergDatagrams.SEABEDIMAGE89)
+        if pings.size == 0:
+            return np.full(snippets.size, -1, dtype=np.int64)
+        ping_keys = pings['device_id'].astype(np.int64) << 32 | pings['ping_number'].astype(np.int64)
+        ping_order = np.argsort(ping_keys, kind='stable')
+        snippet_keys = snippets['device_id'].astype(np.int64) << 32 | snippets['ping_number'].astype(np.int64)
+        matches = ping_order[np.minimum(np.searchsorted(ping_keys[ping_order], snippet_keys), ping_keys.size - 1)]
+        return np.where(ping_keys[matches] == snippet_keys, matches, -1)
+
+    @classmethod
+    def get_pings(cls, raw: Kongsberg, ds: Dataset):
+        """Write the runtime settings, raw bathymetry, beam geometry and snippets groups with a single walk of the
+        78 datagrams, by slabs in time order
+
+        The 89 datagrams are appended (in time order) as the 78 datagrams of their pings come in, taking their
+        detections from the decoded slab.
+        """
+        raw.is_mapped()
+
+        runtime = RawImport.get_runtime(raw=raw)
+        num_beams = RawImport.beam_count(raw=raw)
+        grp_runtime = RawImport.create_runtime_settings(ds=ds)
+        grp_bathy = RawImport.create_raw_bathy(ds=ds, num_beams=num_beams)
+        grp_beam_geo = RawImport.create_beam_geo(ds=ds, num_beams=num_beams)
+        grp_snippet = Snippets.create(ds=ds, sample_datatype="f4")
+
+        snippet_pings = RawImport.snippet_pings(raw=raw)
+        next_snippet = 0
+        for rows, pings in raw.iter_batches(dg_type=KongsbergDatagrams.RAWRANGEANGLE78):
+            records = RawImport.ping_runtime(runtime=runtime, pings=pings)
+            RawImport.write_runtime_settings(grp=grp_runtime, pings=pings, runtime=runtime, records=records)
+            RawImport.write_raw_bathy(grp=grp_bathy, pings=pings, num_beams=num_beams)
+            RawImport.write_beam_geo(grp=grp_beam_geo, pings=pings, runtime=runtime, records=records,
+                                     num_beams=num_beams)
+
+            # the snippets up to the first one of a later ping
+            later = np.flatnonzero(snippet_pings[next_snippet:] > rows[-1])
+            snippet_stop = next_snippet + int(later[0]) if later.size > 0 else snippet_pings.size
+            RawImport.write_snippets(raw=raw, grp=grp_snippet, snippet_rows=np.arange(next_snippet, snippet_stop),
+                                     snippet_pings=snippet_pings, pings=pings, ping_rows=rows)
+            next_snippet = snippet_stop
+
+        RawImport.write_snippets(raw=raw, grp=grp_snippet, snippet_rows=np.arange(next_snippet, snippet_pings.size),
+                                 snippet_pings=snippet_pings)
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_position(cls, raw: Kongsberg, ds: Dataset):
+        raw.is_mapped()
+
+        grp_pos = ds.createGroup("position")
+        grp_pos.createDimension(dimname="time", size=None)
+        spatial_reference = osr.SpatialReference()
+        spatial_reference.ImportFromEPSG(4326)
+        grp_pos.spatial_ref = str(spatial_reference)
+
+        grp_pos.createVariable(varname="time", datatype="f8", dimensions=("time",))
+        grp_pos.createVariable(varname="latitude", datatype="f8", dimensions=("time",))
+        grp_pos.createVariable(varname="longitude", datatype="f8", dimensions=("time",))
+
+        for _, position in raw.iter_batches(dg_type=KongsbergDatagrams.POSITION):
+            RawImport.append_rows(grp=grp_pos, values={'time': position.time, 'latitude': position['latitude'],
+                                                       'longitude': position['longitude']})
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_attitude(cls, raw: Kongsberg, ds: Dataset):
+        raw.is_mapped()
+
+        grp_attitude = ds.createGroup("attitude")
+        grp_attitude.units = "arc-degree"
+        grp_attitude.createDimension(dimname="time", size=None)
+
+        # the heading is sampled with the motion
+        names = ('time', 'roll', 'pitch', 'heave', 'heading_time', 'heading')
+        for name in names:
+            grp_attitude.createVariable(varname=name, datatype="f8", dimensions=("time",))
+
+        for _, attitude in raw.iter_batches(dg_type=KongsbergDatagrams.ATTITUDE):
+            times = attitude.sample_time()
+            RawImport.append_rows(grp=grp_attitude, values={'time': times, 'roll': attitude['roll'],
+                                                            'pitch': attitude['pitch'], 'heave': attitude['heave'],
+                                                            'heading_time': times, 'heading': attitude['heading']})
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def create_beam_geo(cls, ds: Dataset, num_beams: int):
+        grp_beam_geo = ds.createGroup("beam_geometry")
+        grp_beam_geo.createDimension(dimname="ping", size=None)
+        grp_beam_geo.createDimension(dimname="beam_number", size=num_beams)
+
+        grp_beam_geo.createVariable(varname="time", datatype="f8", dimensions=("ping",))
+
+        var_beam_number = grp_beam_geo.createVariable(varname="beam_number", datatype="i4", dimensions=("beam_number",))
+        var_beam_number[:] = [range(num_beams)]
+
+        for name in ('beam_along_angle', 'beam_across_angle', 'along_beamwdith', 'across_beamwidth'):
+            grp_beam_geo.createVariable(varname=name, datatype="f4", dimensions=("ping", "beam_number"))
+        return grp_beam_geo
+
+    @classmethod
+    def write_beam_geo(cls, grp, pings: KongsbergBatch, runtime: KongsbergBatch, records: np.ndarray,
+                       num_beams: int):
+        # the beams are steered along by the tilt of their tx sector, with the nominal beam widths
+        beam_tilt = pings['tx_tilt_angle'][pings.sector_offsets[pings.record_index()] + pings['sector']]
+        beam_runtime = records[pings.record_index()]
+        beam_fields = {
+            'beam_along_angle': beam_tilt,
+            'beam_across_angle': pings['rx_angle'],
+            'along_beamwdith': runtime['tx_beam_width'][beam_runtime],
+            'across_beamwidth': runtime['rx_beam_width'][beam_runtime],
+        }
+
+        values = {'time': pings.time}
+        for name, beam_values in beam_fields.items():
+            beams = np.full((len(pings), num_beams), np.nan)
+            beams[pings.record_index(), pings['beam']] = beam_values
+            values[name] = beams
+        RawImport.append_rows(grp=grp, values=values)
+
+    @classmethod
+    def create_raw_bathy(cls, ds: Dataset, num_beams: int):
+        grp_bathy = ds.createGroup("raw_bathymetry_data")
+        grp_bathy.createDimension(dimname="ping", size=None)
+        grp_bathy.createDimension(dimname="beam_number", size=num_beams)
+
+        for name in ('time', 'sample_rate', 'tx_steering', 'rx_steering'):
+            grp_bathy.createVariable(varname=name,
+                                     datatype="f8",
+                                     dimensions=("ping",),
+                                     fill_value=RawImport.fill_value)
+
+        var_beam_number = grp_bathy.createVariable(varname="beam_number",
+                                                   datatype="i4",
+                                                   dimensions=("beam_number",),
+                                                   fill_value=RawImport.fill_value)
+        var_beam_number[:] = [range(num_beams)]
+
+        for name in ('detect_point', 'rx_angle', 'quality', 'bs_beam_average', 'min_sample_gate', 'max sample gate'):
+            grp_bathy.createVariable(varname=name,
+                                     datatype="f8",
+                                     dimensions=("ping", "beam_number"),
+                                     fill_value=RawImport.fill_value)
+        return grp_bathy
+
+    @classmethod
+    def write_raw_bathy(cls, grp, pings: KongsbergBatch, num_beams: int):
+        num_pings = len(pings)
+        samp_rate = pings['sample_rate']
+
+        # detections in samples and angles in radians, as for the s7k raw detections
+        pings.data['detect_point'] = pings['travel_time'] * np.repeat(samp_rate, np.diff(pings.offsets))
+        pings.data['rx_angle_radians'] = np.deg2rad(pings['rx_angle'])
+        RawImport.append_rows(grp=grp, values={
+            'time': pings.time,
+            'sample_rate': samp_rate,
+            'tx_steering': np.deg2rad(pings['tx_tilt_angle'][pings.sector_offsets[:-1]]),
+            'rx_steering': np.full(num_pings, RawImport.fill_value),  # per beam, in rx_angle
+            'detect_point': pings.to_beams('detect_point', num_beams=num_beams, fill_value=RawImport.fill_value),
+            'rx_angle': pings.to_beams('rx_angle_radians', num_beams=num_beams, fill_value=RawImport.fill_value),
+            'quality': pings.to_beams('quality_factor', num_beams=num_beams, fill_value=RawImport.fill_value),
+            'bs_beam_average': pings.to_beams('reflectivity', num_beams=num_beams, fill_value=RawImport.fill_value),
+            'min_sample_gate': np.full((num_pings, num_beams), RawImport.fill_value),  # not in the 78 datagram
+            'max sample gate': np.full((num_pings, num_beams), RawImport.fill_value),
+        })
+
+    @classmethod
+    def write_snippets(cls, raw: Kongsberg, grp, snippet_rows: np.ndarray, snippet_pings: np.ndarray,
+                       pings: KongsbergBatch = None, ping_rows: np.ndarray = None):
+        """Append the 89 datagrams at snippet_rows, by slabs, with the detections of their 78 datagrams
+
+        The detections are taken from pings (the 78 datagrams at ping_rows) when they hold all the matched pings,
+        otherwise the matched 78 datagrams are decoded (e.g., for the interleaved systems).
+        """
+        for start in range(0, snippet_rows.size, raw.iter_chunk_size):
+            rows = snippet_rows[start:start + raw.iter_chunk_size]
+            snippets = raw.get_batch(dg_type=KongsbergDatagrams.SEABEDIMAGE89, dg_record_range=rows)
+
+            matched_pings = snippet_pings[rows]
+            needed = np.unique(matched_pings[matched_pings >= 0])
+            if pings is not None and np.all(np.isin(needed, ping_rows)):
+                detect_pings, detect_rows = pings, matched_pings - ping_rows[0]
+            elif needed.size > 0:
+                detect_pings = raw.get_batch(dg_type=KongsbergDatagrams.RAWRANGEANGLE78, dg_record_range=needed)
+                detect_rows = np.searchsorted(needed, matched_pings)
+            else:
+                detect_pings, detect_rows = None, matched_pings
+
+            # the detection of each beam, from the raw range and angle datagram of the same ping and system
+            beam_ping = np.where(matched_pings >= 0, detect_rows, -1)[snippets.record_index()]
+            beam_number = snippets['beam']
+            beam_detect = np.full(beam_number.size, np.nan)
+            if detect_pings is not None:
+                ping_detect = detect_pings['travel_time'] * np.repeat(detect_pings['sample_rate'],
+                                                                      np.diff(detect_pings.offsets))
+                ping_beams = np.diff(detect_pings.offsets)
+                found = beam_ping >= 0
+                found[found] = beam_number[found] < ping_beams[beam_ping[found]]
+                beam_detect[found] = ping_detect[detect_pings.offsets[beam_ping[found]] + beam_number[found]]
+            beam_detect = np.round(beam_detect)
+
+            # the detection is at the center sample of each beam
+            num_samples = np.diff(snippets.sample_offsets)
+            valid = ~np.isnan(beam_detect)
+            start_sample = beam_detect - snippets['center_sample']
+            fields = {
+                'detect_sample': np.where(valid, beam_detect, RawImport.fill_value),
+                'snippet_start_sample': np.where(valid, start_sample, RawImport.fill_value),
+                'snippet_end_sample': np.where(valid, start_sample + num_samples - 1, RawImport.fill_value),
+            }
+            Snippets.write(grp=grp, time=snippets.time,
+                           snippet_offsets=snippets.offsets, beam_index=beam_number, fields=fields,
+                           sample_offsets=snippets.sample_offsets, samples=snippets['samples'])
+
+    @classmethod
+    def create_runtime_settings(cls, ds: Dataset):
+        grp_runtime = ds.createGroup("runtime_settings")
+        grp_runtime.createDimension(dimname="ping", size=None)
+
+        grp_runtime.createVariable(varname="time", datatype="f8", dimensions=("ping",))
+        grp_runtime.createVariable(varname="tx_wave_form", datatype="S1", dimensions=("ping",))
+        for name in RawImport.runtime_fields:
+            grp_runtime.createVariable(varname=name, datatype="f8", dimensions=("ping",))
+        for name in RawImport.stabilization_fields:
+            grp_runtime.createVariable(varname=name, datatype="i4", dimensions=("ping",))
+        return grp_runtime
+
+    @classmethod
+    def write_runtime_settings(cls, grp, pings: KongsbergBatch, runtime: KongsbergBatch, records: np.ndarray):
+        num_pings = len(pings)
+        first_sectors = pings.sector_offsets[:-1]
+        stabilization = runtime['stabilization_mode'][records]
+        RawImport.append_rows(grp=grp, values={
+            'time': pings.time,
+            'tx_wave_form': np.where(pings['tx_waveform'][first_sectors] == 0, "CW", "LFM"),
+            'frequency': pings['tx_center_frequency'][first_sectors],
+            'sample_rate': pings['sample_rate'],
+            'rx_band_width': runtime['rx_band_width'][records],
+            'tx_pulse_width': runtime['tx_pulse_length'][records],
+            'source_level': runtime['tx_power'][records],  # dB re maximum
+            'static_gain': runtime['rx_fixed_gain'][records],
+            'tx_along_steering': runtime['tx_along_tilt'][records],
+            'tx_across_steering': np.zeros(num_pings),
+            'tx_along_beam_width': runtime['tx_beam_width'][records],
+            'tx_across_beam_width': np.full(num_pings, RawImport.fill_value),  # not in the runtime datagram
+            'focus': pings['tx_focus_range'][first_sectors],
+            'rx_beam_width': runtime['rx_beam_width'][records],
+            'absorption_gain': runtime['absorption'][records],
+            'sound_velocity': pings['sound_speed'],
+            'spreading_gain': np.full(num_pings, RawImport.fill_value),  # applied by the system TVG
+            'roll_stabilization': np.ones(num_pings, dtype=np.int32),  # the rx beams are always roll stabilized
+            'pitch_stabilization': ((stabilization & 0x80) != 0).astype(np.int32),
+            'yaw_stabilization': ((stabilization & 0x03) != 0).astype(np.int32),
+        })
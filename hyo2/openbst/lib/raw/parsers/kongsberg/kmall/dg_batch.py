@@ -0,0 +1,184 @@
+import logging
+import struct
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.batch import gather, headers, merge_fields, ragged, ragged_mixed, \
+    record_offsets
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_batch import entry_index, KongsbergBatch
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_formats import common_dtype, KmallDatagrams, \
+    mrz_ping_info_dtype, mrz_rx_info_dtype, mrz_sector_dtype, mrz_sounding_dtype, mwc_beam_dtype, \
+    mwc_phase_dtypes, mwc_rx_info_dtype, mwc_sector_dtype, mwc_tx_info_dtype, skm_info_dtype, skm_sample_dtype, \
+    spo_dtype, strided
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_index import dg_time
+
+logger = logging.getLogger(__name__)
+
+
+def strided_ragged(chunks: list, starts, counts, strides, dtype: np.dtype) -> tuple:
+    """As ragged, for items whose size (at least dtype.itemsize) is stored in each record
+
+    The returned items may be strided (with the leading fields of the stored items) when all the records share
+    the same item size, as it is usually the case.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    keys = np.where(counts > 0, np.asarray(strides, dtype=np.int64), dtype.itemsize)
+    dtypes = {stride: strided(dtype, stride) for stride in np.unique(keys).tolist()}
+    if len(dtypes) == 1:
+        return ragged(chunks, starts, counts, *dtypes.values())
+    out = np.empty(int(counts.sum()), dtype=dtype)
+    return ragged_mixed(chunks, starts, counts, keys, dtypes, out)
+
+
+def check_sizes(ends: np.ndarray, sizes: np.ndarray):
+    if np.any(ends > sizes):
+        raise RuntimeError("Datagram shorter than its data section")
+
+
+def parse_batch(dg_type: KmallDatagrams, chunks: list) -> KongsbergBatch:
+    """Decode many (reassembled) data sections of dg_type into a KongsbergBatch"""
+    dtype = header_records.get(dg_type)
+    if dtype is not None:
+        return KongsbergBatch(dg_type, headers(chunks, dtype))
+
+    parser = batch_parsers.get(dg_type)
+    if parser is None:
+        raise RuntimeError("Batch decoding not supported for %s" % dg_type)
+    return parser(chunks)
+
+
+def parse_batch_mrz(chunks: list) -> KongsbergBatch:
+    """MRZ: per-ping info (header), tx sectors and soundings (ragged), seabed image samples in dB (ragged)
+
+    The soundings of each ping are the main ones (extra_detection False) followed by the extra detections.
+    """
+    buffer, starts, sizes = record_offsets(chunks)
+    common = headers(chunks, common_dtype)
+    info_start = common['num_bytes_cmn_part'].astype(np.int64)
+    check_sizes(info_start + mrz_ping_info_dtype.itemsize, sizes)
+    info = gather(buffer, starts + info_start, mrz_ping_info_dtype)
+
+    tx_start = info_start + info['num_bytes_info_data']
+    tx_stride = info['num_bytes_per_tx_sector'].astype(np.int64)
+    num_tx = info['num_tx_sectors'].astype(np.int64)
+    rx_start = tx_start + num_tx * tx_stride
+    check_sizes(rx_start + mrz_rx_info_dtype.itemsize, sizes)
+    rx = gather(buffer, starts + rx_start, mrz_rx_info_dtype)
+
+    batch = KongsbergBatch(KmallDatagrams.MULTIBEAMRAWRANGEDEPTH, merge_fields(common, info, rx))
+    batch.beam_field = 'sounding_index'
+
+    sectors, batch.sector_offsets = strided_ragged(chunks, tx_start, num_tx, tx_stride, mrz_sector_dtype)
+    for name in mrz_sector_dtype.names:
+        if not name.startswith('padding'):
+            batch.data['tx_' + name] = np.ascontiguousarray(sectors[name])
+
+    sounding_start = rx_start + rx['num_bytes_rx_info'] + \
+        rx['num_extra_detection_classes'].astype(np.int64) * rx['num_bytes_per_class']
+    num_main = rx['num_soundings_max_main'].astype(np.int64)
+    num_soundings = num_main + rx['num_extra_detections']
+    sounding_stride = rx['num_bytes_per_sounding'].astype(np.int64)
+    soundings, batch.offsets = strided_ragged(chunks, sounding_start, num_soundings, sounding_stride,
+                                              mrz_sounding_dtype)
+    for name in mrz_sounding_dtype.names:
+        if name != 'padding':
+            batch.data[name] = np.ascontiguousarray(soundings[name])
+    batch.data['extra_detection'] = entry_index(batch.offsets) >= np.repeat(num_main, num_soundings)
+
+    num_samples = soundings['si_num_samples'].astype(np.int64)
+    batch.sample_offsets = np.zeros(num_samples.size + 1, dtype=np.int64)
+    np.cumsum(num_samples, out=batch.sample_offsets[1:])
+    samples, _ = ragged(chunks, sounding_start + num_soundings * sounding_stride,
+                        np.diff(batch.sample_offsets[batch.offsets]), np.dtype('<i2'))
+    batch.data['samples'] = samples * np.float32(0.1)
+    return batch
+
+
+def parse_batch_skm(chunks: list) -> KongsbergBatch:
+    """SKM: attitude and velocity samples (ragged), with their own time in milliseconds in 'sample_time'"""
+    info = headers(chunks, skm_info_dtype)
+    batch = KongsbergBatch(KmallDatagrams.ATTITUDE, info)
+    samples, batch.offsets = strided_ragged(chunks, info['num_bytes_info_part'], info['num_samples'],
+                                            info['num_bytes_per_sample'], skm_sample_dtype)
+    for name in skm_sample_dtype.names:
+        batch.data[name] = np.ascontiguousarray(samples[name])
+    batch.data['sample_time'] = dg_time(samples['time_sec'], samples['time_nanosec'])
+    return batch
+
+
+def parse_water_column(chunk, beam_step: int = 1, sample_step: int = 1) -> KongsbergBatch:
+    """MWC: decode the water column of a ping (a batch of one record), optionally decimated
+
+    The beam data are ragged, with the amplitudes in dB in 'samples' (and the phases in degrees in 'phase',
+    when logged) of beam k at sample_offsets[k]:sample_offsets[k + 1].
+    """
+    buffer = np.frombuffer(chunk, dtype=np.uint8)
+    common = np.frombuffer(chunk, dtype=common_dtype, count=1)
+    tx_start = int(common['num_bytes_cmn_part'][0])
+    tx_info = np.frombuffer(chunk, dtype=mwc_tx_info_dtype, count=1, offset=tx_start)
+    sector_start = tx_start + int(tx_info['num_bytes_tx_info'][0])
+    num_tx = int(tx_info['num_tx_sectors'][0])
+    sector_stride = int(tx_info['num_bytes_per_tx_sector'][0])
+    sectors = np.frombuffer(chunk, dtype=strided(mwc_sector_dtype, sector_stride), count=num_tx,
+                            offset=sector_start)
+    rx_start = sector_start + num_tx * sector_stride
+    rx_info = np.frombuffer(chunk, dtype=mwc_rx_info_dtype, count=1, offset=rx_start)
+
+    phase_dtype = mwc_phase_dtypes.get(int(rx_info['phase_flag'][0]))
+    phase_size = 0 if phase_dtype is None else phase_dtype.itemsize
+    entry_size = int(rx_info['num_bytes_per_beam_entry'][0])
+    num_beams = int(rx_info['num_beams'][0])
+
+    # each beam entry is followed by its samples: walk them to locate the beams
+    positions = np.empty(num_beams, dtype=np.int64)
+    position = rx_start + int(rx_info['num_bytes_rx_info'][0])
+    if entry_size < mwc_beam_dtype.itemsize:
+        raise RuntimeError("Beam entry shorter than its known fields: %d bytes" % entry_size)
+    for beam in range(num_beams):
+        if position + entry_size > buffer.size:
+            raise RuntimeError("Datagram shorter than its water column beams")
+        positions[beam] = position
+        num_samples, = struct.unpack_from('<H', chunk, position + mwc_beam_dtype.itemsize - 2)
+        position += entry_size + num_samples * (1 + phase_size)
+    if position > buffer.size:
+        raise RuntimeError("Datagram shorter than its water column samples")
+
+    beam_numbers = np.arange(0, num_beams, beam_step)
+    positions = positions[beam_numbers]
+    beams = gather(chunk, positions, mwc_beam_dtype)
+    num_samples = beams['num_samples'].astype(np.int64)
+    kept = (num_samples + sample_step - 1) // sample_step
+
+    batch = KongsbergBatch(KmallDatagrams.MULTIBEAMWATERCOLUMN, merge_fields(common, tx_info, rx_info))
+    batch.beam_field = 'beam'
+    batch.sector_offsets = np.array([0, num_tx], dtype=np.int64)
+    for name in mwc_sector_dtype.names:
+        if name != 'padding':
+            batch.data['tx_' + name] = np.ascontiguousarray(sectors[name])
+    batch.offsets = np.array([0, beam_numbers.size], dtype=np.int64)
+    for name in mwc_beam_dtype.names:
+        batch.data[name] = np.ascontiguousarray(beams[name])
+    batch.data['beam'] = beam_numbers
+    batch.sample_offsets = np.zeros(kept.size + 1, dtype=np.int64)
+    np.cumsum(kept, out=batch.sample_offsets[1:])
+
+    sample_numbers = entry_index(batch.sample_offsets) * sample_step
+    sample_starts = np.repeat(positions + entry_size, kept)
+    batch.data['samples'] = buffer[sample_starts + sample_numbers].view(np.int8) * np.float32(0.5)
+    if phase_dtype is not None:
+        phase_starts = np.repeat(positions + entry_size + num_samples, kept)
+        phases = buffer[(phase_starts + sample_numbers * phase_size)[:, np.newaxis] + np.arange(phase_size)]
+        scale = 180.0 / 128.0 if phase_size == 1 else 0.01
+        batch.data['phase'] = phases.view(phase_dtype).ravel() * np.float32(scale)
+    return batch
+
+
+# datagrams of which only the fixed part is decoded, as a single structured array
+header_records = {
+    KmallDatagrams.POSITION: spo_dtype,
+}
+
+batch_parsers = {
+    KmallDatagrams.MULTIBEAMRAWRANGEDEPTH: parse_batch_mrz,
+    KmallDatagrams.ATTITUDE: parse_batch_skm,
+}
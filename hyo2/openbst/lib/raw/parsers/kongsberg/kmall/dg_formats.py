@@ -0,0 +1,154 @@
+from enum import Enum
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def kmall_code(name: str) -> int:
+    """Return the datagram type (e.g., '#MRZ') as the little-endian u4 read at its position in the header"""
+    return int.from_bytes(name.encode('ascii'), 'little')
+
+
+class KmallDatagrams(Enum):
+    """KMALL datagram types, valued as their 4-character identifier"""
+
+    INSTALLATIONPARAMETERS = '#IIP'
+    RUNTIMEPARAMETERS = '#IOP'
+    BISTERROR = '#IBE'
+    BISTREPLY = '#IBR'
+    BISTSHORTREPLY = '#IBS'
+    MULTIBEAMRAWRANGEDEPTH = '#MRZ'
+    MULTIBEAMWATERCOLUMN = '#MWC'
+    POSITION = '#SPO'
+    ATTITUDE = '#SKM'
+    SOUNDVELOCITYPROFILE = '#SVP'
+    SOUNDVELOCITYTRANSDUCER = '#SVT'
+    CLOCK = '#SCL'
+    DEPTH = '#SDE'
+    HEIGHT = '#SHI'
+    COMPATIBILITYPOSITION = '#CPO'
+    COMPATIBILITYHEAVE = '#CHE'
+    FILECALIBRATION = '#FCF'
+
+
+kmall_datagram_code = {dg_type: kmall_code(dg_type.value) for dg_type in KmallDatagrams}
+
+# Datagrams split in partitions when larger than the maximum UDP packet: the partition struct follows the header
+partitioned_records = (KmallDatagrams.MULTIBEAMRAWRANGEDEPTH, KmallDatagrams.MULTIBEAMWATERCOLUMN)
+
+# Common header: the total size includes this field and the copy of it closing the datagram
+header_dtype = np.dtype([('num_bytes', '<u4'), ('dgm_type', '<u4'), ('dgm_version', 'u1'), ('system_id', 'u1'),
+                         ('echo_sounder_id', '<u2'), ('time_sec', '<u4'), ('time_nanosec', '<u4')])
+partition_dtype = np.dtype([('num_partitions', '<u2'), ('partition', '<u2')])
+
+# Common part of the multibeam datagrams (first bytes of the reassembled data)
+common_dtype = np.dtype([('num_bytes_cmn_part', '<u2'), ('ping_count', '<u2'), ('rx_fans_per_ping', 'u1'),
+                         ('rx_fan_index', 'u1'), ('swaths_per_ping', 'u1'), ('swath_along_position', 'u1'),
+                         ('tx_transducer_index', 'u1'), ('rx_transducer_index', 'u1'),
+                         ('num_rx_transducers', 'u1'), ('algorithm_type', 'u1')])
+
+# MRZ ping info: the leading fields common to all the datagram versions, the size is in num_bytes_info_data
+mrz_ping_info_dtype = np.dtype([
+    ('num_bytes_info_data', '<u2'), ('padding_0', '<u2'), ('ping_rate', '<f4'), ('beam_spacing', 'u1'),
+    ('depth_mode', 'u1'), ('sub_depth_mode', 'u1'), ('distance_between_swath', 'u1'), ('detection_mode', 'u1'),
+    ('pulse_form', 'u1'), ('padding_1', '<u2'), ('frequency_mode', '<f4'), ('frequency_low', '<f4'),
+    ('frequency_high', '<f4'), ('max_total_tx_pulse_length', '<f4'), ('max_eff_tx_pulse_length', '<f4'),
+    ('max_eff_tx_band_width', '<f4'), ('absorption', '<f4'), ('port_sector_edge', '<f4'),
+    ('starboard_sector_edge', '<f4'), ('port_mean_coverage', '<f4'), ('starboard_mean_coverage', '<f4'),
+    ('port_mean_coverage_m', '<i2'), ('starboard_mean_coverage_m', '<i2'), ('mode_and_stabilisation', 'u1'),
+    ('runtime_filter_1', 'u1'), ('runtime_filter_2', '<u2'), ('pipe_tracking_status', '<u4'),
+    ('tx_array_size_used', '<f4'), ('rx_array_size_used', '<f4'), ('tx_power', '<f4'),
+    ('sl_ramp_up_time_remaining', '<u2'), ('padding_2', '<u2'), ('yaw_angle', '<f4'), ('num_tx_sectors', '<u2'),
+    ('num_bytes_per_tx_sector', '<u2'), ('heading', '<f4'), ('sound_speed', '<f4'), ('tx_transducer_depth', '<f4'),
+    ('z_water_level', '<f4'), ('x_kmall_to_all', '<f4'), ('y_kmall_to_all', '<f4'), ('lat_long_info', 'u1'),
+    ('position_sensor_status', 'u1'), ('attitude_sensor_status', 'u1'), ('padding_3', 'u1'),
+    ('latitude', '<f8'), ('longitude', '<f8'), ('ellipsoid_height', '<f4')])
+
+# MRZ tx sector: the leading fields, the size is in num_bytes_per_tx_sector
+mrz_sector_dtype = np.dtype([('sector', 'u1'), ('tx_array', 'u1'), ('tx_sub_array', 'u1'), ('padding_0', 'u1'),
+                             ('sector_delay', '<f4'), ('tilt_angle', '<f4'), ('source_level', '<f4'),
+                             ('focus_range', '<f4'), ('center_frequency', '<f4'), ('signal_band_width', '<f4'),
+                             ('total_signal_length', '<f4'), ('pulse_shading', 'u1'), ('waveform', 'u1'),
+                             ('padding_1', '<u2')])
+
+# MRZ receiver info, its size is in num_bytes_rx_info, then the extra detection classes
+mrz_rx_info_dtype = np.dtype([('num_bytes_rx_info', '<u2'), ('num_soundings_max_main', '<u2'),
+                              ('num_soundings_valid_main', '<u2'), ('num_bytes_per_sounding', '<u2'),
+                              ('wc_sample_rate', '<f4'), ('seabed_image_sample_rate', '<f4'),
+                              ('bs_normal', '<f4'), ('bs_oblique', '<f4'), ('extra_detection_alarm_flag', '<u2'),
+                              ('num_extra_detections', '<u2'), ('num_extra_detection_classes', '<u2'),
+                              ('num_bytes_per_class', '<u2')])
+mrz_extra_class_dtype = np.dtype([('num_extra_detections_in_class', '<u2'), ('padding', 'i1'),
+                                  ('alarm_flag', 'u1')])
+
+# MRZ sounding: the size is in num_bytes_per_sounding, the seabed image samples (i2, 0.1 dB) follow all of them
+mrz_sounding_dtype = np.dtype([
+    ('sounding_index', '<u2'), ('tx_sector', 'u1'), ('detection_type', 'u1'), ('detection_method', 'u1'),
+    ('rejection_info_1', 'u1'), ('rejection_info_2', 'u1'), ('post_processing_info', 'u1'),
+    ('detection_class', 'u1'), ('detection_confidence_level', 'u1'), ('padding', '<u2'), ('range_factor', '<f4'),
+    ('quality_factor', '<f4'), ('detection_uncertainty_vertical', '<f4'), ('detection_uncertainty_horizontal', '<f4'),
+    ('detection_window_length', '<f4'), ('echo_length', '<f4'), ('wc_beam_number', '<u2'),
+    ('wc_range_samples', '<u2'), ('wc_nominal_beam_angle_across', '<f4'), ('mean_absorption', '<f4'),
+    ('reflectivity_1', '<f4'), ('reflectivity_2', '<f4'), ('receiver_sensitivity_applied', '<f4'),
+    ('source_level_applied', '<f4'), ('bs_calibration', '<f4'), ('tvg', '<f4'), ('beam_angle_re_rx', '<f4'),
+    ('beam_angle_correction', '<f4'), ('two_way_travel_time', '<f4'), ('two_way_travel_time_correction', '<f4'),
+    ('delta_latitude', '<f4'), ('delta_longitude', '<f4'), ('z', '<f4'), ('y', '<f4'), ('x', '<f4'),
+    ('beam_incidence_angle_adjustment', '<f4'), ('realtime_clean_info', '<u2'), ('si_start_range', '<u2'),
+    ('si_centre_sample', '<u2'), ('si_num_samples', '<u2')])
+
+# MWC tx info and sectors, rx info, then for each beam its fixed part, amplitudes (i1, 0.5 dB) and phases
+mwc_tx_info_dtype = np.dtype([('num_bytes_tx_info', '<u2'), ('num_tx_sectors', '<u2'),
+                              ('num_bytes_per_tx_sector', '<u2'), ('padding', '<i2'), ('heave', '<f4')])
+mwc_sector_dtype = np.dtype([('tilt_angle', '<f4'), ('center_frequency', '<f4'), ('tx_beam_width_along', '<f4'),
+                             ('sector', '<u2'), ('padding', '<i2')])
+mwc_rx_info_dtype = np.dtype([('num_bytes_rx_info', '<u2'), ('num_beams', '<u2'), ('num_bytes_per_beam_entry', 'u1'),
+                              ('phase_flag', 'u1'), ('tvg_function_applied', 'u1'), ('tvg_offset', 'i1'),
+                              ('sample_rate', '<f4'), ('sound_velocity', '<f4')])
+mwc_beam_dtype = np.dtype([('beam_pointing_angle', '<f4'), ('start_range_sample', '<u2'),
+                           ('detected_range', '<u2'), ('tx_sector', '<u2'), ('num_samples', '<u2')])
+mwc_phase_dtypes = {0: None, 1: np.dtype('i1'), 2: np.dtype('<i2')}  # phase flag: none, low and high resolution
+
+# SKM attitude: info, then the samples (KM binary and delayed heave), each num_bytes_per_sample long
+skm_info_dtype = np.dtype([('num_bytes_info_part', '<u2'), ('sensor_system', 'u1'), ('sensor_status', 'u1'),
+                           ('sensor_input_format', '<u2'), ('num_samples', '<u2'), ('num_bytes_per_sample', '<u2'),
+                           ('sensor_data_contents', '<u2')])
+skm_sample_dtype = np.dtype([
+    ('dgm_type', '<u4'), ('num_bytes', '<u2'), ('dgm_version', '<u2'), ('time_sec', '<u4'),
+    ('time_nanosec', '<u4'), ('status', '<u4'), ('latitude', '<f8'), ('longitude', '<f8'),
+    ('ellipsoid_height', '<f4'), ('roll', '<f4'), ('pitch', '<f4'), ('heading', '<f4'), ('heave', '<f4'),
+    ('roll_rate', '<f4'), ('pitch_rate', '<f4'), ('yaw_rate', '<f4'), ('velocity_north', '<f4'),
+    ('velocity_east', '<f4'), ('velocity_down', '<f4'), ('latitude_error', '<f4'), ('longitude_error', '<f4'),
+    ('ellipsoid_height_error', '<f4'), ('roll_error', '<f4'), ('pitch_error', '<f4'), ('heading_error', '<f4'),
+    ('heave_error', '<f4'), ('acceleration_north', '<f4'), ('acceleration_east', '<f4'),
+    ('acceleration_down', '<f4'), ('delayed_heave_time_sec', '<u4'), ('delayed_heave_time_nanosec', '<u4'),
+    ('delayed_heave', '<f4')])
+
+# SPO position: sensor common part, then the position data block (the sensor input string follows)
+spo_dtype = np.dtype([('num_bytes_cmn_part', '<u2'), ('sensor_system', '<u2'), ('sensor_status', '<u2'),
+                      ('padding', '<u2'), ('sensor_time_sec', '<u4'), ('sensor_time_nanosec', '<u4'),
+                      ('fix_quality', '<f4'), ('latitude', '<f8'), ('longitude', '<f8'),
+                      ('speed_over_ground', '<f4'), ('course_over_ground', '<f4'), ('ellipsoid_height', '<f4')])
+
+# IIP and IOP: the ASCII "key=value," text follows
+installation_dtype = np.dtype([('num_bytes_cmn_part', '<u2'), ('info', '<u2'), ('status', '<u2')])
+
+
+def strided(dtype: np.dtype, itemsize: int) -> np.dtype:
+    """Return the dtype of the leading fields of the items of a given size (newer versions append fields)"""
+    if itemsize < dtype.itemsize:
+        raise RuntimeError("Item shorter than its known fields: %d < %d bytes" % (itemsize, dtype.itemsize))
+    return np.dtype({'names': dtype.names, 'formats': [dtype.fields[name][0] for name in dtype.names],
+                     'offsets': [dtype.fields[name][1] for name in dtype.names], 'itemsize': itemsize})
+
+
+def installation_parameters(chunk) -> dict:
+    """Decode the ASCII parameters of an installation or runtime datagram data section as a dict"""
+    text = bytes(chunk[installation_dtype.itemsize:]).split(b'\x00')[0].decode('ascii', errors='replace')
+    parameters = dict()
+    for item in text.replace('\r', '').replace('\n', ',').split(','):
+        key, sep, value = item.partition(':' if ':' in item and '=' not in item else '=')
+        if sep:
+            parameters[key.strip()] = value.strip()
+    return parameters
@@ -0,0 +1,224 @@
+import logging
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_formats import common_dtype, header_dtype, \
+    kmall_datagram_code, partition_dtype, partitioned_records
+from hyo2.openbst.lib.raw.parsers.reson import dg_index as reson_index
+from hyo2.openbst.lib.raw.parsers.reson.dg_index import load_index, save_index, select_records
+
+logger = logging.getLogger(__name__)
+
+# Datagram frame: header (its size first), data and the copy of the size (u4) closing the datagram.
+# The multibeam datagrams have the partition struct after the header: when split, the data sections of the
+# partitions are concatenated, with the common part (and the ping counter) in the first one.
+header_size = header_dtype.itemsize
+partition_size = partition_dtype.itemsize
+footer_size = 4
+type_offset = 4
+type_start = ord('#')
+default_block_size = 16 * 1024 * 1024
+block_overlap = 1024 * 1024  # datagrams starting in a block and ending in its overlap are validated in bulk
+no_ping = 0xFFFFFFFF  # Ping number of the datagrams not related to a ping
+max_datagram_size = 64 * 1024 * 1024  # plausibility limit, the partitioned datagrams are much smaller
+
+# Index sidecar (see reson.dg_index.save_index), keyed as the s7k ones
+source_key = reson_index.source_key
+sidecar_magic = b'OBSTKMAI'
+sidecar_version = 1
+
+# One entry per datagram (or partition), in file order. The size includes the whole frame.
+index_dtype = np.dtype([('offset', '<u8'), ('size', '<u4'), ('dgm_type', '<u4'), ('dgm_version', 'u1'),
+                        ('system_id', 'u1'), ('echo_sounder_id', '<u2'), ('time_sec', '<u4'),
+                        ('time_nanosec', '<u4'), ('num_partitions', '<u2'), ('partition', '<u2'),
+                        ('ping_number', '<u4')])
+
+# One entry per (reassembled) datagram, sorted by datagram type and time. Location and size refer to the data
+# section, the datagrams split in num_parts partitions are read from the parts from first_part on (see assemble).
+map_dtype = np.dtype([('location', '<u8'), ('time', '<f8'), ('size', '<u4'), ('record_type', '<u4'),
+                      ('device_id', '<u4'), ('ping_number', '<u4'), ('first_part', '<u4'), ('num_parts', '<u2')])
+
+datagram_types = np.array(sorted(kmall_datagram_code.values()), dtype=np.uint32)
+partitioned_types = np.array(sorted(kmall_datagram_code[dg_type] for dg_type in partitioned_records),
+                             dtype=np.uint32)
+
+
+def dg_time(time_sec, time_nanosec):
+    """Convert the header time (seconds and nanoseconds since 1970-01-01 UTC) to milliseconds"""
+    return np.asarray(time_sec, dtype=np.float64) * 1000.0 + np.asarray(time_nanosec, dtype=np.float64) / 1e6
+
+
+def data_start(index: np.ndarray) -> np.ndarray:
+    """Return the offset of the data section in each datagram of the index"""
+    return np.where(np.isin(index['dgm_type'], partitioned_types), header_size + partition_size, header_size)
+
+
+def scan_block(block: np.ndarray, block_offset: int, owned_size: int, file_length: int) -> tuple:
+    """Return the plausible datagrams starting in the first owned_size bytes of a uint8 block
+
+    The headers are validated in bulk on type, size and time. The datagrams ending in the block are also
+    validated on the closing size, and returned as the first item; the ones ending past the block are returned
+    as the second item, to be validated by validate_records.
+    """
+    starts = np.flatnonzero(block[type_offset:type_offset + owned_size] == type_start)
+    starts = starts[starts + header_size <= block.size]
+
+    empty = np.empty(0, dtype=index_dtype)
+    if starts.size == 0:
+        return empty, empty
+    headers = block[starts[:, np.newaxis] + np.arange(header_size)].view(header_dtype).ravel()
+    found = np.minimum(np.searchsorted(datagram_types, headers['dgm_type']), datagram_types.size - 1)
+    sizes = headers['num_bytes'].astype(np.int64)
+    valid = (datagram_types[found] == headers['dgm_type']) & (sizes >= header_size + footer_size) \
+        & (sizes <= max_datagram_size) & (block_offset + starts + sizes <= file_length) \
+        & (headers['time_nanosec'] < 1000000000)
+    # the multibeam datagrams hold at least the partition and the common part
+    partitioned = np.isin(headers['dgm_type'], partitioned_types)
+    valid &= ~partitioned | ((starts + header_size + partition_size + common_dtype.itemsize <= block.size)
+                             & (sizes >= header_size + partition_size + footer_size))
+    starts = starts[valid]
+    headers = headers[valid]
+
+    index = np.empty(starts.size, dtype=index_dtype)
+    index['offset'] = block_offset + starts
+    index['size'] = headers['num_bytes']
+    for name in ('dgm_type', 'dgm_version', 'system_id', 'echo_sounder_id', 'time_sec', 'time_nanosec'):
+        index[name] = headers[name]
+    index['num_partitions'] = 1
+    index['partition'] = 1
+    index['ping_number'] = no_ping
+
+    partitioned = np.isin(index['dgm_type'], partitioned_types)
+    if np.any(partitioned):
+        part_starts = starts[partitioned] + header_size
+        partitions = block[part_starts[:, np.newaxis] + np.arange(partition_size)].view(partition_dtype).ravel()
+        index['num_partitions'][partitioned] = partitions['num_partitions']
+        index['partition'][partitioned] = partitions['partition']
+        # the ping counter is in the common part, at the start of the first partition data
+        counters = block[part_starts[:, np.newaxis] + partition_size + 2 + np.arange(2)].view('<u2').ravel()
+        first = partitions['partition'] == 1
+        index['ping_number'][np.flatnonzero(partitioned)[first]] = counters[first]
+        # partition numbers start at 1, up to the number of partitions
+        plausible = (partitions['partition'] >= 1) & (partitions['partition'] <= partitions['num_partitions'])
+        keep = np.ones(index.size, dtype=bool)
+        keep[np.flatnonzero(partitioned)[~plausible]] = False
+        index = index[keep]
+        starts = starts[keep]
+
+    ends = starts + index['size'].astype(np.int64)
+    inside = ends <= block.size
+    checked = np.zeros(index.size, dtype=bool)
+    closing = block[ends[inside, np.newaxis] - footer_size + np.arange(footer_size)].view('<u4').ravel()
+    checked[inside] = closing == index['size'][inside]
+    return index[checked], index[~inside]
+
+
+def validate_records(read, index: np.ndarray) -> np.ndarray:
+    """Return the mask of the index entries with a valid closing size, reading only their last bytes"""
+    valid = np.zeros(index.size, dtype=bool)
+    for n, (offset, size) in enumerate(zip(index['offset'].tolist(), index['size'].tolist())):
+        closing = read(offset + size - footer_size, footer_size)
+        valid[n] = len(closing) == footer_size and int.from_bytes(bytes(closing), 'little') == size
+    return valid
+
+
+def scan(read, start: int, stop: int, file_length: int, block_size: int = default_block_size) -> tuple:
+    """Return the candidate datagrams starting in the [start, stop) byte range, scanned by blocks, with the
+    mask of the ones still to be validated on their closing size"""
+    parts = [np.empty(0, dtype=index_dtype)]
+    pending_parts = [np.empty(0, dtype=bool)]
+    for block_offset in range(start, stop, block_size):
+        owned_size = min(block_size, stop - block_offset)
+        chunk = read(block_offset, owned_size + block_overlap)
+        block = np.frombuffer(chunk, dtype=np.uint8)
+        checked, pending = scan_block(block=block, block_offset=block_offset, owned_size=owned_size,
+                                      file_length=file_length)
+        parts.extend((checked, pending))
+        pending_parts.extend((np.zeros(checked.size, dtype=bool), np.ones(pending.size, dtype=bool)))
+
+    candidates = np.concatenate(parts)
+    order = np.argsort(candidates['offset'], kind='stable')
+    return candidates[order], np.concatenate(pending_parts)[order]
+
+
+def build_index(read, file_length: int, block_size: int = default_block_size) -> np.ndarray:
+    """Scan the file by blocks and return the datagram index in file order
+
+    Only the datagrams with valid framing (known type and matching closing size) are kept, chained as for the
+    s7k files. The datagrams ending past their scanned block are validated once selected in the chain, reading
+    only their closing size. Memory use is bounded by the block size.
+    """
+    candidates, pending = scan(read=read, start=0, stop=file_length, file_length=file_length,
+                               block_size=block_size)
+    while True:
+        selected = select_records(candidates, file_length=file_length)
+        to_validate = np.flatnonzero(selected & pending)
+        if to_validate.size == 0:
+            break
+        valid = validate_records(read=read, index=candidates[to_validate])
+        pending[to_validate[valid]] = False
+        candidates = np.delete(candidates, to_validate[~valid])
+        pending = np.delete(pending, to_validate[~valid])
+    index = candidates[selected]
+
+    unindexed = file_length - int(index['size'].sum(dtype=np.int64))
+    if unindexed != 0:
+        logger.warning("Datagram framing misalignment, %d Bytes outside of valid datagrams" % unindexed)
+    return index
+
+
+def assemble(index: np.ndarray) -> tuple:
+    """Return the datagram table (in map_dtype, in index order) with one entry per reassembled datagram, and the
+    data section location and size of the parts referenced by its first_part and num_parts fields
+
+    The partitions of a datagram are the next index entries of the same type and echo sounder, numbered from 1
+    and with the same time. The datagrams with missing partitions are dropped.
+    """
+    locations = index['offset'] + data_start(index)
+    sizes = (index['size'] - data_start(index) - footer_size).astype(np.int64)
+
+    keys = index['dgm_type'].astype(np.int64) << 16 | index['echo_sounder_id']
+    order = np.argsort(keys, kind='stable')
+    first = np.flatnonzero(index['partition'][order] == 1)
+    num_parts = index['num_partitions'][order[first]].astype(np.int64)
+    fits = first + num_parts <= order.size
+    first, num_parts = first[fits], num_parts[fits]
+
+    part_offsets = np.zeros(first.size + 1, dtype=np.int64)
+    np.cumsum(num_parts, out=part_offsets[1:])
+    leads = order[np.repeat(first, num_parts)]
+    part_numbers = np.arange(part_offsets[-1]) - np.repeat(part_offsets[:-1], num_parts)
+    parts = order[np.repeat(first, num_parts) + part_numbers]
+    matching = (keys[parts] == keys[leads]) & (index['partition'][parts] == part_numbers + 1) \
+        & (index['time_sec'][parts] == index['time_sec'][leads]) \
+        & (index['time_nanosec'][parts] == index['time_nanosec'][leads])
+    complete = np.logical_and.reduceat(matching, part_offsets[:-1]) if first.size > 0 else fits[:0]
+    first, num_parts = first[complete], num_parts[complete]
+
+    dropped = index.size - int(num_parts.sum())
+    if dropped > 0:
+        logger.warning("Datagrams with missing partitions, %d partitions dropped" % dropped)
+
+    leads = order[first]
+    order_sizes = np.zeros(order.size + 1, dtype=np.int64)
+    np.cumsum(sizes[order], out=order_sizes[1:])
+    dg_table = np.empty(first.size, dtype=map_dtype)
+    dg_table['location'] = locations[leads]
+    dg_table['time'] = dg_time(index['time_sec'][leads], index['time_nanosec'][leads])
+    dg_table['size'] = order_sizes[first + num_parts] - order_sizes[first]
+    dg_table['record_type'] = index['dgm_type'][leads]
+    dg_table['device_id'] = index['echo_sounder_id'][leads]
+    dg_table['ping_number'] = index['ping_number'][leads]
+    dg_table['first_part'] = first
+    dg_table['num_parts'] = num_parts
+    dg_table = dg_table[np.argsort(leads, kind='stable')]
+    return dg_table, locations[order], sizes[order]
+
+
+def save_kmall_index(path, index: np.ndarray, key: tuple) -> bool:
+    return save_index(path=path, index=index, key=key, magic=sidecar_magic, version=sidecar_version,
+                      dtype=index_dtype)
+
+
+def load_kmall_index(path, key: tuple):
+    return load_index(path=path, key=key, magic=sidecar_magic, version=sidecar_version, dtype=index_dtype)
@@ -0,0 +1,386 @@
+import logging
+
+from netCDF4 import Dataset
+import numpy as np
+from ogr import osr
+
+from hyo2.openbst.lib.nc_helper import NetCDFHelper
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_formats import KmallDatagrams
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.reader import KongsbergKmall
+from hyo2.openbst.lib.raw.snippets import Snippets
+
+logger = logging.getLogger(__name__)
+
+
+class RawImport:
+    """Import of the .kmall datagrams in the same groups as for the s7k files
+
+    The pings are the MRZ datagrams (one per swath), with their main soundings only. The TVG is given per
+    sounding in the MRZ datagrams, not as a curve, so no time_varying_gain group is written. The .wcd files
+    (MWC datagrams only) are imported in a water_column group instead (import_water_column).
+    """
+    fill_value = -9999
+    num_beams = 512
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def import_raw(cls, raw: KongsbergKmall, ds: Dataset):
+
+        imported = RawImport.get_runtime_settings(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_raw_bathy(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_beam_geo(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_attitude(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_position(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_snippets(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        return imported
+
+    @classmethod
+    def import_water_column(cls, raw: KongsbergKmall, ds: Dataset):
+        return RawImport.get_water_column(raw=raw, ds=ds)
+
+    @classmethod
+    def get_pings(cls, raw: KongsbergKmall) -> tuple:
+        """Return the MRZ batch, with the ping and beam number of its main soundings and the number of beams"""
+        pings = raw.get_batch(dg_type=KmallDatagrams.MULTIBEAMRAWRANGEDEPTH)
+        main = ~pings['extra_detection']
+        sounding_ping = pings.record_index()[main]
+        sounding_beam = pings['sounding_index'][main]
+        num_beams = max(RawImport.num_beams, int(np.max(sounding_beam, initial=0)) + 1)
+        return pings, main, sounding_ping, sounding_beam, num_beams
+
+    @classmethod
+    def to_beams(cls, values: np.ndarray, sounding_ping: np.ndarray, sounding_beam: np.ndarray, num_pings: int,
+                 num_beams: int, fill_value=np.nan) -> np.ndarray:
+        beams = np.full((num_pings, num_beams), fill_value, dtype=np.float64)
+        beams[sounding_ping, sounding_beam] = values
+        return beams
+
+    @classmethod
+    def get_position(cls, raw: KongsbergKmall, ds: Dataset):
+        raw.is_mapped()
+
+        position = raw.get_batch(dg_type=KmallDatagrams.POSITION)
+
+        grp_pos = ds.createGroup("position")
+        grp_pos.createDimension(dimname="time", size=None)
+        spatial_reference = osr.SpatialReference()
+        spatial_reference.ImportFromEPSG(4326)
+        grp_pos.spatial_ref = str(spatial_reference)
+
+        var_time = grp_pos.createVariable(varname="time", datatype="f8", dimensions=("time",))
+        var_time[:] = position.time
+        var_lat = grp_pos.createVariable(varname="latitude", datatype="f8", dimensions=("time",))
+        var_lat[:] = position['latitude']
+        var_lon = grp_pos.createVariable(varname="longitude", datatype="f8", dimensions=("time",))
+        var_lon[:] = position['longitude']
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_attitude(cls, raw: KongsbergKmall, ds: Dataset):
+        raw.is_mapped()
+
+        attitude = raw.get_batch(dg_type=KmallDatagrams.ATTITUDE)
+        times = attitude['sample_time']
+
+        grp_attitude = ds.createGroup("attitude")
+        grp_attitude.units = "arc-degree"
+        grp_attitude.createDimension(dimname="time", size=None)
+
+        var_time = grp_attitude.createVariable(varname="time", datatype="f8", dimensions=("time",))
+        var_time[:] = times
+        for name in ('roll', 'pitch', 'heave'):
+            var = grp_attitude.createVariable(varname=name, datatype="f8", dimensions=("time",))
+            var[:] = attitude[name]
+        # the heading is sampled with the motion
+        var_times_head = grp_attitude.createVariable(varname="heading_time", datatype="f8", dimensions=("time",))
+        var_times_head[:] = times
+        var_heading = grp_attitude.createVariable(varname="heading", datatype="f8", dimensions=("time",))
+        var_heading[:] = attitude['heading']
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_beam_geo(cls, raw: KongsbergKmall, ds: Dataset):
+        raw.is_mapped()
+
+        pings, main, sounding_ping, sounding_beam, num_beams = RawImport.get_pings(raw=raw)
+        num_pings = len(pings)
+
+        # the beams are steered along by the tilt of their tx sector, with the array sizes used as beam widths
+        sounding_tilt = pings['tx_tilt_angle'][pings.sector_offsets[pings.record_index()] + pings['tx_sector']]
+        beam_fields = {
+            'beam_along_angle': sounding_tilt[main],
+            'beam_across_angle': pings['beam_angle_re_rx'][main],
+            'along_beamwdith': pings['tx_array_size_used'][sounding_ping],
+            'across_beamwidth': pings['rx_array_size_used'][sounding_ping],
+        }
+
+        grp_beam_geo = ds.createGroup("beam_geometry")
+        grp_beam_geo.createDimension(dimname="ping", size=None)
+        grp_beam_geo.createDimension(dimname="beam_number", size=num_beams)
+
+        var_time = grp_beam_geo.createVariable(varname="time", datatype="f8", dimensions=("ping",))
+        var_time[:] = pings.time
+
+        var_beam_number = grp_beam_geo.createVariable(varname="beam_number", datatype="i4", dimensions=("beam_number",))
+        var_beam_number[:] = [range(num_beams)]
+
+        for name, values in beam_fields.items():
+            var = grp_beam_geo.createVariable(varname=name, datatype="f4", dimensions=("ping", "beam_number"))
+            var[:] = RawImport.to_beams(values, sounding_ping=sounding_ping, sounding_beam=sounding_beam,
+                                        num_pings=num_pings, num_beams=num_beams)
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_raw_bathy(cls, raw: KongsbergKmall, ds: Dataset):
+        raw.is_mapped()
+
+        pings, main, sounding_ping, sounding_beam, num_beams = RawImport.get_pings(raw=raw)
+        num_pings = len(pings)
+        samp_rate = pings['seabed_image_sample_rate']
+
+        # detections in samples and angles in radians, as for the s7k raw detections
+        fields = {
+            'detect_point': pings['two_way_travel_time'][main] * samp_rate[sounding_ping],
+            'rx_angle': np.deg2rad(pings['beam_angle_re_rx'][main]),
+            'quality': pings['quality_factor'][main],
+            'bs_beam_average': pings['reflectivity_1'][main],
+        }
+
+        grp_bathy = ds.createGroup("raw_bathymetry_data")
+        grp_bathy.createDimension(dimname="ping", size=num_pings)
+        grp_bathy.createDimension(dimname="beam_number", size=num_beams)
+
+        var_time = grp_bathy.createVariable(varname="time",
+                                            datatype="f8",
+                                            dimensions=("ping",),
+                                            fill_value=RawImport.fill_value)
+        var_time[:] = pings.time
+
+        var_beam_number = grp_bathy.createVariable(varname="beam_number",
+                                                   datatype="i4",
+                                                   dimensions=("beam_number",),
+                                                   fill_value=RawImport.fill_value)
+        var_beam_number[:] = [range(num_beams)]
+
+        var_samp_rate = grp_bathy.createVariable(varname="sample_rate",
+                                                 datatype="f8",
+                                                 dimensions=("ping",),
+                                                 fill_value=RawImport.fill_value)
+        var_samp_rate[:] = samp_rate
+
+        var_tx_steering = grp_bathy.createVariable(varname="tx_steering",
+                                                   datatype="f8",
+                                                   dimensions=("ping",),
+                                                   fill_value=RawImport.fill_value)
+        var_tx_steering[:] = np.deg2rad(pings['tx_tilt_angle'][pings.sector_offsets[:-1]])
+
+        var_rx_steering = grp_bathy.createVariable(varname="rx_steering",
+                                                   datatype="f8",
+                                                   dimensions=("ping",),
+                                                   fill_value=RawImport.fill_value)
+        var_rx_steering[:] = np.full(num_pings, RawImport.fill_value)  # per sounding, in rx_angle
+
+        for name, values in fields.items():
+            var = grp_bathy.createVariable(varname=name,
+                                           datatype="f8",
+                                           dimensions=("ping", "beam_number"),
+                                           fill_value=RawImport.fill_value)
+            var[:] = RawImport.to_beams(values, sounding_ping=sounding_ping, sounding_beam=sounding_beam,
+                                        num_pings=num_pings, num_beams=num_beams, fill_value=RawImport.fill_value)
+
+        # the sample gates are not logged
+        for name in ('min_sample_gate', 'max sample gate'):
+            var = grp_bathy.createVariable(varname=name,
+                                           datatype="f8",
+                                           dimensions=("ping", "beam_number"),
+                                           fill_value=RawImport.fill_value)
+            var[:] = np.full((num_pings, num_beams), RawImport.fill_value)
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_snippets(cls, raw: KongsbergKmall, ds: Dataset):
+        """Write the seabed image samples of the main soundings, appended by slabs of MRZ datagrams
+
+        Only the datagrams of a slab (raw.iter_chunk_size) are decoded at once, so that the memory use does not
+        depend on the file size.
+        """
+        raw.is_mapped()
+
+        grp_snippet = Snippets.create(ds=ds, sample_datatype="f4")
+        for _, pings in raw.iter_batches(dg_type=KmallDatagrams.MULTIBEAMRAWRANGEDEPTH):
+            main = ~pings['extra_detection']
+            soundings = np.flatnonzero(main)
+            sounding_ping = pings.record_index()[main]
+            num_samples = np.diff(pings.sample_offsets)[soundings]
+
+            # the seabed image samples start at si_start_range, with the detection at si_centre_sample
+            start = pings['si_start_range'][soundings].astype(np.float64)
+            detect = start + pings['si_centre_sample'][soundings]
+            end = start + num_samples - 1
+            fields = {
+                'detect_sample': detect,
+                'snippet_start_sample': start,
+                'snippet_end_sample': end,
+            }
+
+            # the samples of the main soundings, one after the other
+            sample_offsets = np.zeros(soundings.size + 1, dtype=np.int64)
+            np.cumsum(num_samples, out=sample_offsets[1:])
+            sample_index = np.arange(sample_offsets[-1]) + np.repeat(pings.sample_offsets[soundings] -
+                                                                     sample_offsets[:-1], num_samples)
+
+            Snippets.write(grp=grp_snippet, time=pings.time,
+                           snippet_offsets=np.searchsorted(sounding_ping, np.arange(len(pings) + 1)),
+                           beam_index=pings['sounding_index'][main], fields=fields, sample_offsets=sample_offsets,
+                           samples=pings['samples'][sample_index])
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_water_column(cls, raw: KongsbergKmall, ds: Dataset):
+        """Write the MWC datagrams in the water_column group, as contiguous ragged arrays appended ping by ping
+
+        The beams of a ping are beam_count entries along the beam dimension, and the amplitudes (in dB) of a beam
+        are sample_count entries of the flat 'samples' vector. Only the datagram of the current ping is held, so
+        that the memory use does not depend on the file size. The phases are not imported.
+        """
+        raw.is_mapped()
+
+        grp_wc = ds.createGroup("water_column")
+        grp_wc.createDimension(dimname="ping", size=None)
+        grp_wc.createDimension(dimname="beam", size=None)
+        grp_wc.createDimension(dimname="sample", size=None)
+
+        ping_fields = ('time', 'ping_number', 'sample_rate', 'sound_velocity', 'tvg_offset', 'heave')
+        for name in ping_fields:
+            grp_wc.createVariable(varname=name, datatype="f8", dimensions=("ping",))
+        grp_wc.createVariable(varname="beam_start_index", datatype="i8", dimensions=("ping",))
+        var_beam_count = grp_wc.createVariable(varname="beam_count", datatype="i4", dimensions=("ping",))
+        var_beam_count.sample_dimension = "beam"
+
+        beam_fields = ('beam_pointing_angle', 'start_range_sample', 'detected_range')
+        grp_wc.createVariable(varname="beam_index", datatype="i4", dimensions=("beam",))
+        for name in beam_fields:
+            grp_wc.createVariable(varname=name, datatype="f8", dimensions=("beam",))
+        grp_wc.createVariable(varname="sample_start_index", datatype="i8", dimensions=("beam",))
+        var_sample_count = grp_wc.createVariable(varname="sample_count", datatype="i4", dimensions=("beam",))
+        var_sample_count.sample_dimension = "sample"
+
+        grp_wc.createVariable(varname="samples", datatype="f4", dimensions=("sample",))
+
+        num_beams = 0
+        num_samples = 0
+        for ping, batch in enumerate(raw.iter_water_column()):
+            values = {
+                'time': batch.time,
+                'ping_number': batch.ping_number,
+                'sample_rate': batch['sample_rate'],
+                'sound_velocity': batch['sound_velocity'],
+                'tvg_offset': batch['tvg_offset'],
+                'heave': batch['heave'],
+            }
+            for name in ping_fields:
+                grp_wc.variables[name][ping] = values[name][0]
+            ping_beams = len(batch['beam'])
+            grp_wc.variables["beam_start_index"][ping] = num_beams
+            grp_wc.variables["beam_count"][ping] = ping_beams
+            if ping_beams == 0:
+                continue
+
+            beams = slice(num_beams, num_beams + ping_beams)
+            grp_wc.variables["beam_index"][beams] = batch['beam']
+            grp_wc.variables["beam_pointing_angle"][beams] = np.deg2rad(batch['beam_pointing_angle'])
+            grp_wc.variables["start_range_sample"][beams] = batch['start_range_sample']
+            grp_wc.variables["detected_range"][beams] = batch['detected_range']
+            grp_wc.variables["sample_start_index"][beams] = num_samples + batch.sample_offsets[:-1]
+            grp_wc.variables["sample_count"][beams] = np.diff(batch.sample_offsets)
+            ping_samples = int(batch.sample_offsets[-1])
+            if ping_samples > 0:
+                grp_wc.variables["samples"][num_samples:num_samples + ping_samples] = batch['samples']
+
+            num_beams += ping_beams
+            num_samples += ping_samples
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_runtime_settings(cls, raw: KongsbergKmall, ds: Dataset):
+        raw.is_mapped()
+
+        pings = raw.get_batch(dg_type=KmallDatagrams.MULTIBEAMRAWRANGEDEPTH)
+        num_pings = len(pings)
+        first_sectors = pings.sector_offsets[:-1]
+        stabilisation = pings['mode_and_stabilisation']
+        settings = {
+            'frequency': pings['tx_center_frequency'][first_sectors],
+            'sample_rate': pings['seabed_image_sample_rate'],
+            'rx_band_width': pings['max_eff_tx_band_width'],
+            'tx_pulse_width': pings['max_eff_tx_pulse_length'],
+            'source_level': pings['tx_source_level'][first_sectors],
+            'static_gain': np.full(num_pings, RawImport.fill_value),  # not logged
+            'tx_along_steering': pings['tx_tilt_angle'][first_sectors],
+            'tx_across_steering': np.zeros(num_pings),
+            'tx_along_beam_width': pings['tx_array_size_used'],
+            'tx_across_beam_width': np.full(num_pings, RawImport.fill_value),  # not logged
+            'focus': pings['tx_focus_range'][first_sectors],
+            'rx_beam_width': pings['rx_array_size_used'],
+            'absorption_gain': pings['absorption'],
+            'sound_velocity': pings['sound_speed'],
+            'spreading_gain': np.full(num_pings, RawImport.fill_value),  # applied by the system TVG
+        }
+        stabilization_flags = {
+            'roll_stabilization': np.ones(num_pings, dtype=np.int32),  # the rx beams are always roll stabilized
+            'pitch_stabilization': ((stabilisation & 0x01) != 0).astype(np.int32),
+            'yaw_stabilization': ((stabilisation & 0x02) != 0).astype(np.int32),
+        }
+        tx_wave_form = np.where(pings['pulse_form'] == 0, "CW", "LFM")  # 0: CW, 1: mixed, 2: FM
+
+        grp_runtime = ds.createGroup("runtime_settings")
+        grp_runtime.createDimension(dimname="ping", size=None)
+
+        var_time = grp_runtime.createVariable(varname="time", datatype="f8", dimensions=("ping",))
+        var_time[:] = pings.time
+
+        var_tx_wave_form = grp_runtime.createVariable(varname="tx_wave_form", datatype="S1", dimensions=("ping",))
+        var_tx_wave_form[:] = tx_wave_form
+
+        for name, values in settings.items():
+            var = grp_runtime.createVariable(varname=name, datatype="f8", dimensions=("ping",))
+            var[:] = values
+
+        for name, values in stabilization_flags.items():
+            var = grp_runtime.createVariable(varname=name, datatype="i4", dimensions=("ping",))
+            var[:] = values
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
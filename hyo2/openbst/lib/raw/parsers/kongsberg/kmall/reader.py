@@ -0,0 +1,176 @@
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+import numpy as np
+from pathlib import Path
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_batch import entry_index, KongsbergBatch
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall import dg_index
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_batch import header_records, parse_batch, \
+    parse_water_column
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_formats import installation_parameters, KmallDatagrams, \
+    kmall_datagram_code
+from hyo2.openbst.lib.raw.parsers.kongsberg.reader import Kongsberg
+
+logger = logging.getLogger(__name__)
+
+
+class KongsbergKmall(Kongsberg):
+    """Reader of the Kongsberg .kmall files, and of the .wcd files (water column datagrams only)
+
+    The datagrams split in partitions are reassembled from the index: their data sections are read part by part
+    when the records are requested, so that only the requested datagrams are held in memory.
+    """
+
+    def __init__(self, input_path: Path, use_mmap: bool = False, index_path: Path = None):
+        self.part_locations = None
+        self.part_sizes = None
+        super().__init__(input_path=input_path, use_mmap=use_mmap, index_path=index_path)
+        self.block_size = dg_index.default_block_size
+
+    def check_file(self, file_path: Path):
+        self.format_type = file_path.name.split('.')[-1]
+        valid_formats = ['kmall', 'wcd']
+        try:
+            if self.format_type in valid_formats:
+                self.open_file(file_path)
+                self._valid = True
+            else:
+                logger.error("Unexpected format type: %s" % self.format_type)
+                self._valid = False
+        except FileNotFoundError:
+            logger.error("File not found: %s" % file_path)
+            self._valid = False
+        return self._valid
+
+    def data_map(self, force=False):
+        """Map the (reassembled) datagrams in the file
+
+        The index is loaded from the sidecar at index_path, when present and matching the file, unless forced.
+        """
+        if self.mapped is True and force is False:
+            return self.map
+
+        self.index = None
+        key = None
+        if self.index_path is not None:
+            key = dg_index.source_key(read=self.read, file_length=self.file_length, file_mtime=self.file_mtime)
+            if force is False:
+                self.index = dg_index.load_kmall_index(path=self.index_path, key=key)
+
+        if self.index is None:
+            self.index = dg_index.build_index(read=self.read, file_length=self.file_length,
+                                              block_size=self.block_size)
+            if self.index_path is not None:
+                dg_index.save_kmall_index(path=self.index_path, index=self.index, key=key)
+
+        dg_map, self.part_locations, self.part_sizes = dg_index.assemble(self.index)
+
+        # contiguous and time sorted records for each type, file order among the ones with the same time
+        dg_map = dg_map[np.lexsort((dg_map['time'], dg_map['record_type']))]
+        dg_codes, dg_starts, dg_counts = np.unique(dg_map['record_type'], return_index=True, return_counts=True)
+        self.map_types = {dg_code: slice(dg_start, dg_start + dg_count) for dg_code, dg_start, dg_count in
+                          zip(dg_codes.tolist(), dg_starts.tolist(), dg_counts.tolist())}
+
+        self.map = dg_map
+        self.mapped = True
+        return dg_map
+
+    def get_map(self, dg_type: KmallDatagrams) -> np.ndarray:
+        """Return the time sorted map entries of a datagram type, as a view of the map"""
+        self.is_mapped()
+        dg_slice = self.map_types.get(kmall_datagram_code[dg_type], slice(0, 0))
+        return self.map[dg_slice]
+
+    def read_datagrams(self, dg_map: np.ndarray) -> list:
+        """Return the data sections of the map entries (in map order), joining the parts of the split ones"""
+        num_parts = dg_map['num_parts'].astype(np.int64)
+        part_offsets = np.zeros(dg_map.size + 1, dtype=np.int64)
+        np.cumsum(num_parts, out=part_offsets[1:])
+        parts = np.repeat(dg_map['first_part'].astype(np.int64), num_parts) + entry_index(part_offsets)
+
+        part_chunks = [None] * parts.size
+        file_order = np.argsort(self.part_locations[parts], kind='stable')
+        sorted_parts = parts[file_order]
+        chunks = self.read_records(locations=self.part_locations[sorted_parts], sizes=self.part_sizes[sorted_parts])
+        for n, part_chunk in zip(file_order.tolist(), chunks):
+            part_chunks[n] = part_chunk
+        return [part_chunks[first] if last - first == 1 else b''.join(part_chunks[first:last]) for first, last in
+                zip(part_offsets[:-1].tolist(), part_offsets[1:].tolist())]
+
+    def get_batch(self, dg_type: KmallDatagrams, dg_record_range=None, dg_time=None, dg_ping_range=None,
+                  device_id=None) -> KongsbergBatch:
+        """Read the datagrams of a type, optionally filtered as in query_map, and decode them as columnar arrays
+
+        The records of the returned KongsbergBatch are in time order, with their times in batch.time, and the
+        ping counters and echo sounder ids in batch.ping_number and batch.device_id.
+        """
+        dg_map = self.query_map(dg_type=dg_type, dg_record_range=dg_record_range, dg_time=dg_time,
+                                dg_ping_range=dg_ping_range, device_id=device_id)
+
+        dtype = header_records.get(dg_type)
+        if dtype is not None:
+            if np.any(dg_map['size'] < dtype.itemsize):
+                raise RuntimeError("Datagram shorter than its fixed part: %d bytes" % dtype.itemsize)
+            file_order = np.argsort(dg_map['location'], kind='stable')
+            header = np.empty(dg_map.size, dtype=dtype)
+            header[file_order] = self.read_array(locations=dg_map['location'][file_order], dtype=dtype)
+            batch = KongsbergBatch(dg_type, header)
+        else:
+            batch = parse_batch(dg_type=dg_type, chunks=self.read_datagrams(dg_map))
+
+        batch.time = dg_map['time'].copy()
+        batch.ping_number = dg_map['ping_number'].copy()
+        batch.device_id = dg_map['device_id'].copy()
+        return batch
+
+    def iter_water_column(self, beam_step: int = 1, sample_step: int = 1, dg_time=None, dg_ping_range=None,
+                          device_id=None):
+        """Iterate over the MWC datagrams in time order, decoded one ping at a time and optionally decimated
+
+        Only the datagram of the current ping is read, so that the memory use does not depend on the file size.
+        """
+        dg_map = self.query_map(dg_type=KmallDatagrams.MULTIBEAMWATERCOLUMN, dg_time=dg_time,
+                                dg_ping_range=dg_ping_range, device_id=device_id)
+        for n in range(dg_map.size):
+            dg_chunk, = self.read_datagrams(dg_map[n:n + 1])
+            batch = parse_water_column(dg_chunk, beam_step=beam_step, sample_step=sample_step)
+            batch.time = dg_map['time'][n:n + 1].copy()
+            batch.ping_number = dg_map['ping_number'][n:n + 1].copy()
+            batch.device_id = dg_map['device_id'][n:n + 1].copy()
+            yield batch
+
+    def get_installation(self, dg_type: KmallDatagrams = KmallDatagrams.INSTALLATIONPARAMETERS) -> list:
+        """Return the (time, parameters dict) of the installation (or runtime) datagrams, in time order"""
+        dg_map = self.get_map(dg_type)
+        return [(dg_time, installation_parameters(dg_chunk)) for dg_time, dg_chunk in
+                zip(dg_map['time'].tolist(), self.read_datagrams(dg_map))]
+
+    @staticmethod
+    def get_time(time_sec, time_nanosec):
+        """Time in milliseconds to adhere to the cf standard, for scalar or array header times"""
+        utctime = dg_index.dg_time(time_sec, time_nanosec)
+        if utctime.ndim == 0:
+            return float(utctime)
+        return utctime
+
+
+def map_file(input_path: Path, index_path: Path) -> int:
+    """Worker entry point: map a file, saving its index sidecar, and return the number of datagrams"""
+    with KongsbergKmall(input_path, index_path=index_path) as raw:
+        if not raw.valid:
+            return 0
+        return raw.data_map().size
+
+
+def map_files(input_paths: list, index_paths: list, workers: int = 1) -> list:
+    """Map many files with worker processes (one file each at a time), saving their index sidecars
+
+    The readers opened afterwards with the same index paths load the indices instead of scanning the files.
+    Return the number of datagrams of each file.
+    """
+    if workers <= 1 or len(input_paths) <= 1:
+        return [map_file(input_path, index_path) for input_path, index_path in zip(input_paths, index_paths)]
+
+    logger.debug("Mapping %d files with %d workers" % (len(input_paths), workers))
+    with ProcessPoolExecutor(max_workers=min(workers, len(input_paths))) as executor:
+        return list(executor.map(map_file, input_paths, index_paths))
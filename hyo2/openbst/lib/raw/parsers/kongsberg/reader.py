@@ -0,0 +1,197 @@
+import logging
+
+import numpy as np
+from pathlib import Path
+from hyo2.openbst.lib.raw.parsers.record_reader import RecordReader
+from hyo2.openbst.lib.raw.parsers.kongsberg import dg_index
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_batch import header_records, KongsbergBatch, parse_batch, \
+    parse_header
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_formats import installation_parameters, KongsbergDatagrams, \
+    kongsberg_datagram_code
+
+logger = logging.getLogger(__name__)
+
+
+class Kongsberg(RecordReader):
+    """Reader of the Kongsberg EM series .all files (little-endian datagrams)
+
+    The datagrams are indexed once (STX, ETX and checksum validated) and decoded in batch, as for the s7k files.
+    The records served to the decoders are the data sections, after the common datagram header.
+    """
+
+    def __init__(self, input_path: Path, use_mmap: bool = False, index_path: Path = None):
+        super().__init__(use_mmap=use_mmap)
+
+        self._valid = False
+        self.map = None
+        self.map_types = dict()
+        self.index = None
+        self.mapped = False
+        self.index_path = index_path
+        self.format_type = None
+        self.block_size = dg_index.default_block_size
+        self.iter_chunk_size = 4096  # number of records decoded at once while iterating
+
+        self.check_file(input_path)
+
+    @property
+    def valid(self):
+        return self._valid
+
+    def check_file(self, file_path: Path):
+        self.format_type = file_path.name.split('.')[-1]
+        valid_formats = ['all', ]
+        try:
+            if self.format_type in valid_formats:
+                self.open_file(file_path)
+                self._valid = True
+            else:
+                logger.error("Unexpected format type: %s" % self.format_type)
+                self._valid = False
+        except FileNotFoundError:
+            logger.error("File not found: %s" % file_path)
+            self._valid = False
+        return self._valid
+
+    def data_map(self, force=False):
+        """Map the datagrams in the file
+
+        The index is loaded from the sidecar at index_path, when present and matching the file, unless forced.
+        """
+        if self.mapped is True and force is False:
+            return self.map
+
+        self.index = None
+        key = None
+        if self.index_path is not None:
+            key = dg_index.source_key(read=self.read, file_length=self.file_length, file_mtime=self.file_mtime)
+            if force is False:
+                self.index = dg_index.load_all_index(path=self.index_path, key=key)
+
+        if self.index is None:
+            self.index = dg_index.build_index(read=self.read, file_length=self.file_length,
+                                              block_size=self.block_size)
+            if self.index_path is not None:
+                dg_index.save_all_index(path=self.index_path, index=self.index, key=key)
+
+        dg_map = np.empty(self.index.size, dtype=dg_index.map_dtype)
+        dg_map['location'] = self.index['offset'] + dg_index.header_size
+        dg_map['time'] = dg_index.dg_time(self.index['date'], self.index['time'])
+        dg_map['size'] = self.index['size'] - dg_index.header_size - dg_index.footer_size
+        dg_map['record_type'] = self.index['datagram_type']
+        dg_map['device_id'] = self.index['serial_number']
+        dg_map['ping_number'] = np.where(np.isin(self.index['datagram_type'], dg_index.ping_records),
+                                         self.index['counter'].astype('<u4'), dg_index.no_ping)
+
+        # contiguous and time sorted records for each type, file order among the ones with the same time
+        dg_map = dg_map[np.lexsort((dg_map['time'], dg_map['record_type']))]
+        dg_codes, dg_starts, dg_counts = np.unique(dg_map['record_type'], return_index=True, return_counts=True)
+        self.map_types = {dg_code: slice(dg_start, dg_start + dg_count) for dg_code, dg_start, dg_count in
+                          zip(dg_codes.tolist(), dg_starts.tolist(), dg_counts.tolist())}
+
+        self.map = dg_map
+        self.mapped = True
+        return dg_map
+
+    def get_map(self, dg_type: KongsbergDatagrams) -> np.ndarray:
+        """Return the time sorted map entries of a datagram type, as a view of the map"""
+        self.is_mapped()
+        dg_slice = self.map_types.get(kongsberg_datagram_code[dg_type], slice(0, 0))
+        return self.map[dg_slice]
+
+    def is_mapped(self):
+        if not self.mapped:
+            self.data_map()
+
+    def query_map(self, dg_type: KongsbergDatagrams, dg_record_range=None, dg_time=None, dg_ping_range=None,
+                  device_id=None) -> np.ndarray:
+        """Return the map entries of a datagram type matching all the passed filters
+
+        - dg_record_range: positions in the time sorted records of the type
+        - dg_time: (start, end) time window, inclusive, as datetime or milliseconds (either can be None)
+        - dg_ping_range: (first, last) ping counters, inclusive (either can be None)
+        - device_id: the system serial number
+        """
+        dg_map = self.get_map(dg_type)
+
+        if dg_record_range is not None:
+            map_index = np.asarray(dg_record_range, dtype=np.int64)
+            if np.any(map_index >= dg_map.size) or np.any(map_index < -dg_map.size):
+                raise RuntimeError("Index %s exceeds number of datagram entries (%d)" % (dg_record_range, dg_map.size))
+            dg_map = dg_map[map_index]
+            if np.any(np.diff(dg_map['time']) < 0):
+                dg_map = dg_map[np.argsort(dg_map['time'], kind='stable')]
+
+        if dg_time is not None:
+            time_start, time_end = (self.to_map_time(value) for value in dg_time)
+            first = 0 if time_start is None else np.searchsorted(dg_map['time'], time_start, side='left')
+            last = dg_map.size if time_end is None else np.searchsorted(dg_map['time'], time_end, side='right')
+            dg_map = dg_map[first:last]
+
+        if dg_ping_range is not None:  # the ping counter wraps around at 65536
+            ping_first, ping_last = dg_ping_range
+            ping_first = 0 if ping_first is None else ping_first
+            ping_last = dg_index.no_ping - 1 if ping_last is None else ping_last
+            ping_numbers = dg_map['ping_number']
+            dg_map = dg_map[(ping_numbers >= ping_first) & (ping_numbers <= ping_last)]
+
+        if device_id is not None:
+            dg_map = dg_map[dg_map['device_id'] == device_id]
+
+        return dg_map
+
+    def get_batch(self, dg_type: KongsbergDatagrams, dg_record_range=None, dg_time=None, dg_ping_range=None,
+                  device_id=None) -> KongsbergBatch:
+        """Read the datagrams of a type, optionally filtered as in query_map, and decode them as columnar arrays
+
+        The records of the returned KongsbergBatch are in time order, with their times in batch.time, and the
+        header counters and serial numbers in batch.ping_number and batch.device_id.
+        """
+        dg_map = self.query_map(dg_type=dg_type, dg_record_range=dg_record_range, dg_time=dg_time,
+                                dg_ping_range=dg_ping_range, device_id=device_id)
+        file_order = np.argsort(dg_map['location'], kind='stable')
+
+        dtype = header_records.get(dg_type)
+        if dtype is not None:
+            if np.any(dg_map['size'] < dtype.itemsize):
+                raise RuntimeError("Datagram shorter than its fixed part: %d bytes" % dtype.itemsize)
+            header = np.empty(dg_map.size, dtype=dtype)
+            header[file_order] = self.read_array(locations=dg_map['location'][file_order], dtype=dtype)
+            batch = parse_header(dg_type=dg_type, header=header)
+        else:
+            dg_chunks = [None] * dg_map.size
+            for n, dg_chunk in zip(file_order.tolist(),
+                                   self.read_records(locations=dg_map['location'][file_order],
+                                                     sizes=dg_map['size'][file_order])):
+                dg_chunks[n] = dg_chunk
+            batch = parse_batch(dg_type=dg_type, chunks=dg_chunks)
+
+        batch.time = dg_map['time'].copy()
+        batch.ping_number = dg_map['ping_number'].copy()
+        batch.device_id = dg_map['device_id'].copy()
+        return batch
+
+    def iter_batches(self, dg_type: KongsbergDatagrams):
+        """Iterate over the datagrams of a type in time order, by slabs of iter_chunk_size records
+
+        For each slab, (rows, batch) is yielded, with rows the positions of its records in the time sorted map of
+        the type and batch decoded as in get_batch, so that only the records of a slab are held at once.
+        """
+        num_records = self.get_map(dg_type).size
+        for start in range(0, num_records, self.iter_chunk_size):
+            rows = np.arange(start, min(start + self.iter_chunk_size, num_records))
+            yield rows, self.get_batch(dg_type=dg_type, dg_record_range=rows)
+
+    def get_installation(self, dg_type: KongsbergDatagrams = KongsbergDatagrams.INSTALLATIONSTART) -> list:
+        """Return the (time, parameters dict) of the installation datagrams of a type, in time order"""
+        dg_map = self.get_map(dg_type)
+        return [(dg_time, installation_parameters(self.read(location, size))) for location, size, dg_time in
+                zip(dg_map['location'].tolist(), dg_map['size'].tolist(), dg_map['time'].tolist())]
+
+    @staticmethod
+    def get_time(date, time):
+        """Time in milliseconds to adhere to the cf standard, for scalar or array header date and time"""
+        utctime = dg_index.dg_time(date, time)
+        if utctime.ndim == 0:
+            return float(utctime)
+        return utctime
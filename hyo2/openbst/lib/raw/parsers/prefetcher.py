@@ -0,0 +1,116 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchStats:
+    """Counters of the prefetched reads, and of the waits on either side of the buffer ring"""
+
+    def __init__(self):
+        self.buffers = 0
+        self.bytes = 0
+        self.consumer_stalls = 0  # the decoder waited for the disk
+        self.consumer_stall_time = 0.0
+        self.producer_stalls = 0  # the disk waited for the decoder (ring full)
+        self.producer_stall_time = 0.0
+
+    def __repr__(self):
+        msg = "<%s>\n" % self.__class__.__name__
+        msg += "  <buffers: %d (%d bytes)>\n" % (self.buffers, self.bytes)
+        msg += "  <consumer stalls: %d (%.3f s)>\n" % (self.consumer_stalls, self.consumer_stall_time)
+        msg += "  <producer stalls: %d (%.3f s)>\n" % (self.producer_stalls, self.producer_stall_time)
+        return msg
+
+
+class Prefetcher:
+    """Read a planned sequence of byte ranges on a background thread, ahead of the consumer
+
+    The reads are done with a dedicated file handle and queued in a ring of at most max_buffers buffers, so
+    that the reading thread blocks (back-pressure) when the consumer falls behind. Iterating yields the
+    buffers in the planned order, as memoryview.
+    """
+
+    _done = object()
+
+    def __init__(self, path: str, starts, sizes, max_buffers: int = 4, stats: PrefetchStats = None):
+        self.path = path
+        self.starts = [int(start) for start in starts]
+        self.sizes = [int(size) for size in sizes]
+        if max_buffers < 1:
+            raise RuntimeError("Invalid number of prefetch buffers: %d" % max_buffers)
+        self.stats = stats if stats is not None else PrefetchStats()
+
+        self._queue = queue.Queue(maxsize=max_buffers)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __iter__(self):
+        self._thread = threading.Thread(target=self._produce, name="Prefetcher", daemon=True)
+        self._thread.start()
+        try:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    self.stats.consumer_stalls += 1
+                    stall_start = time.perf_counter()
+                    item = self._queue.get()
+                    self.stats.consumer_stall_time += time.perf_counter() - stall_start
+
+                if item is self._done:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield memoryview(item)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop the reading thread, also when the consumer did not read all the buffers"""
+        self._stop.set()
+        if self._thread is None:
+            return
+        while self._thread.is_alive():
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._thread.join(timeout=0.01)
+        self._thread = None
+
+    def _produce(self):
+        try:
+            with open(self.path, 'rb') as fid:
+                for start, size in zip(self.starts, self.sizes):
+                    if self._stop.is_set():
+                        return
+                    fid.seek(start, 0)
+                    buffer = fid.read(size)
+                    self.stats.buffers += 1
+                    self.stats.bytes += len(buffer)
+                    self._put(buffer)
+            self._put(self._done)
+
+        except Exception as e:  # forwarded to the consumer
+            logger.warning("Prefetch failed for %s: %s" % (self.path, e))
+            self._put(e)
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+            return
+        except queue.Full:
+            self.stats.producer_stalls += 1
+
+        stall_start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self.stats.producer_stall_time += time.perf_counter() - stall_start
@@ -0,0 +1,189 @@
+import logging
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.batch import DatagramBatch, entry_index, gather, headers, merge_fields, ragged, \
+    record_offsets
+from hyo2.openbst.lib.raw.parsers.r2sonic.dg_formats import a0_dtype, a2_dtype, g1_dtype, h0_dtype, i1_dtype, \
+    native, packet_header_dtype, point_dtypes, r0_dtype, R2SonicDatagrams, s1_dtype, section_header_dtype
+
+logger = logging.getLogger(__name__)
+
+
+class R2SonicBatch(DatagramBatch):
+    """Columnar decoding of many R2Sonic packets of a single R2SonicDatagrams type
+
+    The header holds the H0 fields in native byte order, with the ping time in milliseconds in 'ping_time'.
+    For BTH0, the per-point values are ragged (beam numbers in 'beam'), scaled to seconds, radians and
+    micropascals, and NaN when their section is not logged. For SNI0 (one packet per beam), the samples in
+    micropascals of packet n are at sample_offsets[n]:sample_offsets[n + 1].
+    """
+
+    def __init__(self, dg_type: R2SonicDatagrams, header: np.ndarray):
+        super().__init__(dg_type, header)
+
+
+def ping_time(time_seconds, time_nanoseconds) -> np.ndarray:
+    """Convert the H0 time (seconds and nanoseconds since 1970-01-01 UTC) to milliseconds"""
+    return np.asarray(time_seconds, dtype=np.float64) * 1000.0 + np.asarray(time_nanoseconds, dtype=np.float64) / 1e6
+
+
+def section_locations(buffer, starts: np.ndarray, sizes: np.ndarray, names) -> dict:
+    """Walk the sections of all the packets at once, returning for each name the (start, end) of its content
+
+    The start is -1 for the packets without the section. The packets are walked in lockstep, one section each
+    per step, so that the loop runs as many times as the sections of the longest packet.
+    """
+    found = {name: (np.full(starts.size, -1, dtype=np.int64), np.zeros(starts.size, dtype=np.int64))
+             for name in names}
+    positions = starts + packet_header_dtype.itemsize
+    ends = starts + sizes
+    active = np.flatnonzero(positions + section_header_dtype.itemsize <= ends)
+    while active.size > 0:
+        sections = gather(buffer, positions[active], section_header_dtype)
+        section_sizes = sections['section_size'].astype(np.int64)
+        if np.any(section_sizes < section_header_dtype.itemsize) or \
+                np.any(positions[active] + section_sizes > ends[active]):
+            raise RuntimeError("Packet with invalid section size")
+        for name in names:
+            matching = sections['section_name'] == name.encode('ascii')
+            rows = active[matching]
+            found[name][0][rows] = positions[rows] + section_header_dtype.itemsize
+            found[name][1][rows] = positions[rows] + section_sizes[matching]
+        positions[active] += section_sizes
+        active = active[positions[active] + section_header_dtype.itemsize <= ends[active]]
+    return found
+
+
+def check_packets(chunks: list, dg_type: R2SonicDatagrams) -> tuple:
+    """Return the chunks joined in a buffer, with their starts and sizes, after checking the packet names"""
+    packets = headers(chunks, packet_header_dtype)
+    if np.any(packets['packet_name'] != dg_type.value.encode('ascii')):
+        raise RuntimeError("Unexpected packet in %s records" % dg_type.value)
+    return record_offsets(chunks)
+
+
+def fixed_part(buffer, locations: tuple, dtype: np.dtype, rows: np.ndarray = None) -> np.ndarray:
+    """Decode the fixed part of a section at its start, for the passed rows (by default, all of them)"""
+    section_starts, section_ends = locations
+    if rows is None:
+        rows = np.arange(section_starts.size)
+    if np.any(section_starts[rows] < 0):
+        raise RuntimeError("Packet without a required section")
+    if np.any(section_starts[rows] + dtype.itemsize > section_ends[rows]):
+        raise RuntimeError("Section shorter than its fixed part: %d bytes" % dtype.itemsize)
+    return native(gather(buffer, section_starts[rows], dtype))
+
+
+def point_values(chunks: list, starts: np.ndarray, locations: tuple, fixed: np.dtype, counts: np.ndarray,
+                 dtype: np.dtype) -> tuple:
+    """Return the rows with a section, with the per-point values following its fixed part (ragged)"""
+    section_starts, section_ends = locations
+    rows = np.flatnonzero(section_starts >= 0)
+    value_starts = section_starts[rows] + fixed.itemsize
+    if np.any(value_starts + counts[rows] * dtype.itemsize > section_ends[rows]):
+        raise RuntimeError("Section shorter than its %d points" % int(np.max(counts[rows])))
+    values, _ = ragged([chunks[row] for row in rows.tolist()], value_starts - starts[rows], counts[rows], dtype)
+    return rows, values
+
+
+def parse_batch(dg_type: R2SonicDatagrams, chunks: list) -> R2SonicBatch:
+    """Decode many packets (the data sections of their s7k records) of dg_type into a R2SonicBatch"""
+    parser = batch_parsers.get(dg_type)
+    if parser is None:
+        raise RuntimeError("Batch decoding not supported for %s" % dg_type)
+    return parser(chunks)
+
+
+def parse_batch_bathy(chunks: list) -> R2SonicBatch:
+    """BTH0: ping header (H0), then per point the two-way travel time (R0), the angle (A0 or A2), the
+    intensity (I1), the range gates (G1) and the quality flags (Q0)"""
+    buffer, starts, sizes = check_packets(chunks, R2SonicDatagrams.BATHY)
+    locations = section_locations(buffer, starts, sizes, ('H0', 'R0', 'A0', 'A2', 'I1', 'G1', 'Q0'))
+    header = fixed_part(buffer, locations['H0'], h0_dtype)
+
+    batch = R2SonicBatch(R2SonicDatagrams.BATHY, header)
+    batch.data['ping_time'] = ping_time(header['time_seconds'], header['time_nanoseconds'])
+    points = header['points'].astype(np.int64)
+    batch.offsets = np.zeros(points.size + 1, dtype=np.int64)
+    np.cumsum(points, out=batch.offsets[1:])
+    batch.beam_field = 'beam'
+    beam = entry_index(batch.offsets)
+    batch.data['beam'] = beam
+
+    def scattered(rows: np.ndarray, values: np.ndarray, dtype=np.float32, fill_value=np.nan) -> np.ndarray:
+        out = np.full(beam.size, fill_value, dtype=dtype)
+        has = np.zeros(points.size, dtype=bool)
+        has[rows] = True
+        out[np.repeat(has, points)] = values
+        return out
+
+    def scales(rows: np.ndarray, name: str, dtype: np.dtype) -> np.ndarray:
+        return np.repeat(fixed_part(buffer, locations[name], dtype, rows)['scaling_factor'], points[rows])
+
+    rows, ranges = point_values(chunks, starts, locations['R0'], r0_dtype, points, point_dtypes['R0'])
+    batch.data['two_way_travel_time'] = scattered(rows, ranges * scales(rows, 'R0', r0_dtype))
+
+    # evenly spaced angles (A0), unless the angle steps (A2) are logged
+    angle = np.full(beam.size, np.nan, dtype=np.float32)
+    a0_rows = np.flatnonzero((locations['A0'][0] >= 0) & (locations['A2'][0] < 0))
+    if a0_rows.size > 0:
+        a0 = fixed_part(buffer, locations['A0'], a0_dtype, a0_rows)
+        spacing = (a0['angle_last'] - a0['angle_first']) / np.maximum(points[a0_rows] - 1, 1)
+        is_a0 = np.repeat(np.isin(np.arange(points.size), a0_rows), points)
+        angle[is_a0] = np.repeat(a0['angle_first'], points[a0_rows]) + beam[is_a0] * np.repeat(spacing,
+                                                                                               points[a0_rows])
+    rows, steps = point_values(chunks, starts, locations['A2'], a2_dtype, points, point_dtypes['A2'])
+    if rows.size > 0:
+        # the angle of a point is the first one plus the sum of the steps up to it
+        a2 = fixed_part(buffer, locations['A2'], a2_dtype, rows)
+        row_points = points[rows]
+        cumulated = np.cumsum(steps, dtype=np.int64)
+        firsts = np.concatenate(([0], cumulated))[np.cumsum(row_points) - row_points]
+        angle[np.repeat(np.isin(np.arange(points.size), rows), points)] = \
+            np.repeat(a2['angle_first'], row_points) + \
+            (cumulated - np.repeat(firsts, row_points)) * np.repeat(a2['scaling_factor'], row_points)
+    batch.data['angle'] = angle
+
+    rows, intensities = point_values(chunks, starts, locations['I1'], i1_dtype, points, point_dtypes['I1'])
+    batch.data['intensity'] = scattered(rows, intensities * scales(rows, 'I1', i1_dtype))
+
+    rows, gates = point_values(chunks, starts, locations['G1'], g1_dtype, points, point_dtypes['G1'])
+    gate_scales = scales(rows, 'G1', g1_dtype)
+    batch.data['gate_min'] = scattered(rows, gates['f0'] * gate_scales)
+    batch.data['gate_max'] = scattered(rows, gates['f1'] * gate_scales)
+
+    num_words = (points + 7) // 8
+    rows, words = point_values(chunks, starts, locations['Q0'], np.dtype([]), num_words, point_dtypes['Q0'])
+    if rows.size > 0:
+        row_points = points[rows]
+        word_offsets = np.concatenate(([0], np.cumsum(num_words[rows])))
+        row_beam = entry_index(np.concatenate(([0], np.cumsum(row_points))))
+        quality = (words[np.repeat(word_offsets[:-1], row_points) + row_beam // 8] >> (4 * (row_beam % 8))) & 0xF
+    else:
+        quality = np.empty(0, dtype=np.uint8)
+    batch.data['quality'] = scattered(rows, quality, dtype=np.uint8, fill_value=0)
+    return batch
+
+
+def parse_batch_snippet(chunks: list) -> R2SonicBatch:
+    """SNI0: ping header (H0) and snippet (S1) of a beam, with its samples"""
+    buffer, starts, sizes = check_packets(chunks, R2SonicDatagrams.SNIPPET)
+    locations = section_locations(buffer, starts, sizes, ('H0', 'S1'))
+    header = merge_fields(fixed_part(buffer, locations['H0'], h0_dtype),
+                          fixed_part(buffer, locations['S1'], s1_dtype))
+
+    batch = R2SonicBatch(R2SonicDatagrams.SNIPPET, header)
+    batch.data['ping_time'] = ping_time(header['time_seconds'], header['time_nanoseconds'])
+    num_samples = header['num_samples'].astype(np.int64)
+    rows, samples = point_values(chunks, starts, locations['S1'], s1_dtype, num_samples, np.dtype('>u2'))
+    batch.sample_offsets = np.zeros(num_samples.size + 1, dtype=np.int64)
+    np.cumsum(num_samples, out=batch.sample_offsets[1:])
+    batch.data['samples'] = samples * np.repeat(header['scaling_factor'], num_samples)
+    return batch
+
+
+batch_parsers = {
+    R2SonicDatagrams.BATHY: parse_batch_bathy,
+    R2SonicDatagrams.SNIPPET: parse_batch_snippet,
+}
@@ -0,0 +1,52 @@
+from enum import Enum
+
+import numpy as np
+
+
+def r2sonic_code(name: str) -> int:
+    """Return the packet name (e.g., 'BTH0') as the little-endian u4 read at the start of the data section"""
+    return int.from_bytes(name.encode('ascii'), 'little')
+
+
+class R2SonicDatagrams(Enum):
+    """R2Sonic packets, carried in the data section of s7k records of vendor-specific types"""
+
+    BATHY = 'BTH0'
+    SNIPPET = 'SNI0'
+
+
+r2sonic_datagram_code = {dg_type: r2sonic_code(dg_type.value) for dg_type in R2SonicDatagrams}
+
+# The packets are big-endian: name, size (of the whole packet) and stream id, followed by sections made of a
+# 2-char name and a size (including name and size), in any order. The unknown sections are skipped.
+packet_header_dtype = np.dtype([('packet_name', 'S4'), ('packet_size', '>u4'), ('data_stream_id', '>u4')])
+section_header_dtype = np.dtype([('section_name', 'S2'), ('section_size', '>u2')])
+
+# H0: ping header, shared by BTH0 and SNI0 (in SNI0, points is the number of snippets of the ping)
+h0_dtype = np.dtype([
+    ('model_number', 'S12'), ('serial_number', 'S12'), ('time_seconds', '>u4'), ('time_nanoseconds', '>u4'),
+    ('ping_number', '>u4'), ('ping_period', '>f4'), ('sound_speed', '>f4'), ('frequency', '>f4'),
+    ('tx_power', '>f4'), ('tx_pulse_width', '>f4'), ('tx_beamwidth_vert', '>f4'), ('tx_beamwidth_horiz', '>f4'),
+    ('tx_steering_vert', '>f4'), ('tx_steering_horiz', '>f4'), ('tx_misc_info', '>u4'), ('rx_bandwidth', '>f4'),
+    ('rx_sample_rate', '>f4'), ('rx_range', '>f4'), ('rx_gain', '>f4'), ('rx_spreading', '>f4'),
+    ('rx_absorption', '>f4'), ('rx_mount_tilt', '>f4'), ('rx_misc_info', '>u4'), ('reserved', '>u2'),
+    ('points', '>u2')])
+ping_number_offset = packet_header_dtype.itemsize + section_header_dtype.itemsize + h0_dtype.fields['ping_number'][1]
+
+# BTH0 sections, each followed by its per-point values
+r0_dtype = np.dtype([('scaling_factor', '>f4')])  # ranges (u2): two-way travel time [s] = range * scaling_factor
+a0_dtype = np.dtype([('angle_first', '>f4'), ('angle_last', '>f4'), ('more_info', '>f4', (6, ))])  # evenly spaced
+a2_dtype = np.dtype([('angle_first', '>f4'), ('scaling_factor', '>f4'), ('more_info', '>f4', (6, ))])  # steps (u2)
+i1_dtype = np.dtype([('scaling_factor', '>f4')])  # intensities (u2): micropascals = intensity * scaling_factor
+g1_dtype = np.dtype([('scaling_factor', '>f4')])  # gates (u1 min, u1 max): two-way time [s] = gate * scaling_factor
+point_dtypes = {'R0': np.dtype('>u2'), 'A2': np.dtype('>u2'), 'I1': np.dtype('>u2'), 'G1': np.dtype('u1, u1'),
+                'Q0': np.dtype('>u4')}  # Q0: the 4-bit quality flags of 8 points per word, from the low bits
+
+# SNI0 section, followed by the samples (u2): micropascals = sample * scaling_factor
+s1_dtype = np.dtype([('beam_number', '>u2'), ('num_samples', '>u2'), ('first_sample', '>u4'),
+                     ('bottom_sample', '>u4'), ('angle', '>f4'), ('scaling_factor', '>f4')])
+
+
+def native(values: np.ndarray) -> np.ndarray:
+    """Return the big-endian (structured) values in the native byte order"""
+    return values.astype(values.dtype.newbyteorder('='))
@@ -0,0 +1,284 @@
+import logging
+
+from netCDF4 import Dataset
+import numpy as np
+
+from hyo2.openbst.lib.nc_helper import NetCDFHelper
+from hyo2.openbst.lib.raw.parsers.r2sonic.dg_formats import R2SonicDatagrams
+from hyo2.openbst.lib.raw.parsers.r2sonic.reader import R2Sonic
+from hyo2.openbst.lib.raw.parsers.reson.imports import RawImport as ResonImport
+from hyo2.openbst.lib.raw.snippets import Snippets
+
+logger = logging.getLogger(__name__)
+
+
+class RawImport:
+    """Import of the R2Sonic s7k files in the same groups as for the Reson files
+
+    The pings are the BTH0 packets, and the snippets are the SNI0 packets grouped by ping number. The position and the
+    attitude are in standard 7k records, imported as for the Reson files. No TVG curve is logged, so no
+    time_varying_gain group is written. The intensities are converted from micropascals to dB re 1 uPa.
+    """
+    fill_value = -9999
+    num_beams = 512
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def import_raw(cls, raw: R2Sonic, ds: Dataset):
+
+        imported = RawImport.get_runtime_settings(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_raw_bathy(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_beam_geo(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = ResonImport.get_attitude(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = ResonImport.get_position(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        imported = RawImport.get_snippets(raw=raw, ds=ds)
+        if imported is False:
+            return False
+
+        return imported
+
+    @classmethod
+    def to_db(cls, micropascals: np.ndarray) -> np.ndarray:
+        """Convert the intensities in micropascals to dB re 1 uPa, with the zeros (not detected) as NaN"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(micropascals > 0, 20.0 * np.log10(micropascals), np.nan)
+
+    @classmethod
+    def get_pings(cls, raw: R2Sonic):
+        """Return the BTH0 batch, with the number of beams"""
+        pings = raw.get_batch(dg_type=R2SonicDatagrams.BATHY)
+        num_beams = max(RawImport.num_beams, int(np.max(pings['points'], initial=0)))
+        return pings, num_beams
+
+    @classmethod
+    def get_beam_geo(cls, raw: R2Sonic, ds: Dataset):
+        raw.is_mapped()
+
+        pings, num_beams = RawImport.get_pings(raw=raw)
+        num_points = np.diff(pings.offsets)
+
+        # the beams are steered along by the tx steering, with the tx beam width along; the rx widths are not logged
+        beam_fields = {
+            'beam_along_angle': np.repeat(np.rad2deg(pings['tx_steering_vert']), num_points),
+            'beam_across_angle': np.rad2deg(pings['angle']),
+            'along_beamwdith': np.repeat(np.rad2deg(pings['tx_beamwidth_vert']), num_points),
+            'across_beamwidth': np.full(pings['beam'].size, np.nan),
+        }
+
+        grp_beam_geo = ds.createGroup("beam_geometry")
+        grp_beam_geo.createDimension(dimname="ping", size=None)
+        grp_beam_geo.createDimension(dimname="beam_number", size=num_beams)
+
+        var_time = grp_beam_geo.createVariable(varname="time", datatype="f8", dimensions=("ping",))
+        var_time[:] = pings.time
+
+        var_beam_number = grp_beam_geo.createVariable(varname="beam_number", datatype="i4", dimensions=("beam_number",))
+        var_beam_number[:] = [range(num_beams)]
+
+        for name, values in beam_fields.items():
+            pings.data[name] = values
+            var = grp_beam_geo.createVariable(varname=name, datatype="f4", dimensions=("ping", "beam_number"))
+            var[:] = pings.to_beams(name, num_beams=num_beams)
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_raw_bathy(cls, raw: R2Sonic, ds: Dataset):
+        raw.is_mapped()
+
+        pings, num_beams = RawImport.get_pings(raw=raw)
+        num_pings = len(pings)
+        samp_rate = pings['rx_sample_rate']
+        point_rate = np.repeat(samp_rate, np.diff(pings.offsets))
+
+        # detections and gates in samples, angles in radians and intensities in dB, as for the s7k raw detections
+        pings.data['detect_point'] = pings['two_way_travel_time'] * point_rate
+        pings.data['rx_angle'] = pings['angle']
+        pings.data['bs_beam_average'] = RawImport.to_db(pings['intensity'])
+        pings.data['min_sample_gate'] = pings['gate_min'] * point_rate
+        pings.data['max sample gate'] = pings['gate_max'] * point_rate
+        fields = ('detect_point', 'rx_angle', 'quality', 'bs_beam_average', 'min_sample_gate', 'max sample gate')
+
+        grp_bathy = ds.createGroup("raw_bathymetry_data")
+        grp_bathy.createDimension(dimname="ping", size=num_pings)
+        grp_bathy.createDimension(dimname="beam_number", size=num_beams)
+
+        var_time = grp_bathy.createVariable(varname="time",
+                                            datatype="f8",
+                                            dimensions=("ping",),
+                                            fill_value=RawImport.fill_value)
+        var_time[:] = pings.time
+
+        var_beam_number = grp_bathy.createVariable(varname="beam_number",
+                                                   datatype="i4",
+                                                   dimensions=("beam_number",),
+                                                   fill_value=RawImport.fill_value)
+        var_beam_number[:] = [range(num_beams)]
+
+        var_samp_rate = grp_bathy.createVariable(varname="sample_rate",
+                                                 datatype="f8",
+                                                 dimensions=("ping",),
+                                                 fill_value=RawImport.fill_value)
+        var_samp_rate[:] = samp_rate
+
+        var_tx_steering = grp_bathy.createVariable(varname="tx_steering",
+                                                   datatype="f8",
+                                                   dimensions=("ping",),
+                                                   fill_value=RawImport.fill_value)
+        var_tx_steering[:] = pings['tx_steering_vert']
+
+        var_rx_steering = grp_bathy.createVariable(varname="rx_steering",
+                                                   datatype="f8",
+                                                   dimensions=("ping",),
+                                                   fill_value=RawImport.fill_value)
+        var_rx_steering[:] = np.full(num_pings, RawImport.fill_value)  # per point, in rx_angle
+
+        for name in fields:
+            values = pings.to_beams(name, num_beams=num_beams, fill_value=RawImport.fill_value)
+            var = grp_bathy.createVariable(varname=name,
+                                           datatype="f8",
+                                           dimensions=("ping", "beam_number"),
+                                           fill_value=RawImport.fill_value)
+            var[:] = np.where(np.isnan(values), RawImport.fill_value, values)
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def get_snippets(cls, raw: R2Sonic, ds: Dataset):
+        """Write the SNI0 packets (one per beam) grouped by ping, appended by slabs of whole pings
+
+        The pings are grouped from the map, and only the packets of a slab (about raw.iter_chunk_size) are decoded
+        at once, so that the memory use does not depend on the file size.
+        """
+        raw.is_mapped()
+
+        snippet_map = raw.get_map(R2SonicDatagrams.SNIPPET)
+        ping_times, snippet_ping = RawImport.snippet_pings(raw=raw, snippet_map=snippet_map)
+        num_pings = ping_times.size
+        ping_order = np.argsort(snippet_ping, kind='stable')
+        packet_offsets = np.searchsorted(snippet_ping[ping_order], np.arange(num_pings + 1))
+        slab_firsts = np.searchsorted(packet_offsets, np.arange(0, snippet_map.size, raw.iter_chunk_size),
+                                      side='right') - 1
+        slab_bounds = np.unique(np.append(slab_firsts, num_pings))
+
+        grp_snippet = Snippets.create(ds=ds, sample_datatype="f4")
+        for first, last in zip(slab_bounds[:-1].tolist(), slab_bounds[1:].tolist()):
+            # the packets of the slab, decoded in map order, then grouped by ping
+            rows = np.sort(ping_order[packet_offsets[first]:packet_offsets[last]])
+            snippets = raw.get_batch(dg_type=R2SonicDatagrams.SNIPPET, dg_record_range=rows)
+            slab_ping = snippet_ping[rows] - first
+            slab_order = np.argsort(slab_ping, kind='stable')
+            num_samples = np.diff(snippets.sample_offsets)[slab_order]
+
+            sample_offsets = np.zeros(rows.size + 1, dtype=np.int64)
+            np.cumsum(num_samples, out=sample_offsets[1:])
+            sample_index = np.arange(sample_offsets[-1]) + np.repeat(snippets.sample_offsets[:-1][slab_order] -
+                                                                     sample_offsets[:-1], num_samples)
+            samples = RawImport.to_db(snippets['samples'][sample_index])
+
+            start = snippets['first_sample'][slab_order].astype(np.float64)
+            Snippets.write(grp=grp_snippet, time=ping_times[first:last],
+                           snippet_offsets=packet_offsets[first:last + 1] - packet_offsets[first],
+                           beam_index=snippets['beam_number'][slab_order],
+                           fields={'detect_sample': snippets['bottom_sample'][slab_order].astype(np.float64),
+                                   'snippet_start_sample': start,
+                                   'snippet_end_sample': start + num_samples - 1},
+                           sample_offsets=sample_offsets,
+                           samples=np.where(np.isnan(samples), RawImport.fill_value, samples))
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def snippet_pings(cls, raw: R2Sonic, snippet_map: np.ndarray) -> tuple:
+        """Return the time of the pings of the SNI0 packets and the ping (in time order) of each map entry
+
+        The packets are grouped by their H0 ping number. The time of a ping is the record time of its BTH0
+        packet, as for the other groups, or of its first SNI0 packet when it has no BTH0 packet.
+        """
+        ping_numbers, snippet_ping = np.unique(snippet_map['ping_number'], return_inverse=True)
+        snippet_ping = snippet_ping.ravel()
+        ping_times = np.full(ping_numbers.size, np.inf)
+        np.minimum.at(ping_times, snippet_ping, snippet_map['time'])
+
+        bathy_map = raw.get_map(R2SonicDatagrams.BATHY)
+        bathy_numbers, bathy_first = np.unique(bathy_map['ping_number'], return_index=True)
+        matches = np.minimum(np.searchsorted(bathy_numbers, ping_numbers), max(bathy_numbers.size - 1, 0))
+        if bathy_numbers.size > 0:
+            matched = bathy_numbers[matches] == ping_numbers
+            ping_times[matched] = bathy_map['time'][bathy_first[matches[matched]]]
+
+        time_order = np.argsort(ping_times, kind='stable')
+        ping_rank = np.empty(ping_numbers.size, dtype=np.int64)
+        ping_rank[time_order] = np.arange(ping_numbers.size)
+        return ping_times[time_order], ping_rank[snippet_ping]
+
+    @classmethod
+    def get_runtime_settings(cls, raw: R2Sonic, ds: Dataset):
+        raw.is_mapped()
+
+        pings, _ = RawImport.get_pings(raw=raw)
+        num_pings = len(pings)
+        settings = {
+            'frequency': pings['frequency'],
+            'sample_rate': pings['rx_sample_rate'],
+            'rx_band_width': pings['rx_bandwidth'],
+            'tx_pulse_width': pings['tx_pulse_width'],
+            'source_level': pings['tx_power'],
+            'static_gain': pings['rx_gain'] * 2.0,  # logged as half of the relative gain in dB
+            'tx_along_steering': np.rad2deg(pings['tx_steering_vert']),
+            'tx_across_steering': np.rad2deg(pings['tx_steering_horiz']),
+            'tx_along_beam_width': np.rad2deg(pings['tx_beamwidth_vert']),
+            'tx_across_beam_width': np.rad2deg(pings['tx_beamwidth_horiz']),
+            'focus': np.full(num_pings, RawImport.fill_value),  # not logged
+            'rx_beam_width': np.full(num_pings, RawImport.fill_value),  # not logged
+            'absorption_gain': pings['rx_absorption'],
+            'sound_velocity': pings['sound_speed'],
+            'spreading_gain': pings['rx_spreading'],
+        }
+        # the stabilization and the pulse type are in the misc info bits, not decoded (CW pulses assumed)
+        stabilization_flags = {
+            'roll_stabilization': np.zeros(num_pings, dtype=np.int32),
+            'pitch_stabilization': np.zeros(num_pings, dtype=np.int32),
+            'yaw_stabilization': np.zeros(num_pings, dtype=np.int32),
+        }
+        tx_wave_form = np.full(num_pings, "CW")
+
+        grp_runtime = ds.createGroup("runtime_settings")
+        grp_runtime.createDimension(dimname="ping", size=None)
+
+        var_time = grp_runtime.createVariable(varname="time", datatype="f8", dimensions=("ping",))
+        var_time[:] = pings.time
+
+        var_tx_wave_form = grp_runtime.createVariable(varname="tx_wave_form", datatype="S1", dimensions=("ping",))
+        var_tx_wave_form[:] = tx_wave_form
+
+        for name, values in settings.items():
+            var = grp_runtime.createVariable(varname=name, datatype="f8", dimensions=("ping",))
+            var[:] = values
+
+        for name, values in stabilization_flags.items():
+            var = grp_runtime.createVariable(varname=name, datatype="i4", dimensions=("ping",))
+            var[:] = values
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
@@ -0,0 +1,148 @@
+import logging
+
+import numpy as np
+from pathlib import Path
+from hyo2.openbst.lib.raw.parsers.batch import gather
+from hyo2.openbst.lib.raw.parsers.r2sonic.dg_batch import parse_batch
+from hyo2.openbst.lib.raw.parsers.r2sonic.dg_formats import packet_header_dtype, ping_number_offset, \
+    r2sonic_datagram_code
+from hyo2.openbst.lib.raw.parsers.reson import dg_index
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams, reson_datagram_code
+from hyo2.openbst.lib.raw.parsers.reson.reader import Reson
+from hyo2.openbst.lib.raw.raw_formats import RawFormatType
+
+logger = logging.getLogger(__name__)
+
+reson_codes = np.array(sorted(reson_datagram_code.values()), dtype=np.uint32)
+r2sonic_codes = np.array(sorted(r2sonic_datagram_code.values()), dtype=np.uint32)
+code_dtype = np.dtype('<u4')  # the packet name, read as r2sonic_code
+probe_size = 1024 * 1024  # bytes scanned from the file start to detect the dialect
+
+
+def packet_codes(read_array, locations: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Return the R2Sonic packet code of each record data section (0 for the other payloads)"""
+    codes = np.zeros(locations.size, dtype=np.uint32)
+    rows = np.flatnonzero(sizes >= packet_header_dtype.itemsize)
+    rows = rows[np.argsort(locations[rows], kind='stable')]
+    names = read_array(locations=locations[rows], dtype=code_dtype)
+    known = np.isin(names, r2sonic_codes)
+    codes[rows[known]] = names[known]
+    return codes
+
+
+class R2Sonic(Reson):
+    """Reader of the s7k files with R2Sonic packets (e.g., .r2sc), and of the plain Reson s7k files
+
+    The records are indexed as for the Reson files. The records of vendor-specific types carrying an R2Sonic
+    packet are mapped by packet (R2SonicDatagrams), with the ping number of their H0 section, while the other
+    records (e.g., navigation and attitude) are read as ResonDatagrams. The dialect is given by the content:
+    RawFormatType.R2SONIC_S7K when R2Sonic packets are found, RawFormatType.RESON_S7K otherwise.
+    """
+
+    def __init__(self, input_path: Path, use_mmap: bool = False, index_path: Path = None, workers: int = 1):
+        self.dialect = None
+        super().__init__(input_path=input_path, use_mmap=use_mmap, index_path=index_path, workers=workers)
+
+    def check_file(self, file_path: Path):
+        self.format_type = file_path.name.split('.')[-1]
+        valid_formats = ['s7k', 'r2sc']
+        try:
+            if self.format_type in valid_formats:
+                self.open_file(file_path)
+                self.file_location = self.file.tell()
+                self._valid = True
+            else:
+                logger.error("Unexpected format type: %s" % self.format_type)
+                self._valid = False
+        except FileNotFoundError:
+            logger.error("File not found: %s" % file_path)
+            self._valid = False
+        return self._valid
+
+    def data_map(self, force=False):
+        """Map the datagrams in the file, as for the Reson files, then the R2Sonic packets by their name"""
+        if self.mapped is True and force is False:
+            return self.map
+
+        dg_map = super().data_map(force=force)
+        vendor = np.flatnonzero(~np.isin(dg_map['record_type'], reson_codes))
+        codes = packet_codes(self.read_array, locations=dg_map['location'][vendor], sizes=dg_map['size'][vendor])
+        packets = vendor[codes > 0]
+        self.dialect = RawFormatType.R2SONIC_S7K if packets.size > 0 else RawFormatType.RESON_S7K
+        if packets.size == 0:
+            return dg_map
+
+        dg_map['record_type'][packets] = codes[codes > 0]
+        dg_map['ping_number'][packets] = dg_index.no_ping
+        has_ping = packets[dg_map['size'][packets] >= ping_number_offset + 4]
+        file_order = has_ping[np.argsort(dg_map['location'][has_ping], kind='stable')]
+        dg_map['ping_number'][file_order] = self.read_array(locations=dg_map['location'][file_order] +
+                                                            ping_number_offset, dtype=np.dtype('>u4'))
+
+        # contiguous and time sorted records for each type, file order among the ones with the same time
+        dg_map = dg_map[np.lexsort((dg_map['time'], dg_map['record_type']))]
+        dg_codes, dg_starts, dg_counts = np.unique(dg_map['record_type'], return_index=True, return_counts=True)
+        self.map_types = {dg_code: slice(dg_start, dg_start + dg_count) for dg_code, dg_start, dg_count in
+                          zip(dg_codes.tolist(), dg_starts.tolist(), dg_counts.tolist())}
+
+        self.map = dg_map
+        return dg_map
+
+    def get_map(self, dg_type) -> np.ndarray:
+        """Return the time sorted map entries of a datagram type (ResonDatagrams or R2SonicDatagrams)"""
+        if isinstance(dg_type, ResonDatagrams):
+            return super().get_map(dg_type)
+        self.is_mapped()
+        dg_slice = self.map_types.get(r2sonic_datagram_code[dg_type], slice(0, 0))
+        return self.map[dg_slice]
+
+    def get_batch(self, dg_type, dg_record_range=None, dg_time=None, dg_ping_range=None, device_id=None):
+        """Read the datagrams of a type, optionally filtered as in query_map, and decode them as columnar arrays
+
+        The R2Sonic packets are returned as a R2SonicBatch, with the ping numbers in batch.ping_number.
+        """
+        if isinstance(dg_type, ResonDatagrams):
+            return super().get_batch(dg_type=dg_type, dg_record_range=dg_record_range, dg_time=dg_time,
+                                     dg_ping_range=dg_ping_range, device_id=device_id)
+
+        dg_map = self.query_map(dg_type=dg_type, dg_record_range=dg_record_range, dg_time=dg_time,
+                                dg_ping_range=dg_ping_range, device_id=device_id)
+        file_order = np.argsort(dg_map['location'], kind='stable')
+        dg_chunks = [None] * dg_map.size
+        for n, dg_chunk in zip(file_order.tolist(), self.read_records(locations=dg_map['location'][file_order],
+                                                                      sizes=dg_map['size'][file_order])):
+            dg_chunks[n] = dg_chunk
+
+        batch = parse_batch(dg_type=dg_type, chunks=dg_chunks)
+        batch.time = dg_map['time'].copy()
+        batch.ping_number = dg_map['ping_number'].copy()
+        return batch
+
+
+def detect_dialect(read, file_length: int, size: int = probe_size) -> RawFormatType:
+    """Return the dialect of a s7k file from the records starting in its first size bytes
+
+    The records are found as for the index (see reson.dg_index), then the start of their data section is
+    checked for the name of an R2Sonic packet.
+    """
+    stop = min(size, file_length)
+    candidates = dg_index.scan(read=read, start=0, stop=stop, file_length=file_length)
+    records = candidates[dg_index.select_records(candidates, file_length=file_length)]
+    records = records[~np.isin(records['record_type'], reson_codes)]
+
+    block = np.frombuffer(read(0, stop + dg_index.header_size + code_dtype.itemsize), dtype=np.uint8)
+    locations = records['offset'].astype(np.int64) + dg_index.header_size
+    sizes = records['size'].astype(np.int64) - dg_index.header_size - dg_index.footer_size
+    inside = locations + code_dtype.itemsize <= block.size
+    codes = packet_codes(lambda locations, dtype: gather(block, locations, dtype), locations=locations[inside],
+                         sizes=sizes[inside])
+    return RawFormatType.R2SONIC_S7K if np.any(codes > 0) else RawFormatType.RESON_S7K
+
+
+def file_dialect(path: Path) -> RawFormatType:
+    """Return the dialect of a s7k file from its content (see detect_dialect), RawFormatType.RESON_S7K if the file
+    cannot be read"""
+    with R2Sonic(path) as raw:
+        if not raw.valid:
+            return RawFormatType.RESON_S7K
+        return detect_dialect(read=raw.read, file_length=raw.file_length)
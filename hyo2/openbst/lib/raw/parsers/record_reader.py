@@ -0,0 +1,194 @@
+import calendar
+from datetime import datetime, timezone
+import logging
+import mmap
+import os
+from pathlib import Path
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.batch import gather
+from hyo2.openbst.lib.raw.parsers.prefetcher import Prefetcher, PrefetchStats
+
+logger = logging.getLogger(__name__)
+
+
+class RecordReader:
+    """File access shared by the raw readers
+
+    The records are served as zero-copy slices of a memory-mapped file (use_mmap), or as buffered reads that
+    coalesce nearby records and can be prefetched on a background thread.
+    """
+
+    def __init__(self, use_mmap: bool = False):
+        self.file = None
+        self.use_mmap = use_mmap
+        self._mmap = None
+        self._view = None
+        self.file_length = None
+        self.file_mtime = None
+        self.max_read_gap = 64 * 1024  # records closer than this are read together
+        self.max_read_size = 16 * 1024 * 1024  # bytes read at once by coalesced reads
+        self.prefetch_buffers = 0  # coalesced reads queued ahead by a background thread (0: disabled)
+        self.prefetch_stats = PrefetchStats()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def is_mmapped(self) -> bool:
+        return self._view is not None
+
+    def open_file(self, file_path: Path):
+        """Open the file for reading (memory-mapped with use_mmap), raising FileNotFoundError when missing"""
+        self.file = file_path.open(mode='rb')
+        self.file.seek(0)
+        file_stat = os.stat(self.file.name)
+        self.file_length = file_stat.st_size
+        self.file_mtime = file_stat.st_mtime_ns
+        if self.use_mmap:
+            self.open_mmap()
+
+    def open_mmap(self) -> bool:
+        """Map the whole file read-only, so that datagrams are served as zero-copy memoryview slices
+
+        Files that cannot be mapped (e.g., empty files, special files, exhausted address space) are
+        left on the buffered seek/read path."""
+        if self._view is not None:
+            return True
+
+        try:
+            self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError) as e:
+            logger.warning("Unable to memory-map %s, using buffered reads: %s" % (self.file.name, e))
+            self._mmap = None
+            return False
+
+        self._view = memoryview(self._mmap)
+        return True
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # parsed datagrams still hold slices of the mapping, it is unmapped once they are released
+                logger.warning("Memory map still referenced, unmapping deferred: %s" % self.file.name)
+            self._mmap = None
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def read(self, location: int, size: int):
+        """Return size bytes from location: a memoryview slice of the mapping in mmap mode, a bytes copy
+        otherwise"""
+        if self._view is not None:
+            return self._view[location:location + size]
+
+        self.file.seek(location, 0)
+        return self.file.read(size)
+
+    @staticmethod
+    def plan_reads(locations: np.ndarray, sizes: np.ndarray, max_read_gap: int, max_read_size: int) -> tuple:
+        """Group the records (sorted by location) into coalesced reads
+
+        A new read starts when the gap from the previous record exceeds max_read_gap, or when a record starts
+        past max_read_size bytes from the start of the read (so a read exceeds it by at most one record).
+        Return the start and end of each read, and the index of its first record.
+        """
+        locations = np.asarray(locations, dtype=np.int64)
+        ends = locations + np.asarray(sizes, dtype=np.int64)
+        if locations.size == 0:
+            return locations, ends, np.empty(0, dtype=np.int64)
+
+        gap_breaks = np.flatnonzero(locations[1:] - ends[:-1] > max_read_gap) + 1
+        group_firsts = np.concatenate(([0], gap_breaks))
+        group_sizes = np.diff(np.concatenate((group_firsts, [locations.size])))
+        group_starts = np.repeat(locations[group_firsts], group_sizes)
+        group_ids = np.repeat(np.arange(group_firsts.size), group_sizes)
+
+        # split the groups by max_read_size
+        blocks = (locations - group_starts) // max(max_read_size, 1)
+        new_read = np.ones(locations.size, dtype=bool)
+        new_read[1:] = (group_ids[1:] != group_ids[:-1]) | (blocks[1:] != blocks[:-1])
+        read_firsts = np.flatnonzero(new_read)
+        return locations[read_firsts], np.maximum.reduceat(ends, read_firsts), read_firsts
+
+    def read_records(self, locations: np.ndarray, sizes: np.ndarray, max_read_size: int = None):
+        """Yield the buffers of the records at the passed locations (sorted), reading nearby records at once
+
+        The reads are planned with plan_reads using max_read_gap and max_read_size, and the records are
+        sliced out of each read (zero-copy in mmap mode). With prefetch_buffers > 0 (and no mmap), the reads
+        are done ahead on a background thread, holding at most prefetch_buffers reads in memory.
+        """
+        if max_read_size is None:
+            max_read_size = self.max_read_size
+        locations = np.asarray(locations, dtype=np.int64)
+        sizes = np.asarray(sizes, dtype=np.int64)
+        read_starts, read_ends, read_firsts = self.plan_reads(locations=locations, sizes=sizes,
+                                                              max_read_gap=self.max_read_gap,
+                                                              max_read_size=max_read_size)
+        read_lasts = np.concatenate((read_firsts[1:], [locations.size]))
+        if self.prefetch_buffers > 0 and self._view is None:
+            prefetcher = Prefetcher(path=self.file.name, starts=read_starts, sizes=read_ends - read_starts,
+                                    max_buffers=self.prefetch_buffers, stats=self.prefetch_stats)
+            buffers = iter(prefetcher)
+        else:
+            prefetcher = None
+            buffers = (self.read_ahead(read_start, read_end - read_start)
+                       for read_start, read_end in zip(read_starts.tolist(), read_ends.tolist()))
+
+        try:
+            for buffer, read_start, first, last in zip(buffers, read_starts.tolist(),
+                                                       read_firsts.tolist(), read_lasts.tolist()):
+                for location, size in zip(locations[first:last].tolist(), sizes[first:last].tolist()):
+                    yield buffer[location - read_start:location - read_start + size]
+        finally:
+            if prefetcher is not None:
+                prefetcher.stop()
+
+    def read_array(self, locations: np.ndarray, dtype: np.dtype) -> np.ndarray:
+        """Decode a dtype item at each of the passed locations (sorted), without per-record objects"""
+        locations = np.asarray(locations, dtype=np.int64)
+        if self._view is not None:
+            return gather(self._view, locations, dtype)
+
+        out = np.empty(locations.size, dtype=dtype)
+        read_starts, read_ends, read_firsts = self.plan_reads(locations=locations,
+                                                              sizes=np.full(locations.size, dtype.itemsize),
+                                                              max_read_gap=self.max_read_gap,
+                                                              max_read_size=self.max_read_size)
+        read_lasts = np.concatenate((read_firsts[1:], [locations.size]))
+        for read_start, read_end, first, last in zip(read_starts.tolist(), read_ends.tolist(),
+                                                     read_firsts.tolist(), read_lasts.tolist()):
+            buffer = self.read_ahead(read_start, read_end - read_start)
+            out[first:last] = gather(buffer, locations[first:last] - read_start, dtype)
+        return out
+
+    def read_ahead(self, location: int, size: int):
+        """Return a buffer with size bytes from location, hinting the kernel to prefetch them in mmap mode"""
+        if self._view is not None:
+            if hasattr(self._mmap, 'madvise'):
+                page_start = location - location % mmap.PAGESIZE
+                self._mmap.madvise(mmap.MADV_WILLNEED, page_start,
+                                   min(location + size, self.file_length) - page_start)
+            return self._view[location:location + size]
+
+        return memoryview(self.read(location, size))
+
+    @staticmethod
+    def to_map_time(value):
+        """Convert a datetime (naive ones are taken as UTC) to the map time in milliseconds"""
+        if isinstance(value, datetime):
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            return (calendar.timegm(value.timetuple()) + value.microsecond / 1e6) * 1000
+        return value
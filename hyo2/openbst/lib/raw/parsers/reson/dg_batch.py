@@ -0,0 +1,290 @@
+import logging
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.batch import DatagramBatch, gather, headers, ragged, ragged_mixed
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams, Data1003, Data1012, Data1013, Data1015, \
+    Data1016, Data7000, Data7004, Data7010, Data7012, Data7027, Data7028
+
+logger = logging.getLogger(__name__)
+
+
+class ResonBatch(DatagramBatch):
+    """Columnar decoding of many s7k records of a single ResonDatagrams type"""
+
+
+class SettingsEpochs:
+    """Run-length table of the sonar configuration (7000 settings and 7004 beam geometry) along the pings
+
+    - starts: the first ping of each epoch, where any setting or the beam geometry changes
+    - epoch_settings, epoch_geometry: the configuration of each epoch, as rows of the unique tables
+    - settings: the unique settings (the 7000 fields without the per-ping ones), in order of appearance
+    - geometry: dict of the unique beam geometries as (row, beam) arrays, NaN padded
+    """
+
+    # the 7000 fields that identify a ping rather than a configuration
+    ping_fields = ('ping_number', 'multiping_flag', 'tx_pulse_reserved', 'reserved')
+    geometry_fields = ('rx_angle_vertical', 'rx_angle_horizontal', 'rx_beam_width_along', 'rx_beam_width_across')
+
+    def __init__(self, settings: np.ndarray, settings_index: np.ndarray, geometry: dict,
+                 geometry_index: np.ndarray, time: np.ndarray = None):
+        self.num_pings = settings_index.size
+        change = np.ones(self.num_pings, dtype=bool)
+        change[1:] = (settings_index[1:] != settings_index[:-1]) | (geometry_index[1:] != geometry_index[:-1])
+        self.starts = np.flatnonzero(change)
+        self.start_time = time[self.starts] if time is not None else None
+        self.epoch_settings = settings_index[self.starts]
+        self.epoch_geometry = geometry_index[self.starts]
+        self.settings = settings
+        self.geometry = geometry
+
+    def __len__(self):
+        return self.starts.size
+
+    def __repr__(self):
+        msg = "<%s>\n" % self.__class__.__name__
+        msg += "  <pings: %d>\n" % self.num_pings
+        msg += "  <epochs: %d>\n" % len(self)
+        msg += "  <unique settings: %d>\n" % self.settings.size
+        msg += "  <unique geometries: %d>\n" % (self.geometry['num_rx_beams'].size if self.geometry else 0)
+        return msg
+
+    def epoch(self, pings=None) -> np.ndarray:
+        """Return the epoch of each of the passed ping indices (all the pings by default)"""
+        if pings is None:
+            pings = np.arange(self.num_pings)
+        return np.searchsorted(self.starts, pings, side='right') - 1
+
+    def settings_index(self, pings=None) -> np.ndarray:
+        """Return the row of the settings table in use at each ping (-1 with no settings)"""
+        return self.epoch_settings[self.epoch(pings)]
+
+    def geometry_index(self, pings=None) -> np.ndarray:
+        """Return the row of the beam geometry table in use at each ping (-1 with no geometry)"""
+        return self.epoch_geometry[self.epoch(pings)]
+
+    def ping_settings(self, pings=None) -> np.ndarray:
+        """Expand the settings table to the passed pings"""
+        return self.settings[self.settings_index(pings)]
+
+    def ping_geometry(self, name: str, pings=None) -> np.ndarray:
+        """Expand a beam geometry field to the passed pings, as (ping, beam)"""
+        index = self.geometry_index(pings)
+        if np.any(index < 0):
+            raise RuntimeError("Ping without beam geometry")
+        return self.geometry[name][index]
+
+    @classmethod
+    def from_batches(cls, settings: ResonBatch, beam_geometry: ResonBatch = None) -> 'SettingsEpochs':
+        """Build the table for the pings of a 7000 batch, with the beam geometry of the last 7004 record at or
+        before each ping (none, -1, for the pings before the first 7004 record)"""
+        fields = [name for name in settings.header.dtype.names if name not in cls.ping_fields]
+        values = np.empty(len(settings), dtype=[(name, settings.header.dtype[name]) for name in fields])
+        for name in fields:
+            values[name] = settings.header[name]
+        rows, settings_index = unique_rows(values)
+
+        geometry = dict()
+        geometry_index = np.full(len(settings), -1, dtype=np.int64)
+        if beam_geometry is not None and len(beam_geometry) > 0:
+            num_rx_beams = beam_geometry.header['num_rx_beams'].astype('<u4')
+            stacked = np.stack([beam_geometry.data[name] for name in cls.geometry_fields], axis=1)
+            keys = np.concatenate((num_rx_beams.view(np.uint8).reshape(-1, 4),
+                                   np.ascontiguousarray(stacked).view(np.uint8).reshape(len(beam_geometry), -1)),
+                                  axis=1)
+            geometry_rows, record_geometry = unique_rows(keys)
+            geometry['num_rx_beams'] = num_rx_beams[geometry_rows]
+            for name in cls.geometry_fields:
+                geometry[name] = beam_geometry.data[name][geometry_rows]
+
+            records = np.searchsorted(beam_geometry.time, settings.time, side='right') - 1
+            geometry_index = np.where(records >= 0, record_geometry[np.maximum(records, 0)], -1)
+
+        return cls(settings=values[rows], settings_index=settings_index, geometry=geometry,
+                   geometry_index=geometry_index, time=settings.time)
+
+
+def unique_rows(values: np.ndarray) -> tuple:
+    """Compare the rows of an array bytewise, returning the first row of each unique value (in order of
+    appearance) and the unique value of each row"""
+    if len(values) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    keys = np.ascontiguousarray(values).view(np.uint8).reshape(len(values), -1)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.size)
+    return first[order], rank[inverse.reshape(-1)]
+
+
+def parse_batch(dg_type: ResonDatagrams, chunks: list = None, buffer=None, offsets=None,
+                sizes=None) -> ResonBatch:
+    """Decode many records of dg_type into a ResonBatch
+
+    The records are passed either as a list of buffers (chunks), or as offsets and sizes in a single buffer
+    (e.g., a memory-mapped file).
+    """
+    dtype = fixed_size_records.get(dg_type)
+    if dtype is not None:
+        if chunks is None:
+            if np.any(np.asarray(sizes) < dtype.itemsize):
+                raise RuntimeError("Record shorter than its header: %d bytes" % dtype.itemsize)
+            return ResonBatch(dg_type, gather(buffer, offsets, dtype))
+        return ResonBatch(dg_type, headers(chunks, dtype))
+
+    if chunks is None:
+        view = memoryview(buffer)
+        chunks = [view[offset:offset + size] for offset, size in
+                  zip(np.asarray(offsets).tolist(), np.asarray(sizes).tolist())]
+
+    parser = batch_parsers.get(dg_type)
+    if parser is None:
+        raise RuntimeError("Batch decoding not supported for %s" % dg_type)
+    return parser(chunks)
+
+
+def parse_batch_1016(chunks: list) -> ResonBatch:
+    """Attitude samples, ragged, with their time offsets in milliseconds"""
+    batch = ResonBatch(ResonDatagrams.ATTITUDE, headers(chunks, Data1016.header_dtype))
+    samples, batch.offsets = ragged(chunks, Data1016.header_dtype.itemsize, batch.header['num_samples'],
+                                    Data1016.sample_dtype)
+    batch.data['time_offset'] = samples['time_offset'].astype(np.float64)
+    for name in ('roll', 'pitch', 'heave', 'heading'):
+        batch.data[name] = np.ascontiguousarray(samples[name])
+    return batch
+
+
+def parse_batch_7004(chunks: list) -> ResonBatch:
+    """Beam geometry as (record, beam) arrays, padded with NaN"""
+    batch = ResonBatch(ResonDatagrams.BEAMGEO, headers(chunks, Data7004.header_dtype))
+    num_rx_beams = batch.header['num_rx_beams'].astype(np.int64)
+    max_beams = int(num_rx_beams.max(initial=0))
+
+    # the four per-beam arrays of a record are stored one after the other
+    values, offsets = ragged(chunks, Data7004.header_dtype.itemsize, 4 * num_rx_beams, np.dtype('<f4'))
+    if np.all(num_rx_beams == max_beams):
+        values = values.reshape(len(chunks), 4, max_beams)
+    else:
+        padded = np.full((len(chunks), 4, max_beams), np.nan, dtype=np.float32)
+        rows = np.repeat(np.arange(len(chunks)), 4 * num_rx_beams)
+        positions = np.arange(values.size) - offsets[rows]
+        padded[rows, positions // num_rx_beams[rows], positions % num_rx_beams[rows]] = values
+        values = padded
+
+    for n, name in enumerate(('rx_angle_vertical', 'rx_angle_horizontal', 'rx_beam_width_along',
+                              'rx_beam_width_across')):
+        batch.data[name] = values[:, n, :]
+    return batch
+
+
+def parse_batch_7010(chunks: list) -> ResonBatch:
+    """TVG curves, ragged"""
+    batch = ResonBatch(ResonDatagrams.TVG, headers(chunks, Data7010.header_dtype))
+    batch.data['tvg_curve'], batch.offsets = ragged(chunks, Data7010.header_dtype.itemsize,
+                                                    batch.header['num_samples'], np.dtype('<f4'))
+    return batch
+
+
+def parse_batch_7012(chunks: list) -> ResonBatch:
+    """Ping motion samples, ragged, with NaN for the arrays missing from a record (pitch is one value per record)"""
+    batch = ResonBatch(ResonDatagrams.PINGMOTIONDATA, headers(chunks, Data7012.header_dtype))
+    num_samples = batch.header['num_samples'].astype(np.int64)
+    flags = batch.header['flags']
+    batch.offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum(num_samples, out=batch.offsets[1:])
+
+    has_pitch = (flags & Data7012.pitch_flag).astype(bool)
+    start = Data7012.header_dtype.itemsize + 4 * has_pitch.astype(np.int64)
+    pitch, _ = ragged(chunks, Data7012.header_dtype.itemsize, has_pitch, np.dtype('<f4'))
+    batch.data['pitch'] = np.full(len(chunks), np.nan, dtype=np.float32)
+    batch.data['pitch'][has_pitch] = pitch
+
+    for name, flag in Data7012.sample_fields:
+        present = (flags & flag).astype(bool)
+        values, _ = ragged(chunks, start, num_samples * present, np.dtype('<f4'))
+        if np.all(present):
+            batch.data[name] = values
+        else:
+            batch.data[name] = np.full(int(batch.offsets[-1]), np.nan, dtype=np.float32)
+            batch.data[name][np.repeat(present, num_samples)] = values
+        start = start + 4 * num_samples * present
+
+    # the samples are taken at sampling_rate from the record time
+    with np.errstate(divide='ignore', invalid='ignore'):
+        batch.data['time_offset'] = 1000.0 * (np.arange(int(batch.offsets[-1])) -
+                                              np.repeat(batch.offsets[:-1], num_samples)) / \
+            np.repeat(batch.header['sampling_rate'].astype(np.float64), num_samples)
+    return batch
+
+
+def parse_batch_7027(chunks: list) -> ResonBatch:
+    """Detections, ragged, with the fields missing from a data field size set to NaN when sizes are mixed"""
+    batch = ResonBatch(ResonDatagrams.RAWDETECTDATA, headers(chunks, Data7027.header_dtype))
+    batch.beam_field = 'beam'
+    header_size = Data7027.header_dtype.itemsize
+    field_sizes = batch.header['data_field_size']
+
+    if np.unique(field_sizes).size == 1 and int(field_sizes[0]) in Data7027.detection_dtypes:
+        dtype = Data7027.detection_dtypes[int(field_sizes[0])]
+        detections, batch.offsets = ragged(chunks, header_size, batch.header['num_detect_points'], dtype)
+    else:
+        dtype = Data7027.detection_dtypes[34]
+        detections = np.zeros(int(batch.header['num_detect_points'].sum(dtype=np.int64)), dtype=dtype)
+        for name in ('signal_strength', 'min_limit', 'max_limit'):
+            detections[name] = np.nan
+        detections, batch.offsets = ragged_mixed(chunks, header_size, batch.header['num_detect_points'],
+                                                 field_sizes, Data7027.detection_dtypes, detections)
+
+    for name in dtype.names:
+        batch.data[name] = np.ascontiguousarray(detections[name])
+    return batch
+
+
+def parse_batch_7028(chunks: list) -> ResonBatch:
+    """Snippets, with ragged per-beam descriptors and the samples of all the beams back to back (as uint32 when
+    the sample widths are mixed)"""
+    batch = ResonBatch(ResonDatagrams.SNIPPETDATA, headers(chunks, Data7028.header_dtype))
+    batch.beam_field = 'beam_number'
+    header_size = Data7028.header_dtype.itemsize
+    num_beams = batch.header['num_detect_points'].astype(np.int64)
+
+    descriptors, batch.offsets = ragged(chunks, header_size, num_beams, Data7028.descriptor_dtype)
+    for name in Data7028.descriptor_dtype.names:
+        batch.data[name] = np.ascontiguousarray(descriptors[name])
+
+    num_samples = batch.data['snippet_end_sample'].astype(np.int64) - batch.data['snippet_start_sample'] + 1
+    if np.any(num_samples < 0):
+        raise RuntimeError("Snippet ending before its start")
+    batch.sample_offsets = np.zeros(num_samples.size + 1, dtype=np.int64)
+    np.cumsum(num_samples, out=batch.sample_offsets[1:])
+
+    record_samples = np.diff(batch.sample_offsets[batch.offsets])
+    samples_start = header_size + num_beams * Data7028.descriptor_dtype.itemsize
+    wide = (batch.header['flags'] & 0x01).astype(bool)  # flags bit 0: 32-bit samples
+    if np.all(wide) or not np.any(wide):
+        batch.data['samples'], _ = ragged(chunks, samples_start, record_samples,
+                                          np.dtype('<u4') if np.all(wide) and wide.size else np.dtype('<u2'))
+    else:
+        batch.data['samples'], _ = ragged_mixed(chunks, samples_start, record_samples, wide,
+                                                {False: np.dtype('<u2'), True: np.dtype('<u4')},
+                                                np.empty(int(record_samples.sum()), dtype=np.uint32))
+    return batch
+
+
+# records made of their header only, decoded as a single structured array
+fixed_size_records = {
+    ResonDatagrams.POSITION: Data1003.header_dtype,
+    ResonDatagrams.ROLLPITCHHEAVE: Data1012.header_dtype,
+    ResonDatagrams.HEADING: Data1013.header_dtype,
+    ResonDatagrams.NAVIGATION: Data1015.header_dtype,
+    ResonDatagrams.SONARSETTINGS: Data7000.header_dtype,
+}
+
+batch_parsers = {
+    ResonDatagrams.ATTITUDE: parse_batch_1016,
+    ResonDatagrams.BEAMGEO: parse_batch_7004,
+    ResonDatagrams.TVG: parse_batch_7010,
+    ResonDatagrams.PINGMOTIONDATA: parse_batch_7012,
+    ResonDatagrams.RAWDETECTDATA: parse_batch_7027,
+    ResonDatagrams.SNIPPETDATA: parse_batch_7028,
+}
@@ -0,0 +1,347 @@
+from collections import namedtuple
+import itertools
+import logging
+import struct
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.batch import gather, record_offsets
+from hyo2.openbst.lib.raw.parsers.reson import dg_index
+
+logger = logging.getLogger(__name__)
+
+default_chunk_size = 4 * 1024 * 1024  # bytes read (and written) at once
+max_packet_size = 16 * 1024 * 1024  # larger network packets or records are taken as corrupted
+max_pending_size = 64 * 1024 * 1024  # bytes held for the incomplete transmissions or fragmented records
+
+# Hypack logging: each block of the capture is preceded by its size
+hypack_header = struct.Struct('<I')
+
+# 7k Network Frame, preceding the record bytes of each network packet
+network_frame = struct.Struct('<2HI2H4I2HI')
+NetworkFrame = namedtuple('NetworkFrame', ['version', 'offset', 'total_packets', 'total_records', 'transmission_id',
+                                           'packet_size', 'total_size', 'sequence_number', 'destination_id',
+                                           'destination_enumerator', 'source_enumerator', 'source_id'])
+
+# Data Record Frame fields used to walk and to join the records
+sync_bytes = struct.pack('<I', dg_index.sync_pattern)
+sync_size = struct.Struct('<2I')  # sync pattern and record size
+field_offsets = {name: dg_index.header_dtype.fields[name][1] for name in dg_index.header_dtype.names}
+checksum_flag = 0x0001
+
+
+class DemuxStats:
+    """Counters of a demultiplexed capture"""
+
+    def __init__(self):
+        self.frames = 0
+        self.records = 0
+        self.fragments = 0  # fragments joined in records
+        self.skipped = 0  # bytes outside of valid network frames or records
+        self.dropped = 0  # bytes of incomplete transmissions or fragmented records
+
+    def __repr__(self):
+        msg = "<%s>\n" % self.__class__.__name__
+        msg += "  <frames: %d>\n" % self.frames
+        msg += "  <records: %d (%d joined fragments)>\n" % (self.records, self.fragments)
+        msg += "  <skipped: %d bytes>\n" % self.skipped
+        msg += "  <dropped: %d bytes>\n" % self.dropped
+        return msg
+
+
+class ByteStream:
+    """Forward-only buffer over an iterable of byte chunks
+
+    The chunks are pulled only when more bytes are needed, and the consumed bytes are discarded, so that the
+    buffer holds at most the largest item requested plus one chunk. No byte is read twice.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.buffer = bytearray()
+        self.position = 0  # start of the unconsumed bytes in the buffer
+
+    @property
+    def available(self) -> int:
+        return len(self.buffer) - self.position
+
+    def fill(self, size: int) -> bool:
+        """Make at least size unconsumed bytes available, returning False when the chunks end before"""
+        while self.available < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            if self.position > 0:
+                del self.buffer[:self.position]
+                self.position = 0
+            self.buffer += chunk
+        return True
+
+    def skip(self, size: int):
+        self.position += size
+
+    def take(self, size: int) -> bytes:
+        data = bytes(self.buffer[self.position:self.position + size])
+        self.position += size
+        return data
+
+    def resync(self, pattern: bytes, back: int) -> int:
+        """Skip to back bytes before the next pattern, at least one byte ahead, and return the skipped bytes
+
+        At the end of the chunks, all the remaining bytes are skipped.
+        """
+        skipped = 0
+        while True:
+            found = self.buffer.find(pattern, self.position + back + 1)
+            if found >= 0:
+                size = found - self.position - back
+                self.skip(size)
+                return skipped + size
+
+            # keep the bytes where the pattern could still start
+            checked = self.available - back - len(pattern)
+            if checked >= 1:
+                self.skip(checked)
+                skipped += checked
+            elif not self.fill(self.available + 1):
+                skipped += self.available
+                self.skip(self.available)
+                return skipped
+
+
+def strip_hypack(chunks):
+    """Yield the content of the Hypack blocks of a capture, without their size headers"""
+    remaining = 0
+    header = b''
+    for chunk in chunks:
+        view = memoryview(chunk)
+        while view.nbytes > 0:
+            if remaining == 0:
+                needed = hypack_header.size - len(header)
+                header += view[:needed].tobytes()
+                view = view[needed:]
+                if len(header) == hypack_header.size:
+                    remaining, = hypack_header.unpack(header)
+                    header = b''
+                continue
+
+            size = min(remaining, view.nbytes)
+            yield view[:size]
+            view = view[size:]
+            remaining -= size
+
+
+def valid_frame(frame: NetworkFrame) -> bool:
+    return network_frame.size <= frame.offset <= frame.packet_size <= max_packet_size \
+        and frame.sequence_number < frame.total_packets
+
+
+def network_payloads(stream: ByteStream, stats: DemuxStats, max_pending: int = max_pending_size):
+    """Yield the record bytes of each 7k network transmission, joining the packets of the multi-packet ones
+
+    The packets of a transmission are joined in sequence order once all of them are in. The incomplete
+    transmissions are held up to max_pending bytes, then the oldest ones are dropped.
+    """
+    pending = dict()  # transmission identifier -> {sequence number: packet payload}
+    pending_size = 0
+    while stream.fill(network_frame.size):
+        frame = NetworkFrame._make(network_frame.unpack_from(stream.buffer, stream.position))
+        if not valid_frame(frame):
+            # the first packet of a transmission starts with a record
+            stats.skipped += stream.resync(sync_bytes, back=network_frame.size + dg_index.sync_offset)
+            continue
+        if not stream.fill(frame.packet_size):
+            break
+        stream.skip(frame.offset)
+        payload = stream.take(frame.packet_size - frame.offset)
+        stats.frames += 1
+        if frame.total_packets == 1:
+            yield payload
+            continue
+
+        parts = pending.pop(frame.transmission_id, dict())
+        if frame.sequence_number in parts:  # identifier reused by a new transmission
+            size = sum(len(part) for part in parts.values())
+            pending_size -= size
+            stats.dropped += size
+            parts = dict()
+        parts[frame.sequence_number] = payload
+        pending_size += len(payload)
+        if len(parts) == frame.total_packets and max(parts) < frame.total_packets:
+            pending_size -= sum(len(part) for part in parts.values())
+            yield b''.join(parts[number] for number in range(frame.total_packets))
+            continue
+
+        pending[frame.transmission_id] = parts
+        while pending_size > max_pending:
+            size = sum(len(part) for part in pending.pop(next(iter(pending))).values())
+            pending_size -= size
+            stats.dropped += size
+
+    stats.skipped += stream.available
+    stats.dropped += pending_size
+
+
+def data_records(stream: ByteStream, stats: DemuxStats):
+    """Yield the Data Record Frames of a stream, resyncing on the sync pattern past the invalid bytes"""
+    while stream.fill(dg_index.header_size):
+        sync, size = sync_size.unpack_from(stream.buffer, stream.position + dg_index.sync_offset)
+        if sync != dg_index.sync_pattern or not dg_index.header_size + dg_index.footer_size <= size <= \
+                max_packet_size:
+            stats.skipped += stream.resync(sync_bytes, back=dg_index.sync_offset)
+            continue
+        if not stream.fill(size):
+            break
+        yield stream.take(size)
+
+    stats.skipped += stream.available
+
+
+def join_fragments(fragments: list) -> bytes:
+    """Return a single record with the header of the first fragment and the data sections of all of them
+
+    The checksum is not recomputed, so it is zeroed and flagged as not valid.
+    """
+    sections = [fragment[dg_index.header_size:len(fragment) - dg_index.footer_size] for fragment in fragments]
+    header = bytearray(fragments[0][:dg_index.header_size])
+
+    opd_offset = 0
+    location = dg_index.header_size
+    for fragment, section in zip(fragments, sections):
+        fragment_opd, = struct.unpack_from('<I', fragment, field_offsets['opd_offset'])
+        if fragment_opd != 0 and opd_offset == 0:
+            opd_offset = location + fragment_opd - dg_index.header_size
+        location += len(section)
+
+    flags, = struct.unpack_from('<H', header, field_offsets['flags'])
+    struct.pack_into('<I', header, field_offsets['size'], location + dg_index.footer_size)
+    struct.pack_into('<I', header, field_offsets['opd_offset'], opd_offset)
+    struct.pack_into('<H', header, field_offsets['flags'], flags & ~checksum_flag)
+    struct.pack_into('<2I', header, field_offsets['total_fragments'], 0, 0)
+    return bytes(header) + b''.join(sections) + bytes(dg_index.footer_size)
+
+
+def joined_records(records, stats: DemuxStats, max_pending: int = max_pending_size):
+    """Yield the records, with the fragmented ones joined once all their fragments are in
+
+    The fragments of a record are matched by record type, device identifier and system enumerator, and
+    joined in fragment number order. The incomplete records are held up to max_pending bytes, then the
+    oldest ones are dropped.
+    """
+    pending = dict()  # (record type, device identifier, system enumerator) -> {fragment number: fragment}
+    pending_size = 0
+    for record in records:
+        total, number = struct.unpack_from('<2I', record, field_offsets['total_fragments'])
+        if total <= 1:
+            yield record
+            continue
+
+        key = struct.unpack_from('<2I', record, field_offsets['record_type']) + \
+            struct.unpack_from('<H', record, field_offsets['system_enumerator'])
+        parts = pending.pop(key, dict())
+        if number in parts:  # a new record, the previous one is incomplete
+            size = sum(len(part) for part in parts.values())
+            pending_size -= size
+            stats.dropped += size
+            parts = dict()
+        parts[number] = record
+        pending_size += len(record)
+        if len(parts) == total:
+            pending_size -= sum(len(part) for part in parts.values())
+            stats.fragments += total
+            yield join_fragments([parts[number] for number in sorted(parts)])
+            continue
+
+        pending[key] = parts
+        while pending_size > max_pending:
+            size = sum(len(part) for part in pending.pop(next(iter(pending))).values())
+            pending_size -= size
+            stats.dropped += size
+
+    stats.dropped += pending_size
+
+
+def detect_framing(head: bytes) -> str:
+    """Return the framing of a capture from its first bytes: 'hypack' (Hypack blocks of network frames),
+    'network' (7k network frames), 'records' (bare records, as for s7k), or None"""
+    def record_at(location: int) -> bool:
+        return len(head) >= location + dg_index.sync_offset + 4 and \
+            head[location + dg_index.sync_offset:location + dg_index.sync_offset + 4] == sync_bytes
+
+    def frame_at(location: int) -> bool:
+        if len(head) < location + network_frame.size:
+            return False
+        frame = NetworkFrame._make(network_frame.unpack_from(head, location))
+        return valid_frame(frame) and record_at(location + frame.offset)
+
+    if record_at(0):
+        return 'records'
+    if frame_at(0):
+        return 'network'
+    if frame_at(hypack_header.size):
+        return 'hypack'
+    return None
+
+
+def demux(chunks, write, framing: str, stats: DemuxStats = None, write_size: int = default_chunk_size) \
+        -> np.ndarray:
+    """Stream the chunks of a capture once, writing its records as s7k and returning their index
+
+    The Hypack headers and the network frames (as for framing) are stripped, the multi-packet transmissions
+    and the fragmented records are joined, then the records are written by blocks of about write_size bytes.
+    The index has the offsets of the records in the written stream, as for dg_index.build_index.
+    """
+    if stats is None:
+        stats = DemuxStats()
+
+    if framing == 'hypack':
+        chunks = strip_hypack(chunks)
+    if framing in ('hypack', 'network'):
+        payloads = network_payloads(ByteStream(chunks), stats=stats)
+        records = itertools.chain.from_iterable(data_records(ByteStream([payload]), stats=stats)
+                                                for payload in payloads)
+    elif framing == 'records':
+        records = data_records(ByteStream(chunks), stats=stats)
+    else:
+        raise RuntimeError("Unknown framing: %s" % framing)
+
+    parts = [np.empty(0, dtype=dg_index.index_dtype)]
+    location = 0
+    pending = list()
+    pending_size = 0
+    for record in itertools.chain(joined_records(records, stats=stats), [None]):
+        if record is not None:
+            pending.append(record)
+            pending_size += len(record)
+            if pending_size < write_size:
+                continue
+        if len(pending) == 0:
+            break
+
+        buffer, starts, sizes = record_offsets(pending)
+        write(buffer)
+        block = np.frombuffer(buffer, dtype=np.uint8)
+        parts.append(dg_index.index_headers(block=block, starts=starts, headers=gather(block, starts,
+                                                                                       dg_index.header_dtype),
+                                            block_offset=location))
+        stats.records += len(pending)
+        location += len(buffer)
+        pending = list()
+        pending_size = 0
+
+    if stats.skipped > 0 or stats.dropped > 0:
+        logger.warning("Demultiplexed capture with %d Bytes skipped and %d Bytes dropped"
+                       % (stats.skipped, stats.dropped))
+    return np.concatenate(parts)
+
+
+def demux_file(fid, write, chunk_size: int = default_chunk_size, stats: DemuxStats = None) -> np.ndarray:
+    """Demultiplex a .7k capture read sequentially from fid (see demux), with the framing from its first chunk"""
+    head = fid.read(chunk_size)
+    framing = detect_framing(head)
+    if framing is None:
+        raise RuntimeError("Unknown .7k framing, neither Hypack, network frames nor records")
+    logger.debug("Demultiplexing .7k capture with %s framing" % framing)
+
+    chunks = itertools.chain([head], iter(lambda: fid.read(chunk_size), b''))
+    return demux(chunks, write=write, framing=framing, stats=stats, write_size=chunk_size)
@@ -2,6 +2,8 @@ import logging
 import struct
 from enum import Enum
 
+import numpy as np
+
 
 class ResonDatagrams(Enum):
 
@@ -87,33 +89,110 @@ reson_datagram_code = {
     ResonDatagrams.BEAMFORMEDCOMPRESSED: 7041,
     ResonDatagrams.WATERCOLUMNCOMPRESSED: 7042,
     ResonDatagrams.BEAMDATACALIBRATED: 7048,
-    ResonDatagrams.SIDESCANCALIBRATED: 7058,
+    ResonDatagrams.SIDESCANCALIBRATED: 7057,
     ResonDatagrams.SNIPPETBSSTRENGTH: 7058
 }
 
 
 class ResonData:
+    """Base of the record classes: the record constants (description, compiled header struct) are class attributes,
+    and the instances only carry their __slots__"""
+    __slots__ = ('time', 'parse_check')
     num_beams_max = 512
+    desc = None
+    header_struct = None
+    header_size = None
 
     def __init__(self):
-        self.desc = None
         self.time = None
-        self.num_beams_max = ResonData.num_beams_max
-        self.parse_check = None
-        self.header_fmt = None
-        self.header_size = None
+        self.parse_check = False
+
+    @property
+    def header_fmt(self):
+        return self.header_struct.format
 
     def parse(self, chunk):
         raise RuntimeError("Not Implemented")
 
 
+class ResonWaterColumn(ResonData):
+    """Water column record, with the beam x sample arrays kept in the native dtype of the record
+
+    With beam_step/sample_step larger than 1, the arrays are decimated (and copied) at decode time, so that
+    they do not keep the record buffer alive.
+    """
+
+    __slots__ = ('beam_step', 'sample_step', 'amplitude', 'phase')
+
+    def __init__(self, beam_step: int = 1, sample_step: int = 1):
+        super().__init__()
+        self.beam_step = beam_step
+        self.sample_step = sample_step
+        self.amplitude = None  # (beam, sample)
+        self.phase = None  # (beam, sample), if present
+
+    def decimate(self, values: np.ndarray) -> np.ndarray:
+        if self.beam_step == 1 and self.sample_step == 1:
+            return values
+        return np.ascontiguousarray(values[::self.beam_step, ::self.sample_step])
+
+    def to_db(self) -> np.ndarray:
+        """Return the amplitude in dB (20 log10), as float32"""
+        with np.errstate(divide='ignore'):
+            return 20.0 * np.log10(self.amplitude.astype(np.float32))
+
+    @staticmethod
+    def read_beams(chunk, offset: int, num_beams: int, descriptor_dtype: np.dtype, sample_dtype: np.dtype) -> tuple:
+        """Read num_beams blocks made of a descriptor (with 'num_samples') followed by the samples
+
+        Return the descriptors and the (beam, sample) samples, padded with zeros when the beams have different
+        lengths. Beams of the same length (the usual case) are read with a single frombuffer.
+        """
+        descriptors = np.zeros(num_beams, dtype=descriptor_dtype)
+        if num_beams == 0:
+            return descriptors, np.zeros((0, 0), dtype=sample_dtype)
+        if len(chunk) - offset < descriptor_dtype.itemsize:
+            raise RuntimeError("Truncated beam data")
+
+        num_samples = int(np.frombuffer(chunk, dtype=descriptor_dtype, count=1, offset=offset)['num_samples'][0])
+        block_dtype = np.dtype(descriptor_dtype.descr + [('samples', sample_dtype, (num_samples,))])
+        if len(chunk) - offset >= num_beams * block_dtype.itemsize:
+            blocks = np.frombuffer(chunk, dtype=block_dtype, count=num_beams, offset=offset)
+            if np.all(blocks['num_samples'] == num_samples):
+                for name in descriptor_dtype.names:
+                    descriptors[name] = blocks[name]
+                return descriptors, blocks['samples']
+
+        samples = list()
+        for beam in range(num_beams):
+            if len(chunk) - offset < descriptor_dtype.itemsize:
+                raise RuntimeError("Truncated beam data at beam %d" % beam)
+            descriptors[beam] = np.frombuffer(chunk, dtype=descriptor_dtype, count=1, offset=offset)[0]
+            offset += descriptor_dtype.itemsize
+            num_samples = int(descriptors['num_samples'][beam])
+            if len(chunk) - offset < num_samples * sample_dtype.itemsize:
+                raise RuntimeError("Truncated beam data at beam %d" % beam)
+            samples.append(np.frombuffer(chunk, dtype=sample_dtype, count=num_samples, offset=offset))
+            offset += num_samples * sample_dtype.itemsize
+
+        padded = np.zeros((num_beams, int(descriptors['num_samples'].max())), dtype=sample_dtype)
+        for beam, beam_samples in enumerate(samples):
+            padded[beam, :beam_samples.size] = beam_samples
+        return descriptors, padded
+
+
 class Data1003(ResonData):
+    __slots__ = ('datum', 'latency', 'latitude', 'longitude', 'datum_height', 'position_flag', 'utm_zone',
+                 'qual_flag', 'position_method', 'num_of_satelites')
+    desc = "Position"
+    header_struct = struct.Struct('<If3d5B')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('datum', '<u4'), ('latency', '<f4'), ('latitude', '<f8'), ('longitude', '<f8'),
+                             ('datum_height', '<f8'), ('position_flag', 'u1'), ('utm_zone', 'u1'),
+                             ('qual_flag', 'u1'), ('position_method', 'u1'), ('num_of_satelites', 'u1')])
+
     def __init__(self, chunk):
         super().__init__()
-        self.desc = "Position"
-        self.parse_check = False
-        self.header_fmt = '<If3d5B'
-        self.header_size = struct.calcsize(self.header_fmt)
 
         self.datum = None
         self.latency = None
@@ -121,6 +200,7 @@ class Data1003(ResonData):
         self.longitude = None
         self.datum_height = None
         self.position_flag = None
+        self.utm_zone = None
         self.qual_flag = None
         self.position_method = None
         self.num_of_satelites = None
@@ -128,7 +208,7 @@ class Data1003(ResonData):
         self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        header_unpack = struct.unpack(self.header_fmt, chunk)
+        header_unpack = self.header_struct.unpack_from(chunk)
 
         if header_unpack[0] == 0:
             self.datum = 'WGS'
@@ -140,20 +220,23 @@ class Data1003(ResonData):
         self.longitude = header_unpack[3]
         self.datum_height = header_unpack[4]
         self.position_flag = header_unpack[5]
-        self.qual_flag = header_unpack[6]
-        self.position_method = header_unpack[7]
-        self.num_of_satelites = header_unpack[8]
+        self.utm_zone = header_unpack[6]
+        self.qual_flag = header_unpack[7]
+        self.position_method = header_unpack[8]
+        self.num_of_satelites = header_unpack[9]
         self.parse_check = True
         return self.parse_check
 
 
 class Data1012(ResonData):
+    __slots__ = ('roll', 'pitch', 'heave')
+    desc = "Roll, Pitch, Heave"
+    header_struct = struct.Struct('<3f')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('roll', '<f4'), ('pitch', '<f4'), ('heave', '<f4')])
+
     def __init__(self, chunk):
         super().__init__()
-        self.desc = "Roll, Pitch, Heave"
-        self.parse_check = False
-        self.header_fmt = '<3f'
-        self.header_size = struct.calcsize(self.header_fmt)
 
         self.roll = None
         self.pitch = None
@@ -162,7 +245,7 @@ class Data1012(ResonData):
         self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        header_unpack = struct.unpack(self.header_fmt, chunk)
+        header_unpack = self.header_struct.unpack_from(chunk)
 
         self.roll = header_unpack[0]
         self.pitch = header_unpack[1]
@@ -173,19 +256,21 @@ class Data1012(ResonData):
 
 
 class Data1013(ResonData):
+    __slots__ = ('heading', )
+    desc = "Heading"
+    header_struct = struct.Struct('<f')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('heading', '<f4')])
+
     def __init__(self, chunk):
         super().__init__()
-        self.desc = "Heading"
-        self.parse_check = False
-        self.header_fmt = '<f'
-        self.header_size = struct.calcsize(self.header_fmt)
 
         self.heading = None
 
         self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        header_unpack = struct.unpack(self.header_fmt, chunk)
+        header_unpack = self.header_struct.unpack_from(chunk)
 
         self.heading = header_unpack[0]
         self.parse_check = True
@@ -193,13 +278,175 @@ class Data1013(ResonData):
         return self.parse_check
 
 
+class Data1015(ResonData):
+    __slots__ = ('vertical_reference', 'latitude', 'longitude', 'horizontal_accuracy', 'vessel_height',
+                 'height_accuracy', 'speed_over_ground', 'course_over_ground', 'heading')
+    desc = "Navigation"
+    header_struct = struct.Struct('<B2d6f')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('vertical_reference', 'u1'), ('latitude', '<f8'), ('longitude', '<f8'),
+                             ('horizontal_accuracy', '<f4'), ('vessel_height', '<f4'), ('height_accuracy', '<f4'),
+                             ('speed_over_ground', '<f4'), ('course_over_ground', '<f4'), ('heading', '<f4')])
+
+    def __init__(self, chunk):
+        super().__init__()
+
+        self.vertical_reference = None
+        self.latitude = None
+        self.longitude = None
+        self.horizontal_accuracy = None
+        self.vessel_height = None
+        self.height_accuracy = None
+        self.speed_over_ground = None
+        self.course_over_ground = None
+        self.heading = None
+
+        self.parse_check = self.parse(chunk)
+
+    def parse(self, chunk):
+        header_unpack = self.header_struct.unpack_from(chunk)
+
+        self.vertical_reference = header_unpack[0]
+        self.latitude = header_unpack[1]
+        self.longitude = header_unpack[2]
+        self.horizontal_accuracy = header_unpack[3]
+        self.vessel_height = header_unpack[4]
+        self.height_accuracy = header_unpack[5]
+        self.speed_over_ground = header_unpack[6]
+        self.course_over_ground = header_unpack[7]
+        self.heading = header_unpack[8]
+        self.parse_check = True
+
+        return self.parse_check
+
+
+class Data1016(ResonData):
+    __slots__ = ('num_samples', 'time_offset', 'roll', 'pitch', 'heave', 'heading')
+    desc = "Attitude"
+    header_struct = struct.Struct('<B')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('num_samples', 'u1')])
+    # time offset in ms from the record time
+    sample_dtype = np.dtype([('time_offset', '<u2'), ('roll', '<f4'), ('pitch', '<f4'), ('heave', '<f4'),
+                             ('heading', '<f4')])
+
+    def __init__(self, chunk):
+        super().__init__()
+
+        self.num_samples = None
+        self.time_offset = None
+        self.roll = None
+        self.pitch = None
+        self.heave = None
+        self.heading = None
+
+        self.parse_check = self.parse(chunk)
+
+    def parse(self, chunk):
+        header_unpack = self.header_struct.unpack_from(chunk)
+        self.num_samples = header_unpack[0]
+
+        data_size = self.num_samples * self.sample_dtype.itemsize
+        if len(chunk) < self.header_size + data_size:
+            raise RuntimeError("Attitude record shorter than its %d samples" % self.num_samples)
+        samples = np.frombuffer(chunk, dtype=self.sample_dtype, count=self.num_samples, offset=self.header_size)
+        for name in self.sample_dtype.names:
+            setattr(self, name, samples[name])
+
+        self.parse_check = True
+        return self.parse_check
+
+
+class Data7012(ResonData):
+    __slots__ = ('sonar_id', 'ping_number', 'multi_ping', 'num_samples', 'flags', 'error_flags', 'sampling_rate',
+                 'pitch', 'roll', 'heading', 'heave')
+    desc = "Ping Motion Data"
+    header_struct = struct.Struct('<QIHIHIf')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('sonar_id', '<u8'), ('ping_number', '<u4'), ('multi_ping', '<u2'),
+                             ('num_samples', '<u4'), ('flags', '<u2'), ('error_flags', '<u4'),
+                             ('sampling_rate', '<f4')])
+    # flags bits of the per-sample arrays, in the order they are stored (after the optional pitch value)
+    sample_fields = (('roll', 0x02), ('heading', 0x04), ('heave', 0x08))
+    pitch_flag = 0x01
+
+    def __init__(self, chunk):
+        super().__init__()
+
+        self.sonar_id = None
+        self.ping_number = None
+        self.multi_ping = None
+        self.num_samples = None
+        self.flags = None
+        self.error_flags = None
+        self.sampling_rate = None
+        self.pitch = None
+        self.roll = None
+        self.heading = None
+        self.heave = None
+
+        self.parse_check = self.parse(chunk)
+
+    def parse(self, chunk):
+        header_unpack = self.header_struct.unpack_from(chunk)
+
+        self.sonar_id = header_unpack[0]
+        self.ping_number = header_unpack[1]
+        self.multi_ping = header_unpack[2]
+        self.num_samples = header_unpack[3]
+        self.flags = header_unpack[4]
+        self.error_flags = header_unpack[5]
+        self.sampling_rate = header_unpack[6]
+
+        offset = self.header_size
+        if self.flags & self.pitch_flag:
+            if len(chunk) < offset + 4:
+                raise RuntimeError("Ping motion record without its pitch value")
+            self.pitch = struct.unpack_from('<f', chunk, offset)[0]
+            offset += 4
+        for name, flag in self.sample_fields:
+            if not self.flags & flag:
+                continue
+            if len(chunk) < offset + 4 * self.num_samples:
+                raise RuntimeError("Ping motion record shorter than its %d samples" % self.num_samples)
+            setattr(self, name, np.frombuffer(chunk, dtype='<f4', count=self.num_samples, offset=offset))
+            offset += 4 * self.num_samples
+
+        self.parse_check = True
+        return self.parse_check
+
+
 class Data7000(ResonData):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping_flag', 'frequency', 'sample_rate', 'rx_band_width',
+                 'tx_pulse_width', 'tx_wave_form', 'tx_envelope', 'tx_envelope_param', 'tx_pulse_mode', 'max_pingrate',
+                 'ping_period', 'range_select', 'power_select', 'gain_select', 'control_flag', 'tx_identifier',
+                 'tx_beam_steering_vertical', 'tx_beam_steering_horizontal', 'tx_beam_width_vertical',
+                 'tx_beam_width_horizontal', 'tx_focus', 'tx_shading', 'tx_shading_param', 'rx_identifier',
+                 'rx_shading', 'rx_shading_param', 'rx_flag', 'rx_beam_width', 'bottom_detect_range_min',
+                 'bottom_detect_range_max', 'bottom_detect_depth_min', 'bottom_detect_depth_max', 'stabilization_roll',
+                 'stabilization_pitch', 'stabilization_yaw', 'absorption', 'sound_velocity', 'spreading')
+    desc = "Runtime Settings"
+    header_struct = struct.Struct('<QIH4f2If2H5f2I5fIf3IfI8fH')
+    header_size = header_struct.size
+    # record type header, as NumPy dtype (for the batch decoding)
+    header_dtype = np.dtype([('sonar_id', '<u8'), ('ping_number', '<u4'), ('multiping_flag', '<u2'),
+                             ('frequency', '<f4'), ('sample_rate', '<f4'), ('rx_band_width', '<f4'),
+                             ('tx_pulse_width', '<f4'), ('tx_pulse_type', '<u4'), ('tx_envelope', '<u4'),
+                             ('tx_envelope_param', '<f4'), ('tx_pulse_mode', '<u2'), ('tx_pulse_reserved', '<u2'),
+                             ('max_pingrate', '<f4'), ('ping_period', '<f4'), ('range_select', '<f4'),
+                             ('power_select', '<f4'), ('gain_select', '<f4'), ('control_flag', '<u4'),
+                             ('tx_identifier', '<u4'), ('tx_beam_steering_vertical', '<f4'),
+                             ('tx_beam_steering_horizontal', '<f4'), ('tx_beam_width_vertical', '<f4'),
+                             ('tx_beam_width_horizontal', '<f4'), ('tx_focus', '<f4'), ('tx_shading', '<u4'),
+                             ('tx_shading_param', '<f4'), ('tx_flags', '<u4'), ('rx_identifier', '<u4'),
+                             ('rx_shading', '<u4'), ('rx_shading_param', '<f4'), ('rx_flag', '<u4'),
+                             ('rx_beam_width', '<f4'), ('bottom_detect_range_min', '<f4'),
+                             ('bottom_detect_range_max', '<f4'), ('bottom_detect_depth_min', '<f4'),
+                             ('bottom_detect_depth_max', '<f4'), ('absorption', '<f4'), ('sound_velocity', '<f4'),
+                             ('spreading', '<f4'), ('reserved', '<u2')])
+
     def __init__(self, chunk):
         super().__init__()
-        self.desc = "Runtime Settings"
-        self.parse_check = False
-        self.header_fmt = '<QIH4f2If2H5f2I5fIf3IfI8fH'
-        self.header_size = struct.calcsize(self.header_fmt)
 
         self.sonar_id = None
         self.ping_number = None
@@ -245,7 +492,7 @@ class Data7000(ResonData):
         self.parse(chunk)
 
     def parse(self, chunk):
-        header_unpack = struct.unpack(self.header_fmt, chunk)
+        header_unpack = self.header_struct.unpack_from(chunk)
 
         self.sonar_id = header_unpack[0]
         self.ping_number = header_unpack[1]
@@ -291,12 +538,7 @@ class Data7000(ResonData):
         self.rx_identifier = header_unpack[27]
         self.rx_shading = header_unpack[28]     # TODO: parser for rx shading term
         self.rx_shading_param = header_unpack[29]
-        rcv_flags = header_unpack[30]
-        rcv_flags = format(rcv_flags, '32b')
-        if rcv_flags[-1] == 1:
-            self.stabilization_roll = True
-        else:
-            self.stabilization_roll = False
+        self.stabilization_roll = bool(header_unpack[30] & 0x01)  # rx flags bit 0: roll compensation
         self.rx_beam_width = header_unpack[31]
         self.bottom_detect_range_min = header_unpack[32]
         self.bottom_detect_range_max = header_unpack[33]
@@ -312,6 +554,8 @@ class Data7000(ResonData):
 
 
 class Data7001(ResonData):
+    __slots__ = ('header', 'data')
+
     def __init__(self, chunk):
         super().__init__()
         self.header = None
@@ -324,12 +568,15 @@ class Data7001(ResonData):
 
 
 class Data7004(ResonData):
+    __slots__ = ('data_size', 'sonar_id', 'num_rx_beams', 'rx_beam_number', 'rx_angle_vertical', 'rx_angle_horizontal',
+                 'rx_beam_width_along', 'rx_beam_width_across')
+    desc = "Beam Geometry"
+    header_struct = struct.Struct('<QI')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('sonar_id', '<u8'), ('num_rx_beams', '<u4')])
+
     def __init__(self, chunk):
         super().__init__()
-        self.desc = "Beam Geometry"
-        self.parse_check = False
-        self.header_fmt = '<QI'
-        self.header_size = struct.calcsize(self.header_fmt)
 
         self.data_size = None
         self.sonar_id = None
@@ -342,38 +589,121 @@ class Data7004(ResonData):
         self.parse(chunk)
 
     def parse(self, chunk):
-        header_chunk = chunk[0:self.header_size]
-        header_unpack = struct.unpack(self.header_fmt, header_chunk)
+        header_unpack = self.header_struct.unpack_from(chunk)
         self.sonar_id = header_unpack[0]
         self.num_rx_beams = header_unpack[1]
 
-        data_chunk = chunk[self.header_size:]
-        data_fmt = f'<%df' % (4 * self.num_rx_beams)
-        data_unpack = struct.unpack(data_fmt, data_chunk)
+        # the four per-beam arrays are stored one after the other: one (4, beams) view
+        if len(chunk) < self.header_size + 16 * self.num_rx_beams:
+            raise RuntimeError("Beam geometry record shorter than its %d beams" % self.num_rx_beams)
+        data = np.frombuffer(chunk, dtype='<f4', count=4 * self.num_rx_beams,
+                             offset=self.header_size).reshape(4, self.num_rx_beams)
         self.rx_beam_number = range(0, self.num_rx_beams)
-        self.rx_angle_vertical = data_unpack[0:self.num_rx_beams]
-        self.rx_angle_horizontal = data_unpack[self.num_rx_beams:2*self.num_rx_beams]
-        self.rx_beam_width_along = data_unpack[2*self.num_rx_beams:3*self.num_rx_beams]
-        self.rx_beam_width_across = data_unpack[3*self.num_rx_beams:4*self.num_rx_beams]
-        logging.debug('sdf')
+        self.rx_angle_vertical = data[0]
+        self.rx_angle_horizontal = data[1]
+        self.rx_beam_width_along = data[2]
+        self.rx_beam_width_across = data[3]
 
         self.parse_check = True
         return self.parse_check
 
 
 class Data7006(ResonData):
-    def __init__(self, chunk):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_beams', 'layer_comp_flag', 'sound_velocity_flag',
+                 'sound_velocity', 'range', 'quality', 'intensity', 'min_filter', 'max_filter', 'frequency', 'latitude',
+                 'longitude', 'heading', 'height_source', 'tide', 'roll', 'pitch', 'heave', 'vehicle_depth', 'depth',
+                 'along_track', 'across_track', 'pointing_angle', 'azimuth_angle')
+    desc = "Bathymetric Data"
+    header_struct = struct.Struct('<QIHI2Bf')
+    header_size = header_struct.size
+    optional_header_dtype = np.dtype([('frequency', '<f4'), ('latitude', '<f8'), ('longitude', '<f8'),
+                                      ('heading', '<f4'), ('height_source', 'u1'), ('tide', '<f4'), ('roll', '<f4'),
+                                      ('pitch', '<f4'), ('heave', '<f4'), ('vehicle_depth', '<f4')])
+    optional_beam_dtype = np.dtype([('depth', '<f4'), ('along_track', '<f4'), ('across_track', '<f4'),
+                                    ('pointing_angle', '<f4'), ('azimuth_angle', '<f4')])
+
+    def __init__(self, chunk, optional_offset: int = None):
         super().__init__()
-        self.header = None
-        self.data = None
 
-        self.parse(chunk)
+        self.sonar_id = None
+        self.ping_number = None
+        self.multiping = None
+        self.num_beams = None
+        self.layer_comp_flag = None
+        self.sound_velocity_flag = None
+        self.sound_velocity = None
+        self.range = None  # two-way travel time
+        self.quality = None
+        self.intensity = None
+        self.min_filter = None
+        self.max_filter = None
+        # optional data: None when the record does not have it
+        self.frequency = None
+        self.latitude = None
+        self.longitude = None
+        self.heading = None
+        self.height_source = None
+        self.tide = None
+        self.roll = None
+        self.pitch = None
+        self.heave = None
+        self.vehicle_depth = None
+        self.depth = None
+        self.along_track = None
+        self.across_track = None
+        self.pointing_angle = None
+        self.azimuth_angle = None
+
+        self.parse_check = self.parse(chunk, optional_offset=optional_offset)
+
+    @property
+    def detection_type(self) -> np.ndarray:
+        """Bottom detection of each beam from the quality bits 2-3 (1: amplitude, 2: phase, 3: both)"""
+        return (self.quality >> 2) & 0x03
+
+    def parse(self, chunk, optional_offset: int = None):
+        """optional_offset is the position of the optional data in chunk, if known (otherwise, it is expected
+        right after the beam data)"""
+        header_unpack = self.header_struct.unpack_from(chunk)
+        self.sonar_id = header_unpack[0]
+        self.ping_number = header_unpack[1]
+        self.multiping = header_unpack[2]
+        self.num_beams = header_unpack[3]
+        self.layer_comp_flag = header_unpack[4]
+        self.sound_velocity_flag = header_unpack[5]
+        self.sound_velocity = header_unpack[6]
+
+        # the beam data are five arrays, one after the other
+        num_beams = self.num_beams
+        beam_dtype = np.dtype([('range', '<f4', (num_beams,)), ('quality', 'u1', (num_beams,)),
+                               ('intensity', '<f4', (num_beams,)), ('min_filter', '<f4', (num_beams,)),
+                               ('max_filter', '<f4', (num_beams,))])
+        if len(chunk) - self.header_size < beam_dtype.itemsize:
+            raise RuntimeError("Truncated bathymetric data: %d beams" % num_beams)
+        beam_data = np.frombuffer(chunk, dtype=beam_dtype, count=1, offset=self.header_size)[0]
+        for name in beam_dtype.names:
+            setattr(self, name, beam_data[name])
+
+        if optional_offset is None:
+            optional_offset = self.header_size + beam_dtype.itemsize
+        optional_size = self.optional_header_dtype.itemsize + num_beams * self.optional_beam_dtype.itemsize
+        if len(chunk) - optional_offset >= optional_size:
+            optional_header = np.frombuffer(chunk, dtype=self.optional_header_dtype, count=1,
+                                            offset=optional_offset)[0]
+            for name in self.optional_header_dtype.names:
+                setattr(self, name, optional_header[name].item())
+            optional_beams = np.frombuffer(chunk, dtype=self.optional_beam_dtype, count=num_beams,
+                                           offset=optional_offset + self.optional_header_dtype.itemsize)
+            for name in self.optional_beam_dtype.names:
+                setattr(self, name, optional_beams[name])
 
-    def parse(self, chunk):
-        pass
+        self.parse_check = True
+        return self.parse_check
 
 
 class Data7007(ResonData):
+    __slots__ = ('header', 'data')
+
     def __init__(self, chunk):
         super().__init__()
         self.header = None
@@ -385,25 +715,103 @@ class Data7007(ResonData):
         pass
 
 
-class Data7008(ResonData):
-    def __init__(self, chunk):
-        super().__init__()
-        self.header = None
-        self.data = None
+class Data7008(ResonWaterColumn):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_beams', 'num_samples', 'record_subset_flag',
+                 'row_column_flag', 'data_sample_type', 'element_data', 'beam_number', 'first_sample', 'last_sample',
+                 'i', 'q')
+    desc = "Generic Water Column"
+    header_struct = struct.Struct('<QI3HI2BHI')
+    header_size = header_struct.size
+    descriptor_dtype = np.dtype([('beam_number', '<u2'), ('first_sample', '<u4'), ('last_sample', '<u4')])
+    # sample widths by the 4-bit codes of the data sample type (0: absent, 2: 16-bit, 3: 32-bit)
+    magnitude_dtypes = {2: '<u2', 3: '<u4'}
+    phase_dtypes = {2: '<i2', 3: '<i4'}
+    iq_dtypes = {1: '<i2', 2: '<i4'}  # I and Q (0: absent, 1: 16-bit, 2: 32-bit)
 
-        self.parse(chunk)
+    def __init__(self, chunk, beam_step: int = 1, sample_step: int = 1):
+        super().__init__(beam_step=beam_step, sample_step=sample_step)
+
+        self.sonar_id = None
+        self.ping_number = None
+        self.multiping = None
+        self.num_beams = None
+        self.num_samples = None
+        self.record_subset_flag = None
+        self.row_column_flag = None
+        self.data_sample_type = None
+        self.element_data = None
+        self.beam_number = None
+        self.first_sample = None
+        self.last_sample = None
+        self.i = None  # (beam, sample), if present
+        self.q = None
+
+        self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        pass
+        header_unpack = self.header_struct.unpack_from(chunk)
+        self.sonar_id = header_unpack[0]
+        self.ping_number = header_unpack[1]
+        self.multiping = header_unpack[2]
+        self.num_beams = header_unpack[3]
+        self.num_samples = header_unpack[5]
+        self.record_subset_flag = header_unpack[6]
+        self.row_column_flag = header_unpack[7]
+        self.data_sample_type = header_unpack[9]
+
+        magnitude = self.data_sample_type & 0x0F
+        phase = (self.data_sample_type >> 4) & 0x0F
+        iq = (self.data_sample_type >> 8) & 0x0F
+        self.element_data = bool((self.data_sample_type >> 12) & 0x07)
+        sample_fields = list()
+        for code, dtypes, names in ((magnitude, self.magnitude_dtypes, ('amplitude', )),
+                                    (phase, self.phase_dtypes, ('phase', )), (iq, self.iq_dtypes, ('i', 'q'))):
+            if code == 0:
+                continue
+            if code not in dtypes:
+                raise RuntimeError("Unsupported data sample type: 0x%x" % self.data_sample_type)
+            sample_fields.extend((name, dtypes[code]) for name in names)
+        sample_dtype = np.dtype(sample_fields)
+
+        descriptors = np.frombuffer(chunk, dtype=self.descriptor_dtype, count=self.num_beams,
+                                    offset=self.header_size)
+        self.beam_number = descriptors['beam_number'][::self.beam_step]
+        self.first_sample = descriptors['first_sample'][::self.beam_step]
+        self.last_sample = descriptors['last_sample'][::self.beam_step]
+
+        if len(sample_fields) == 0:  # descriptors only
+            self.parse_check = True
+            return self.parse_check
+
+        data_offset = self.header_size + self.num_beams * self.descriptor_dtype.itemsize
+        count = self.num_beams * self.num_samples
+        if len(chunk) - data_offset < count * sample_dtype.itemsize:
+            raise RuntimeError("Truncated water column data: %d beams, %d samples" % (self.num_beams,
+                                                                                     self.num_samples))
+        data = np.frombuffer(chunk, dtype=sample_dtype, count=count, offset=data_offset)
+        # row/column flag 0: beam by beam, 1: sample by sample (the transposed view is used, without copying)
+        if self.row_column_flag == 0:
+            data = data.reshape(self.num_beams, self.num_samples)
+        else:
+            data = data.reshape(self.num_samples, self.num_beams).T
+        data = self.decimate(data)
+        for name in sample_dtype.names:
+            setattr(self, name, data[name])
+
+        self.parse_check = True
+        return self.parse_check
 
 
 class Data7010(ResonData):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_samples', 'tvg_curve')
+    desc = "TVG"
+    header_struct = struct.Struct('<QIHI8I')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('sonar_id', '<u8'), ('ping_number', '<u4'), ('multiping', '<u2'),
+                             ('num_samples', '<u4'), ('reserved', '<u4', (8,))])
+
     def __init__(self, chunk):
         super().__init__()
-        self.desc = "TVG"
-        self.parse_check = False
-        self.header_fmt = '<QIHI8I'
-        self.header_size = struct.calcsize(self.header_fmt)
 
         self.sonar_id = None
         self.ping_number = None
@@ -414,8 +822,7 @@ class Data7010(ResonData):
         self.parse(chunk)
 
     def parse(self, chunk):
-        header_chunk = chunk[0:self.header_size]
-        header_unpack = struct.unpack(self.header_fmt, header_chunk)
+        header_unpack = self.header_struct.unpack_from(chunk)
         self.sonar_id = header_unpack[0]
         self.ping_number = header_unpack[1]
         self.multiping = header_unpack[2]
@@ -430,6 +837,8 @@ class Data7010(ResonData):
 
 
 class Data7017(ResonData):
+    __slots__ = ('header', 'data')
+
     def __init__(self, chunk):
         super().__init__()
         self.header = None
@@ -441,25 +850,70 @@ class Data7017(ResonData):
         pass
 
 
-class Data7018(ResonData):
-    def __init__(self, chunk):
-        super().__init__()
-        self.header = None
-        self.data = None
+class Data7018(ResonWaterColumn):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_beams', 'num_samples')
+    desc = "Beamformed Data"
+    header_struct = struct.Struct('<QI2HI8I')
+    header_size = header_struct.size
+    sample_dtype = np.dtype([('amplitude', '<u2'), ('phase', '<i2')])
 
-        self.parse(chunk)
+    def __init__(self, chunk, beam_step: int = 1, sample_step: int = 1):
+        super().__init__(beam_step=beam_step, sample_step=sample_step)
+
+        self.sonar_id = None
+        self.ping_number = None
+        self.multiping = None
+        self.num_beams = None
+        self.num_samples = None
+
+        self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        pass
+        header_unpack = self.header_struct.unpack_from(chunk)
+        self.sonar_id = header_unpack[0]
+        self.ping_number = header_unpack[1]
+        self.multiping = header_unpack[2]
+        self.num_beams = header_unpack[3]
+        self.num_samples = header_unpack[4]
+
+        count = self.num_beams * self.num_samples
+        if len(chunk) - self.header_size < count * self.sample_dtype.itemsize:
+            raise RuntimeError("Truncated beamformed data: %d beams, %d samples" % (self.num_beams,
+                                                                                  self.num_samples))
+        # stored sample by sample, the transposed view is (beam, sample)
+        data = np.frombuffer(chunk, dtype=self.sample_dtype, count=count, offset=self.header_size)
+        data = self.decimate(data.reshape(self.num_samples, self.num_beams).T)
+        self.amplitude = data['amplitude']
+        self.phase = data['phase']
+
+        self.parse_check = True
+        return self.parse_check
 
 
 class Data7027(ResonData):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_detect_ponts', 'data_field_size', 'detection_algorithm',
+                 'flags', 'sample_rate', 'tx_steering_angle', 'rx_steering_angle', 'detections', 'beam', 'detect_point',
+                 'rx_angle', 'beam_flag', 'quality_flag', 'uncertainty', 'signal_strength', 'min_limit', 'max_limit')
+    desc = "Raw Bathy"
+    header_struct = struct.Struct('<QIH2IBI3f15I')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('sonar_id', '<u8'), ('ping_number', '<u4'), ('multiping', '<u2'),
+                             ('num_detect_points', '<u4'), ('data_field_size', '<u4'), ('detection_algorithm', 'u1'),
+                             ('flags', '<u4'), ('sample_rate', '<f4'), ('tx_steering_angle', '<f4'),
+                             ('rx_steering_angle', '<f4'), ('reserved', '<u4', (15,))])
+    # detection table layouts, by data field size
+    detection_dtypes = {
+        22: np.dtype([('beam', '<u2'), ('detect_point', '<f4'), ('rx_angle', '<f4'), ('beam_flag', '<u4'),
+                      ('quality_flag', '<u4'), ('uncertainty', '<f4')]),
+        26: np.dtype([('beam', '<u2'), ('detect_point', '<f4'), ('rx_angle', '<f4'), ('beam_flag', '<u4'),
+                      ('quality_flag', '<u4'), ('uncertainty', '<f4'), ('signal_strength', '<f4')]),
+        34: np.dtype([('beam', '<u2'), ('detect_point', '<f4'), ('rx_angle', '<f4'), ('beam_flag', '<u4'),
+                      ('quality_flag', '<u4'), ('uncertainty', '<f4'), ('signal_strength', '<f4'),
+                      ('min_limit', '<f4'), ('max_limit', '<f4')]),
+    }
+
     def __init__(self, chunk):
         super().__init__()
-        self.desc = "Raw Bathy"
-        self.parse_check = False
-        self.header_fmt = '<QIH2IBI3f15I'
-        self.header_size = struct.calcsize(self.header_fmt)
 
         self.sonar_id = None
         self.ping_number = None
@@ -471,21 +925,22 @@ class Data7027(ResonData):
         self.sample_rate = None
         self.tx_steering_angle = None
         self.rx_steering_angle = None
-        self.beam = list()
-        self.detect_point = list()
-        self.rx_angle = list()
-        self.beam_flag = list()
-        self.quality_flag = list()
-        self.uncertainty = list()
-        self.signal_strength = list()
-        self.min_limit = list()
-        self.max_limit = list()
+        self.detections = None  # structured array with one row per detection point
+        # per-field views of detections (None for the fields missing from the data field size)
+        self.beam = None
+        self.detect_point = None
+        self.rx_angle = None
+        self.beam_flag = None
+        self.quality_flag = None
+        self.uncertainty = None
+        self.signal_strength = None
+        self.min_limit = None
+        self.max_limit = None
 
         self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        header_chunk = chunk[0:self.header_size]
-        header_unpack = struct.unpack(self.header_fmt, header_chunk)
+        header_unpack = self.header_struct.unpack_from(chunk)
         self.sonar_id = header_unpack[0]
         self.ping_number = header_unpack[1]
         self.multiping = header_unpack[2]
@@ -497,45 +952,38 @@ class Data7027(ResonData):
         self.tx_steering_angle = header_unpack[8]
         self.rx_steering_angle = header_unpack[9]
 
-        data_chunk = chunk[self.header_size:]
-        if self.data_field_size == 22:
-            fmt_base = '<H2f2If'
-        elif self.data_field_size == 26:
-            fmt_base = '<H2f2I2f'
-        elif self.data_field_size == 34:
-            fmt_base = '<H2f2I4f'
-        else:
+        dtype = self.detection_dtypes.get(self.data_field_size)
+        if dtype is None:
             raise RuntimeError("Unrecognized data field size")
+        if len(chunk) - self.header_size < self.num_detect_ponts * dtype.itemsize:
+            raise RuntimeError("Truncated detection table: %d points" % self.num_detect_ponts)
 
-        offset = 0
-        if self.num_detect_ponts > 0:
-            for detect_point in range(self.num_detect_ponts):
-                data_unpack = struct.unpack(fmt_base, data_chunk[offset:offset+self.data_field_size])
-                self.beam.append(data_unpack[0])
-                self.detect_point.append(data_unpack[1])
-                self.rx_angle.append(data_unpack[2])
-                self.beam_flag.append(data_unpack[3])
-                self.quality_flag.append(data_unpack[4])
-                self.uncertainty.append(data_unpack[5])
-                self.signal_strength.append(data_unpack[6])
-                self.min_limit.append(data_unpack[7])
-                self.max_limit.append(data_unpack[8])
-
-                offset += self.data_field_size
+        # copied out of the read buffer, so that the record does not keep the whole buffer alive
+        self.detections = np.frombuffer(chunk, dtype=dtype, count=self.num_detect_ponts,
+                                        offset=self.header_size).copy()
+        for name in dtype.names:
+            setattr(self, name, self.detections[name])
 
         self.parse_check = True
         return self.parse_check
 
 
 class Data7028(ResonData):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_detect_points', 'error_flag', 'control_flag', 'flags',
+                 'descriptors', 'beam_number', 'snippet_start_sample', 'bottom_detect_sample', 'snippet_end_sample',
+                 'samples', 'sample_offsets')
+    desc = "Snippet Data"
+    header_struct = struct.Struct('<QI2H2BI6I')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('sonar_id', '<u8'), ('ping_number', '<u4'), ('multiping', '<u2'),
+                             ('num_detect_points', '<u2'), ('error_flag', 'u1'), ('control_flag', 'u1'),
+                             ('flags', '<u4'), ('reserved', '<u4', (6,))])
+    descriptor_dtype = np.dtype([('beam_number', '<u2'), ('snippet_start_sample', '<u4'),
+                                 ('bottom_detect_sample', '<u4'), ('snippet_end_sample', '<u4')])
+    descriptor_size = descriptor_dtype.itemsize
+
     def __init__(self, chunk):
         super().__init__()
-        self.desc = "Snippet Data"
-        self.parse_check = False
-        self.header_fmt = '<QI2H2BI6I'
-        self.header_size = struct.calcsize(self.header_fmt)
-        self.descriptor_fmt = '<H3I'
-        self.descriptor_size = struct.calcsize(self.descriptor_fmt)
 
         self.sonar_id = None
         self.ping_number = None
@@ -545,17 +993,20 @@ class Data7028(ResonData):
         self.control_flag = None
         self.flags = None
 
-        self.beam_number = list()
-        self.snippet_start_sample = list()
-        self.bottom_detect_sample = list()
-        self.snippet_end_sample = list()
-        self.snippet = list()
+        # per-beam descriptors, as views of the descriptor table
+        self.descriptors = None
+        self.beam_number = None
+        self.snippet_start_sample = None
+        self.bottom_detect_sample = None
+        self.snippet_end_sample = None
+        # snippets of all the beams, back to back (CSR): beam n is samples[sample_offsets[n]:sample_offsets[n + 1]]
+        self.samples = None
+        self.sample_offsets = None
 
         self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        header_chunk = chunk[0:self.header_size]
-        header_unpack = struct.unpack(self.header_fmt, header_chunk)
+        header_unpack = self.header_struct.unpack_from(chunk)
 
         self.sonar_id = header_unpack[0]
         self.ping_number = header_unpack[1]
@@ -565,34 +1016,43 @@ class Data7028(ResonData):
         self.control_flag = header_unpack[5]
         self.flags = header_unpack[6]
 
-        data_chunk = chunk[self.header_size:]
-        offset = 0
-        if self.num_detect_points > 0:
-            for n in range(self.num_detect_points):
-                data_unpack = struct.unpack(self.descriptor_fmt, data_chunk[offset:offset+self.descriptor_size])
-                self.beam_number.append(data_unpack[0])
-                self.snippet_start_sample.append(data_unpack[1])
-                self.bottom_detect_sample.append(data_unpack[2])
-                self.snippet_end_sample.append(data_unpack[3])
-                offset += self.descriptor_size
-
-            for beam in range(self.num_detect_points):
-                num_samples = self.snippet_end_sample[beam] - self.snippet_start_sample[beam] + 1
-                if (self.flags % 10) == 0:
-                    snippet_fmt = '<%dH' % num_samples
-                else:
-                    snippet_fmt = '<%dI' % num_samples
-
-                snippet_size = struct.calcsize(snippet_fmt)
-                data = struct.unpack(snippet_fmt, data_chunk[offset:offset+snippet_size])
-                self.snippet.append(data)
-                offset += snippet_size
+        self.descriptors = np.frombuffer(chunk, dtype=self.descriptor_dtype, count=self.num_detect_points,
+                                         offset=self.header_size)
+        self.beam_number = self.descriptors['beam_number']
+        self.snippet_start_sample = self.descriptors['snippet_start_sample']
+        self.bottom_detect_sample = self.descriptors['bottom_detect_sample']
+        self.snippet_end_sample = self.descriptors['snippet_end_sample']
+
+        num_samples = self.snippet_end_sample.astype(np.int64) - self.snippet_start_sample + 1
+        if np.any(num_samples < 0):
+            raise RuntimeError("Snippet ending before its start")
+        self.sample_offsets = np.zeros(self.num_detect_points + 1, dtype=np.int64)
+        np.cumsum(num_samples, out=self.sample_offsets[1:])
+
+        # flags bit 0: 32-bit samples, otherwise 16-bit
+        sample_dtype = np.dtype('<u4') if self.flags & 0x01 else np.dtype('<u2')
+        samples_offset = self.header_size + self.num_detect_points * self.descriptor_size
+        if len(chunk) - samples_offset < self.sample_offsets[-1] * sample_dtype.itemsize:
+            raise RuntimeError("Truncated snippets: %d samples" % self.sample_offsets[-1])
+        # zero-copy: the samples are a view of the record buffer
+        self.samples = np.frombuffer(chunk, dtype=sample_dtype, count=int(self.sample_offsets[-1]),
+                                     offset=samples_offset)
 
         self.parse_check = True
         return self.parse_check
 
+    def beam_snippet(self, index: int) -> np.ndarray:
+        """Return the samples of the index-th beam in the record (a view)"""
+        return self.samples[self.sample_offsets[index]:self.sample_offsets[index + 1]]
+
+    @property
+    def snippet(self) -> list:
+        return [self.beam_snippet(index) for index in range(self.num_detect_points)]
+
 
 class Data7048(ResonData):
+    __slots__ = ('header', 'data')
+
     def __init__(self, chunk):
         super().__init__()
         self.header = None
@@ -603,31 +1063,243 @@ class Data7048(ResonData):
         pass
 
 
-class Data7041(ResonData):
-    def __init__(self, chunk):
-        super().__init__()
-        self.header = None
-        self.data = None
+class Data7041(ResonWaterColumn):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_beams', 'flags', 'sample_rate', 'beam_id', 'num_samples')
+    desc = "Compressed Beamformed Magnitude"
+    header_struct = struct.Struct('<QI3Hf4I')
+    header_size = header_struct.size
 
-        self.parse(chunk)
+    def __init__(self, chunk, beam_step: int = 1, sample_step: int = 1):
+        super().__init__(beam_step=beam_step, sample_step=sample_step)
+
+        self.sonar_id = None
+        self.ping_number = None
+        self.multiping = None
+        self.num_beams = None
+        self.flags = None
+        self.sample_rate = None
+        self.beam_id = None  # beam number, or beam angle (flags bit 7)
+        self.num_samples = None  # per beam
+
+        self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        pass
+        header_unpack = self.header_struct.unpack_from(chunk)
+        self.sonar_id = header_unpack[0]
+        self.ping_number = header_unpack[1]
+        self.multiping = header_unpack[2]
+        self.num_beams = header_unpack[3]
+        self.flags = header_unpack[4]
+        self.sample_rate = header_unpack[5]
+
+        # flags bit 0: 16-bit samples (otherwise 8-bit), bit 7: beam angles as float (otherwise beam numbers)
+        sample_dtype = np.dtype('<u2') if self.flags & 0x01 else np.dtype('u1')
+        descriptor_dtype = np.dtype([('beam_id', '<f4' if self.flags & 0x80 else '<u2'), ('num_samples', '<u4')])
+        descriptors, samples = self.read_beams(chunk, self.header_size, self.num_beams, descriptor_dtype,
+                                               sample_dtype)
+        self.beam_id = descriptors['beam_id'][::self.beam_step]
+        self.num_samples = descriptors['num_samples'][::self.beam_step]
+        self.amplitude = self.decimate(samples)
+
+        self.parse_check = True
+        return self.parse_check
+
+
+class Data7042(ResonWaterColumn):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_beams', 'samples', 'compressed_samples', 'flags',
+                 'first_sample', 'sample_rate', 'compression_factor', 'beam_number', 'segment_number', 'num_samples')
+    desc = "Compressed Water Column"
+    header_struct = struct.Struct('<QI2H4I2fI')
+    header_size = header_struct.size
+
+    def __init__(self, chunk, beam_step: int = 1, sample_step: int = 1):
+        super().__init__(beam_step=beam_step, sample_step=sample_step)
+
+        self.sonar_id = None
+        self.ping_number = None
+        self.multiping = None
+        self.num_beams = None
+        self.samples = None
+        self.compressed_samples = None
+        self.flags = None
+        self.first_sample = None
+        self.sample_rate = None
+        self.compression_factor = None
+        self.beam_number = None
+        self.segment_number = None  # only if flagged
+        self.num_samples = None  # per beam
+
+        self.parse_check = self.parse(chunk)
+
+    @property
+    def is_db(self) -> bool:
+        """Whether the magnitude was converted to dB before the compression (flags bit 2)"""
+        return bool(self.flags & 0x04)
+
+    def parse(self, chunk):
+        header_unpack = self.header_struct.unpack_from(chunk)
+        self.sonar_id = header_unpack[0]
+        self.ping_number = header_unpack[1]
+        self.multiping = header_unpack[2]
+        self.num_beams = header_unpack[3]
+        self.samples = header_unpack[4]
+        self.compressed_samples = header_unpack[5]
+        self.flags = header_unpack[6]
+        self.first_sample = header_unpack[7]
+        self.sample_rate = header_unpack[8]
+        self.compression_factor = header_unpack[9]
+
+        # flags bit 1: magnitude only, bit 2: 8-bit (dB) samples, bit 12: 32-bit magnitude,
+        # bit 14: segment numbers present
+        magnitude_only = bool(self.flags & 0x02)
+        if magnitude_only:
+            if self.flags & 0x04:
+                sample_dtype = np.dtype([('amplitude', 'u1')])
+            elif self.flags & 0x1000:
+                sample_dtype = np.dtype([('amplitude', '<u4')])
+            else:
+                sample_dtype = np.dtype([('amplitude', '<u2')])
+        elif self.flags & 0x04:
+            sample_dtype = np.dtype([('amplitude', 'u1'), ('phase', 'i1')])
+        else:
+            sample_dtype = np.dtype([('amplitude', '<u2'), ('phase', '<i2')])
+        descriptor_fields = [('beam_number', '<u2')]
+        if self.flags & 0x4000:
+            descriptor_fields.append(('segment_number', 'u1'))
+        descriptor_fields.append(('num_samples', '<u4'))
+
+        descriptors, samples = self.read_beams(chunk, self.header_size, self.num_beams,
+                                               np.dtype(descriptor_fields), sample_dtype)
+        self.beam_number = descriptors['beam_number'][::self.beam_step]
+        if self.flags & 0x4000:
+            self.segment_number = descriptors['segment_number'][::self.beam_step]
+        self.num_samples = descriptors['num_samples'][::self.beam_step]
+        samples = self.decimate(samples)
+        self.amplitude = samples['amplitude']
+        if not magnitude_only:
+            self.phase = samples['phase']
+
+        self.parse_check = True
+        return self.parse_check
+
+    def to_db(self) -> np.ndarray:
+        if self.is_db:
+            return self.amplitude.astype(np.float32)
+        return super().to_db()
 
 
 class Data7058(ResonData):
+    __slots__ = ('sonar_id', 'ping_number', 'multiping', 'num_beams', 'error_flag', 'status', 'control_flags',
+                 'beam_number', 'snippet_start_sample', 'bottom_detect_sample', 'snippet_end_sample', 'sample_offsets',
+                 'bs_strength', 'footprint', 'footprint_time')
+    desc = "Calibrated Snippet Data"
+    header_struct = struct.Struct('<QI2HBI7I')
+    header_size = header_struct.size
+    header_dtype = np.dtype([('sonar_id', '<u8'), ('ping_number', '<u4'), ('multiping', '<u2'),
+                             ('num_beams', '<u2'), ('error_flag', 'u1'), ('control_flags', '<u4'),
+                             ('reserved', '<u4', (7,))])
+    descriptor_dtype = Data7028.descriptor_dtype
+    # control flags announcing the optional per-sample fields, stored after the backscatter of each beam
+    footprint_flag = 0x40  # bit 6: footprint areas
+    footprint_time_flag = 0x100  # bit 8: footprint times
+    error_messages = {
+        0: "OK",
+        1: "No calibration",
+        2: "TVG read error",
+        3: "CTD not available",
+        4: "Invalid sonar geometry",
+        5: "Invalid sonar specifications",
+        6: "Bottom detection failed",
+        7: "No power",
+        8: "No gain",
+        255: "Missing c7k file",
+    }
+
     def __init__(self, chunk):
         super().__init__()
-        self.header = None
-        self.data = None
 
-        self.parse(chunk)
+        self.sonar_id = None
+        self.ping_number = None
+        self.multiping = None
+        self.num_beams = None
+        self.error_flag = None
+        self.status = None
+        self.control_flags = None
+
+        # per-beam descriptors, as views of the descriptor table
+        self.beam_number = None
+        self.snippet_start_sample = None
+        self.bottom_detect_sample = None
+        self.snippet_end_sample = None
+        # per-sample values of all the beams, back to back: beam n is [sample_offsets[n]:sample_offsets[n + 1]]
+        self.sample_offsets = None
+        self.bs_strength = None
+        self.footprint = None  # only if flagged in control_flags
+        self.footprint_time = None  # only if flagged in control_flags
+
+        self.parse_check = self.parse(chunk)
 
     def parse(self, chunk):
-        pass
+        header_unpack = self.header_struct.unpack_from(chunk)
+        self.sonar_id = header_unpack[0]
+        self.ping_number = header_unpack[1]
+        self.multiping = header_unpack[2]
+        self.num_beams = header_unpack[3]
+        self.error_flag = header_unpack[4]
+        self.control_flags = header_unpack[5]
+        self.status = self.error_messages.get(self.error_flag, "Error flag %d" % self.error_flag)
+
+        num_beams = self.num_beams
+        if self.error_flag != 0:  # no calibrated data
+            logging.debug("7058 \"%s\" at ping %d" % (self.status, self.ping_number))
+            num_beams = 0
+
+        descriptors = np.frombuffer(chunk, dtype=self.descriptor_dtype, count=num_beams,
+                                    offset=self.header_size)
+        self.beam_number = descriptors['beam_number']
+        self.snippet_start_sample = descriptors['snippet_start_sample']
+        self.bottom_detect_sample = descriptors['bottom_detect_sample']
+        self.snippet_end_sample = descriptors['snippet_end_sample']
+
+        num_samples = self.snippet_end_sample.astype(np.int64) - self.snippet_start_sample + 1
+        if np.any(num_samples < 0):
+            raise RuntimeError("Snippet ending before its start")
+        self.sample_offsets = np.zeros(num_beams + 1, dtype=np.int64)
+        np.cumsum(num_samples, out=self.sample_offsets[1:])
+
+        fields = ['bs_strength']
+        if self.control_flags & self.footprint_flag:
+            fields.append('footprint')
+        if self.control_flags & self.footprint_time_flag:
+            fields.append('footprint_time')
+
+        data_offset = self.header_size + num_beams * self.descriptor_dtype.itemsize
+        num_values = int(self.sample_offsets[-1]) * len(fields)
+        if len(chunk) - data_offset < num_values * 4:
+            raise RuntimeError("Truncated calibrated snippets: %d samples" % self.sample_offsets[-1])
+        values = np.frombuffer(chunk, dtype='<f4', count=num_values, offset=data_offset)
+
+        if len(fields) == 1:
+            self.bs_strength = values  # zero-copy view of the record buffer
+        else:
+            # each beam stores all its samples of a field, then the next field
+            beam_offsets = np.repeat(self.sample_offsets[:-1], num_samples)
+            beam_samples = np.repeat(num_samples, num_samples)
+            positions = len(fields) * beam_offsets + np.arange(beam_offsets.size) - beam_offsets
+            for n, name in enumerate(fields):
+                setattr(self, name, values[positions + n * beam_samples])
+
+        self.parse_check = True
+        return self.parse_check
+
+    def beam_values(self, index: int, name: str = 'bs_strength') -> np.ndarray:
+        """Return the per-sample values of the index-th beam in the record"""
+        return getattr(self, name)[self.sample_offsets[index]:self.sample_offsets[index + 1]]
 
 
 class Data7200(ResonData):
+    __slots__ = ('header', 'data')
+
     def __init__(self, chunk):
         super().__init__()
         self.header = None
@@ -640,6 +1312,8 @@ class Data7200(ResonData):
 
 
 class Data7503(ResonData):
+    __slots__ = ('header', 'data')
+
     def __init__(self, chunk):
         super().__init__()
         self.header = None
@@ -651,57 +1325,59 @@ class Data7503(ResonData):
         pass
 
 
-def parse(chunk: bytes, dg_type: ResonDatagrams) -> ResonData:
-    if dg_type is ResonDatagrams.POSITION:
-        datapacket = Data1003(chunk)
-
-    elif dg_type is ResonDatagrams.ROLLPITCHHEAVE:
-        datapacket = Data1012(chunk)
-
-    elif dg_type is ResonDatagrams.HEADING:
-        datapacket = Data1013(chunk)
-
-    elif dg_type is ResonDatagrams.SONARSETTINGS:
-        datapacket = Data7000(chunk)
-
-    elif dg_type is ResonDatagrams.SONARCONFIG:
-        datapacket = Data7001(chunk)
-
-    elif dg_type is ResonDatagrams.BEAMGEO:
-        datapacket = Data7004(chunk)
-
-    elif dg_type is ResonDatagrams.BATHYDATA:
-        datapacket = Data7006(chunk)
-
-    elif dg_type is ResonDatagrams.SIDESCAN:
-        datapacket = Data7007(chunk)
-
-    elif dg_type is ResonDatagrams.WATERCOLUMNGEN:
-        datapacket = Data7008(chunk)
-
-    elif dg_type is ResonDatagrams.TVG:
-        datapacket = Data7010(chunk)
+# record classes, by record type identifier
+datagram_parsers = {
+    1003: Data1003,
+    1012: Data1012,
+    1013: Data1013,
+    1015: Data1015,
+    1016: Data1016,
+    7000: Data7000,
+    7001: Data7001,
+    7004: Data7004,
+    7006: Data7006,
+    7007: Data7007,
+    7008: Data7008,
+    7010: Data7010,
+    7012: Data7012,
+    7018: Data7018,
+    7027: Data7027,
+    7028: Data7028,
+    7041: Data7041,
+    7042: Data7042,
+    7048: Data7048,
+    7058: Data7058,
+}
 
-    elif dg_type is ResonDatagrams.BEAMFORMEDDATA:
-        datapacket = Data7018(chunk)
 
-    elif dg_type is ResonDatagrams.RAWDETECTDATA:
-        datapacket = Data7027(chunk)
+def register_parser(record_type: int, parser):
+    """Register (or replace) the class, or callable taking the record data, decoding a record type"""
+    datagram_parsers[record_type] = parser
 
-    elif dg_type is ResonDatagrams.SNIPPETDATA:
-        datapacket = Data7028(chunk)
 
-    elif dg_type is ResonDatagrams.BEAMFORMEDCOMPRESSED:
-        datapacket = Data7041(chunk)
+# record classes locating their optional data with the offset of the record frame
+optional_data_parsers = (Data7006, )
 
-    elif dg_type is ResonDatagrams.BEAMDATACALIBRATED:
-        datapacket = Data7048(chunk)
 
-    elif dg_type is ResonDatagrams.SNIPPETBSSTRENGTH:
-        datapacket = Data7058(chunk)
+def parse(chunk: bytes, dg_type, optional_offset: int = None) -> ResonData:
+    """Decode the data section of a record, with dg_type as ResonDatagrams or record type identifier
 
-    else:
-        datapacket = None
+    optional_offset is the position of the optional data in chunk (from the opd_offset of the record frame), if
+    any: it is passed to the records with optional data after a variable layout (optional_data_parsers).
+    """
+    parser = datagram_parsers.get(dg_type.value if isinstance(dg_type, ResonDatagrams) else dg_type)
+    if parser is None:
         logging.error("Unsuported datagram type")
-
-    return datapacket
+        return None
+    if optional_offset is not None and parser in optional_data_parsers:
+        return parser(chunk, optional_offset=optional_offset)
+    return parser(chunk)
+
+
+# the water column records, which can be decimated at decode time
+water_column_records = {
+    ResonDatagrams.WATERCOLUMNGEN: Data7008,
+    ResonDatagrams.BEAMFORMEDDATA: Data7018,
+    ResonDatagrams.BEAMFORMEDCOMPRESSED: Data7041,
+    ResonDatagrams.WATERCOLUMNCOMPRESSED: Data7042,
+}
@@ -0,0 +1,325 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import logging
+import math
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+header_size = 64
+footer_size = 4
+sync_pattern = 65535  # Integer representation of 0x0000FFFF, Reson Sync Pattern
+sync_offset = 4  # Location of the sync pattern in the data record frame
+default_block_size = 64 * 1024 * 1024
+no_ping = 0xFFFFFFFF  # Ping number of the datagrams not related to a ping
+
+# Index sidecar: magic, format version, index item size, source size, source mtime [ns], source fingerprint, count
+sidecar_magic = b'OBSTS7KI'
+sidecar_version = 3
+sidecar_format = '<8s2H2Q32sQ'
+sidecar_header_size = struct.calcsize(sidecar_format)
+fingerprint_size = 64 * 1024
+
+# Data Record Frame header
+header_dtype = np.dtype([('protocol_version', '<u2'), ('offset', '<u2'), ('sync_pattern', '<u4'),
+                         ('size', '<u4'), ('opd_offset', '<u4'), ('opd_identifier', '<u4'),
+                         ('year', '<u2'), ('day', '<u2'), ('seconds', '<f4'), ('hours', 'u1'), ('minutes', 'u1'),
+                         ('record_version', '<u2'), ('record_type', '<u4'), ('device_id', '<u4'),
+                         ('reserved_1', '<u2'), ('system_enumerator', '<u2'), ('reserved_2', '<u4'),
+                         ('flags', '<u2'), ('reserved_3', '<u2'), ('reserved_4', '<u4'),
+                         ('total_fragments', '<u4'), ('fragment_number', '<u4')])
+
+# One entry per datagram, in file order. The time is kept as the raw 7KTIME fields. The record flags are the
+# flags of the data section of the snippet records (7028, bit 0 for 32-bit samples), 0 for the other records.
+index_dtype = np.dtype([('offset', '<u8'), ('size', '<u4'), ('record_type', '<u4'), ('device_id', '<u4'),
+                        ('opd_offset', '<u4'), ('ping_number', '<u4'), ('year', '<u2'), ('day', '<u2'),
+                        ('seconds', '<f4'), ('hours', 'u1'), ('minutes', 'u1'), ('record_flags', '<u4')])
+
+# One entry per datagram, sorted by record type and time. Location and size refer to the data section.
+map_dtype = np.dtype([('location', '<u8'), ('time', '<f8'), ('size', '<u4'), ('opd_offset', '<u4'),
+                      ('record_type', '<u4'), ('device_id', '<u4'), ('ping_number', '<u4'),
+                      ('record_flags', '<u4')])
+
+# Records whose data section starts with the sonar id (u64) followed by the ping number (u32)
+ping_records = np.array([7000, 7006, 7007, 7008, 7010, 7011, 7012, 7018, 7027, 7028, 7041, 7042, 7048, 7057,
+                         7058], dtype=np.uint32)
+ping_number_offset = header_size + 8
+# 7028 flags: after the sonar id, ping number, multi-ping sequence, number of detections, error and control flags
+snippet_record = 7028
+snippet_flags_offset = header_size + 18
+block_overlap = snippet_flags_offset + 4 - 1
+
+
+def dg_seconds(year, day, hour, minute, second):
+    """Convert 7KTIME fields (scalars or arrays) to seconds since 1970-01-01 UTC
+
+    The whole seconds are computed with integer arithmetic and the float seconds are added last, which gives
+    the same value of calendar.timegm(time.strptime(...)) + second, with the sub-second precision kept.
+    """
+    days = (np.asarray(year, dtype=np.int64) - 1970).astype('datetime64[Y]').astype('datetime64[D]') \
+        .astype(np.int64) + np.asarray(day, dtype=np.int64) - 1
+    whole_seconds = days * 86400 + np.asarray(hour, dtype=np.int64) * 3600 + np.asarray(minute, dtype=np.int64) * 60
+    return whole_seconds.astype(np.float64) + np.asarray(second, dtype=np.float64)
+
+
+def dg_time(year, day, hour, minute, second):
+    """Convert 7KTIME fields (scalars or arrays) to milliseconds since 1970-01-01 UTC, as for the cf standard"""
+    return dg_seconds(year, day, hour, minute, second) * 1000
+
+
+def sync_locations(block: np.ndarray) -> np.ndarray:
+    """Return the sorted locations of the sync pattern in a uint8 block, at any byte alignment"""
+    locations = list()
+    for alignment in range(4):
+        num_words = (block.size - alignment) // 4
+        if num_words <= 0:
+            continue
+        words = block[alignment:alignment + 4 * num_words].view('<u4')
+        locations.append(np.flatnonzero(words == sync_pattern) * 4 + alignment)
+
+    if len(locations) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.sort(np.concatenate(locations))
+
+
+def scan_block(block: np.ndarray, block_offset: int, owned_size: int, file_length: int) -> np.ndarray:
+    """Return the plausible datagram headers starting in the first owned_size bytes of a uint8 block
+
+    The block has to extend block_overlap bytes past owned_size (when available) so that the headers
+    starting at its tail are complete, with the ping number that follows them. The headers are validated
+    in bulk on size, record type and footer location, the chain consistency is checked later by
+    select_records.
+    """
+    starts = sync_locations(block) - sync_offset
+    starts = starts[(starts >= 0) & (starts < owned_size) & (starts + header_size <= block.size)]
+
+    if starts.size == 0:
+        return np.empty(0, dtype=index_dtype)
+
+    headers = block[starts[:, np.newaxis] + np.arange(header_size)].view(header_dtype).ravel()
+    valid = (headers['size'] >= header_size + footer_size) \
+        & (block_offset + starts + headers['size'] <= file_length) \
+        & (headers['record_type'] >= 1000) \
+        & (headers['day'] >= 1) & (headers['day'] <= 366) & (headers['hours'] < 24) & (headers['minutes'] < 60) \
+        & ((headers['opd_offset'] == 0) |
+           ((headers['opd_offset'] >= header_size) & (headers['opd_offset'] < headers['size'])))
+
+    return index_headers(block=block, starts=starts[valid], headers=headers[valid], block_offset=block_offset)
+
+
+def index_headers(block: np.ndarray, starts: np.ndarray, headers: np.ndarray, block_offset: int) -> np.ndarray:
+    """Return the index entries of the datagrams with the passed headers, starting at starts in a uint8 block"""
+    index = np.empty(starts.size, dtype=index_dtype)
+    index['offset'] = block_offset + starts
+    for name in index_dtype.names[1:]:
+        if name in ('ping_number', 'record_flags'):
+            continue
+        index[name] = headers[name]
+
+    index['ping_number'] = no_ping
+    has_ping = np.isin(index['record_type'], ping_records) \
+        & (index['size'] >= ping_number_offset + 4 + footer_size) & (starts + ping_number_offset + 4 <= block.size)
+    ping_starts = starts[has_ping] + ping_number_offset
+    index['ping_number'][has_ping] = block[ping_starts[:, np.newaxis] + np.arange(4)].view('<u4').ravel()
+
+    index['record_flags'] = 0
+    has_flags = (index['record_type'] == snippet_record) \
+        & (index['size'] >= snippet_flags_offset + 4 + footer_size) & (starts + snippet_flags_offset + 4 <= block.size)
+    flags_starts = starts[has_flags] + snippet_flags_offset
+    index['record_flags'][has_flags] = block[flags_starts[:, np.newaxis] + np.arange(4)].view('<u4').ravel()
+    return index
+
+
+def _is_in(values: np.ndarray, sorted_set: np.ndarray) -> np.ndarray:
+    if sorted_set.size == 0:
+        return np.zeros(values.size, dtype=bool)
+    found = np.minimum(np.searchsorted(sorted_set, values), sorted_set.size - 1)
+    return sorted_set[found] == values
+
+
+def _resolve_overlaps(kept: np.ndarray, starts: np.ndarray, ends: np.ndarray, score: np.ndarray) -> np.ndarray:
+    """Resolve the overlaps between the kept datagrams (sorted by start) in a single forward pass
+
+    A datagram overlapping the last retained one replaces it only with a better score, so that a dropped
+    datagram does not discard its neighbours. Only the datagrams of the overlapping runs (found with the running
+    maximum of the ends) are walked, and the losers are deleted at once.
+    """
+    if kept.size < 2:
+        return kept
+    kept_starts = starts[kept]
+    kept_ends = ends[kept]
+    overlapping = np.flatnonzero(kept_starts[1:] < np.maximum.accumulate(kept_ends)[:-1]) + 1
+    if overlapping.size == 0:
+        return kept
+
+    kept_score = score[kept]
+    dropped = list()
+    current = -1
+    for n in np.union1d(overlapping - 1, overlapping).tolist():  # the runs, each with its first datagram
+        if current >= 0 and kept_ends[current] > kept_starts[n]:
+            if kept_score[current] >= kept_score[n]:
+                dropped.append(n)
+                continue
+            dropped.append(current)
+        current = n
+    return np.delete(kept, dropped)
+
+
+def select_records(candidates: np.ndarray, file_length: int) -> np.ndarray:
+    """Return the mask of the candidates belonging to the datagram chain
+
+    A datagram is kept when it is chained to the previous or to the next one (or sits at the file start/end).
+    This drops the sync patterns found in the datagram payloads while keeping the records around corrupted
+    stretches. The few remaining overlaps are resolved in favour of the better chained datagram, then the
+    isolated datagrams are accepted only when they fit in the gaps left between the chained ones.
+    """
+    starts = candidates['offset'].astype(np.int64)
+    ends = starts + candidates['size']
+    has_prev = _is_in(starts, np.sort(ends)) | (starts == 0)
+    has_next = _is_in(ends, starts) | (ends == file_length)
+    score = has_prev.astype(np.int8) + has_next
+
+    kept = _resolve_overlaps(np.flatnonzero(score > 0), starts=starts, ends=ends, score=score)
+
+    isolated = np.flatnonzero(score == 0)
+    if isolated.size > 0:
+        following = np.searchsorted(starts[kept], starts[isolated], side='right')
+        prev_end = np.concatenate(([0], ends[kept]))[following]
+        next_start = np.concatenate((starts[kept], [file_length]))[following]
+        isolated = isolated[(prev_end <= starts[isolated]) & (ends[isolated] <= next_start)]
+        kept = _resolve_overlaps(np.union1d(kept, isolated), starts=starts, ends=ends, score=score)
+
+    mask = np.zeros(candidates.size, dtype=bool)
+    mask[kept] = True
+    return mask
+
+
+def scan(read, start: int, stop: int, file_length: int, block_size: int = default_block_size) -> np.ndarray:
+    """Return the candidate headers starting in the [start, stop) byte range, scanned by blocks"""
+    parts = [np.empty(0, dtype=index_dtype)]
+    for block_offset in range(start, stop, block_size):
+        owned_size = min(block_size, stop - block_offset)
+        chunk = read(block_offset, owned_size + block_overlap)
+        block = np.frombuffer(chunk, dtype=np.uint8)
+        parts.append(scan_block(block=block, block_offset=block_offset, owned_size=owned_size,
+                                file_length=file_length))
+    return np.concatenate(parts)
+
+
+def scan_range(path: str, start: int, stop: int, file_length: int, block_size: int = default_block_size) \
+        -> np.ndarray:
+    """Worker entry point: open the file and scan its [start, stop) byte range"""
+    with open(path, 'rb') as fid:
+        def read(location: int, size: int) -> bytes:
+            fid.seek(location, 0)
+            return fid.read(size)
+
+        return scan(read=read, start=start, stop=stop, file_length=file_length, block_size=block_size)
+
+
+def scan_parallel(path: str, file_length: int, workers: int, block_size: int = default_block_size) -> np.ndarray:
+    """Split the file in byte ranges scanned by worker processes, then stitch the candidates
+
+    Each candidate belongs to the range holding its first byte, so that the ranges overlap only by the
+    block_overlap bytes needed to read the headers across the boundaries.
+    """
+    range_size = max(int(math.ceil(file_length / workers)), block_size)
+    starts = list(range(0, file_length, range_size))
+    stops = starts[1:] + [file_length]
+    logger.debug("Mapping %s with %d workers" % (path, len(starts)))
+
+    with ProcessPoolExecutor(max_workers=len(starts)) as executor:
+        parts = list(executor.map(scan_range, [path] * len(starts), starts, stops, [file_length] * len(starts),
+                                  [block_size] * len(starts)))
+
+    candidates = np.concatenate(parts)
+    offsets = candidates['offset']
+    if offsets.size > 1 and not np.all(offsets[1:] > offsets[:-1]):
+        logger.warning("Duplicated or unsorted candidates across the mapped ranges")
+        _, unique = np.unique(offsets, return_index=True)
+        candidates = candidates[unique]
+    return candidates
+
+
+def build_index(read, file_length: int, block_size: int = default_block_size, workers: int = 1,
+                path: str = None) -> np.ndarray:
+    """Scan the file by blocks and return the datagram index in file order
+
+    The read callable returns the bytes (or a buffer) of a given size at a given location. With more than one
+    worker and the file path, the byte ranges are scanned by worker processes: the selection of the datagram
+    chain runs on the stitched candidates, so the index is the same of the serial scan.
+    """
+    if workers > 1 and path is not None and file_length > block_size:
+        candidates = scan_parallel(path=path, file_length=file_length, workers=workers, block_size=block_size)
+    else:
+        candidates = scan(read=read, start=0, stop=file_length, file_length=file_length, block_size=block_size)
+
+    index = candidates[select_records(candidates, file_length=file_length)]
+
+    unindexed = file_length - int(index['size'].sum(dtype=np.int64))
+    if unindexed != 0:
+        logger.warning("Sync pattern misalignment, %d Bytes outside of valid datagrams" % unindexed)
+    return index
+
+
+def source_key(read, file_length: int, file_mtime: int) -> tuple:
+    """Return the key identifying a source file content: size, modification time and head/tail fingerprint"""
+    fingerprint = hashlib.sha256()
+    fingerprint.update(read(0, fingerprint_size))
+    fingerprint.update(read(max(file_length - fingerprint_size, 0), fingerprint_size))
+    return file_length, file_mtime, fingerprint.digest()
+
+
+def save_index(path: Path, index: np.ndarray, key: tuple, magic: bytes = sidecar_magic,
+               version: int = sidecar_version, dtype: np.dtype = index_dtype) -> bool:
+    """Save the index in a sidecar, with the index format (magic, version, dtype) and the source key"""
+    file_length, file_mtime, fingerprint = key
+    header = struct.pack(sidecar_format, magic, version, dtype.itemsize, file_length, file_mtime, fingerprint,
+                         index.size)
+
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        with open(str(tmp_path), 'wb') as fod:
+            fod.write(header)
+            fod.write(np.ascontiguousarray(index, dtype=dtype).tobytes())
+        os.replace(str(tmp_path), str(path))
+    except OSError as e:
+        logger.warning("Unable to save datagram index: %s -> %s" % (path, e))
+        return False
+
+    logger.debug("Datagram index saved: %s" % path)
+    return True
+
+
+def load_index(path: Path, key: tuple, magic: bytes = sidecar_magic, version: int = sidecar_version,
+               dtype: np.dtype = index_dtype):
+    """Return the index stored in the sidecar, or None when missing, stale or of a different format version"""
+    if not path.exists():
+        return None
+
+    try:
+        with open(str(path), 'rb') as fid:
+            header = fid.read(sidecar_header_size)
+            if len(header) != sidecar_header_size:
+                return None
+            file_magic, file_version, item_size, file_length, file_mtime, fingerprint, count = \
+                struct.unpack(sidecar_format, header)
+            if file_magic != magic or file_version != version or item_size != dtype.itemsize:
+                logger.info("Datagram index with unsupported format, ignored: %s" % path)
+                return None
+            if (file_length, file_mtime, fingerprint) != key:
+                logger.info("Datagram index outdated, ignored: %s" % path)
+                return None
+            index = np.fromfile(fid, dtype=dtype, count=count)
+    except OSError as e:
+        logger.warning("Unable to load datagram index: %s -> %s" % (path, e))
+        return None
+
+    if index.size != count:
+        logger.info("Datagram index truncated, ignored: %s" % path)
+        return None
+    return index
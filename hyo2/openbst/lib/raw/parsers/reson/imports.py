@@ -5,20 +5,33 @@ import numpy as np
 from ogr import osr
 
 from hyo2.openbst.lib.nc_helper import NetCDFHelper
-from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams
+from hyo2.openbst.lib.raw.parsers.batch import join_batches
+from hyo2.openbst.lib.raw.parsers.reson.dg_batch import parse_batch, ResonBatch
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonData, ResonDatagrams
 from hyo2.openbst.lib.raw.parsers.reson.reader import Reson
+from hyo2.openbst.lib.raw.snippets import Snippets
 
 logger = logging.getLogger(__name__)
 
 
 class RawImport:
+    """Import of the Reson s7k files
+
+    Each group is created with its layout (create_* methods), then the variables of its records are written at
+    their rows (write_* methods), which are the positions of the records in time order. The groups are either
+    imported one after the other (each reading its records), or all at once with a single walk of the file
+    (single_pass).
+    """
     fill_value = -9999
+    num_beams = 512  # beams of the raw bathymetry arrays
 
     def __init__(self):
         pass
 
     @classmethod
-    def import_raw(cls, raw: Reson, ds: Dataset):
+    def import_raw(cls, raw: Reson, ds: Dataset, single_pass: bool = False):
+        if single_pass:
+            return RawImport.import_raw_single_pass(raw=raw, ds=ds)
 
         imported = RawImport.get_runtime_settings(raw=raw, ds=ds)
         if imported is False:
@@ -50,19 +63,113 @@ class RawImport:
         return imported
 
     @classmethod
-    def get_position(cls, raw: Reson, ds: Dataset):
+    def import_raw_single_pass(cls, raw: Reson, ds: Dataset):
+        """Import the same groups of import_raw, walking the records of all of them once, in file order
+
+        The groups are created up front, with the record counts of the map. The records are decoded by slabs of
+        file order, and each group is written as its records come in. The snippets are appended in time order,
+        holding back the records logged ahead of their predecessors (see snippets_in_row_order). The navigation
+        records (position, attitude and heading) are decoded as they come in too, and their columns are joined
+        and written at the end of the walk (their groups have one row per sample, not per record).
+        """
         raw.is_mapped()
-        lat = list()
-        lon = list()
-
-        position = raw.get_datagram(dg_type=ResonDatagrams.POSITION)
-        times = [dg_pos.time for dg_pos in position]
-        for dg_pos in position:
-            if dg_pos.datum is "WGS":
-                lat.append(dg_pos.latitude * (180 / np.pi))
-                lon.append(dg_pos.longitude * (180 / np.pi))
+        attitude_type = ResonDatagrams.ROLLPITCHHEAVE
+        if raw.get_map(ResonDatagrams.ROLLPITCHHEAVE).size == 0:  # the attitude records (1016) pack many samples
+            attitude_type = ResonDatagrams.ATTITUDE
+
+        groups = {
+            ResonDatagrams.SONARSETTINGS: (RawImport.create_runtime_settings(ds=ds),
+                                           RawImport.write_runtime_settings),
+            ResonDatagrams.RAWDETECTDATA: (RawImport.create_raw_bathy(
+                ds=ds, num_pings=raw.get_map(ResonDatagrams.RAWDETECTDATA).size), RawImport.write_raw_bathy),
+            ResonDatagrams.BEAMGEO: (RawImport.create_beam_geo(ds=ds), RawImport.write_beam_geo),
+            ResonDatagrams.TVG: (RawImport.create_tvg(ds=ds), RawImport.write_tvg),
+            ResonDatagrams.SNIPPETDATA: (RawImport.create_snippets(
+                ds=ds, sample_datatype=RawImport.snippet_datatype(raw=raw)), RawImport.write_snippets),
+        }
+        navigation = {dg_type: list() for dg_type in (ResonDatagrams.POSITION, attitude_type, ResonDatagrams.HEADING)}
+        pending_snippets = dict()
+
+        for dg_type, rows, dg_chunks in raw.sweep(list(groups.keys()) + list(navigation.keys())):
+            if dg_type == ResonDatagrams.SNIPPETDATA:
+                rows, dg_chunks = RawImport.snippets_in_row_order(grp=groups[dg_type][0], rows=rows,
+                                                                  dg_chunks=dg_chunks, pending=pending_snippets)
+                if len(dg_chunks) == 0:
+                    continue
+            batch = parse_batch(dg_type=dg_type, chunks=dg_chunks)
+            if dg_type in navigation:
+                navigation[dg_type].append((rows, batch))
+                continue
+
+            grp, write = groups[dg_type]
+            batch.time = raw.get_map(dg_type)['time'][rows]
+            write(grp=grp, rows=rows, batch=batch)
+
+        batches = dict()
+        for dg_type, parts in navigation.items():
+            if len(parts) > 0:
+                batches[dg_type] = join_batches(parts)
             else:
-                raise AttributeError("unrecognized datum: %s" % dg_pos.datum)
+                batches[dg_type] = parse_batch(dg_type=dg_type, chunks=[])
+            batches[dg_type].time = raw.get_map(dg_type)['time'].copy()
+        RawImport.write_attitude(ds=ds, attitude=batches[attitude_type], heading=batches[ResonDatagrams.HEADING])
+        RawImport.write_position(ds=ds, position=batches[ResonDatagrams.POSITION])
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def create_group(cls, ds: Dataset, name: str, dimensions: dict, variables: dict):
+        """Create a group with its dimensions and its variables, as name -> (datatype, dimensions, fill_value)"""
+        grp = ds.createGroup(name)
+        for dimname, size in dimensions.items():
+            grp.createDimension(dimname=dimname, size=size)
+        for varname, (datatype, var_dimensions, fill_value) in variables.items():
+            grp.createVariable(varname=varname, datatype=datatype, dimensions=var_dimensions, fill_value=fill_value)
+        return grp
+
+    @classmethod
+    def write_rows(cls, grp, rows: np.ndarray, values: dict):
+        """Write the values of the records (along the first dimension) at their rows
+
+        The values can be shorter than the variable along the other dimensions.
+        """
+        order = np.argsort(rows, kind='stable')
+        rows = rows[order]
+        if rows.size == 0:
+            return
+        if rows[-1] - rows[0] + 1 == rows.size:
+            index = slice(int(rows[0]), int(rows[-1]) + 1)
+        else:
+            index = rows
+
+        for name, value in values.items():
+            value = np.asarray(value)[order]
+            grp.variables[name][(index,) + tuple(slice(0, size) for size in value.shape[1:])] = value
+
+    @classmethod
+    def write_vlen(cls, var, rows: np.ndarray, offsets: np.ndarray, values: np.ndarray):
+        """Write the ragged values of each record (values[offsets[n]:offsets[n + 1]]) at its row"""
+        for n, row in enumerate(rows.tolist()):
+            var[row] = values[offsets[n]:offsets[n + 1]]
+
+    @classmethod
+    def get_position(cls, raw: Reson, ds: Dataset):
+        raw.is_mapped()
+
+        position = raw.get_batch(dg_type=ResonDatagrams.POSITION)
+        RawImport.write_position(ds=ds, position=position)
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
+
+    @classmethod
+    def write_position(cls, ds: Dataset, position: ResonBatch):
+        times = position.time
+        if np.any(position['datum'] != 0):  # 0: WGS84
+            raise AttributeError("unrecognized datum: %s" % position['datum'][position['datum'] != 0][0])
+        lat = np.rad2deg(position['latitude'])
+        lon = np.rad2deg(position['longitude'])
 
         grp_pos = ds.createGroup("position")
         grp_pos.createDimension(dimname="time", size=None)
@@ -76,24 +183,33 @@ class RawImport:
         var_lat[:] = lat
         var_lon = grp_pos.createVariable(varname="longitude", datatype="f8", dimensions=("time",))
         var_lon[:] = lon
-
-        NetCDFHelper.update_modified(ds=ds)
-        return True
         # TODO: Write spatial reference check and formatter
 
     @classmethod
     def get_attitude(cls, raw: Reson, ds: Dataset):
         raw.is_mapped()
 
-        attitude = raw.get_datagram(dg_type=ResonDatagrams.ROLLPITCHHEAVE)
-        times_rph = [dg_att.time for dg_att in attitude]
-        roll = np.rad2deg([dg_att.roll for dg_att in attitude])
-        pitch = np.rad2deg([dg_att.pitch for dg_att in attitude])
-        heave = np.rad2deg([dg_att.heave for dg_att in attitude])
+        attitude = raw.get_batch(dg_type=ResonDatagrams.ROLLPITCHHEAVE)
+        if len(attitude) == 0:  # the attitude records (1016) pack many samples
+            attitude = raw.get_batch(dg_type=ResonDatagrams.ATTITUDE)
+        heading = raw.get_batch(dg_type=ResonDatagrams.HEADING)
+        RawImport.write_attitude(ds=ds, attitude=attitude, heading=heading)
+
+        NetCDFHelper.update_modified(ds=ds)
+        return True
 
-        heading = raw.get_datagram(dg_type=ResonDatagrams.HEADING)
-        times_head = [dg_head.time for dg_head in heading]
-        head = np.rad2deg([dg_head.heading for dg_head in heading])
+    @classmethod
+    def write_attitude(cls, ds: Dataset, attitude: ResonBatch, heading: ResonBatch):
+        if attitude.dg_type is ResonDatagrams.ATTITUDE:
+            times_rph = attitude.sample_time()
+        else:
+            times_rph = attitude.time
+        roll = np.rad2deg(attitude['roll'])
+        pitch = np.rad2deg(attitude['pitch'])
+        heave = np.rad2deg(attitude['heave'])
+
+        times_head = heading.time
+        head = np.rad2deg(heading['heading'])
 
         grp_attitude = ds.createGroup("attitude")
         grp_attitude.units = "arc-degree"
@@ -113,339 +229,228 @@ class RawImport:
         var_heading = grp_attitude.createVariable(varname="heading", datatype="f8", dimensions=("time",))
         var_heading[:] = head
 
-        NetCDFHelper.update_modified(ds=ds)
-        return True
-
     @classmethod
     def get_tvg(cls, raw: Reson, ds: Dataset):
         raw.is_mapped()
 
-        tvg = raw.get_datagram(dg_type=ResonDatagrams.TVG)
-        times_tvg = [dg_tvg.time for dg_tvg in tvg]
+        tvg = raw.get_batch(dg_type=ResonDatagrams.TVG)
+        grp_tvg = RawImport.create_tvg(ds=ds)
+        RawImport.write_tvg(grp=grp_tvg, rows=np.arange(len(tvg)), batch=tvg)
 
-        grp_tvg = ds.createGroup("time_varying_gain")
-        grp_tvg.createDimension(dimname="ping", size=None)
+        NetCDFHelper.update_modified(ds=ds)
+        return True
 
-        var_time = grp_tvg.createVariable(varname="time", datatype="f8", dimensions=("ping",))
-        var_time[:] = times_tvg
+    @classmethod
+    def create_tvg(cls, ds: Dataset):
+        grp_tvg = RawImport.create_group(ds=ds, name="time_varying_gain", dimensions={"ping": None},
+                                         variables={"time": ("f8", ("ping",), None)})
         vlen_tvg = grp_tvg.createVLType(datatype="f4", datatype_name="tvg_variable_length")
-        var_tvg = grp_tvg.createVariable(varname="tvg", datatype=vlen_tvg, dimensions=("ping",))
-        for ping in range(len(tvg)):
-            tvg_curve = np.asarray(tvg[ping].tvg_curve, dtype="f4")
-            var_tvg[ping] = tvg_curve
+        grp_tvg.createVariable(varname="tvg", datatype=vlen_tvg, dimensions=("ping",))
+        return grp_tvg
 
-        NetCDFHelper.update_modified(ds=ds)
-        return True
+    @classmethod
+    def write_tvg(cls, grp, rows: np.ndarray, batch: ResonBatch):
+        RawImport.write_rows(grp=grp, rows=rows, values={"time": batch.time})
+        RawImport.write_vlen(var=grp.variables["tvg"], rows=rows, offsets=batch.offsets,
+                             values=batch['tvg_curve'].astype("f4"))
 
     @classmethod
     def get_beam_geo(cls, raw: Reson, ds: Dataset):
         raw.is_mapped()
 
-        beam_geo = raw.get_datagram(dg_type=ResonDatagrams.BEAMGEO)
-        num_beams = beam_geo[0].num_beams_max
-        beam_angle_along = np.empty(shape=(len(beam_geo), num_beams))
-        beam_angle_across = np.empty(shape=(len(beam_geo), num_beams))
-        beam_width_along = np.empty(shape=(len(beam_geo), num_beams))
-        beam_width_across = np.empty(shape=(len(beam_geo), num_beams))
-        times_beam_geo = [dg_beam_geo.time for dg_beam_geo in beam_geo]
-
-        for index, dg_beam_geo in enumerate(beam_geo):
-            beam_index = [range(dg_beam_geo.num_rx_beams)]
+        beam_geo = raw.get_batch(dg_type=ResonDatagrams.BEAMGEO)
+        grp_beam_geo = RawImport.create_beam_geo(ds=ds)
+        RawImport.write_beam_geo(grp=grp_beam_geo, rows=np.arange(len(beam_geo)), batch=beam_geo)
 
-            beam_angle_along[index, beam_index] = np.rad2deg(dg_beam_geo.rx_angle_vertical)
-            beam_angle_across[index, beam_index] = np.rad2deg(dg_beam_geo.rx_angle_horizontal)
-            beam_width_along[index, beam_index] = np.rad2deg(dg_beam_geo.rx_beam_width_along)
-            beam_width_across[index, beam_index] = np.rad2deg(dg_beam_geo.rx_beam_width_across)
-
-        grp_beam_geo = ds.createGroup("beam_geometry")
-        grp_beam_geo.createDimension(dimname="ping", size=None)
-        grp_beam_geo.createDimension(dimname="beam_number", size=num_beams)
-
-        var_time = grp_beam_geo.createVariable(varname="time", datatype="f8", dimensions=("ping",))
-        var_time[:] = times_beam_geo
-
-        var_beam_number = grp_beam_geo.createVariable(varname="beam_number", datatype="i4", dimensions=("beam_number",))
-        var_beam_number[:] = [range(num_beams)]
+        NetCDFHelper.update_modified(ds=ds)
+        return True
 
-        var_beam_angle_along = \
-            grp_beam_geo.createVariable(varname="beam_along_angle", datatype="f4", dimensions=("ping", "beam_number"))
-        var_beam_angle_along[:] = beam_angle_along
+    @classmethod
+    def create_beam_geo(cls, ds: Dataset):
+        num_beams = ResonData.num_beams_max
+        variables = {"time": ("f8", ("ping",), None), "beam_number": ("i4", ("beam_number",), None)}
+        for name in ("beam_along_angle", "beam_across_angle", "along_beamwdith", "across_beamwidth"):
+            variables[name] = ("f4", ("ping", "beam_number"), None)
+        grp_beam_geo = RawImport.create_group(ds=ds, name="beam_geometry",
+                                              dimensions={"ping": None, "beam_number": num_beams},
+                                              variables=variables)
+        grp_beam_geo.variables["beam_number"][:] = [range(num_beams)]
+        return grp_beam_geo
 
-        var_beam_angle_across = \
-            grp_beam_geo.createVariable(varname="beam_across_angle", datatype="f4", dimensions=("ping", "beam_number"))
-        var_beam_angle_across[:] = beam_angle_across
+    @classmethod
+    def write_beam_geo(cls, grp, rows: np.ndarray, batch: ResonBatch):
+        num_beams = ResonData.num_beams_max
+
+        def to_beams(name: str) -> np.ndarray:
+            values = np.full((len(batch), num_beams), np.nan)
+            values[:, :batch[name].shape[1]] = np.rad2deg(batch[name])
+            return values
+
+        RawImport.write_rows(grp=grp, rows=rows, values={
+            "time": batch.time,
+            "beam_along_angle": to_beams('rx_angle_vertical'),
+            "beam_across_angle": to_beams('rx_angle_horizontal'),
+            "along_beamwdith": to_beams('rx_beam_width_along'),
+            "across_beamwidth": to_beams('rx_beam_width_across'),
+        })
 
-        var_beam_width_along = \
-            grp_beam_geo.createVariable(varname="along_beamwdith", datatype="f4", dimensions=("ping", "beam_number"))
-        var_beam_width_along[:] = beam_width_along
+    @classmethod
+    def get_raw_bathy(cls, raw: Reson, ds: Dataset):
+        raw.is_mapped()
 
-        var_beam_width_across = \
-            grp_beam_geo.createVariable(varname="across_beamwidth", datatype="f4", dimensions=("ping", "beam_number"))
-        var_beam_width_across[:] = beam_width_across
+        raw_bathy = raw.get_batch(dg_type=ResonDatagrams.RAWDETECTDATA)
+        grp_bathy = RawImport.create_raw_bathy(ds=ds, num_pings=len(raw_bathy))
+        RawImport.write_raw_bathy(grp=grp_bathy, rows=np.arange(len(raw_bathy)), batch=raw_bathy)
 
         NetCDFHelper.update_modified(ds=ds)
         return True
 
     @classmethod
-    def get_raw_bathy(cls, raw: Reson, ds: Dataset):
-        raw.is_mapped()
+    def create_raw_bathy(cls, ds: Dataset, num_pings: int):
+        variables = {"time": ("f8", ("ping",), RawImport.fill_value),
+                     "beam_number": ("i4", ("beam_number",), RawImport.fill_value)}
+        for name in ("sample_rate", "tx_steering", "rx_steering"):
+            variables[name] = ("f8", ("ping",), RawImport.fill_value)
+        for name in ("detect_point", "rx_angle", "quality", "bs_beam_average", "min_sample_gate", "max sample gate"):
+            variables[name] = ("f8", ("ping", "beam_number"), RawImport.fill_value)
+        grp_bathy = RawImport.create_group(ds=ds, name="raw_bathymetry_data",
+                                           dimensions={"ping": num_pings, "beam_number": RawImport.num_beams},
+                                           variables=variables)
+        grp_bathy.variables["beam_number"][:] = [range(RawImport.num_beams)]
+        return grp_bathy
 
-        raw_bathy = raw.get_datagram(dg_type=ResonDatagrams.RAWDETECTDATA)
-        times_bathy = [dg_raw_bathy.time for dg_raw_bathy in raw_bathy]
-        samp_rate = [dg_raw_bathy.sample_rate for dg_raw_bathy in raw_bathy]
-        tx_steering = [dg_raw_bathy.tx_steering_angle for dg_raw_bathy in raw_bathy]
-        rx_steering = [dg_raw_bathy.rx_steering_angle for dg_raw_bathy in raw_bathy]
-
-        num_beams = 512
-        num_pings = len(raw_bathy)
-        detect_point = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-        rx_angle = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-        quality = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-        bs_beam_average = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-        bs_beam_min_gate = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-        bs_beam_max_gate = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-
-        for index, dg_raw_bathy in enumerate(raw_bathy):
-            beam_num = dg_raw_bathy.beam
-            detect_point[index, beam_num] = dg_raw_bathy.detect_point
-            rx_angle[index, beam_num] = dg_raw_bathy.rx_angle
-            quality[index, beam_num] = dg_raw_bathy.quality_flag
-            bs_beam_average[index, beam_num] = dg_raw_bathy.signal_strength
-            bs_beam_min_gate[index, beam_num] = dg_raw_bathy.min_limit
-            bs_beam_max_gate[index, beam_num] = dg_raw_bathy.max_limit
-
-        grp_bathy = ds.createGroup("raw_bathymetry_data")
-        grp_bathy.createDimension(dimname="ping", size=num_pings)
-        grp_bathy.createDimension(dimname="beam_number", size=num_beams)
-
-        var_time = grp_bathy.createVariable(varname="time",
-                                            datatype="f8",
-                                            dimensions=("ping",),
-                                            fill_value=RawImport.fill_value)
-        var_time[:] = times_bathy
-
-        var_beam_number = grp_bathy.createVariable(varname="beam_number",
-                                                   datatype="i4",
-                                                   dimensions=("beam_number",),
-                                                   fill_value=RawImport.fill_value)
-        var_beam_number[:] = [range(num_beams)]
-
-        var_samp_rate = grp_bathy.createVariable(varname="sample_rate",
-                                                 datatype="f8",
-                                                 dimensions=("ping",),
-                                                 fill_value=RawImport.fill_value)
-        var_samp_rate[:] = samp_rate
-
-        var_tx_steering = grp_bathy.createVariable(varname="tx_steering",
-                                                   datatype="f8",
-                                                   dimensions=("ping",),
-                                                   fill_value=RawImport.fill_value)
-        var_tx_steering[:] = tx_steering
-
-        var_rx_steering = grp_bathy.createVariable(varname="rx_steering",
-                                                   datatype="f8",
-                                                   dimensions=("ping",),
-                                                   fill_value=RawImport.fill_value)
-        var_rx_steering[:] = rx_steering
-
-        var_detect_point = grp_bathy.createVariable(varname="detect_point",
-                                                    datatype="f8",
-                                                    dimensions=("ping", "beam_number"),
-                                                    fill_value=RawImport.fill_value)
-        var_detect_point[:] = detect_point
-        var_rx_angle = grp_bathy.createVariable(varname="rx_angle",
-                                                datatype="f8",
-                                                dimensions=("ping", "beam_number"),
-                                                fill_value=RawImport.fill_value)
-        var_rx_angle[:] = detect_point
-
-        var_quality = grp_bathy.createVariable(varname="quality",
-                                               datatype="f8",
-                                               dimensions=("ping", "beam_number"),
-                                               fill_value=RawImport.fill_value)
-        var_quality[:] = quality
-
-        var_beam_average = grp_bathy.createVariable(varname="bs_beam_average",
-                                                    datatype="f8",
-                                                    dimensions=("ping", "beam_number"),
-                                                    fill_value=RawImport.fill_value)
-        var_beam_average[:] = bs_beam_average
-
-        var_min_gate = grp_bathy.createVariable(varname="min_sample_gate",
-                                                datatype="f8",
-                                                dimensions=("ping", "beam_number"),
-                                                fill_value=RawImport.fill_value)
-        var_min_gate[:] = bs_beam_min_gate
-
-        var_max_gate = grp_bathy.createVariable(varname="max sample gate",
-                                                datatype="f8",
-                                                dimensions=("ping", "beam_number"),
-                                                fill_value=RawImport.fill_value)
-        var_max_gate[:] = bs_beam_max_gate
+    @classmethod
+    def write_raw_bathy(cls, grp, rows: np.ndarray, batch: ResonBatch):
+        num_beams = RawImport.num_beams
+        values = {
+            "time": batch.time,
+            "sample_rate": batch['sample_rate'],
+            "tx_steering": batch['tx_steering_angle'],
+            "rx_steering": batch['rx_steering_angle'],
+            "detect_point": batch.to_beams('detect_point', num_beams=num_beams, fill_value=RawImport.fill_value),
+            "rx_angle": batch.to_beams('rx_angle', num_beams=num_beams, fill_value=RawImport.fill_value),
+            "quality": batch.to_beams('quality_flag', num_beams=num_beams, fill_value=RawImport.fill_value),
+        }
+
+        # the backscatter fields are only present in the 26- and 34-byte data fields
+        for varname, name in (("bs_beam_average", 'signal_strength'), ("min_sample_gate", 'min_limit'),
+                              ("max sample gate", 'max_limit')):
+            if name in batch.data:
+                values[varname] = batch.to_beams(name, num_beams=num_beams, fill_value=RawImport.fill_value)
+            else:
+                values[varname] = np.ones(shape=(len(batch), num_beams)) * RawImport.fill_value
 
-        NetCDFHelper.update_modified(ds=ds)
-        return True
+        RawImport.write_rows(grp=grp, rows=rows, values=values)
 
     @classmethod
     def get_snippets(cls, raw: Reson, ds: Dataset):
         raw.is_mapped()
 
-        snippets = raw.get_datagram(dg_type=ResonDatagrams.SNIPPETDATA)
-        snippet_len = max([len(dg_snippets.snippet) for dg_snippets in snippets])
-        num_beams = snippets[0].num_beams_max
-        num_pings = len(snippets)
-
-        detect_sample = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-        snippet_sample_start = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-        snippet_sample_end = np.ones(shape=(num_pings, num_beams)) * RawImport.fill_value
-        snippet_data = np.ones(shape=(num_pings, num_beams, snippet_len)) * RawImport.fill_value
-        beam_index = list()
-        times_snippets = [dg_snippets.time for dg_snippets in snippets]
-        for ping, dg_snippets in enumerate(snippets):                           # TODO: Faster code then for loop
-            beam_index.append(dg_snippets.beam_number)
-            detect_sample[ping, dg_snippets.beam_number] = dg_snippets.bottom_detect_sample
-            snippet_sample_start[ping, dg_snippets.beam_number] = dg_snippets.snippet_start_sample
-            snippet_sample_end[ping, dg_snippets.beam_number] = dg_snippets.snippet_end_sample
-            for n, beam in enumerate(dg_snippets.beam_number):
-                snippet_size = len(dg_snippets.snippet[n])
-                snippet_data[ping, beam, [range(snippet_size)]] = np.asarray(dg_snippets.snippet[n])
-
-        grp_snippet = ds.createGroup("snippets")
-        grp_snippet.createDimension(dimname="ping", size=None)
-        grp_snippet.createDimension(dimname="beam_number", size=num_beams)
-        grp_snippet.createDimension(dimname="sample", size=None)
-
-        var_time = grp_snippet.createVariable(varname="time", datatype="f8", dimensions=("ping",))
-        var_time[:] = times_snippets
-
-        var_detect_sample = grp_snippet.createVariable(varname="detect_sample",
-                                                       datatype="f8",
-                                                       dimensions=("ping", "beam_number"),
-                                                       fill_value=RawImport.fill_value)
-        var_detect_sample[:] = detect_sample
-
-        var_snippet_start = grp_snippet.createVariable(varname="snippet_start_sample",
-                                                       datatype="f8",
-                                                       dimensions=("ping", "beam_number"),
-                                                       fill_value=RawImport.fill_value)
-        var_snippet_start[:] = snippet_sample_start
-
-        var_snippet_end = grp_snippet.createVariable(varname="snippet_end_sample",
-                                                     datatype="f8",
-                                                     dimensions=("ping", "beam_number", ),
-                                                     fill_value=RawImport.fill_value)
-        var_snippet_end[:] = snippet_sample_end
-
-        vlen_beam = grp_snippet.createVLType(datatype="i4", datatype_name="beam_index_vlen")
-        var_beam = grp_snippet.createVariable(varname="beam_index", datatype=vlen_beam, dimensions=("ping",))
-        for ping, dg_snippets in enumerate(snippets):
-            var_beam[ping] = np.asarray(dg_snippets.beam_number)
-
-        var_snippet = grp_snippet.createVariable(varname="snippets",
-                                                 datatype="f8",
-                                                 dimensions=("ping", "beam_number", "sample"),
-                                                 fill_value=RawImport.fill_value)
-        var_snippet[:] = snippet_data
+        grp_snippet = RawImport.create_snippets(ds=ds, sample_datatype=RawImport.snippet_datatype(raw=raw))
+        # streamed by slabs of records, the samples are never held for the whole file
+        pending = dict()
+        for dg_type, rows, dg_chunks in raw.sweep([ResonDatagrams.SNIPPETDATA, ]):
+            rows, dg_chunks = RawImport.snippets_in_row_order(grp=grp_snippet, rows=rows, dg_chunks=dg_chunks,
+                                                              pending=pending)
+            if len(dg_chunks) == 0:
+                continue
+            snippets = parse_batch(dg_type=dg_type, chunks=dg_chunks)
+            snippets.time = raw.get_map(dg_type)['time'][rows]
+            RawImport.write_snippets(grp=grp_snippet, rows=rows, batch=snippets)
 
         NetCDFHelper.update_modified(ds=ds)
         return True
 
     @classmethod
-    def get_runtime_settings(cls, raw: Reson, ds: Dataset):
-        raw.is_mapped()
-
-        runtime = raw.get_datagram(dg_type=ResonDatagrams.SONARSETTINGS)
-        times_runtime = [dg_runtime.time for dg_runtime in runtime]
-        frequency = [dg_runtime.frequency for dg_runtime in runtime]
-        sample_rate = [dg_runtime.sample_rate for dg_runtime in runtime]
-        rx_band_width = [dg_runtime.rx_band_width for dg_runtime in runtime]
-        tx_pulse_width = [dg_runtime.tx_pulse_width for dg_runtime in runtime]
-        tx_wave_form = [dg_runtime.tx_wave_form for dg_runtime in runtime]
-        source_level = [dg_runtime.power_select for dg_runtime in runtime]
-        static_gain = [dg_runtime.gain_select for dg_runtime in runtime]
-        tx_along_steering = [np.rad2deg(dg_runtime.tx_beam_steering_vertical) for dg_runtime in runtime]
-        tx_across_steering = [np.rad2deg(dg_runtime.tx_beam_steering_horizontal) for dg_runtime in runtime]
-        tx_along_beam_width = [np.rad2deg(dg_runtime.tx_beam_width_vertical) for dg_runtime in runtime]
-        tx_across_beam_width = [np.rad2deg(dg_runtime.tx_beam_width_horizontal) for dg_runtime in runtime]
-        tx_focus = [dg_runtime.tx_focus for dg_runtime in runtime]
-        stabilization_roll = [int(dg_runtime.stabilization_roll) for dg_runtime in runtime]
-        stabilization_pitch = [int(dg_runtime.stabilization_pitch) for dg_runtime in runtime]
-        stabilization_yaw = [int(dg_runtime.stabilization_yaw) for dg_runtime in runtime]
-        rx_beam_width = [np.rad2deg(dg_runtime.rx_beam_width) for dg_runtime in runtime]
-        absorption_gain = [dg_runtime.absorption for dg_runtime in runtime]
-        sound_velocity = [dg_runtime.sound_velocity for dg_runtime in runtime]
-        spreading_gain = [dg_runtime.spreading for dg_runtime in runtime]
-
-        grp_runtime = ds.createGroup("runtime_settings")
-        grp_runtime.createDimension(dimname="ping", size=None)
-
-        var_time = grp_runtime.createVariable(varname="time", datatype="f8", dimensions=("ping",))
-        var_time[:] = times_runtime
-
-        var_frequency = grp_runtime.createVariable(varname="frequency", datatype="f8", dimensions=("ping",))
-        var_frequency[:] = frequency
-
-        var_sample_rate = grp_runtime.createVariable(varname="sample_rate", datatype="f8", dimensions=("ping",))
-        var_sample_rate[:] = sample_rate
-
-        var_rx_band_width = grp_runtime.createVariable(varname="rx_band_width", datatype="f8", dimensions=("ping",))
-        var_rx_band_width[:] = rx_band_width
-
-        var_tx_pulse_width = grp_runtime.createVariable(varname="tx_pulse_width", datatype="f8", dimensions=("ping",))
-        var_tx_pulse_width[:] = tx_pulse_width
-
-        var_tx_wave_form = grp_runtime.createVariable(varname="tx_wave_form", datatype="S1", dimensions=("ping",))
-        var_tx_wave_form[:] = tx_wave_form
-
-        var_source_level = grp_runtime.createVariable(varname="source_level", datatype="f8", dimensions=("ping",))
-        var_source_level[:] = source_level
-
-        var_static_gain = grp_runtime.createVariable(varname="static_gain", datatype="f8", dimensions=("ping",))
-        var_static_gain[:] = static_gain
-
-        var_tx_along_steering = grp_runtime.createVariable(varname="tx_along_steering",
-                                                           datatype="f8",
-                                                           dimensions=("ping",))
-        var_tx_along_steering[:] = tx_along_steering
-
-        var_tx_across_steering = grp_runtime.createVariable(varname="tx_across_steering",
-                                                            datatype="f8",
-                                                            dimensions=("ping",))
-        var_tx_across_steering[:] = tx_across_steering
-
-        var_along_beam_width = grp_runtime.createVariable(varname="tx_along_beam_width",
-                                                          datatype="f8",
-                                                          dimensions=("ping",))
-        var_along_beam_width[:] = tx_along_beam_width
-
-        var_tx_across_beam_width = grp_runtime.createVariable(varname="tx_across_beam_width",
-                                                              datatype="f8",
-                                                              dimensions=("ping",))
-        var_tx_across_beam_width[:] = tx_across_beam_width
-
-        var_focus = grp_runtime.createVariable(varname="focus", datatype="f8", dimensions=("ping",))
-        var_focus[:] = tx_focus
-
-        var_stab_roll = grp_runtime.createVariable(varname="roll_stabilization", datatype="i4", dimensions=("ping",))
-        var_stab_roll[:] = stabilization_roll
-
-        var_stab_pitch = grp_runtime.createVariable(varname="pitch_stabilization", datatype="i4", dimensions=("ping",))
-        var_stab_pitch[:] = stabilization_pitch
+    def snippets_in_row_order(cls, grp, rows: np.ndarray, dg_chunks: list, pending: dict) -> tuple:
+        """Return the rows (and their chunks) that follow the written snippets, from the passed and pending records
+
+        The snippets are appended in time order (the rows of the map), so a record logged ahead of its predecessors
+        is copied into pending (row -> bytes) until they are written; in a file in time order, nothing is held.
+        """
+        next_row = len(grp.dimensions["ping"])
+        records = dict(zip(rows.tolist(), dg_chunks))
+        ready = list()
+        while True:
+            if next_row + len(ready) in records:
+                ready.append(records.pop(next_row + len(ready)))
+            elif next_row + len(ready) in pending:
+                ready.append(pending.pop(next_row + len(ready)))
+            else:
+                break
+        for row, chunk in records.items():
+            pending[row] = bytes(chunk)
+        return np.arange(next_row, next_row + len(ready)), ready
 
-        var_stab_yaw = grp_runtime.createVariable(varname="yaw_stabilization", datatype="i4", dimensions=("ping",))
-        var_stab_yaw[:] = stabilization_yaw
+    @classmethod
+    def snippet_datatype(cls, raw: Reson) -> str:
+        """Return the datatype of the snippet samples, u4 if any record has 32-bit samples (from the map)"""
+        flags = raw.get_map(ResonDatagrams.SNIPPETDATA)['record_flags']
+        return "u4" if np.any(flags & 0x01) else "u2"  # flags bit 0: 32-bit samples
 
-        var_rx_beam_width = grp_runtime.createVariable(varname="rx_beam_width", datatype="f8", dimensions=("ping",))
-        var_rx_beam_width[:] = rx_beam_width
+    @classmethod
+    def create_snippets(cls, ds: Dataset, sample_datatype: str):
+        return Snippets.create(ds=ds, sample_datatype=sample_datatype)
 
-        var_absorp = grp_runtime.createVariable(varname="absorption_gain", datatype="f8", dimensions=("ping",))
-        var_absorp[:] = absorption_gain
+    @classmethod
+    def write_snippets(cls, grp, rows: np.ndarray, batch: ResonBatch):
+        if rows.size > 0 and rows[0] != len(grp.dimensions["ping"]):
+            raise RuntimeError("snippets of row %d written after %d pings" % (rows[0], len(grp.dimensions["ping"])))
+        Snippets.write(grp=grp, time=batch.time, snippet_offsets=batch.offsets,
+                       beam_index=batch['beam_number'],
+                       fields={"detect_sample": batch['bottom_detect_sample'],
+                               "snippet_start_sample": batch['snippet_start_sample'],
+                               "snippet_end_sample": batch['snippet_end_sample']},
+                       sample_offsets=batch.sample_offsets, samples=batch['samples'])
 
-        var_sound_velocity = grp_runtime.createVariable(varname="sound_velocity", datatype="f8", dimensions=("ping",))
-        var_sound_velocity[:] = sound_velocity
+    @classmethod
+    def get_runtime_settings(cls, raw: Reson, ds: Dataset):
+        raw.is_mapped()
 
-        var_spreading_gain = grp_runtime.createVariable(varname="spreading_gain", datatype="f8", dimensions=("ping",))
-        var_spreading_gain[:] = spreading_gain
+        runtime = raw.get_batch(dg_type=ResonDatagrams.SONARSETTINGS)
+        grp_runtime = RawImport.create_runtime_settings(ds=ds)
+        RawImport.write_runtime_settings(grp=grp_runtime, rows=np.arange(len(runtime)), batch=runtime)
 
         NetCDFHelper.update_modified(ds=ds)
         return True
+
+    @classmethod
+    def create_runtime_settings(cls, ds: Dataset):
+        variables = dict()
+        for name in ("time", "frequency", "sample_rate", "rx_band_width", "tx_pulse_width", "tx_wave_form",
+                     "source_level", "static_gain", "tx_along_steering", "tx_across_steering", "tx_along_beam_width",
+                     "tx_across_beam_width", "focus", "roll_stabilization", "pitch_stabilization",
+                     "yaw_stabilization", "rx_beam_width", "absorption_gain", "sound_velocity", "spreading_gain"):
+            if name == "tx_wave_form":
+                variables[name] = ("S1", ("ping",), None)
+            elif name.endswith("_stabilization"):
+                variables[name] = ("i4", ("ping",), None)
+            else:
+                variables[name] = ("f8", ("ping",), None)
+        return RawImport.create_group(ds=ds, name="runtime_settings", dimensions={"ping": None},
+                                      variables=variables)
+
+    @classmethod
+    def write_runtime_settings(cls, grp, rows: np.ndarray, batch: ResonBatch):
+        RawImport.write_rows(grp=grp, rows=rows, values={
+            "time": batch.time,
+            "frequency": batch['frequency'],
+            "sample_rate": batch['sample_rate'],
+            "rx_band_width": batch['rx_band_width'],
+            "tx_pulse_width": batch['tx_pulse_width'],
+            "tx_wave_form": np.where(batch['tx_pulse_type'] == 0, "CW", "LFM"),
+            "source_level": batch['power_select'],
+            "static_gain": batch['gain_select'],
+            "tx_along_steering": np.rad2deg(batch['tx_beam_steering_vertical']),
+            "tx_across_steering": np.rad2deg(batch['tx_beam_steering_horizontal']),
+            "tx_along_beam_width": np.rad2deg(batch['tx_beam_width_vertical']),
+            "tx_across_beam_width": np.rad2deg(batch['tx_beam_width_horizontal']),
+            "focus": batch['tx_focus'],
+            "roll_stabilization": (batch['rx_flag'] & 0x01).astype(np.int32),  # rx flags bit 0: roll compensation
+            "pitch_stabilization": np.zeros(len(batch), dtype=np.int32),  # not supported by the 7k format
+            "yaw_stabilization": np.zeros(len(batch), dtype=np.int32),
+            "rx_beam_width": np.rad2deg(batch['rx_beam_width']),
+            "absorption_gain": batch['absorption'],
+            "sound_velocity": batch['sound_velocity'],
+            "spreading_gain": batch['spreading'],
+        })
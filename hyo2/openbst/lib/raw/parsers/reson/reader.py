@@ -1,35 +1,43 @@
-import calendar
+import itertools
 import logging
 import os
-import struct
-import time
 
 import numpy as np
 from pathlib import Path
-from hyo2.openbst.lib.raw.parsers.reson.dg_formats import parse, ResonDatagrams, reson_datagram_code
+from hyo2.openbst.lib.raw.parsers.record_reader import RecordReader
+from hyo2.openbst.lib.raw.parsers.reson import dg_demux, dg_index
+from hyo2.openbst.lib.raw.parsers.reson.dg_batch import fixed_size_records, parse_batch, ResonBatch, SettingsEpochs
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import parse, ResonDatagrams, reson_datagram_code, \
+    water_column_records
 
 logger = logging.getLogger(__name__)
 
 
-class Reson:
+class Reson(RecordReader):
+
+    def __init__(self, input_path: Path, use_mmap: bool = False, index_path: Path = None, workers: int = 1):
+        super().__init__(use_mmap=use_mmap)
 
-    def __init__(self, input_path: Path):
         # Object attributes
         self._valid = False
         self.data = None
         self.map = None
+        self.map_types = dict()
+        self.index = None
         self.mapped = False
-        self.file = None
+        self.index_path = index_path
+        self.workers = workers  # number of processes mapping the file
 
         # File attributes
         self._header_size = 64  # TODO: Verify if this is proper use of leading '_'. These are special private variables
         self._header_format = '<2H4I2Hf2BH2I2HI2H3I'
         self._footer_size = 4
-        self._reson_sync_patt = 65535  # Integer representation of 0x0000FFFF, Reson Sync Pattern
+        self._reson_sync_patt = dg_index.sync_pattern
         self.format_type = None
-        self.file_length = None
         self.file_location = None
         self.file_end = False
+        self.block_size = dg_index.default_block_size
+        self.iter_chunk_size = 4096  # number of index entries handled at once while iterating
 
         # Call initializing methods
         self.check_file(input_path)
@@ -45,9 +53,7 @@ class Reson:
         valid_formats = ['s7k', ]
         try:                            # TODO: Write warning for 7k type and skip processing file
             if self.format_type in valid_formats:
-                self.file = file_path.open(mode='rb')
-                self.file.seek(0)
-                self.file_length = os.stat(self.file.name).st_size
+                self.open_file(file_path)
                 self.file_location = self.file.tell()
                 self._valid = True
             else:
@@ -59,118 +65,341 @@ class Reson:
         return self._valid
 
     def data_map(self, force=False):
-        if self.mapped is True or force is True:
+        """Map the datagrams in the file
+
+        The index is loaded from the sidecar at index_path, when present and matching the file, unless forced.
+        """
+        if self.mapped is True and force is False:
             dg_map = self.map
             return dg_map
 
-        if self.file_location != 0:
-            self.file.seek(0)
-
-        self.file_end = False
-        dg_map = dict()
-
-        while not self.file_end:
-            header, count = self.read_dg_header()
-            if count != 0:
-                logging.warning("Sync pattern misalignment, file pointer shifted %d Bytes forward" % count)
-
-            if header is None:
-                self.file_end = True
-                break
-
-            dg_type = header[12]
-            dg_opd_offset = header[4]
-            dg_year = header[6]
-            dg_day = header[7]
-            dg_second = header[8]
-            dg_hour = header[9]
-            dg_minute = header[10]
-            dg_time = self.get_time(dg_year, dg_day, dg_hour, dg_minute, dg_second)
-
-            dg_data_header_loc = self.file_location
-            dg_data_size = header[3] - self._header_size - self._footer_size
-
-            map_data_entry = [dg_data_header_loc, dg_time, dg_data_size, dg_opd_offset]
-
-            if dg_type in dg_map:
-                dg_map[dg_type].append(map_data_entry)
-            else:
-                dg_map[dg_type] = list()
-                dg_map[dg_type].append(map_data_entry)
+        self.index = None
+        key = None
+        if self.index_path is not None:
+            key = dg_index.source_key(read=self.read, file_length=self.file_length, file_mtime=self.file_mtime)
+            if force is False:
+                self.index = dg_index.load_index(path=self.index_path, key=key)
+
+        if self.index is None:
+            self.index = self.make_index()
+            if self.index_path is not None:
+                dg_index.save_index(path=self.index_path, index=self.index, key=key)
+        self.file_location = self.file_length
+        self.file_end = True
+
+        dg_map = np.empty(self.index.size, dtype=dg_index.map_dtype)
+        dg_map['location'] = self.index['offset'] + self._header_size
+        dg_map['time'] = self.get_time(self.index['year'], self.index['day'], self.index['hours'],
+                                       self.index['minutes'], self.index['seconds'])
+        dg_map['size'] = self.index['size'] - self._header_size - self._footer_size
+        for name in ('opd_offset', 'record_type', 'device_id', 'ping_number', 'record_flags'):
+            dg_map[name] = self.index[name]
+
+        # contiguous and time sorted records for each type, file order among the ones with the same time
+        dg_map = dg_map[np.lexsort((dg_map['time'], dg_map['record_type']))]
+        dg_codes, dg_starts, dg_counts = np.unique(dg_map['record_type'], return_index=True, return_counts=True)
+        self.map_types = {dg_code: slice(dg_start, dg_start + dg_count) for dg_code, dg_start, dg_count in
+                          zip(dg_codes.tolist(), dg_starts.tolist(), dg_counts.tolist())}
 
         self.map = dg_map
         self.mapped = True
         return dg_map
 
+    def make_index(self) -> np.ndarray:
+        """Scan the file for its datagram index"""
+        return dg_index.build_index(read=self.read, file_length=self.file_length, block_size=self.block_size,
+                                    workers=self.workers, path=self.file.name)
+
+    def get_map(self, dg_type: ResonDatagrams) -> np.ndarray:
+        """Return the time sorted map entries of a datagram type, as a view of the map"""
+        self.is_mapped()
+        dg_slice = self.map_types.get(reson_datagram_code[dg_type], slice(0, 0))
+        return self.map[dg_slice]
+
     def is_mapped(self):
         if not self.mapped:
             self.data_map()
 
     # Datagram Reading Methods
-    def read_dg_header(self, count=0):
-        chunk = self.file.read(self._header_size)
-        self.file_location = self.file.tell()
-        if len(chunk) != self._header_size:
-            logging.debug("End of file")
-            header_data = None
-            return header_data, count
-
-        header_data = struct.unpack(self._header_format, chunk)
-
-        header_sync_patt = header_data[2]
-        if header_sync_patt != self._reson_sync_patt:   # TODO: This is a recursive data check. It can be simpler
-            self.file.seek(-(self._header_size-1), 1)
-            header_data, count = self.read_dg_header()
-            return header_data, count + 1
-        else:
-            data_size = header_data[3]
-            self.file.seek(data_size - self._header_size, 1)
-            return header_data, count
-
-    def get_datagram(self, dg_type: ResonDatagrams, dg_record_range=None, dg_time=None):
-        self.is_mapped()
-        dg_code = reson_datagram_code[dg_type]
-        dg_num_records = len(self.map[dg_code])
-        data_out = list()
-
-        # Determine indices of all desired datagrams
-        map_index = None
-        if dg_record_range is None:
-            map_index = range(dg_num_records)  # Get all the data records
-        elif dg_record_range is not None and dg_time is None:
-            if any(dg_record_number > dg_num_records for dg_record_number in dg_record_range):
-                raise RuntimeError("Index %d exceeds number of datagram entries (%d)"
+    def query_map(self, dg_type: ResonDatagrams, dg_record_range=None, dg_time=None, dg_ping_range=None,
+                  device_id=None) -> np.ndarray:
+        """Return the map entries of a datagram type matching all the passed filters
+
+        - dg_record_range: positions in the time sorted records of the type
+        - dg_time: (start, end) time window, inclusive, as datetime or milliseconds (either can be None)
+        - dg_ping_range: (first, last) ping numbers, inclusive (either can be None)
+        - device_id: the device/sonar identifier
+        """
+        dg_map = self.get_map(dg_type)
+        dg_num_records = dg_map.size
+
+        if dg_record_range is not None:
+            map_index = np.asarray(dg_record_range, dtype=np.int64)
+            if np.any(map_index >= dg_num_records) or np.any(map_index < -dg_num_records):
+                raise RuntimeError("Index %s exceeds number of datagram entries (%d)"
                                    % (dg_record_range, dg_num_records))
-            map_index = dg_record_range            # Get Records indicated by range
-        elif dg_record_range is None and dg_time is not None:
-            pass  # get records in time range
-        else:
-            pass  # get specified records and time range
-
-        # loop over indices and place data in
-        for n in map_index:
-            dg_data_header_loc = self.map[dg_code][n][0]
-            dg_time = self.map[dg_code][n][1]
-            dg_size = self.map[dg_code][n][2]
-
-            datapacket = self.get_record(dg_type, dg_data_header_loc, dg_size)
+            dg_map = dg_map[map_index]
+            if np.any(np.diff(dg_map['time']) < 0):
+                dg_map = dg_map[np.argsort(dg_map['time'], kind='stable')]
+
+        if dg_time is not None:
+            time_start, time_end = (self.to_map_time(value) for value in dg_time)
+            first = 0 if time_start is None else np.searchsorted(dg_map['time'], time_start, side='left')
+            last = dg_map.size if time_end is None else np.searchsorted(dg_map['time'], time_end, side='right')
+            dg_map = dg_map[first:last]
+
+        if dg_ping_range is not None:
+            ping_first, ping_last = dg_ping_range
+            ping_first = 0 if ping_first is None else ping_first
+            ping_last = dg_index.no_ping - 1 if ping_last is None else ping_last
+            ping_numbers = dg_map['ping_number']
+            if np.all(ping_numbers[1:] >= ping_numbers[:-1]):
+                first = np.searchsorted(ping_numbers, ping_first, side='left')
+                last = np.searchsorted(ping_numbers, ping_last, side='right')
+                dg_map = dg_map[first:last]
+            else:  # ping counter reset or interleaved devices
+                dg_map = dg_map[(ping_numbers >= ping_first) & (ping_numbers <= ping_last)]
+
+        if device_id is not None:
+            dg_map = dg_map[dg_map['device_id'] == device_id]
+
+        return dg_map
+
+    def optional_offsets(self, opd_offsets: np.ndarray) -> list:
+        """Return the positions of the optional data in the record data sections (None when there are none)
+
+        The opd_offset of the record frame is relative to the start of the record, before its header.
+        """
+        return [None if opd_offset == 0 else opd_offset - self._header_size for opd_offset in opd_offsets.tolist()]
+
+    def get_datagram(self, dg_type: ResonDatagrams, dg_record_range=None, dg_time=None, dg_ping_range=None,
+                     device_id=None):
+        """Read and parse the datagrams of a type, optionally filtered as in query_map
+
+        Only the matching records are read from the file.
+        """
+        dg_map = self.query_map(dg_type=dg_type, dg_record_range=dg_record_range, dg_time=dg_time,
+                                dg_ping_range=dg_ping_range, device_id=device_id)
+        data_out = [None] * dg_map.size
+
+        # read in file order, then place the data in time order
+        file_order = np.argsort(dg_map['location'], kind='stable')
+        dg_chunks = self.read_records(locations=dg_map['location'][file_order], sizes=dg_map['size'][file_order])
+        optional_offsets = self.optional_offsets(dg_map['opd_offset'][file_order])
+        for n, dg_time, optional_offset, dg_chunk in zip(file_order.tolist(), dg_map['time'][file_order].tolist(),
+                                                         optional_offsets, dg_chunks):
+            datapacket = parse(dg_chunk, dg_type, optional_offset=optional_offset)
             datapacket.time = dg_time
-            data_out.append(datapacket)
+            data_out[n] = datapacket
 
         return data_out
 
+    def get_batch(self, dg_type: ResonDatagrams, dg_record_range=None, dg_time=None, dg_ping_range=None,
+                  device_id=None) -> ResonBatch:
+        """Read the datagrams of a type, optionally filtered as in query_map, and decode them as columnar arrays
+
+        The records of the returned ResonBatch are in time order, with their times in batch.time. The records made
+        of a header only (e.g., navigation) are decoded without creating per-record objects.
+        """
+        dg_map = self.query_map(dg_type=dg_type, dg_record_range=dg_record_range, dg_time=dg_time,
+                                dg_ping_range=dg_ping_range, device_id=device_id)
+        file_order = np.argsort(dg_map['location'], kind='stable')
+
+        dtype = fixed_size_records.get(dg_type)
+        if dtype is not None:
+            if np.any(dg_map['size'] < dtype.itemsize):
+                raise RuntimeError("Record shorter than its header: %d bytes" % dtype.itemsize)
+            header = np.empty(dg_map.size, dtype=dtype)
+            header[file_order] = self.read_array(locations=dg_map['location'][file_order], dtype=dtype)
+            batch = ResonBatch(dg_type=dg_type, header=header)
+            batch.time = dg_map['time'].copy()
+            return batch
+
+        dg_chunks = [None] * dg_map.size
+        for n, dg_chunk in zip(file_order.tolist(), self.read_records(locations=dg_map['location'][file_order],
+                                                                      sizes=dg_map['size'][file_order])):
+            dg_chunks[n] = dg_chunk
+
+        batch = parse_batch(dg_type=dg_type, chunks=dg_chunks)
+        batch.time = dg_map['time'].copy()
+        return batch
+
+    def get_settings_epochs(self, device_id=None) -> SettingsEpochs:
+        """Return the run-length table of the sonar settings (7000) and beam geometry (7004) along the pings"""
+        settings = self.get_batch(dg_type=ResonDatagrams.SONARSETTINGS, device_id=device_id)
+        beam_geometry = self.get_batch(dg_type=ResonDatagrams.BEAMGEO, device_id=device_id)
+        return SettingsEpochs.from_batches(settings=settings, beam_geometry=beam_geometry)
+
+    def iter_water_column(self, dg_type: ResonDatagrams = ResonDatagrams.BEAMFORMEDDATA, beam_step: int = 1,
+                          sample_step: int = 1, dg_time=None, dg_ping_range=None, device_id=None):
+        """Iterate over the water column records of a type in time order, optionally decimated at decode time
+
+        The records are read one at a time (no coalescing), so that only the buffer of the current ping is alive
+        while the yielded datapackets are processed.
+        """
+        data_class = water_column_records.get(dg_type)
+        if data_class is None:
+            raise RuntimeError("Not a water column datagram type: %s" % dg_type)
+
+        dg_map = self.query_map(dg_type=dg_type, dg_time=dg_time, dg_ping_range=dg_ping_range, device_id=device_id)
+        for location, size, dg_time in zip(dg_map['location'].tolist(), dg_map['size'].tolist(),
+                                           dg_map['time'].tolist()):
+            datapacket = data_class(self.read(location, size), beam_step=beam_step, sample_step=sample_step)
+            datapacket.time = dg_time
+            yield datapacket
+
+    def iter_datagrams(self, types, batch_size: int = None, read_ahead: int = None):
+        """Iterate over the datagrams of the passed type(s) in file order, with bounded memory
+
+        Without batch_size, (dg_type, datapacket) tuples are yielded. Otherwise, the datapackets are grouped by
+        type and (dg_type, list of datapackets) tuples are yielded as soon as a batch is full, with the partial
+        batches yielded at the end. The records are read by coalesced spans of up to read_ahead bytes (by
+        default, max_read_size), prefetched by the kernel in mmap mode.
+        """
+        self.is_mapped()
+        if isinstance(types, ResonDatagrams):
+            types = [types, ]
+        dg_codes = np.array([reson_datagram_code[dg_type] for dg_type in types], dtype=np.uint32)
+        index = self.index[np.isin(self.index['record_type'], dg_codes)]
+
+        batches = dict()
+        for chunk_start in range(0, index.size, self.iter_chunk_size):
+            entries = index[chunk_start:chunk_start + self.iter_chunk_size]
+            dg_times = self.get_time(entries['year'], entries['day'], entries['hours'], entries['minutes'],
+                                     entries['seconds'])
+            dg_chunks = self.read_records(locations=entries['offset'] + self._header_size,
+                                          sizes=entries['size'] - self._header_size - self._footer_size,
+                                          max_read_size=read_ahead)
+
+            for dg_code, dg_time, optional_offset, dg_chunk in zip(entries['record_type'].tolist(), dg_times.tolist(),
+                                                                   self.optional_offsets(entries['opd_offset']),
+                                                                   dg_chunks):
+                dg_type = ResonDatagrams(dg_code)
+                datapacket = parse(dg_chunk, dg_type, optional_offset=optional_offset)
+                datapacket.time = dg_time
+
+                if batch_size is None:
+                    yield dg_type, datapacket
+                    continue
+
+                batch = batches.setdefault(dg_type, list())
+                batch.append(datapacket)
+                if len(batch) >= batch_size:
+                    yield dg_type, batch
+                    batches[dg_type] = list()
+
+        for dg_type, batch in batches.items():
+            if len(batch) > 0:
+                yield dg_type, batch
+
+    def sweep(self, types, read_ahead: int = None):
+        """Walk the records of the passed types once, in file order, by slabs of iter_chunk_size records
+
+        For the records of each type in a slab, (dg_type, rows, chunks) is yielded, with rows the positions of
+        the records in the time sorted map of their type (as for get_map and get_batch). The records are read by
+        coalesced spans of up to read_ahead bytes (by default, max_read_size).
+        """
+        self.is_mapped()
+        dg_codes = [reson_datagram_code[dg_type] for dg_type in types]
+        dg_slices = [self.map_types.get(dg_code, slice(0, 0)) for dg_code in dg_codes]
+        positions = np.concatenate([np.arange(dg_slice.start, dg_slice.stop, dtype=np.int64)
+                                    for dg_slice in dg_slices] + [np.empty(0, dtype=np.int64)])
+        positions = positions[np.argsort(self.map['location'][positions], kind='stable')]
+
+        # the map holds the records of each type one after the other
+        type_starts = np.array(sorted(dg_slice.start for dg_slice in self.map_types.values()), dtype=np.int64)
+        rows = positions - type_starts[np.searchsorted(type_starts, positions, side='right') - 1]
+
+        # a single sequence of coalesced reads over the whole walk, consumed by slabs
+        records = self.read_records(locations=self.map['location'][positions], sizes=self.map['size'][positions],
+                                    max_read_size=read_ahead)
+        try:
+            for chunk_start in range(0, positions.size, self.iter_chunk_size):
+                record_types = self.map['record_type'][positions[chunk_start:chunk_start + self.iter_chunk_size]]
+                slab_rows = rows[chunk_start:chunk_start + self.iter_chunk_size]
+                dg_chunks = list(itertools.islice(records, record_types.size))
+                for dg_type, dg_code in zip(types, dg_codes):
+                    selected = np.flatnonzero(record_types == dg_code)
+                    if selected.size > 0:
+                        yield dg_type, slab_rows[selected], [dg_chunks[n] for n in selected.tolist()]
+        finally:
+            records.close()
+
     def get_record(self, dg_type, dg_data_header_loc, dg_size):
-        self.file.seek(dg_data_header_loc, 0)  # go to file position
-        dg_chunk = self.file.read(dg_size)  # extract the data
+        dg_chunk = self.read(dg_data_header_loc, dg_size)  # extract the data, zero-copy in mmap mode
         datapacket = parse(dg_chunk, dg_type)  # Parse the data
 
         return datapacket
 
     @staticmethod
-    def get_time(year, day, hour, minute, second):                  # TODO: Change this to use the datetime modules
-        time_fmt = '%Y, %j, %H, %M'
-        temp_string = '%d, %d, %d, %d' % (year, day, hour, minute)
-        timestruct = time.strptime(temp_string, time_fmt)
-        utctime = calendar.timegm(timestruct) + second
+    def get_time(year, day, hour, minute, second):
+        """Time in milliseconds to adhere to the cf standard, for scalar or array 7KTIME fields"""
+        utctime = dg_index.dg_time(year, day, hour, minute, second)
+        if utctime.ndim == 0:
+            return float(utctime)
+        return utctime
+
+
+class Reson7k(Reson):
+    """Reader of the .7k captures, with Hypack headers and/or 7k network frames around the records
+
+    The capture is demultiplexed once, streaming it from start to end, into a s7k file at records_path (by
+    default, next to the capture) while indexing its records. That file is then read as any s7k file, and
+    it is reused as long as it is newer than the capture.
+    """
+
+    def __init__(self, input_path: Path, records_path: Path = None, use_mmap: bool = False, index_path: Path = None,
+                 workers: int = 1):
+        self.records_path = records_path
+        self.demux_index = None  # index of the records demultiplexed by this reader
+        self.demux_stats = None
+        super().__init__(input_path=input_path, use_mmap=use_mmap, index_path=index_path, workers=workers)
+
+    def check_file(self, file_path: Path):
+        self.format_type = file_path.name.split('.')[-1]
+        if self.format_type != '7k':
+            logger.error("Unexpected format type: %s" % self.format_type)
+            self._valid = False
+            return self._valid
+
+        if self.records_path is None:
+            self.records_path = file_path.with_name(file_path.name + '.s7k')
+        try:
+            if not self.is_demuxed(file_path):
+                self.demux(file_path)
+            self.open_file(self.records_path)
+            self.file_location = self.file.tell()
+            self._valid = True
+        except FileNotFoundError:
+            logger.error("File not found: %s" % file_path)
+            self._valid = False
+        except RuntimeError as e:
+            logger.error("Unable to demultiplex %s -> %s" % (file_path, e))
+            self._valid = False
+        return self._valid
 
-        return utctime * 1000        # Time in milliseconds to adhere to the cf standard
+    def is_demuxed(self, file_path: Path) -> bool:
+        """Return whether the records file is there and newer than the capture"""
+        capture_mtime = os.stat(str(file_path)).st_mtime_ns
+        if not self.records_path.exists():
+            return False
+        return os.stat(str(self.records_path)).st_mtime_ns >= capture_mtime
+
+    def demux(self, file_path: Path):
+        """Demultiplex the capture into the records file, keeping the index of its records"""
+        self.demux_stats = dg_demux.DemuxStats()
+        tmp_path = self.records_path.with_name(self.records_path.name + '.tmp')
+        try:
+            with open(str(file_path), 'rb') as fid, open(str(tmp_path), 'wb') as fod:
+                self.demux_index = dg_demux.demux_file(fid, write=fod.write, stats=self.demux_stats)
+            os.replace(str(tmp_path), str(self.records_path))
+        except RuntimeError:
+            os.remove(str(tmp_path))
+            raise
+        logger.debug("Demultiplexed %s -> %s\n%s" % (file_path, self.records_path, self.demux_stats))
+
+    def make_index(self) -> np.ndarray:
+        """Return the index built while demultiplexing, or scan the reused records file"""
+        if self.demux_index is not None:
+            return self.demux_index
+        return super().make_index()
@@ -14,6 +14,8 @@ class RawFormatType(Enum):
 
     @classmethod
     def retrieve_format_type(cls, path: Path):
+        """Return the format of a raw file from its extension, and from its content for the s7k files (R2Sonic
+        packets or not)"""
         fileparts = path.name.split('.')
         extention = fileparts[-1]
 
@@ -24,7 +26,9 @@ class RawFormatType(Enum):
         elif extention == 'wcd':
             raw_format = RawFormatType.KNG_WCD
         elif extention == 's7k':
-            raw_format = RawFormatType.RESON_S7K
+            # the parsers use this module: imported when needed
+            from hyo2.openbst.lib.raw.parsers.r2sonic.reader import file_dialect
+            raw_format = file_dialect(path=path)
         elif extention == '7k':
             raw_format = RawFormatType.RESON_7K
         elif extention == 'r2sc':
@@ -9,8 +9,14 @@ from pathlib import Path
 from hyo2.openbst.lib.nc_helper import NetCDFHelper
 from hyo2.openbst.lib.raw.raw_formats import RawFormatType
 
+from hyo2.openbst.lib.raw.parsers.kongsberg.imports import RawImport as kongsberg_import
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.imports import RawImport as kmall_import
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.reader import KongsbergKmall
+from hyo2.openbst.lib.raw.parsers.kongsberg.reader import Kongsberg
+from hyo2.openbst.lib.raw.parsers.r2sonic.imports import RawImport as r2sonic_import
+from hyo2.openbst.lib.raw.parsers.r2sonic.reader import R2Sonic
 from hyo2.openbst.lib.raw.parsers.reson.imports import RawImport as reson_import
-from hyo2.openbst.lib.raw.parsers.reson.reader import Reson
+from hyo2.openbst.lib.raw.parsers.reson.reader import Reson, Reson7k
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +24,8 @@ logger = logging.getLogger(__name__)
 class Raws:
 
     ext = ".nc"
+    index_ext = ".idx"
+    records_ext = ".s7k"  # records demultiplexed from the .7k captures
 
     def __init__(self, raws_path: Path) -> None:
         self._path = raws_path
@@ -55,6 +63,10 @@ class Raws:
         else:
             raw_path = self._path.joinpath(path_hash + Raws.ext)
             os.remove(str(raw_path.resolve()))
+            for ext in (Raws.index_ext, Raws.records_ext):
+                sidecar_path = self._path.joinpath(path_hash + ext)
+                if sidecar_path.exists():
+                    os.remove(str(sidecar_path.resolve()))
             logger.info("raw .nc deleted for file: %s" % str(path.resolve()))
             return True
 
@@ -71,35 +83,67 @@ class Raws:
         else:
             file_name = self.path.joinpath(path_hash + self.ext)
             ds_raw = Dataset(filename=file_name, mode='a')
+        index_path = self.path.joinpath(path_hash + self.index_ext)
 
         # generate raw parser object
         if raw_format is RawFormatType.KNG_ALL:
-            pass                                                    # TODO: Create the Kongsberg parser
+            raw = Kongsberg(path, index_path=index_path)
+            if raw.valid is True:
+                raw.data_map()
+            else:
+                return False
+            imported = kongsberg_import.import_raw(raw=raw, ds=ds_raw)
+            raw.close()
 
         elif raw_format is RawFormatType.KNG_KMALL:
-            pass
+            raw = KongsbergKmall(path, index_path=index_path)
+            if raw.valid is True:
+                raw.data_map()
+            else:
+                return False
+            imported = kmall_import.import_raw(raw=raw, ds=ds_raw)
+            raw.close()
 
         elif raw_format is RawFormatType.KNG_WCD:
-            pass
+            # water column datagrams only, with the same reader of the .kmall files
+            raw = KongsbergKmall(path, index_path=index_path)
+            if raw.valid is True:
+                raw.data_map()
+            else:
+                return False
+            imported = kmall_import.import_water_column(raw=raw, ds=ds_raw)
+            raw.close()
 
         elif raw_format is RawFormatType.RESON_S7K:
-            raw = Reson(path)
+            raw = Reson(path, index_path=index_path)
             if raw.valid is True:
                 raw.data_map()
             else:
                 return False
-            imported = reson_import.import_raw(raw=raw, ds=ds_raw)
+            imported = reson_import.import_raw(raw=raw, ds=ds_raw, single_pass=True)
+            raw.close()
 
-        elif raw_format is RawFormatType.RESON_7K:
-            raw = Reson(path)
+        elif raw_format is RawFormatType.R2SONIC_S7K:
+            # the dialect of the map decides for the .r2sc files without R2Sonic packets
+            raw = R2Sonic(path, index_path=index_path)
             if raw.valid is True:
                 raw.data_map()
             else:
                 return False
-            imported = reson_import.import_raw(raw=raw, ds=ds_raw)
+            if raw.dialect is RawFormatType.R2SONIC_S7K:
+                imported = r2sonic_import.import_raw(raw=raw, ds=ds_raw)
+            else:
+                imported = reson_import.import_raw(raw=raw, ds=ds_raw, single_pass=True)
+            raw.close()
 
-        elif raw_format is RawFormatType.R2SONIC_S7K:
-            pass                                                      # TODO: Create R2Sonic Parser
+        elif raw_format is RawFormatType.RESON_7K:
+            raw = Reson7k(path, records_path=self.path.joinpath(path_hash + self.records_ext), index_path=index_path)
+            if raw.valid is True:
+                raw.data_map()
+            else:
+                return False
+            imported = reson_import.import_raw(raw=raw, ds=ds_raw, single_pass=True)
+            raw.close()
 
         if imported is False:
             raise RuntimeError(" Error Importing file: %s" % path)
@@ -0,0 +1,106 @@
+from collections import namedtuple
+import logging
+
+from netCDF4 import Dataset
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SnippetPing = namedtuple('SnippetPing', ['time', 'beam_index', 'detect_sample', 'snippet_start_sample',
+                                         'snippet_end_sample', 'samples'])
+
+
+class Snippets:
+    """Snippets group of the raw .nc files, as CF contiguous ragged arrays
+
+    The snippets of a ping are snippet_count entries along the snippet dimension, and the samples of a snippet are
+    sample_count entries of the flat 'snippets' vector, in the datatype of the source (e.g., u2 or u4 magnitudes),
+    so that the size on disk follows the samples actually logged. The pings are appended in time order, so that
+    the counts give the contiguous ragged layout; the start indices (snippet_start_index and sample_start_index)
+    are stored too, for the direct lookup of a ping.
+    """
+    group_name = "snippets"
+    fill_value = -9999
+    snippet_fields = ("detect_sample", "snippet_start_sample", "snippet_end_sample")
+
+    def __init__(self):
+        pass
+
+    @classmethod
+    def create(cls, ds: Dataset, sample_datatype: str):
+        grp_snippet = ds.createGroup(Snippets.group_name)
+        grp_snippet.createDimension(dimname="ping", size=None)
+        grp_snippet.createDimension(dimname="snippet", size=None)
+        grp_snippet.createDimension(dimname="sample", size=None)
+
+        grp_snippet.createVariable(varname="time", datatype="f8", dimensions=("ping",))
+        grp_snippet.createVariable(varname="snippet_start_index", datatype="i8", dimensions=("ping",))
+        var_snippet_count = grp_snippet.createVariable(varname="snippet_count", datatype="i4", dimensions=("ping",))
+        var_snippet_count.sample_dimension = "snippet"
+
+        grp_snippet.createVariable(varname="beam_index", datatype="i4", dimensions=("snippet",))
+        for name in Snippets.snippet_fields:
+            grp_snippet.createVariable(varname=name, datatype="f8", dimensions=("snippet",),
+                                       fill_value=Snippets.fill_value)
+        grp_snippet.createVariable(varname="sample_start_index", datatype="i8", dimensions=("snippet",))
+        var_sample_count = grp_snippet.createVariable(varname="sample_count", datatype="i4", dimensions=("snippet",))
+        var_sample_count.sample_dimension = "sample"
+
+        # every sample is written: no fill value, which would be a valid magnitude
+        grp_snippet.createVariable(varname="snippets", datatype=sample_datatype, dimensions=("sample",),
+                                   fill_value=False)
+        return grp_snippet
+
+    @classmethod
+    def write(cls, grp, time: np.ndarray, snippet_offsets: np.ndarray, beam_index: np.ndarray, fields: dict,
+              sample_offsets: np.ndarray, samples: np.ndarray):
+        """Append the passed pings (in time order, after the written ones) with their snippets
+
+        The snippets of ping k are snippet_offsets[k]:snippet_offsets[k + 1] (beam_index and the fields), and the
+        samples of snippet n are samples[sample_offsets[n]:sample_offsets[n + 1]].
+        """
+        num_pings = len(time)
+        if num_pings == 0:
+            return
+        ping_start = len(grp.dimensions["ping"])
+        snippet_start = len(grp.dimensions["snippet"])
+        sample_start = len(grp.dimensions["sample"])
+
+        num_snippets = int(snippet_offsets[-1])
+        if num_snippets > 0:
+            snippets = slice(snippet_start, snippet_start + num_snippets)
+            grp.variables["beam_index"][snippets] = beam_index
+            for name in Snippets.snippet_fields:
+                grp.variables[name][snippets] = fields[name]
+            grp.variables["sample_start_index"][snippets] = sample_start + sample_offsets[:-1]
+            grp.variables["sample_count"][snippets] = np.diff(sample_offsets)
+        if sample_offsets[-1] > 0:
+            grp.variables["snippets"][sample_start:sample_start + int(sample_offsets[-1])] = samples
+
+        pings = slice(ping_start, ping_start + num_pings)
+        grp.variables["time"][pings] = time
+        grp.variables["snippet_start_index"][pings] = snippet_start + snippet_offsets[:-1]
+        grp.variables["snippet_count"][pings] = np.diff(snippet_offsets)
+
+    @classmethod
+    def read_ping(cls, grp, ping: int) -> SnippetPing:
+        """Read the snippets of a ping, with the samples of each snippet as a view on a single read"""
+        snippet_start = int(grp.variables["snippet_start_index"][ping])
+        snippets = slice(snippet_start, snippet_start + int(grp.variables["snippet_count"][ping]))
+        sample_starts = np.asarray(grp.variables["sample_start_index"][snippets], dtype=np.int64)
+        sample_counts = np.asarray(grp.variables["sample_count"][snippets], dtype=np.int64)
+
+        var_samples = grp.variables["snippets"]
+        var_samples.set_auto_mask(False)  # no fill value: any magnitude is valid
+        first = int(sample_starts[0]) if sample_starts.size > 0 else 0
+        ping_samples = var_samples[first:first + int(sample_counts.sum())]
+        sample_starts -= first
+        samples = [ping_samples[start:start + count] for start, count in
+                   zip(sample_starts.tolist(), sample_counts.tolist())]
+
+        return SnippetPing(time=float(grp.variables["time"][ping]),
+                           beam_index=np.asarray(grp.variables["beam_index"][snippets]),
+                           detect_sample=grp.variables["detect_sample"][snippets],
+                           snippet_start_sample=grp.variables["snippet_start_sample"][snippets],
+                           snippet_end_sample=grp.variables["snippet_end_sample"][snippets],
+                           samples=samples)
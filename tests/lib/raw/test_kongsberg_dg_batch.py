@@ -0,0 +1,151 @@
+import struct
+import unittest
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_batch import parse_batch
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_formats import installation_parameters, KongsbergDatagrams, \
+    range_angle_beam_dtype, range_angle_sector_dtype, runtime_dtype, seabed_image_beam_dtype, xyz_beam_dtype
+
+
+def make_position(latitude: float, longitude: float) -> bytes:
+    return struct.pack('<2i4H2B', int(latitude * 20000000), int(longitude * 10000000), 150, 250, 9000, 18000,
+                       0x81, 6) + b'$GPGGA'
+
+
+def make_attitude(num_samples: int, roll: float = 1.5) -> bytes:
+    samples = b''.join(struct.pack('<2H3hH', 10 * n, 0, int(roll * 100), -200, 5, 35999)
+                       for n in range(num_samples))
+    return struct.pack('<H', num_samples) + samples + b'\x00'
+
+
+def make_runtime(absorption: float = 35.5, stabilization_mode: int = 0x80) -> bytes:
+    values = np.zeros(1, dtype=runtime_dtype)
+    values['absorption'] = int(absorption * 100)
+    values['tx_pulse_length'] = 150
+    values['tx_beam_width'] = 10
+    values['rx_beam_width'] = 20
+    values['rx_band_width'] = 60
+    values['tx_power'] = -10
+    values['stabilization_mode'] = stabilization_mode
+    values['tx_along_tilt'] = -15
+    return values.tobytes() + b'\x00'
+
+
+def make_range_angle(num_beams: int, num_sectors: int = 2, sample_rate: float = 30000.0) -> bytes:
+    sectors = np.zeros(num_sectors, dtype=range_angle_sector_dtype)
+    sectors['tilt_angle'] = np.arange(num_sectors) * 100 - 50
+    sectors['focus_range'] = 1000
+    sectors['center_frequency'] = 300000.0 + np.arange(num_sectors) * 10000.0
+    sectors['mean_absorption'] = 6000
+    sectors['sector'] = np.arange(num_sectors)
+    beams = np.zeros(num_beams, dtype=range_angle_beam_dtype)
+    beams['rx_angle'] = np.linspace(6000, -6000, num_beams).astype('<i2')
+    beams['sector'] = np.arange(num_beams) * num_sectors // num_beams
+    beams['quality_factor'] = 10
+    beams['travel_time'] = 0.01 + 0.001 * np.arange(num_beams)
+    beams['reflectivity'] = -250
+    return struct.pack('<4HfI', 14850, num_sectors, num_beams, num_beams, sample_rate, 0) + sectors.tobytes() + \
+        beams.tobytes() + b'\x00'
+
+
+def make_xyz(num_beams: int) -> bytes:
+    beams = np.zeros(num_beams, dtype=xyz_beam_dtype)
+    beams['depth'] = 20.0 + np.arange(num_beams)
+    beams['across_track'] = np.linspace(-30.0, 30.0, num_beams)
+    beams['reflectivity'] = -300
+    return struct.pack('<2Hf2HfB3B', 9000, 14850, 1.5, num_beams, num_beams, 30000.0, 0, 0, 0, 0) + \
+        beams.tobytes() + b'\x00'
+
+
+def make_seabed_image(num_samples, sorting_direction) -> bytes:
+    beams = np.zeros(len(num_samples), dtype=seabed_image_beam_dtype)
+    beams['sorting_direction'] = sorting_direction
+    beams['num_samples'] = num_samples
+    beams['center_sample'] = np.asarray(num_samples) // 2
+    samples = np.concatenate([np.arange(count, dtype='<i2') - 400 for count in num_samples])
+    data = struct.pack('<f5H', 30000.0, 40, 0xFFE2, 0xFF9C, 10, 60) + struct.pack('<H', len(num_samples)) + \
+        beams.tobytes() + samples.tobytes()
+    return data + b'\x00' * (len(data) % 2)
+
+
+def make_installation(parameters: str) -> bytes:
+    return struct.pack('<H', 0) + parameters.encode('ascii') + b'\x00'
+
+
+class TestLibRawKongsbergDgBatch(unittest.TestCase):
+
+    def test_position(self):
+        batch = parse_batch(KongsbergDatagrams.POSITION, [make_position(43.125, -70.5), make_position(-1.0, 2.0)])
+        self.assertEqual(len(batch), 2)
+        self.assertTrue(np.allclose(batch['latitude'], [43.125, -1.0]))
+        self.assertTrue(np.allclose(batch['longitude'], [-70.5, 2.0]))
+        self.assertTrue(np.allclose(batch['heading'], 180.0))
+        self.assertEqual(batch['input_size'][0], 6)
+
+    def test_attitude(self):
+        batch = parse_batch(KongsbergDatagrams.ATTITUDE, [make_attitude(3), make_attitude(2, roll=-0.5)])
+        self.assertTrue(np.array_equal(batch.offsets, [0, 3, 5]))
+        self.assertTrue(np.allclose(batch['roll'], [1.5, 1.5, 1.5, -0.5, -0.5]))
+        self.assertTrue(np.allclose(batch['pitch'], -2.0))
+        self.assertTrue(np.allclose(batch['heave'], 0.05))
+        self.assertTrue(np.allclose(batch['heading'], 359.99))
+        batch.time = np.array([1000.0, 2000.0])
+        self.assertTrue(np.array_equal(batch.sample_time(), [1000.0, 1010.0, 1020.0, 2000.0, 2010.0]))
+
+    def test_runtime(self):
+        batch = parse_batch(KongsbergDatagrams.RUNTIME, [make_runtime(), make_runtime(absorption=40.0)])
+        self.assertTrue(np.allclose(batch['absorption'], [35.5, 40.0]))
+        self.assertTrue(np.allclose(batch['tx_pulse_length'], 150e-6))
+        self.assertTrue(np.allclose(batch['tx_beam_width'], 1.0))
+        self.assertTrue(np.allclose(batch['rx_band_width'], 3000.0))
+        self.assertTrue(np.allclose(batch['tx_along_tilt'], -1.5))
+        self.assertEqual(batch['tx_power'][0], -10)
+
+    def test_range_angle(self):
+        batch = parse_batch(KongsbergDatagrams.RAWRANGEANGLE78, [make_range_angle(4), make_range_angle(3, 1)])
+        self.assertTrue(np.array_equal(batch.offsets, [0, 4, 7]))
+        self.assertTrue(np.array_equal(batch.sector_offsets, [0, 2, 3]))
+        self.assertTrue(np.allclose(batch['sound_speed'], 1485.0))
+        self.assertTrue(np.allclose(batch['tx_tilt_angle'], [-0.5, 0.5, -0.5]))
+        self.assertTrue(np.allclose(batch['tx_focus_range'], 100.0))
+        self.assertTrue(np.allclose(batch['tx_mean_absorption'], 60.0))
+        self.assertTrue(np.array_equal(batch['beam'], [0, 1, 2, 3, 0, 1, 2]))
+        self.assertTrue(np.allclose(batch.record('rx_angle', 0), [60.0, 20.0, -20.0, -60.0]))
+        self.assertTrue(np.array_equal(batch.record('sector', 0), [0, 0, 1, 1]))
+        self.assertTrue(np.allclose(batch['reflectivity'], -25.0))
+        self.assertTrue(np.allclose(batch.record('travel_time', 1), [0.01, 0.011, 0.012]))
+        self.assertEqual(batch.to_beams('quality_factor', num_beams=5, fill_value=-1)[1, 3], -1)
+
+    def test_xyz(self):
+        batch = parse_batch(KongsbergDatagrams.XYZ88, [make_xyz(5)])
+        self.assertTrue(np.allclose(batch['heading'], 90.0))
+        self.assertTrue(np.allclose(batch['depth'], 20.0 + np.arange(5)))
+        self.assertTrue(np.allclose(batch['reflectivity'], -30.0))
+        self.assertTrue(np.array_equal(batch['beam'], np.arange(5)))
+
+    def test_seabed_image(self):
+        batch = parse_batch(KongsbergDatagrams.SEABEDIMAGE89,
+                            [make_seabed_image([3, 2], [1, -1]), make_seabed_image([0, 4], [1, 1])])
+        self.assertTrue(np.array_equal(batch.offsets, [0, 2, 4]))
+        self.assertTrue(np.array_equal(batch.sample_offsets, [0, 3, 5, 5, 9]))
+        self.assertTrue(np.allclose(batch['normal_incidence_bs'], -3.0))
+        self.assertTrue(np.allclose(batch['oblique_bs'], -10.0))
+        # the samples of the backward sorted beam are back in increasing range order
+        self.assertTrue(np.allclose(batch['samples'][:5], [-40.0, -39.9, -39.8, -39.9, -40.0]))
+        self.assertTrue(np.allclose(batch['samples'][5:], [-40.0, -39.9, -39.8, -39.7]))
+        self.assertEqual(batch['samples'].dtype, np.float32)
+
+    def test_installation(self):
+        parameters = installation_parameters(make_installation("WLZ=-0.5,SMH=2040,\r\nS1X=1.25,"))
+        self.assertEqual(parameters, {'WLZ': '-0.5', 'SMH': '2040', 'S1X': '1.25'})
+
+    def test_unsupported(self):
+        with self.assertRaises(RuntimeError):
+            parse_batch(KongsbergDatagrams.WATERCOLUMN, [b'\x00' * 10])
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawKongsbergDgBatch))
+    return s
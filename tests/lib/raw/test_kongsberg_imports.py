@@ -0,0 +1,90 @@
+from pathlib import Path
+import unittest
+
+from netCDF4 import Dataset
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.nc_helper import NetCDFHelper
+from hyo2.openbst.lib.raw.parsers.kongsberg.imports import RawImport
+from hyo2.openbst.lib.raw.parsers.kongsberg.reader import Kongsberg
+from tests.lib.raw.test_kongsberg_dg_batch import make_attitude, make_position, make_range_angle, make_runtime, \
+    make_seabed_image
+from tests.lib.raw.test_kongsberg_reader import make_datagram, make_ping
+
+
+class TestLibRawKongsbergImports(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.all_path = cls.testing.output_data_folder().joinpath("test_imports.all")
+        with open(str(cls.all_path), 'wb') as fod:
+            fod.write(make_datagram(0x52, make_runtime(), counter=100))
+            for n in range(10):
+                fod.write(make_datagram(0x50, make_position(43.0 + n * 0.001, -70.0), time_ms=43200000 + 1000 * n,
+                                        counter=n))
+                fod.write(make_datagram(0x41, make_attitude(3), time_ms=43200500 + 1000 * n, counter=n))
+                fod.write(make_ping(n))
+            fod.write(make_datagram(0x52, make_runtime(absorption=40.0), time_ms=43205500, counter=105))
+            # a second system, with more than 512 beams, and its seabed image logged ahead of the ping
+            fod.write(make_datagram(0x4E, make_range_angle(600), time_ms=43209500, counter=100, serial_number=124))
+            fod.write(make_datagram(0x59, make_seabed_image([3, 2, 4, 1], [1, 1, 1, 1]), time_ms=43201500,
+                                    counter=100, serial_number=124))
+            # a seabed image without its ping
+            fod.write(make_datagram(0x59, make_seabed_image([2], [1]), time_ms=43203500, counter=7,
+                                    serial_number=125))
+
+    def test_import_raw(self):
+        ds = Dataset("test_imports_all.nc", mode='w', diskless=True)
+        NetCDFHelper.init(ds=ds)
+        with Kongsberg(self.all_path) as raw:
+            raw.iter_chunk_size = 3  # the pings of the second system come after the snippets of three slabs
+            raw.data_map()
+            self.assertTrue(RawImport.import_raw(raw=raw, ds=ds))
+
+        grp_runtime = ds["runtime_settings"]
+        self.assertEqual(grp_runtime.variables["time"].shape, (11,))
+        self.assertTrue(np.all(np.diff(grp_runtime.variables["time"][:]) > 0))
+        # the runtime parameters of the last datagram at or before each ping
+        self.assertTrue(np.allclose(grp_runtime.variables["absorption_gain"][:], [35.5] * 6 + [40.0] * 5))
+        self.assertTrue(np.allclose(grp_runtime.variables["tx_pulse_width"][:], 150e-6))
+        self.assertTrue(np.allclose(grp_runtime.variables["rx_band_width"][:], 3000.0))
+        self.assertEqual(grp_runtime.variables["pitch_stabilization"][:].tolist(), [1] * 11)
+
+        grp_bathy = ds["raw_bathymetry_data"]
+        self.assertEqual(grp_bathy.variables["detect_point"].shape, (11, 600))
+        self.assertTrue(np.allclose(grp_bathy.variables["detect_point"][0, :4], [300.0, 330.0, 360.0, 390.0]))
+        self.assertTrue(np.ma.is_masked(grp_bathy.variables["detect_point"][0, 4]))
+        self.assertAlmostEqual(float(grp_bathy.variables["detect_point"][10, 599]), 18270.0, places=2)
+        self.assertEqual(ds["beam_geometry"].variables["across_beamwidth"].shape, (11, 600))
+        self.assertTrue(np.allclose(ds["beam_geometry"].variables["across_beamwidth"][:, 0], 2.0))
+
+        grp_snippet = ds["snippets"]
+        self.assertEqual(grp_snippet.variables["time"].shape, (12,))
+        self.assertTrue(np.all(np.diff(grp_snippet.variables["time"][:]) >= 0))
+        snippet_count = grp_snippet.variables["snippet_count"][:]
+        self.assertEqual(snippet_count.tolist(), [4, 4, 4, 4, 4, 1, 4, 4, 4, 4, 4, 4])
+        self.assertEqual(grp_snippet.variables["snippet_start_index"][:].tolist(),
+                         (np.cumsum(snippet_count) - snippet_count).tolist())
+        # the detection of each beam, at the center sample of its snippet
+        for ping in (0, 2, 11):
+            snippets = slice(4 * ping - (ping > 5) * 3, 4 * ping - (ping > 5) * 3 + 4)
+            self.assertEqual(grp_snippet.variables["detect_sample"][snippets].tolist(), [300.0, 330.0, 360.0, 390.0])
+            self.assertEqual(grp_snippet.variables["snippet_start_sample"][snippets].tolist(),
+                             [299.0, 329.0, 358.0, 390.0])
+            self.assertEqual(grp_snippet.variables["snippet_end_sample"][snippets].tolist(),
+                             [301.0, 330.0, 361.0, 390.0])
+        self.assertTrue(np.ma.is_masked(grp_snippet.variables["detect_sample"][20]))
+
+        self.assertEqual(ds["position"].variables["latitude"].shape, (10,))
+        self.assertTrue(np.allclose(ds["position"].variables["latitude"][:3], [43.0, 43.001, 43.002]))
+        self.assertEqual(ds["attitude"].variables["roll"].shape, (30,))
+        self.assertTrue(np.all(np.diff(ds["attitude"].variables["time"][:]) > 0))
+        ds.close()
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawKongsbergImports))
+    return s
@@ -0,0 +1,163 @@
+import struct
+import unittest
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_batch import parse_batch, parse_water_column
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_formats import installation_parameters, KmallDatagrams, \
+    mrz_ping_info_dtype, mrz_rx_info_dtype, mrz_sector_dtype, mrz_sounding_dtype, skm_sample_dtype, spo_dtype, \
+    strided
+
+
+def make_common(ping_count: int) -> bytes:
+    return struct.pack('<2H8B', 12, ping_count, 1, 0, 1, 0, 0, 0, 1, 0)
+
+
+def make_mrz(ping_count: int, num_soundings: int, num_extra: int = 0, sector_size: int = 48) -> bytes:
+    info = np.zeros(1, dtype=strided(mrz_ping_info_dtype, mrz_ping_info_dtype.itemsize + 8))
+    info['num_bytes_info_data'] = info.dtype.itemsize
+    info['pulse_form'] = 2
+    info['absorption'] = 45.5
+    info['mode_and_stabilisation'] = 0x01
+    info['tx_array_size_used'] = 1.0
+    info['rx_array_size_used'] = 2.0
+    info['num_tx_sectors'] = 2
+    info['num_bytes_per_tx_sector'] = sector_size
+    info['sound_speed'] = 1490.0
+    sectors = np.zeros(2, dtype=strided(mrz_sector_dtype, sector_size))
+    sectors['sector'] = [0, 1]
+    sectors['tilt_angle'] = [-1.5, 1.5]
+    sectors['center_frequency'] = [300000.0, 320000.0]
+    sectors['source_level'] = 210.0
+    sectors['focus_range'] = 50.0
+
+    rx = np.zeros(1, dtype=mrz_rx_info_dtype)
+    rx['num_bytes_rx_info'] = mrz_rx_info_dtype.itemsize
+    rx['num_soundings_max_main'] = num_soundings
+    rx['num_soundings_valid_main'] = num_soundings
+    rx['num_bytes_per_sounding'] = mrz_sounding_dtype.itemsize
+    rx['seabed_image_sample_rate'] = 10000.0
+    rx['num_extra_detections'] = num_extra
+    rx['num_extra_detection_classes'] = 1
+    rx['num_bytes_per_class'] = 4
+
+    soundings = np.zeros(num_soundings + num_extra, dtype=mrz_sounding_dtype)
+    soundings['sounding_index'] = np.arange(soundings.size)
+    soundings['tx_sector'] = np.arange(soundings.size) * 2 // max(soundings.size, 1)
+    soundings['quality_factor'] = 0.5
+    soundings['reflectivity_1'] = -20.0 - np.arange(soundings.size)
+    soundings['beam_angle_re_rx'] = np.linspace(-60.0, 60.0, soundings.size)
+    soundings['two_way_travel_time'] = 0.02
+    soundings['si_start_range'] = 190
+    soundings['si_num_samples'] = np.arange(soundings.size) % 3 + 1
+    soundings['si_centre_sample'] = soundings['si_num_samples'] // 2
+    samples = np.concatenate([np.arange(count, dtype='<i2') - 300 * (ping_count % 2 + 1)
+                              for count in soundings['si_num_samples']])
+    return make_common(ping_count) + info.tobytes() + sectors.tobytes() + rx.tobytes() + b'\x00' * 4 + \
+        soundings.tobytes() + samples.tobytes()
+
+
+def make_mwc(ping_count: int, num_samples, phase_flag: int = 0) -> bytes:
+    tx_info = struct.pack('<3Hhf', 12, 1, 16, 0, 0.25)
+    sector = struct.pack('<3fHh', -0.5, 300000.0, 1.0, 0, 0)
+    rx_info = struct.pack('<2H3Bbff', 16, len(num_samples), 12, phase_flag, 1, 30, 15000.0, 1490.0)
+    beams = b''
+    for beam, count in enumerate(num_samples):
+        beams += struct.pack('<f4H', -60.0 + beam, 0, count // 2, 0, count)
+        beams += (np.arange(count) - 100).astype('i1').tobytes()
+        if phase_flag == 1:
+            beams += np.full(count, 64, dtype='i1').tobytes()
+        elif phase_flag == 2:
+            beams += np.full(count, 4500, dtype='<i2').tobytes()
+    return make_common(ping_count) + tx_info + sector + rx_info + beams
+
+
+def make_skm(time_sec: int, num_samples: int, roll: float = 1.5) -> bytes:
+    samples = np.zeros(num_samples, dtype=skm_sample_dtype)
+    samples['time_sec'] = time_sec
+    samples['time_nanosec'] = np.arange(num_samples) * 10000000
+    samples['roll'] = roll
+    samples['pitch'] = -2.0
+    samples['heave'] = 0.05
+    samples['heading'] = 359.5
+    return struct.pack('<H2B4H', 12, 1, 0, 0, num_samples, skm_sample_dtype.itemsize, 0) + samples.tobytes()
+
+
+def make_spo(latitude: float, longitude: float) -> bytes:
+    values = np.zeros(1, dtype=spo_dtype)
+    values['num_bytes_cmn_part'] = 8
+    values['latitude'] = latitude
+    values['longitude'] = longitude
+    return values.tobytes() + b'$GPGGA'
+
+
+def make_iip(parameters: str) -> bytes:
+    return struct.pack('<3H', 6, 0, 0) + parameters.encode('ascii') + b'\x00'
+
+
+class TestLibRawKongsbergKmallDgBatch(unittest.TestCase):
+
+    def test_mrz(self):
+        chunks = [make_mrz(7, 4, num_extra=1), make_mrz(8, 3, sector_size=40)]
+        batch = parse_batch(KmallDatagrams.MULTIBEAMRAWRANGEDEPTH, chunks)
+        self.assertEqual(len(batch), 2)
+        self.assertTrue(np.array_equal(batch['ping_count'], [7, 8]))
+        self.assertTrue(np.allclose(batch['absorption'], 45.5))
+        self.assertTrue(np.allclose(batch['seabed_image_sample_rate'], 10000.0))
+        self.assertTrue(np.array_equal(batch.sector_offsets, [0, 2, 4]))
+        self.assertTrue(np.allclose(batch['tx_tilt_angle'], [-1.5, 1.5, -1.5, 1.5]))
+        self.assertTrue(np.array_equal(batch.offsets, [0, 5, 8]))
+        self.assertTrue(np.array_equal(batch['extra_detection'], [False] * 4 + [True] + [False] * 3))
+        self.assertTrue(np.allclose(batch.record('reflectivity_1', 1), [-20.0, -21.0, -22.0]))
+        self.assertTrue(np.array_equal(batch['sounding_index'], [0, 1, 2, 3, 4, 0, 1, 2]))
+        self.assertTrue(np.array_equal(np.diff(batch.sample_offsets), [1, 2, 3, 1, 2, 1, 2, 3]))
+        self.assertTrue(np.allclose(batch['samples'][:3], [-60.0, -60.0, -59.9]))
+        self.assertTrue(np.allclose(batch['samples'][9:], [-30.0, -30.0, -29.9, -30.0, -29.9, -29.8]))
+
+    def test_mrz_short_sectors(self):
+        with self.assertRaises(RuntimeError):
+            parse_batch(KmallDatagrams.MULTIBEAMRAWRANGEDEPTH, [make_mrz(7, 4, sector_size=32)])
+
+    def test_skm(self):
+        batch = parse_batch(KmallDatagrams.ATTITUDE, [make_skm(1554897600, 3), make_skm(1554897601, 2, roll=-0.5)])
+        self.assertTrue(np.array_equal(batch.offsets, [0, 3, 5]))
+        self.assertTrue(np.allclose(batch['roll'], [1.5, 1.5, 1.5, -0.5, -0.5]))
+        self.assertTrue(np.allclose(batch['sample_time'] - 1554897600000.0, [0.0, 10.0, 20.0, 1000.0, 1010.0]))
+
+    def test_spo(self):
+        batch = parse_batch(KmallDatagrams.POSITION, [make_spo(43.125, -70.5)])
+        self.assertTrue(np.allclose(batch['latitude'], 43.125))
+        self.assertTrue(np.allclose(batch['longitude'], -70.5))
+
+    def test_water_column(self):
+        batch = parse_water_column(make_mwc(3, [4, 0, 5]))
+        self.assertEqual(len(batch), 1)
+        self.assertTrue(np.allclose(batch['heave'], 0.25))
+        self.assertTrue(np.allclose(batch['sample_rate'], 15000.0))
+        self.assertTrue(np.allclose(batch['tx_tilt_angle'], -0.5))
+        self.assertTrue(np.array_equal(batch['beam'], [0, 1, 2]))
+        self.assertTrue(np.array_equal(batch.sample_offsets, [0, 4, 4, 9]))
+        self.assertTrue(np.allclose(batch['samples'][4:], [-50.0, -49.5, -49.0, -48.5, -48.0]))
+        self.assertNotIn('phase', batch.data)
+
+    def test_water_column_decimated(self):
+        for phase_flag, phase in ((1, 90.0), (2, 45.0)):
+            batch = parse_water_column(make_mwc(3, [4, 0, 5], phase_flag=phase_flag), beam_step=2, sample_step=2)
+            self.assertTrue(np.array_equal(batch['beam'], [0, 2]))
+            self.assertTrue(np.array_equal(batch.sample_offsets, [0, 2, 5]))
+            self.assertTrue(np.allclose(batch['samples'], [-50.0, -49.0, -50.0, -49.0, -48.0]))
+            self.assertTrue(np.allclose(batch['phase'], phase))
+
+    def test_water_column_truncated(self):
+        with self.assertRaises(RuntimeError):
+            parse_water_column(make_mwc(3, [4, 0, 5])[:-2])
+
+    def test_installation(self):
+        parameters = installation_parameters(make_iip("OSCV:Empty,EMXV:EM2040P,\nSTC=5,"))
+        self.assertEqual(parameters, {'OSCV': 'Empty', 'EMXV': 'EM2040P', 'STC': '5'})
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawKongsbergKmallDgBatch))
+    return s
@@ -0,0 +1,92 @@
+from pathlib import Path
+import unittest
+
+from netCDF4 import Dataset
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.nc_helper import NetCDFHelper
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.imports import RawImport
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.reader import KongsbergKmall
+from hyo2.openbst.lib.raw.snippets import Snippets
+from tests.lib.raw.test_kongsberg_kmall_dg_batch import make_mrz, make_mwc
+from tests.lib.raw.test_kongsberg_kmall_reader import make_partitioned, start_sec
+
+
+class TestLibRawKongsbergKmallImports(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.wcd_path = cls.testing.output_data_folder().joinpath("test_imports.wcd")
+        with open(str(cls.wcd_path), 'wb') as fod:
+            # the second ping is split in 2 partitions, the last one is written ahead of the others
+            parts = [make_partitioned('#MWC', make_mwc(100 + n, [4, 0, 5 + n]), num_partitions=2 if n == 1 else 1,
+                                      time_sec=start_sec + n) for n in range(3)]
+            for part in sum(parts[-1:] + parts[:-1], []):
+                fod.write(part)
+        cls.kmall_path = cls.testing.output_data_folder().joinpath("test_imports.kmall")
+        with open(str(cls.kmall_path), 'wb') as fod:
+            # the second ping has an extra detection, and is split in 2 partitions
+            for n in range(3):
+                for part in make_partitioned('#MRZ', make_mrz(100 + n, 4, num_extra=1 if n == 1 else 0),
+                                             num_partitions=2 if n == 1 else 1, time_sec=start_sec + n):
+                    fod.write(part)
+
+    def test_snippets(self):
+        ds = Dataset("test_imports_kmall.nc", mode='w', diskless=True)
+        NetCDFHelper.init(ds=ds)
+        with KongsbergKmall(self.kmall_path) as raw:
+            raw.data_map()
+            raw.iter_chunk_size = 2  # the last ping in a second slab
+            self.assertTrue(RawImport.get_snippets(raw=raw, ds=ds))
+
+        grp_snippet = ds["snippets"]
+        self.assertEqual(grp_snippet.variables["time"][:].tolist(), [start_sec * 1000.0 + 1000.0 * n for n in range(3)])
+        self.assertEqual(grp_snippet.variables["snippet_count"][:].tolist(), [4, 4, 4])
+        self.assertEqual(grp_snippet.variables["snippet_start_index"][:].tolist(), [0, 4, 8])
+        self.assertEqual(grp_snippet.variables["beam_index"][:].tolist(), [0, 1, 2, 3] * 3)
+        self.assertEqual(grp_snippet.variables["sample_count"][:].tolist(), [1, 2, 3, 1] * 3)
+        self.assertEqual(grp_snippet.variables["sample_start_index"][:].tolist(),
+                         [0, 1, 3, 6, 7, 8, 10, 13, 14, 15, 17, 20])
+        self.assertTrue(np.allclose(grp_snippet.variables["detect_sample"][:4], [190.0, 191.0, 191.0, 190.0]))
+        self.assertTrue(np.allclose(grp_snippet.variables["snippet_end_sample"][:4], [190.0, 191.0, 192.0, 190.0]))
+
+        # the samples of the extra detection of the second ping are not imported
+        ping = Snippets.read_ping(grp_snippet, 2)
+        self.assertTrue(np.allclose(ping.samples[2], [-30.0, -29.9, -29.8]))
+        ping = Snippets.read_ping(grp_snippet, 1)
+        self.assertTrue(np.allclose(ping.samples[3], [-60.0]))
+        self.assertEqual(len(grp_snippet.variables["snippets"]), 21)
+        ds.close()
+
+    def test_water_column(self):
+        ds = Dataset("test_imports_wcd.nc", mode='w', diskless=True)
+        NetCDFHelper.init(ds=ds)
+        with KongsbergKmall(self.wcd_path) as raw:
+            raw.data_map()
+            self.assertTrue(RawImport.import_water_column(raw=raw, ds=ds))
+
+        grp_wc = ds["water_column"]
+        self.assertEqual(grp_wc.variables["ping_number"][:].tolist(), [100, 101, 102])
+        self.assertTrue(np.all(np.diff(grp_wc.variables["time"][:]) > 0))
+        self.assertEqual(grp_wc.variables["beam_count"][:].tolist(), [3, 3, 3])
+        self.assertEqual(grp_wc.variables["beam_start_index"][:].tolist(), [0, 3, 6])
+        self.assertEqual(grp_wc.variables["beam_index"][:].tolist(), [0, 1, 2] * 3)
+        self.assertEqual(grp_wc.variables["sample_count"][:].tolist(), [4, 0, 5, 4, 0, 6, 4, 0, 7])
+        sample_count = grp_wc.variables["sample_count"][:]
+        self.assertEqual(grp_wc.variables["sample_start_index"][:].tolist(),
+                         (np.cumsum(sample_count) - sample_count).tolist())
+        self.assertTrue(np.allclose(grp_wc.variables["beam_pointing_angle"][:3], np.deg2rad([-60.0, -59.0, -58.0])))
+        self.assertTrue(np.allclose(grp_wc.variables["sample_rate"][:], 15000.0))
+
+        # the amplitudes of the last beam of the second ping, in dB
+        start = int(grp_wc.variables["sample_start_index"][5])
+        self.assertTrue(np.allclose(grp_wc.variables["samples"][start:start + 6], (np.arange(6) - 100) * 0.5))
+        ds.close()
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawKongsbergKmallImports))
+    return s
@@ -0,0 +1,167 @@
+import os
+from pathlib import Path
+import struct
+import unittest
+
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall import dg_index
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.dg_formats import KmallDatagrams
+from hyo2.openbst.lib.raw.parsers.kongsberg.kmall.reader import KongsbergKmall, map_files
+from tests.lib.raw.test_kongsberg_kmall_dg_batch import make_iip, make_mrz, make_mwc, make_skm, make_spo
+
+start_sec = 1554897600
+
+
+def make_datagram(dg_type: str, data: bytes, time_sec: int = start_sec, time_nanosec: int = 0,
+                  echo_sounder_id: int = 2040, partition: tuple = None) -> bytes:
+    if partition is not None:
+        data = struct.pack('<2H', *partition) + data
+    num_bytes = 20 + len(data) + 4
+    header = struct.pack('<I4s2BH2I', num_bytes, dg_type.encode('ascii'), 0, 1, echo_sounder_id, time_sec,
+                         time_nanosec)
+    return header + data + struct.pack('<I', num_bytes)
+
+
+def make_partitioned(dg_type: str, data: bytes, num_partitions: int = 1, **kwargs) -> list:
+    """Split the data section of a multibeam datagram in partitions"""
+    bounds = np.linspace(0, len(data), num_partitions + 1).astype(int)
+    return [make_datagram(dg_type, data[bounds[n]:bounds[n + 1]], partition=(num_partitions, n + 1), **kwargs)
+            for n in range(num_partitions)]
+
+
+class TestLibRawKongsbergKmallReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.kmall_path = cls.testing.output_data_folder().joinpath("test_reader.kmall")
+        with open(str(cls.kmall_path), 'wb') as fod:
+            fod.write(make_datagram('#IIP', make_iip("OSCV:Empty,EMXV:EM2040P,")))
+            for n in range(10):
+                fod.write(make_datagram('#SPO', make_spo(43.0 + n * 0.001, -70.0), time_sec=start_sec + n))
+                fod.write(make_datagram('#SKM', make_skm(start_sec + n, 3), time_sec=start_sec + n,
+                                        time_nanosec=500000000))
+                # every third ping is split in 3 partitions
+                for part in make_partitioned('#MRZ', make_mrz(100 + n, 4), num_partitions=3 if n % 3 == 0 else 1,
+                                             time_sec=start_sec + n):
+                    fod.write(part)
+        cls.wcd_path = cls.testing.output_data_folder().joinpath("test_reader.wcd")
+        with open(str(cls.wcd_path), 'wb') as fod:
+            for n in range(4):
+                for part in make_partitioned('#MWC', make_mwc(100 + n, [4, 0, 5]), num_partitions=2 if n == 1 else 1,
+                                             time_sec=start_sec + n):
+                    fod.write(part)
+
+        cls.corrupted_path = cls.testing.output_data_folder().joinpath("test_reader_corrupted.kmall")
+        with open(str(cls.corrupted_path), 'wb') as fod:
+            fod.write(make_datagram('#SPO', make_spo(43.0, -70.0)))
+            bad_closing = bytearray(make_datagram('#SPO', make_spo(44.0, -70.0), time_sec=start_sec + 1))
+            bad_closing[-1] ^= 0xFF
+            fod.write(bytes(bad_closing))
+            fod.write(b'\x30\x00\x00\x00#SPO' * 500)  # corrupted stretch with plausible sizes and types
+            fod.write(make_datagram('#SPO', make_spo(45.0, -70.0), time_sec=start_sec + 2))
+            # the second of two partitions is missing
+            fod.write(make_partitioned('#MRZ', make_mrz(100, 4), num_partitions=2, time_sec=start_sec + 3)[0])
+            fod.write(make_datagram('#SPO', make_spo(46.0, -70.0), time_sec=start_sec + 4)[:-10])  # truncated
+
+    def test_map_table(self):
+        with KongsbergKmall(self.kmall_path) as raw:
+            self.assertTrue(raw.valid)
+            dg_map = raw.data_map()
+            self.assertEqual(dg_map.size, 31)
+            self.assertEqual(raw.index.size, 39)
+            self.assertEqual(int(raw.index['size'].sum()), raw.file_length)
+            pings = raw.get_map(KmallDatagrams.MULTIBEAMRAWRANGEDEPTH)
+            self.assertTrue(np.array_equal(pings['ping_number'], np.arange(100, 110)))
+            self.assertTrue(np.array_equal(pings['num_parts'], [3, 1, 1] * 3 + [3]))
+            self.assertTrue(np.all(np.diff(pings['time']) == 1000.0))
+            self.assertEqual(int(pings['time'][0]), start_sec * 1000)
+            self.assertTrue(np.all(raw.get_map(KmallDatagrams.POSITION)['ping_number'] == dg_index.no_ping))
+            self.assertTrue(np.all(raw.get_map(KmallDatagrams.ATTITUDE)['device_id'] == 2040))
+
+    def test_get_batch(self):
+        with KongsbergKmall(self.kmall_path) as raw:
+            position = raw.get_batch(KmallDatagrams.POSITION, dg_record_range=[3, 1])
+            self.assertTrue(np.allclose(position['latitude'], [43.001, 43.003]))
+
+            attitude = raw.get_batch(KmallDatagrams.ATTITUDE, dg_record_range=[0])
+            self.assertTrue(np.allclose(attitude['sample_time'] - start_sec * 1000.0, [0.0, 10.0, 20.0]))
+
+            pings = raw.get_batch(KmallDatagrams.MULTIBEAMRAWRANGEDEPTH)
+            self.assertTrue(np.array_equal(pings['ping_count'], np.arange(100, 110)))
+            self.assertTrue(np.array_equal(pings.ping_number, np.arange(100, 110)))
+            self.assertTrue(np.array_equal(pings.offsets, np.arange(0, 44, 4)))
+            self.assertTrue(np.allclose(pings['tx_tilt_angle'], [-1.5, 1.5] * 10))
+            self.assertEqual(pings['samples'].size, 70)
+
+            # the reassembled pings decode as the unsplit ones
+            split = raw.get_batch(KmallDatagrams.MULTIBEAMRAWRANGEDEPTH, dg_ping_range=(103, 104))
+            self.assertTrue(np.array_equal(split['reflectivity_1'], pings.record('reflectivity_1', 3).tolist() +
+                                           pings.record('reflectivity_1', 4).tolist()))
+
+    def test_get_installation(self):
+        with KongsbergKmall(self.kmall_path) as raw:
+            installation = raw.get_installation()
+            self.assertEqual(len(installation), 1)
+            self.assertEqual(installation[0][1]['EMXV'], 'EM2040P')
+            self.assertEqual(raw.get_installation(KmallDatagrams.RUNTIMEPARAMETERS), [])
+
+    def test_water_column(self):
+        with KongsbergKmall(self.wcd_path, use_mmap=True) as raw:
+            raw.data_map()
+            self.assertEqual(list(raw.map_types.keys()), [dg_index.kmall_datagram_code[
+                KmallDatagrams.MULTIBEAMWATERCOLUMN]])
+            pings = list(raw.iter_water_column(beam_step=2, dg_ping_range=(101, None)))
+            self.assertEqual(len(pings), 3)
+            self.assertEqual([int(ping.ping_number[0]) for ping in pings], [101, 102, 103])
+            for ping in pings:
+                self.assertTrue(np.array_equal(ping['beam'], [0, 2]))
+                self.assertTrue(np.array_equal(ping.sample_offsets, [0, 4, 9]))
+
+    def test_corrupted_map(self):
+        for use_mmap in (False, True):
+            with KongsbergKmall(self.corrupted_path, use_mmap=use_mmap) as raw:
+                raw.data_map()
+                self.assertEqual(list(raw.map_types.keys()), [dg_index.kmall_datagram_code[KmallDatagrams.POSITION]])
+                position = raw.get_batch(KmallDatagrams.POSITION)
+                self.assertTrue(np.allclose(position['latitude'], [43.0, 45.0]))
+
+    def test_pending_validation(self):
+        with KongsbergKmall(self.kmall_path) as raw:
+            raw.data_map()
+            index = raw.index
+            block = np.frombuffer(raw.read(0, 1050), dtype=np.uint8)
+            checked, pending = dg_index.scan_block(block=block, block_offset=0, owned_size=1000,
+                                                   file_length=raw.file_length)
+            self.assertTrue(np.array_equal(np.concatenate((checked, pending))['offset'],
+                                           index['offset'][index['offset'] < 1000]))
+            self.assertGreater(pending.size, 0)
+            self.assertTrue(np.all(dg_index.validate_records(read=raw.read, index=pending)))
+
+    def test_wrong_extension(self):
+        self.assertFalse(KongsbergKmall(Path("missing.all")).valid)
+        self.assertFalse(KongsbergKmall(Path("missing.kmall")).valid)
+
+    def test_index_sidecar(self):
+        index_paths = [self.testing.output_data_folder().joinpath(name) for name in
+                       ("test_reader_kmall.idx", "test_reader_wcd.idx")]
+        for index_path in index_paths:
+            if index_path.exists():
+                os.remove(str(index_path))
+
+        sizes = map_files([self.kmall_path, self.wcd_path], index_paths, workers=2)
+        self.assertEqual(sizes, [31, 4])
+        self.assertTrue(all(index_path.exists() for index_path in index_paths))
+
+        with KongsbergKmall(self.kmall_path, index_path=index_paths[0]) as raw:
+            key = dg_index.source_key(read=raw.read, file_length=raw.file_length, file_mtime=raw.file_mtime)
+            self.assertEqual(dg_index.load_kmall_index(path=index_paths[0], key=key).size, 39)
+            self.assertTrue(np.array_equal(raw.data_map()['num_parts'], raw.data_map(force=True)['num_parts']))
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawKongsbergKmallReader))
+    return s
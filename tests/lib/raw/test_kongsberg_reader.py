@@ -0,0 +1,158 @@
+import calendar
+from datetime import datetime
+import os
+from pathlib import Path
+import struct
+import unittest
+
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.raw.parsers.kongsberg import dg_index
+from hyo2.openbst.lib.raw.parsers.kongsberg.dg_formats import KongsbergDatagrams
+from hyo2.openbst.lib.raw.parsers.kongsberg.reader import Kongsberg
+from tests.lib.raw.test_kongsberg_dg_batch import make_attitude, make_installation, make_position, \
+    make_range_angle, make_runtime, make_seabed_image
+
+
+def make_datagram(dg_type: int, data: bytes, time_ms: int = 43200000, date: int = 20190410, counter: int = 0,
+                  serial_number: int = 123) -> bytes:
+    body = struct.pack('<2BH2I2H', 0x02, dg_type, 2040, date, time_ms, counter, serial_number) + data
+    checksum = sum(body[1:]) % 65536
+    datagram = body + struct.pack('<BH', 0x03, checksum)
+    return struct.pack('<I', len(datagram)) + datagram
+
+
+def make_ping(n: int, serial_number: int = 123) -> bytes:
+    time_ms = 43200000 + 1000 * n
+    return make_datagram(0x4E, make_range_angle(4), time_ms=time_ms, counter=100 + n,
+                         serial_number=serial_number) + \
+        make_datagram(0x59, make_seabed_image([3, 2, 4, 1], [1, -1, 1, 1]), time_ms=time_ms, counter=100 + n,
+                      serial_number=serial_number)
+
+
+class TestLibRawKongsbergReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.all_path = cls.testing.output_data_folder().joinpath("test_reader.all")
+        with open(str(cls.all_path), 'wb') as fod:
+            fod.write(make_datagram(0x49, make_installation("WLZ=-0.5,SMH=2040,")))
+            fod.write(make_datagram(0x52, make_runtime(), counter=100))
+            for n in range(10):
+                fod.write(make_datagram(0x50, make_position(43.0 + n * 0.001, -70.0), time_ms=43200000 + 1000 * n,
+                                        counter=n))
+                fod.write(make_datagram(0x41, make_attitude(3), time_ms=43200500 + 1000 * n, counter=n))
+                fod.write(make_ping(n))
+            fod.write(make_datagram(0x52, make_runtime(absorption=40.0), time_ms=43205500, counter=105))
+
+        cls.corrupted_path = cls.testing.output_data_folder().joinpath("test_reader_corrupted.all")
+        with open(str(cls.corrupted_path), 'wb') as fod:
+            fod.write(make_datagram(0x50, make_position(43.0, -70.0)))
+            bad_checksum = bytearray(make_datagram(0x50, make_position(44.0, -70.0), time_ms=43201000))
+            bad_checksum[-2] ^= 0xFF
+            fod.write(bytes(bad_checksum))
+            fod.write(b'\x02\x50' * 2000)  # long corrupted stretch with STX and plausible types
+            fod.write(make_datagram(0x50, make_position(45.0, -70.0), time_ms=43202000))
+            fod.write(make_datagram(0x50, make_position(46.0, -70.0), time_ms=43203000)[:-10])  # truncated
+
+    def test_map_table(self):
+        with Kongsberg(self.all_path) as raw:
+            self.assertTrue(raw.valid)
+            dg_map = raw.data_map()
+            self.assertEqual(dg_map.size, 43)
+            self.assertEqual(sorted(raw.map_types.keys()), [0x41, 0x49, 0x4E, 0x50, 0x52, 0x59])
+            self.assertEqual(int(raw.index['size'].sum()), raw.file_length)
+            pings = raw.get_map(KongsbergDatagrams.RAWRANGEANGLE78)
+            self.assertTrue(np.array_equal(pings['ping_number'], np.arange(100, 110)))
+            self.assertTrue(np.all(raw.get_map(KongsbergDatagrams.POSITION)['ping_number'] == dg_index.no_ping))
+            self.assertTrue(np.all(np.diff(pings['time']) == 1000.0))
+
+    def test_query_map(self):
+        with Kongsberg(self.all_path, use_mmap=True) as raw:
+            start = raw.get_map(KongsbergDatagrams.POSITION)['time'][2]
+            self.assertEqual(raw.query_map(KongsbergDatagrams.POSITION, dg_time=(start, start + 2000.0)).size, 3)
+            self.assertEqual(raw.query_map(KongsbergDatagrams.SEABEDIMAGE89, dg_ping_range=(105, None)).size, 5)
+            self.assertEqual(raw.query_map(KongsbergDatagrams.POSITION, device_id=124).size, 0)
+            self.assertEqual(raw.query_map(KongsbergDatagrams.CLOCK).size, 0)
+            with self.assertRaises(RuntimeError):
+                raw.query_map(KongsbergDatagrams.POSITION, dg_record_range=[10])
+
+    def test_get_time(self):
+        expected = (calendar.timegm(datetime(2019, 4, 10).timetuple()) + 43200.5) * 1000.0
+        self.assertEqual(Kongsberg.get_time(20190410, 43200500), expected)
+        self.assertTrue(np.array_equal(Kongsberg.get_time([20190410, 20200229], [43200500, 0]),
+                                       [expected, calendar.timegm(datetime(2020, 2, 29).timetuple()) * 1000.0]))
+
+    def test_get_batch(self):
+        with Kongsberg(self.all_path) as raw:
+            position = raw.get_batch(KongsbergDatagrams.POSITION, dg_record_range=[3, 1])
+            self.assertTrue(np.allclose(position['latitude'], [43.001, 43.003]))
+            self.assertTrue(np.all(np.diff(position.time) > 0))
+
+            runtime = raw.get_batch(KongsbergDatagrams.RUNTIME)
+            self.assertTrue(np.allclose(runtime['absorption'], [35.5, 40.0]))
+            self.assertTrue(np.array_equal(runtime.ping_number, [100, 105]))
+
+            attitude = raw.get_batch(KongsbergDatagrams.ATTITUDE, dg_record_range=[0])
+            self.assertTrue(np.array_equal(attitude.sample_time() - attitude.time[0], [0.0, 10.0, 20.0]))
+
+            pings = raw.get_batch(KongsbergDatagrams.RAWRANGEANGLE78, dg_ping_range=(102, 103))
+            self.assertEqual(len(pings), 2)
+            self.assertTrue(np.array_equal(pings.ping_number, [102, 103]))
+            self.assertTrue(np.array_equal(pings.device_id, [123, 123]))
+
+            snippets = raw.get_batch(KongsbergDatagrams.SEABEDIMAGE89)
+            self.assertEqual(snippets['samples'].size, 100)
+
+    def test_get_installation(self):
+        with Kongsberg(self.all_path) as raw:
+            installation = raw.get_installation()
+            self.assertEqual(len(installation), 1)
+            self.assertEqual(installation[0][1]['SMH'], '2040')
+            self.assertEqual(raw.get_installation(KongsbergDatagrams.INSTALLATIONSTOP), [])
+
+    def test_corrupted_map(self):
+        for use_mmap in (False, True):
+            with Kongsberg(self.corrupted_path, use_mmap=use_mmap) as raw:
+                raw.data_map()
+                self.assertEqual(list(raw.map_types.keys()), [0x50])
+                position = raw.get_batch(KongsbergDatagrams.POSITION)
+                self.assertTrue(np.allclose(position['latitude'], [43.0, 45.0]))
+
+    def test_pending_validation(self):
+        with Kongsberg(self.all_path) as raw:
+            raw.data_map()
+            index = raw.index
+            block = np.frombuffer(raw.read(0, 420), dtype=np.uint8)
+            checked, pending = dg_index.scan_block(block=block, block_offset=0, owned_size=400,
+                                                   file_length=raw.file_length)
+            self.assertTrue(np.array_equal(np.concatenate((checked, pending))['offset'],
+                                           index['offset'][index['offset'] < 400]))
+            self.assertGreater(pending.size, 0)
+            self.assertTrue(np.all(dg_index.validate_records(read=raw.read, index=pending)))
+
+    def test_wrong_extension(self):
+        self.assertFalse(Kongsberg(Path("missing.kmall")).valid)
+        self.assertFalse(Kongsberg(Path("missing.all")).valid)
+
+    def test_index_sidecar(self):
+        index_path = self.testing.output_data_folder().joinpath("test_reader_all.idx")
+        if index_path.exists():
+            os.remove(str(index_path))
+
+        with Kongsberg(self.all_path, index_path=index_path) as raw:
+            dg_map = raw.data_map()
+        self.assertTrue(index_path.exists())
+
+        with Kongsberg(self.all_path, index_path=index_path) as raw:
+            key = dg_index.source_key(read=raw.read, file_length=raw.file_length, file_mtime=raw.file_mtime)
+            self.assertEqual(dg_index.load_all_index(path=index_path, key=key).size, 43)
+            self.assertTrue(np.array_equal(raw.data_map(), dg_map))
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawKongsbergReader))
+    return s
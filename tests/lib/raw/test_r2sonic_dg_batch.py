@@ -0,0 +1,125 @@
+import struct
+import unittest
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.r2sonic.dg_batch import parse_batch
+from hyo2.openbst.lib.raw.parsers.r2sonic.dg_formats import h0_dtype, R2SonicDatagrams, s1_dtype
+
+start_sec = 1554897600
+
+
+def make_section(name: str, payload: bytes) -> bytes:
+    return name.encode('ascii') + struct.pack('>H', 4 + len(payload)) + payload
+
+
+def make_packet(name: str, sections: list) -> bytes:
+    body = b''.join(sections)
+    return name.encode('ascii') + struct.pack('>2I', 12 + len(body), 0) + body
+
+
+def make_h0(ping_number: int, points: int, time_sec: int = start_sec) -> bytes:
+    values = np.zeros(1, dtype=h0_dtype)
+    values['model_number'] = b'2024'
+    values['time_seconds'] = time_sec
+    values['time_nanoseconds'] = 250000000
+    values['ping_number'] = ping_number
+    values['sound_speed'] = 1500.0
+    values['frequency'] = 400000.0
+    values['tx_power'] = 221.0
+    values['tx_pulse_width'] = 0.00005
+    values['tx_beamwidth_vert'] = np.deg2rad(1.0)
+    values['tx_steering_vert'] = np.deg2rad(2.0)
+    values['rx_sample_rate'] = 60000.0
+    values['rx_gain'] = 10.0
+    values['rx_spreading'] = 30.0
+    values['rx_absorption'] = 90.0
+    values['points'] = points
+    return make_section('H0', values.tobytes())
+
+
+def make_bth0(ping_number: int, points: int, angle_steps: bool = False, intensity: bool = True,
+              time_sec: int = start_sec) -> bytes:
+    sections = [make_h0(ping_number, points, time_sec=time_sec),
+                make_section('X9', b'\x00' * 6),  # unknown section, skipped
+                make_section('R0', struct.pack('>f', 1e-5) + (np.arange(points) + 1000).astype('>u2').tobytes())]
+    if angle_steps:
+        steps = np.full(points, 10, dtype='>u2')
+        steps[0] = 0
+        sections.append(make_section('A2', struct.pack('>8f', -1.0, 0.001, *[0.0] * 6) + steps.tobytes()))
+    else:
+        sections.append(make_section('A0', struct.pack('>8f', -1.0, 1.0, *[0.0] * 6)))
+    if intensity:
+        sections.append(make_section('I1', struct.pack('>f', 0.5) + (np.arange(points) + 2000).astype('>u2')
+                                     .tobytes()))
+    gates = np.zeros(points, dtype='u1, u1')
+    gates['f0'] = 10
+    gates['f1'] = 30
+    sections.append(make_section('G1', struct.pack('>f', 1e-4) + gates.tobytes()))
+    quality = np.zeros((points + 7) // 8 * 8, dtype=np.uint32)
+    quality[:points] = np.arange(points) % 16
+    words = (quality.reshape(-1, 8) << (4 * np.arange(8, dtype=np.uint32))).sum(axis=1).astype('>u4')
+    sections.append(make_section('Q0', words.tobytes()))
+    return make_packet('BTH0', sections)
+
+
+def make_sni0(ping_number: int, beam: int, num_samples: int, time_sec: int = start_sec) -> bytes:
+    snippet = np.zeros(1, dtype=s1_dtype)
+    snippet['beam_number'] = beam
+    snippet['num_samples'] = num_samples
+    snippet['first_sample'] = 100 + beam
+    snippet['bottom_sample'] = 100 + beam + num_samples // 2
+    snippet['angle'] = -0.5
+    snippet['scaling_factor'] = 10.0
+    samples = (np.arange(num_samples) + 1).astype('>u2')
+    return make_packet('SNI0', [make_h0(ping_number, 4, time_sec=time_sec),
+                                make_section('S1', snippet.tobytes() + samples.tobytes())])
+
+
+class TestLibRawR2SonicDgBatch(unittest.TestCase):
+
+    def test_bathy(self):
+        batch = parse_batch(R2SonicDatagrams.BATHY, [make_bth0(7, 5), make_bth0(8, 11, angle_steps=True)])
+        self.assertEqual(len(batch), 2)
+        self.assertTrue(np.array_equal(batch['ping_number'], [7, 8]))
+        self.assertTrue(np.allclose(batch['ping_time'], start_sec * 1000.0 + 250.0))
+        self.assertEqual(batch['model_number'][0], b'2024')
+        self.assertTrue(np.array_equal(batch.offsets, [0, 5, 16]))
+        self.assertTrue(np.array_equal(batch['beam'][:6], [0, 1, 2, 3, 4, 0]))
+        self.assertTrue(np.allclose(batch.record('two_way_travel_time', 0), [0.01, 0.01001, 0.01002, 0.01003,
+                                                                             0.01004]))
+        self.assertTrue(np.allclose(batch.record('angle', 0), [-1.0, -0.5, 0.0, 0.5, 1.0]))
+        self.assertTrue(np.allclose(batch.record('angle', 1)[:3], [-1.0, -0.99, -0.98]))
+        self.assertTrue(np.allclose(batch.record('intensity', 1)[:2], [1000.0, 1000.5]))
+        self.assertTrue(np.allclose(batch['gate_min'], 0.001))
+        self.assertTrue(np.allclose(batch['gate_max'], 0.003))
+        self.assertTrue(np.array_equal(batch.record('quality', 1), np.arange(11) % 16))
+
+    def test_bathy_missing_section(self):
+        batch = parse_batch(R2SonicDatagrams.BATHY, [make_bth0(7, 3, intensity=False), make_bth0(8, 2)])
+        self.assertTrue(np.all(np.isnan(batch.record('intensity', 0))))
+        self.assertTrue(np.allclose(batch.record('intensity', 1), [1000.0, 1000.5]))
+
+    def test_bathy_invalid(self):
+        packet = bytearray(make_bth0(7, 5))
+        packet[12 + 2:12 + 4] = struct.pack('>H', 2)  # H0 section shorter than its name and size
+        with self.assertRaises(RuntimeError):
+            parse_batch(R2SonicDatagrams.BATHY, [bytes(packet)])
+        with self.assertRaises(RuntimeError):
+            parse_batch(R2SonicDatagrams.BATHY, [make_bth0(7, 5)[:-2]])  # Q0 section past the packet end
+        with self.assertRaises(RuntimeError):
+            parse_batch(R2SonicDatagrams.BATHY, [make_sni0(7, 0, 4)])
+
+    def test_snippet(self):
+        batch = parse_batch(R2SonicDatagrams.SNIPPET, [make_sni0(7, 0, 4), make_sni0(7, 1, 3)])
+        self.assertTrue(np.array_equal(batch['beam_number'], [0, 1]))
+        self.assertTrue(np.array_equal(batch['first_sample'], [100, 101]))
+        self.assertTrue(np.array_equal(batch['bottom_sample'], [102, 102]))
+        self.assertTrue(np.array_equal(batch.sample_offsets, [0, 4, 7]))
+        self.assertTrue(np.allclose(batch['samples'], [10.0, 20.0, 30.0, 40.0, 10.0, 20.0, 30.0]))
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawR2SonicDgBatch))
+    return s
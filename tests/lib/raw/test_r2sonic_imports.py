@@ -0,0 +1,103 @@
+import os
+from pathlib import Path
+import unittest
+
+from netCDF4 import Dataset
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.nc_helper import NetCDFHelper
+from hyo2.openbst.lib.raw.parsers.r2sonic.imports import RawImport
+from hyo2.openbst.lib.raw.parsers.r2sonic.reader import R2Sonic
+from hyo2.openbst.lib.raw.raw_formats import RawFormatType
+from hyo2.openbst.lib.raw.raws import Raws
+from tests.lib.raw.test_r2sonic_dg_batch import make_bth0, make_sni0, start_sec
+from tests.lib.raw.test_reson_dg_formats import make_1016
+from tests.lib.raw.test_reson_imports import make_pings
+from tests.lib.raw.test_reson_reader import make_heading, make_position, make_record
+
+vendor_record_type = 30000  # s7k record type carrying the R2Sonic packets
+
+
+def make_r2sonic_pings(num_pings: int) -> list:
+    records = list()
+    for n in range(num_pings):
+        records.append(make_position(seconds=float(n)))
+        records.append(make_record(1016, make_1016(num_samples=3, first=n), seconds=n + 0.1))
+        records.append(make_heading(seconds=n + 0.1, heading=0.1 * n))
+        records.append(make_record(vendor_record_type, make_bth0(100 + n, 8, time_sec=start_sec + n),
+                                   seconds=n + 0.2))
+        for beam in range(3):
+            # the H0 time of the last packet of ping 2 differs from the other packets of the ping
+            time_sec = start_sec + n + (1 if n == 2 and beam == 2 else 0)
+            records.append(make_record(vendor_record_type, make_sni0(100 + n, beam, 4 + beam, time_sec=time_sec),
+                                       seconds=n + 0.2))
+    # the snippets of a ping without BTH0 packet
+    records.append(make_record(vendor_record_type, make_sni0(200, 5, 2), seconds=num_pings + 0.5))
+    return records
+
+
+class TestLibRawR2SonicImports(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.s7k_path = cls.testing.output_data_folder().joinpath("test_imports_r2sonic.s7k")
+        with open(str(cls.s7k_path), 'wb') as fod:
+            fod.write(b''.join(make_r2sonic_pings(num_pings=4)))
+        cls.reson_path = cls.testing.output_data_folder().joinpath("test_imports_reson.s7k")
+        with open(str(cls.reson_path), 'wb') as fod:
+            fod.write(b''.join(make_pings(num_pings=3)))
+
+    def test_import_raw(self):
+        ds = Dataset("test_imports_r2sonic.nc", mode='w', diskless=True)
+        NetCDFHelper.init(ds=ds)
+        with R2Sonic(self.s7k_path) as raw:
+            raw.data_map()
+            raw.iter_chunk_size = 4  # the snippets in slabs of one or more whole pings
+            self.assertTrue(RawImport.import_raw(raw=raw, ds=ds))
+
+        grp_bathy = ds["raw_bathymetry_data"]
+        self.assertEqual(grp_bathy.variables["detect_point"].shape, (4, 512))
+        self.assertTrue(np.allclose(grp_bathy.variables["detect_point"][1, :2], [600.0, 600.6]))
+        self.assertTrue(np.ma.is_masked(grp_bathy.variables["detect_point"][1, 8]))
+        self.assertAlmostEqual(float(grp_bathy.variables["bs_beam_average"][0, 0]), 60.0, places=4)
+        self.assertTrue(np.allclose(grp_bathy.variables["sample_rate"][:], 60000.0))
+        self.assertTrue(np.allclose(ds["runtime_settings"].variables["frequency"][:], 400000.0))
+        self.assertEqual(ds["position"].variables["latitude"].shape, (4,))
+
+        # the snippets grouped by ping number, with the time of the BTH0 records (as the other groups)
+        grp_snippet = ds["snippets"]
+        self.assertEqual(grp_snippet.variables["snippet_count"][:].tolist(), [3, 3, 3, 3, 1])
+        self.assertTrue(np.array_equal(grp_snippet.variables["time"][:4], grp_bathy.variables["time"][:]))
+        self.assertGreater(float(grp_snippet.variables["time"][4]), float(grp_bathy.variables["time"][3]))
+        self.assertEqual(grp_snippet.variables["beam_index"][6:10].tolist(), [0, 1, 2, 0])
+        self.assertEqual(grp_snippet.variables["snippet_start_sample"][6:9].tolist(), [100.0, 101.0, 102.0])
+        self.assertEqual(grp_snippet.variables["detect_sample"][6:9].tolist(), [102.0, 103.0, 105.0])
+        self.assertEqual(grp_snippet.variables["snippet_end_sample"][6:9].tolist(), [103.0, 105.0, 107.0])
+        self.assertEqual(grp_snippet.variables["sample_count"][6:9].tolist(), [4, 5, 6])
+        ds.close()
+
+    def test_raws_dialect(self):
+        self.assertIs(RawFormatType.retrieve_format_type(path=self.s7k_path), RawFormatType.R2SONIC_S7K)
+        self.assertIs(RawFormatType.retrieve_format_type(path=self.reson_path), RawFormatType.RESON_S7K)
+
+        raws_path = self.testing.output_data_folder().joinpath("test_raws")
+        os.makedirs(str(raws_path), exist_ok=True)
+        raws = Raws(raws_path=raws_path)
+        for path, sample_datatype in ((self.s7k_path, np.float32), (self.reson_path, np.uint16)):
+            raws.remove_raw(path)
+            self.assertTrue(raws.add_raw(path))
+            self.assertTrue(raws.import_raw(path))
+
+            ds = Dataset(str(raws_path.joinpath(NetCDFHelper.hash_string(str(path)) + Raws.ext)))
+            self.assertEqual(ds["snippets"].variables["snippets"].dtype, sample_datatype)
+            self.assertIn("raw_bathymetry_data", ds.groups)
+            ds.close()
+            raws.remove_raw(path)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawR2SonicImports))
+    return s
@@ -0,0 +1,89 @@
+from pathlib import Path
+import unittest
+
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.raw.parsers.r2sonic.dg_formats import R2SonicDatagrams, r2sonic_datagram_code
+from hyo2.openbst.lib.raw.parsers.r2sonic.reader import detect_dialect, R2Sonic
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams
+from hyo2.openbst.lib.raw.raw_formats import RawFormatType
+from tests.lib.raw.test_r2sonic_dg_batch import make_bth0, make_sni0, start_sec
+from tests.lib.raw.test_reson_reader import make_heading, make_position, make_record
+
+vendor_record_type = 30000  # s7k record type carrying the R2Sonic packets
+
+
+class TestLibRawR2SonicReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.r2sc_path = cls.testing.output_data_folder().joinpath("test_reader.r2sc")
+        with open(str(cls.r2sc_path), 'wb') as fod:
+            for n in range(6):
+                fod.write(make_position(seconds=float(n)))
+                fod.write(make_heading(seconds=n + 0.1, heading=0.1 * n))
+                fod.write(make_record(vendor_record_type, make_bth0(100 + n, 8, time_sec=start_sec + n),
+                                      seconds=n + 0.2))
+                for beam in range(3):
+                    fod.write(make_record(vendor_record_type, make_sni0(100 + n, beam, 4, time_sec=start_sec + n),
+                                          seconds=n + 0.2))
+            fod.write(make_record(vendor_record_type, b'NOT0' + b'\x00' * 20, seconds=7.0))  # other payload
+
+        cls.s7k_path = cls.testing.output_data_folder().joinpath("test_reader_dialect.s7k")
+        with open(str(cls.s7k_path), 'wb') as fod:
+            for n in range(3):
+                fod.write(make_position(seconds=float(n)))
+                fod.write(make_record(vendor_record_type, b'NOT0' + b'\x00' * 20, seconds=n + 0.5))
+
+    def test_map_table(self):
+        with R2Sonic(self.r2sc_path) as raw:
+            self.assertTrue(raw.valid)
+            dg_map = raw.data_map()
+            self.assertEqual(dg_map.size, 37)
+            self.assertIs(raw.dialect, RawFormatType.R2SONIC_S7K)
+            self.assertEqual(sorted(raw.map_types.keys()), sorted([1003, 1013, vendor_record_type] + [
+                r2sonic_datagram_code[dg_type] for dg_type in R2SonicDatagrams]))
+            pings = raw.get_map(R2SonicDatagrams.BATHY)
+            self.assertTrue(np.array_equal(pings['ping_number'], np.arange(100, 106)))
+            self.assertEqual(raw.get_map(R2SonicDatagrams.SNIPPET).size, 18)
+            self.assertEqual(raw.get_map(ResonDatagrams.POSITION).size, 6)
+
+    def test_get_batch(self):
+        with R2Sonic(self.r2sc_path, use_mmap=True) as raw:
+            pings = raw.get_batch(R2SonicDatagrams.BATHY, dg_ping_range=(102, 103))
+            self.assertTrue(np.array_equal(pings.ping_number, [102, 103]))
+            self.assertTrue(np.allclose(pings['ping_time'], [(start_sec + 2) * 1000.0 + 250.0,
+                                                             (start_sec + 3) * 1000.0 + 250.0]))
+            self.assertEqual(pings['beam'].size, 16)
+
+            snippets = raw.get_batch(R2SonicDatagrams.SNIPPET, dg_ping_range=(105, None))
+            self.assertTrue(np.array_equal(snippets['beam_number'], [0, 1, 2]))
+            self.assertEqual(snippets['samples'].size, 12)
+
+            headings = raw.get_batch(ResonDatagrams.HEADING)
+            self.assertTrue(np.allclose(headings['heading'], 0.1 * np.arange(6)))
+
+    def test_dialect(self):
+        with R2Sonic(self.s7k_path) as raw:
+            raw.data_map()
+            self.assertIs(raw.dialect, RawFormatType.RESON_S7K)
+            self.assertEqual(raw.get_map(R2SonicDatagrams.BATHY).size, 0)
+            self.assertIs(detect_dialect(read=raw.read, file_length=raw.file_length), RawFormatType.RESON_S7K)
+
+        with R2Sonic(self.r2sc_path) as raw:
+            self.assertIs(detect_dialect(read=raw.read, file_length=raw.file_length), RawFormatType.R2SONIC_S7K)
+            size = len(make_position(seconds=0.0)) + len(make_heading(seconds=0.1, heading=0.0))
+            self.assertIs(detect_dialect(read=raw.read, file_length=raw.file_length, size=size),
+                          RawFormatType.RESON_S7K)  # only the first position and heading records
+
+    def test_wrong_extension(self):
+        self.assertFalse(R2Sonic(Path("missing.all")).valid)
+        self.assertFalse(R2Sonic(Path("missing.r2sc")).valid)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawR2SonicReader))
+    return s
@@ -0,0 +1,167 @@
+import struct
+import unittest
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.batch import join_batches
+from hyo2.openbst.lib.raw.parsers.reson.dg_batch import parse_batch, SettingsEpochs
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams, Data7000, Data7004, Data7010, Data7027
+from tests.lib.raw.test_reson_dg_formats import make_1016, make_7012, make_7027, make_7028
+
+
+def make_7000(ping_number: int, frequency: float) -> bytes:
+    values = [7125, ping_number, 0, frequency, 34482.0, 1000.0, 0.0002, 0, 0, 0.0, 0, 0, 50.0, 0.1, 100.0, 220.0,
+              20.0, 0, 0, 0.0, 0.0, 0.01, 0.02, 100.0, 0, 0.0, 0, 0, 0, 0.0, 1, 0.005, 1.0, 200.0, 1.0, 200.0, 30.0,
+              1500.0, 40.0, 0]
+    return struct.pack('<QIH4f2If2H5f2I5fIf3IfI8fH', *values)
+
+
+def make_7004(num_beams: int) -> bytes:
+    values = np.arange(4 * num_beams, dtype='<f4')
+    return struct.pack('<QI', 7125, num_beams) + values.tobytes()
+
+
+def make_7010(num_samples: int) -> bytes:
+    return struct.pack('<QIHI8I', 7125, 1, 0, num_samples, *([0] * 8)) + \
+        np.linspace(0.0, 1.0, num_samples, dtype='<f4').tobytes()
+
+
+class TestLibRawResonDgBatch(unittest.TestCase):
+
+    def test_batch_7000(self):
+        chunks = [make_7000(n, 200000.0 + n) for n in range(3)]
+        batch = parse_batch(ResonDatagrams.SONARSETTINGS, chunks=chunks)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch['ping_number'].tolist(), [0, 1, 2])
+        self.assertEqual(batch['frequency'].tolist(), [Data7000(chunk).frequency for chunk in chunks])
+        self.assertEqual(batch['sound_velocity'].tolist(), [1500.0] * 3)
+
+    def test_batch_1016(self):
+        chunks = [make_1016(3, first=0), make_1016(0), make_1016(2, first=3)]
+        batch = parse_batch(ResonDatagrams.ATTITUDE, chunks=chunks)
+        batch.time = np.array([100000.0, 101000.0, 102000.0])
+        self.assertEqual(batch.offsets.tolist(), [0, 3, 3, 5])
+        self.assertEqual(batch['roll'].tolist(), [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(batch['roll'].dtype, np.float32)
+        self.assertTrue(np.allclose(batch.sample_time(), [100000.0, 100010.0, 100020.0, 102000.0, 102010.0]))
+
+    def test_batch_7004(self):
+        for beams in ([3, 3], [3, 5, 0]):
+            chunks = [make_7004(num_beams) for num_beams in beams]
+            batch = parse_batch(ResonDatagrams.BEAMGEO, chunks=chunks)
+            self.assertEqual(batch['rx_angle_vertical'].shape, (len(beams), max(beams)))
+            for n, chunk in enumerate(chunks):
+                dg = Data7004(chunk)
+                for name in ('rx_angle_vertical', 'rx_beam_width_across'):
+                    self.assertEqual(batch[name][n, :beams[n]].tolist(), list(getattr(dg, name)))
+                    self.assertTrue(np.all(np.isnan(batch[name][n, beams[n]:])))
+
+    def test_batch_7010(self):
+        chunks = [make_7010(num_samples) for num_samples in (10, 0, 4)]
+        batch = parse_batch(ResonDatagrams.TVG, chunks=chunks)
+        self.assertEqual(batch.offsets.tolist(), [0, 10, 10, 14])
+        for n, chunk in enumerate(chunks):
+            self.assertEqual(batch.record('tvg_curve', n).tolist(), list(Data7010(chunk).tvg_curve))
+
+    def test_batch_7012(self):
+        chunks = [make_7012(3, flags=0x0F), make_7012(2, flags=0x0A, first=10)]
+        batch = parse_batch(ResonDatagrams.PINGMOTIONDATA, chunks=chunks)
+        batch.time = np.array([10000.0, 20000.0])
+        self.assertEqual(batch.offsets.tolist(), [0, 3, 5])
+        self.assertEqual(batch['pitch'][0], -1.0)
+        self.assertTrue(np.isnan(batch['pitch'][1]))
+        self.assertEqual(batch['roll'].tolist(), [0.0, 1.0, 2.0, 10.0, 11.0])
+        self.assertTrue(np.all(np.isnan(batch['heading'][3:])))
+        self.assertTrue(np.allclose(batch['heave'], [0.2, 1.2, 2.2, 10.2, 11.2]))
+        self.assertTrue(np.allclose(batch.sample_time(), [10000.0, 10010.0, 10020.0, 20000.0, 20010.0]))
+
+    def test_batch_7027(self):
+        for field_sizes in ((34, 34), (22, 34, 26)):
+            chunks = [make_7027([n, n + 2, n + 4], data_field_size) for n, data_field_size in enumerate(field_sizes)]
+            batch = parse_batch(ResonDatagrams.RAWDETECTDATA, chunks=chunks)
+            self.assertEqual(batch['ping_number'].tolist(), [42] * len(chunks))
+            for n, chunk in enumerate(chunks):
+                dg = Data7027(chunk)
+                self.assertEqual(batch.record('beam', n).tolist(), dg.beam.tolist())
+                self.assertEqual(batch.record('detect_point', n).tolist(), dg.detect_point.tolist())
+                if dg.min_limit is not None:
+                    self.assertEqual(batch.record('min_limit', n).tolist(), dg.min_limit.tolist())
+                elif len(set(field_sizes)) > 1:
+                    self.assertTrue(np.all(np.isnan(batch.record('min_limit', n))))
+
+            detect_point = batch.to_beams('detect_point', num_beams=8)
+            self.assertEqual(detect_point[1, 3], 103.0)
+            self.assertTrue(np.isnan(detect_point[1, 0]))
+
+    def test_batch_7028(self):
+        snippets = [(3, 100, [1, 2, 3]), (4, 90, [4, 5, 6, 7, 8])]
+        for flags in ((0, 0), (1, 1), (0, 1)):
+            chunks = [make_7028(snippets, flags=flag) for flag in flags] + [make_7028([], flags=flags[0])]
+            batch = parse_batch(ResonDatagrams.SNIPPETDATA, chunks=chunks)
+            self.assertEqual(batch.offsets.tolist(), [0, 2, 4, 4])
+            self.assertEqual(batch.sample_offsets.tolist(), [0, 3, 8, 11, 16])
+            self.assertEqual(batch['samples'].tolist(), [1, 2, 3, 4, 5, 6, 7, 8] * 2)
+            self.assertEqual(batch['beam_number'].tolist(), [3, 4, 3, 4])
+            self.assertEqual(batch['samples'].dtype, np.uint16 if flags == (0, 0) else np.uint32)
+
+    def test_settings_epochs(self):
+        # pings 0-1: 200 kHz, pings 2-3: 400 kHz, ping 4: 200 kHz again; the geometry changes at ping 3
+        frequencies = [200000.0, 200000.0, 400000.0, 400000.0, 200000.0]
+        settings = parse_batch(ResonDatagrams.SONARSETTINGS,
+                               chunks=[make_7000(n, frequency) for n, frequency in enumerate(frequencies)])
+        settings.time = np.arange(5) * 1000.0
+        beam_geometry = parse_batch(ResonDatagrams.BEAMGEO, chunks=[make_7004(3), make_7004(5)])
+        beam_geometry.time = np.array([0.0, 3000.0])
+
+        epochs = SettingsEpochs.from_batches(settings, beam_geometry)
+        self.assertEqual(epochs.starts.tolist(), [0, 2, 3, 4])
+        self.assertEqual(epochs.start_time.tolist(), [0.0, 2000.0, 3000.0, 4000.0])
+        self.assertEqual(epochs.settings.size, 2)
+        self.assertNotIn('ping_number', epochs.settings.dtype.names)
+        self.assertEqual(epochs.settings_index().tolist(), [0, 0, 1, 1, 0])
+        self.assertEqual(epochs.geometry_index([0, 2, 3, 4]).tolist(), [0, 0, 1, 1])
+        self.assertEqual(epochs.ping_settings()['frequency'].tolist(), frequencies)
+        self.assertEqual(epochs.geometry['num_rx_beams'].tolist(), [3, 5])
+        self.assertTrue(np.array_equal(epochs.ping_geometry('rx_angle_vertical', [1, 4]),
+                                       [[0.0, 1.0, 2.0, np.nan, np.nan], [0.0, 1.0, 2.0, 3.0, 4.0]], equal_nan=True))
+
+        # no beam geometry before the first 7004 record
+        beam_geometry.time = np.array([500.0, 3000.0])
+        epochs = SettingsEpochs.from_batches(settings, beam_geometry)
+        self.assertEqual(epochs.starts.tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(epochs.geometry_index().tolist(), [-1, 0, 0, 1, 1])
+        self.assertRaises(RuntimeError, epochs.ping_geometry, 'rx_angle_vertical', [0, 1])
+        self.assertEqual(epochs.ping_geometry('rx_angle_vertical', [1, 2]).shape, (2, 5))
+
+        epochs = SettingsEpochs.from_batches(settings)
+        self.assertEqual(epochs.starts.tolist(), [0, 2, 4])
+        self.assertRaises(RuntimeError, epochs.ping_geometry, 'rx_angle_vertical')
+
+    def test_join_batches(self):
+        chunks = [make_1016(num_samples, first=10 * n) for n, num_samples in enumerate((2, 3, 1, 4))]
+        expected = parse_batch(ResonDatagrams.ATTITUDE, chunks=chunks)
+        # decoded by parts, out of row order
+        parts = [(np.array([3, 1]), parse_batch(ResonDatagrams.ATTITUDE, chunks=[chunks[3], chunks[1]])),
+                 (np.array([0, 2]), parse_batch(ResonDatagrams.ATTITUDE, chunks=[chunks[0], chunks[2]]))]
+        joined = join_batches(parts)
+        self.assertTrue(np.array_equal(joined.header, expected.header))
+        self.assertEqual(joined.offsets.tolist(), expected.offsets.tolist())
+        for name in ('time_offset', 'roll', 'heading'):
+            self.assertTrue(np.array_equal(joined[name], expected[name]))
+
+    def test_batch_buffer(self):
+        chunks = [make_7010(num_samples) for num_samples in (10, 4)]
+        buffer = b'\x00' * 7 + chunks[0] + b'\x00' * 3 + chunks[1]
+        batch = parse_batch(ResonDatagrams.TVG, buffer=buffer, offsets=[7, 7 + len(chunks[0]) + 3],
+                            sizes=[len(chunk) for chunk in chunks])
+        self.assertEqual(batch['num_samples'].tolist(), [10, 4])
+        self.assertEqual(batch.record('tvg_curve', 1).tolist(), list(Data7010(chunks[1]).tvg_curve))
+
+        self.assertRaises(RuntimeError, parse_batch, ResonDatagrams.TVG, chunks=[chunks[0][:-4]])
+        self.assertRaises(RuntimeError, parse_batch, ResonDatagrams.BEAMFORMEDDATA, chunks=[])
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawResonDgBatch))
+    return s
@@ -0,0 +1,176 @@
+from pathlib import Path
+import os
+import struct
+import unittest
+
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.raw.parsers.reson import dg_demux, dg_index
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams
+from hyo2.openbst.lib.raw.parsers.reson.reader import Reson7k
+from tests.lib.raw.test_reson_reader import make_heading, make_ping_record, make_position, make_record
+
+
+def make_records() -> list:
+    records = list()
+    for n in range(6):
+        records.append(make_position(seconds=float(n)))
+        records.append(make_heading(seconds=n + 0.5, heading=0.1 * n))
+        records.append(make_ping_record(7010, seconds=n + 0.6, ping_number=100 + n))
+    records.append(make_record(7999, bytes(range(256)) * 10, seconds=9.0))  # larger than a network packet
+    return records
+
+
+def make_frames(payload: bytes, transmission_id: int, packet_size: int = 1000) -> bytes:
+    packets = [payload[start:start + packet_size] for start in range(0, len(payload), packet_size)]
+    frames = list()
+    for sequence, packet in enumerate(packets):
+        frames.append(dg_demux.network_frame.pack(5, 36, len(packets), 1, transmission_id, 36 + len(packet),
+                                                  36 * len(packets) + len(payload), sequence, 0, 0, 0, 7125))
+        frames.append(packet)
+    return b''.join(frames)
+
+
+def make_network(records: list) -> bytes:
+    return b''.join(make_frames(record, transmission_id=n % 65536) for n, record in enumerate(records))
+
+
+def make_hypack(capture: bytes, block_size: int = 333) -> bytes:
+    blocks = [capture[start:start + block_size] for start in range(0, len(capture), block_size)]
+    return b''.join(struct.pack('<I', len(block)) + block for block in blocks)
+
+
+def make_fragments(record: bytes, total: int) -> list:
+    data = record[64:-4]
+    size = -(-len(data) // total)
+    fragments = list()
+    for number in range(total):
+        part = data[number * size:(number + 1) * size]
+        header = bytearray(record[:64])
+        struct.pack_into('<I', header, 8, 64 + len(part) + 4)
+        struct.pack_into('<2I', header, 56, total, number)
+        fragments.append(bytes(header) + part + bytes(4))
+    return fragments
+
+
+def run_demux(capture: bytes, framing: str, chunk_size: int = 7, **kwargs) -> tuple:
+    chunks = [capture[start:start + chunk_size] for start in range(0, len(capture), chunk_size)]
+    written = list()
+    stats = dg_demux.DemuxStats()
+    index = dg_demux.demux(chunks, write=written.append, framing=framing, stats=stats, **kwargs)
+    return b''.join(written), index, stats
+
+
+class TestLibRawResonDgDemux(unittest.TestCase):
+
+    def assert_records(self, capture: bytes, framing: str, records: list):
+        clean, index, stats = run_demux(capture, framing=framing, write_size=500)
+        self.assertEqual(clean, b''.join(records))
+        self.assertEqual(stats.records, len(records))
+        self.assertEqual(stats.skipped, 0)
+        expected = dg_index.build_index(read=lambda location, size: clean[location:location + size],
+                                        file_length=len(clean))
+        self.assertTrue(np.array_equal(index, expected))
+
+    def test_framing(self):
+        records = make_records()
+        network = make_network(records)
+        self.assertEqual(dg_demux.detect_framing(b''.join(records)), 'records')
+        self.assertEqual(dg_demux.detect_framing(network), 'network')
+        self.assertEqual(dg_demux.detect_framing(make_hypack(network)), 'hypack')
+        self.assertIsNone(dg_demux.detect_framing(b'\x00' * 100))
+
+    def test_network(self):
+        records = make_records()
+        self.assert_records(make_network(records), framing='network', records=records)
+        self.assert_records(b''.join(records), framing='records', records=records)
+
+    def test_hypack(self):
+        records = make_records()
+        # the Hypack blocks split the network frames and the records at any byte
+        self.assert_records(make_hypack(make_network(records)), framing='hypack', records=records)
+        self.assert_records(make_hypack(make_network(records), block_size=4096), framing='hypack', records=records)
+
+    def test_fragments(self):
+        records = make_records()
+        fragmented = records[:3] + make_fragments(records[-1], total=3) + records[3:-1]
+        clean, index, stats = run_demux(make_network(fragmented), framing='network')
+        self.assertEqual(stats.fragments, 3)
+        self.assertEqual(clean, b''.join(records[:3] + [records[-1]] + records[3:-1]))
+        self.assertEqual(index['record_type'][3], 7999)
+
+    def test_corrupted(self):
+        records = make_records()
+        frames = [make_frames(record, transmission_id=n) for n, record in enumerate(records)]
+        frames[2] = b'\x01\x02\x03' + frames[2]  # garbage between frames
+        frames[-1] = frames[-1][:1036]  # incomplete transmission, its first packet only
+        clean, index, stats = run_demux(b''.join(frames), framing='network')
+        self.assertEqual(clean, b''.join(records[:-1]))
+        self.assertEqual(stats.skipped, 3)
+        self.assertEqual(stats.dropped, 1000)
+
+        garbled = bytearray(b''.join(records))
+        garbled[len(records[0]) + 4] = 0  # broken sync pattern of the second record
+        clean, index, stats = run_demux(bytes(garbled), framing='records')
+        self.assertEqual(clean, b''.join(records[:1] + records[2:]))
+        self.assertEqual(stats.skipped, len(records[1]))
+
+    def test_pending_bound(self):
+        records = make_records()
+        # the first packet of a transmission, then a whole one exceeding the bound with it
+        first = make_frames(records[-1], transmission_id=1)
+        second = make_frames(records[-1], transmission_id=2)
+        stats = dg_demux.DemuxStats()
+        payloads = list(dg_demux.network_payloads(dg_demux.ByteStream([first[:1036] + second]), stats=stats,
+                                                  max_pending=2500))
+        self.assertEqual(payloads, [records[-1]])
+        self.assertEqual(stats.dropped, 1000)
+
+
+class TestLibRawResonReader7k(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.records = make_records()
+        cls.capture_path = cls.testing.output_data_folder().joinpath("test_reader.7k")
+        cls.records_path = cls.testing.output_data_folder().joinpath("test_reader_demuxed.s7k")
+        with open(str(cls.capture_path), 'wb') as fod:
+            fod.write(make_hypack(make_network(cls.records)))
+
+    def test_demux(self):
+        if self.records_path.exists():
+            os.remove(str(self.records_path))
+        with Reson7k(self.capture_path, records_path=self.records_path) as raw:
+            self.assertTrue(raw.valid)
+            self.assertIsNotNone(raw.demux_index)
+            self.assertEqual(raw.demux_stats.records, len(self.records))
+            self.assertEqual(raw.data_map().size, len(self.records))
+            headings = raw.get_batch(ResonDatagrams.HEADING)
+            self.assertTrue(np.allclose(headings['heading'], 0.1 * np.arange(6)))
+            pings = raw.get_map(ResonDatagrams.TVG)
+            self.assertTrue(np.array_equal(pings['ping_number'], np.arange(100, 106)))
+        self.assertEqual(self.records_path.read_bytes(), b''.join(self.records))
+
+        # reused records file, indexed as a s7k file
+        with Reson7k(self.capture_path, records_path=self.records_path) as raw:
+            self.assertTrue(raw.valid)
+            self.assertIsNone(raw.demux_index)
+            self.assertEqual(raw.data_map().size, len(self.records))
+
+    def test_invalid(self):
+        self.assertFalse(Reson7k(Path("missing.s7k")).valid)
+        self.assertFalse(Reson7k(Path("missing.7k")).valid)
+
+        garbage_path = self.testing.output_data_folder().joinpath("test_reader_garbage.7k")
+        garbage_path.write_bytes(b'\x00' * 100)
+        self.assertFalse(Reson7k(garbage_path).valid)
+        self.assertFalse(garbage_path.with_name(garbage_path.name + '.s7k.tmp').exists())
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawResonDgDemux))
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawResonReader7k))
+    return s
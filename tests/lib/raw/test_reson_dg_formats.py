@@ -0,0 +1,332 @@
+import struct
+import unittest
+
+import numpy as np
+
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import Data1003, Data1013, Data1015, Data1016, Data7006, Data7008, \
+    Data7012, Data7018, Data7027, Data7028, Data7041, Data7042, Data7058, datagram_parsers, parse, register_parser, \
+    ResonDatagrams
+
+
+def make_7027(beams, data_field_size: int) -> bytes:
+    header = struct.pack('<QIH2IBI3f15I', 7125, 42, 0, len(beams), data_field_size, 1, 0, 34482.0, 0.0, 0.5,
+                         *([0] * 15))
+    # the shorter data fields are leading subsets of the 34-byte one
+    detections = b''.join(struct.pack('<H2f2I4f', beam, 100.0 + beam, -0.5 + 0.01 * beam, 1, 3, 0.25, -30.0, 90.0,
+                                      110.0)[:data_field_size] for beam in beams)
+    return header + detections
+
+
+def make_7028(snippets, flags: int = 0) -> bytes:
+    header = struct.pack('<QI2H2BI6I', 7125, 42, 0, len(snippets), 0, 0, flags, *([0] * 6))
+    descriptors = b''.join(struct.pack('<H3I', beam, start, start + len(samples) // 2, start + len(samples) - 1)
+                           for beam, start, samples in snippets)
+    fmt = '<%dI' if flags & 0x01 else '<%dH'
+    samples = b''.join(struct.pack(fmt % len(samples), *samples) for _, _, samples in snippets)
+    return header + descriptors + samples
+
+
+def make_7058(snippets, control_flags: int = 0, error_flag: int = 0) -> bytes:
+    header = struct.pack('<QI2HBI7I', 7125, 42, 0, len(snippets), error_flag, control_flags, *([0] * 7))
+    descriptors = b''.join(struct.pack('<H3I', beam, start, start + len(values) // 2, start + len(values) - 1)
+                           for beam, start, values in snippets)
+    data = b''
+    for _, _, values in snippets:
+        data += struct.pack('<%df' % len(values), *values)
+        if control_flags & Data7058.footprint_flag:
+            data += struct.pack('<%df' % len(values), *[value * 10 for value in values])
+        if control_flags & Data7058.footprint_time_flag:
+            data += struct.pack('<%df' % len(values), *[value * 100 for value in values])
+    return header + descriptors + data
+
+
+def make_7018(num_beams: int, num_samples: int) -> bytes:
+    header = struct.pack('<QI2HI8I', 7125, 42, 0, num_beams, num_samples, *([0] * 8))
+    # stored sample by sample: amplitude = 100 * sample + beam, phase = -beam
+    data = np.zeros((num_samples, num_beams), dtype=[('amplitude', '<u2'), ('phase', '<i2')])
+    data['amplitude'] = 100 * np.arange(num_samples)[:, np.newaxis] + np.arange(num_beams)
+    data['phase'] = -np.arange(num_beams)
+    return header + data.tobytes()
+
+
+def make_7041(beam_samples, flags: int = 0) -> bytes:
+    header = struct.pack('<QI3Hf4I', 7125, 42, 0, len(beam_samples), flags, 34482.0, *([0] * 4))
+    fmt = '<%dH' if flags & 0x01 else '<%dB'
+    return header + b''.join(struct.pack('<HI', beam, len(samples)) + struct.pack(fmt % len(samples), *samples)
+                             for beam, samples in enumerate(beam_samples))
+
+
+def make_7042(beam_samples, flags: int = 0) -> bytes:
+    header = struct.pack('<QI2H4I2fI', 7125, 42, 0, len(beam_samples), 10, 10, flags, 0, 34482.0, 1.0, 0)
+    data = b''
+    for beam, samples in enumerate(beam_samples):
+        data += struct.pack('<H', beam)
+        if flags & 0x4000:
+            data += struct.pack('<B', 7)
+        data += struct.pack('<I', len(samples))
+        for sample in samples:
+            if flags & 0x02:
+                data += struct.pack('<B' if flags & 0x04 else '<H', sample)
+            else:
+                data += struct.pack('<Bb' if flags & 0x04 else '<Hh', sample, -1)
+    return header + data
+
+
+def make_7006(num_beams: int, optional: bool = True) -> bytes:
+    header = struct.pack('<QIHI2Bf', 7125, 42, 0, num_beams, 0, 1, 1500.0)
+    beams = np.arange(num_beams, dtype='<f4')
+    data = (0.01 * beams).astype('<f4').tobytes() + np.full(num_beams, 0x0B, dtype='u1').tobytes() + \
+        (beams + 50).astype('<f4').tobytes() + np.zeros(num_beams, dtype='<f4').tobytes() + \
+        np.ones(num_beams, dtype='<f4').tobytes()
+    if optional:
+        data += struct.pack('<f2dfB5f', 200000.0, 0.75, -1.25, 90.0, 0, 0.1, 1.0, 2.0, 0.3, 4.0)
+        data += np.column_stack((10 + beams, beams * 0, beams - 2, beams * 0.1, beams * 0)).astype('<f4').tobytes()
+    return header + data
+
+
+def make_7008(num_beams: int, num_samples: int, data_sample_type: int, row_column: int) -> bytes:
+    header = struct.pack('<QI3HI2BHI', 7125, 42, 0, num_beams, 0, num_samples, 0, row_column, 0, data_sample_type)
+    descriptors = b''.join(struct.pack('<H2I', beam, 0, num_samples - 1) for beam in range(num_beams))
+    fields = list()
+    for code, dtypes, names in ((data_sample_type & 0x0F, Data7008.magnitude_dtypes, ('amplitude', )),
+                                ((data_sample_type >> 4) & 0x0F, Data7008.phase_dtypes, ('phase', )),
+                                ((data_sample_type >> 8) & 0x0F, Data7008.iq_dtypes, ('i', 'q'))):
+        if code:
+            fields.extend((name, dtypes[code]) for name in names)
+    # amplitude = 100 * beam + sample, the other fields = -amplitude
+    values = 100 * np.arange(num_beams)[:, np.newaxis] + np.arange(num_samples)
+    data = np.zeros((num_beams, num_samples), dtype=fields)
+    for name in data.dtype.names:
+        data[name] = values if name == 'amplitude' else -values
+    if row_column == 1:
+        data = data.T
+    return header + descriptors + np.ascontiguousarray(data).tobytes()
+
+
+def make_1016(num_samples: int, first: int = 0) -> bytes:
+    samples = np.zeros(num_samples, dtype=Data1016.sample_dtype)
+    samples['time_offset'] = 10 * np.arange(num_samples)
+    for n, name in enumerate(('roll', 'pitch', 'heave', 'heading')):
+        samples[name] = first + np.arange(num_samples) + n / 10
+    return struct.pack('<B', num_samples) + samples.tobytes()
+
+
+def make_7012(num_samples: int, flags: int, first: int = 0) -> bytes:
+    chunk = struct.pack('<QIHIHIf', 7125, 42, 0, num_samples, flags, 0, 100.0)
+    if flags & 0x01:
+        chunk += struct.pack('<f', -1.0)
+    for n, flag in enumerate((0x02, 0x04, 0x08)):
+        if flags & flag:
+            chunk += (first + np.arange(num_samples, dtype='<f4') + n / 10).astype('<f4').tobytes()
+    return chunk
+
+
+class TestLibRawResonDgFormats(unittest.TestCase):
+
+    def test_data7027(self):
+        beams = [0, 1, 5, 511]
+        for data_field_size in (22, 26, 34):
+            dg = Data7027(make_7027(beams, data_field_size))
+            self.assertTrue(dg.parse_check)
+            self.assertEqual(dg.ping_number, 42)
+            self.assertEqual(dg.detections.size, 4)
+            self.assertEqual(dg.beam.tolist(), beams)
+            self.assertEqual(dg.detect_point.dtype, np.float32)
+            self.assertEqual(dg.detect_point.tolist(), [100.0, 101.0, 105.0, 611.0])
+            self.assertTrue(np.all(dg.quality_flag == 3))
+            if data_field_size == 22:
+                self.assertIsNone(dg.signal_strength)
+            else:
+                self.assertTrue(np.all(dg.signal_strength == -30.0))
+            if data_field_size == 34:
+                self.assertTrue(np.all(dg.min_limit == 90.0))
+                self.assertTrue(np.all(dg.max_limit == 110.0))
+            else:
+                self.assertIsNone(dg.min_limit)
+
+        self.assertRaises(RuntimeError, Data7027, make_7027(beams, 34)[:-10])
+
+    def test_data7028(self):
+        snippets = [(3, 100, [1, 2, 3]), (4, 90, [4, 5, 6, 7, 8]), (9, 95, [65535])]
+        for flags in (0, 1):
+            chunk = make_7028(snippets, flags=flags)
+            dg = Data7028(chunk)
+            self.assertTrue(dg.parse_check)
+            self.assertEqual(dg.samples.dtype, np.uint32 if flags else np.uint16)
+            self.assertEqual(dg.beam_number.tolist(), [3, 4, 9])
+            self.assertEqual(dg.snippet_start_sample.tolist(), [100, 90, 95])
+            self.assertEqual(dg.sample_offsets.tolist(), [0, 3, 8, 9])
+            self.assertEqual([snippet.tolist() for snippet in dg.snippet], [samples for _, _, samples in snippets])
+            self.assertTrue(np.shares_memory(dg.beam_snippet(1), np.frombuffer(chunk, dtype=np.uint8)))
+
+        empty = Data7028(make_7028([]))
+        self.assertEqual(empty.samples.size, 0)
+        self.assertRaises(RuntimeError, Data7028, make_7028(snippets)[:-2])
+
+    def test_data7058(self):
+        snippets = [(3, 100, [-30.0, -31.0, -32.0]), (4, 90, [-20.0, -21.0]), (9, 95, [-40.0])]
+        dg = Data7058(make_7058(snippets))
+        self.assertEqual(dg.status, "OK")
+        self.assertEqual(dg.beam_number.tolist(), [3, 4, 9])
+        self.assertEqual(dg.bs_strength.dtype, np.float32)
+        self.assertEqual(dg.beam_values(1).tolist(), [-20.0, -21.0])
+        self.assertIsNone(dg.footprint)
+        self.assertIsNone(dg.footprint_time)
+
+        dg = Data7058(make_7058(snippets, control_flags=Data7058.footprint_flag | Data7058.footprint_time_flag))
+        self.assertEqual(dg.bs_strength.tolist(), [-30.0, -31.0, -32.0, -20.0, -21.0, -40.0])
+        self.assertEqual(dg.beam_values(0, 'footprint').tolist(), [-300.0, -310.0, -320.0])
+        self.assertEqual(dg.beam_values(2, 'footprint_time').tolist(), [-4000.0])
+
+        dg = Data7058(make_7058([], error_flag=6))
+        self.assertTrue(dg.parse_check)
+        self.assertEqual(dg.status, "Bottom detection failed")
+        self.assertEqual(dg.bs_strength.size, 0)
+        self.assertRaises(RuntimeError, Data7058, make_7058(snippets)[:-4])
+
+    def test_data7018(self):
+        chunk = make_7018(num_beams=4, num_samples=6)
+        dg = Data7018(chunk)
+        self.assertEqual(dg.amplitude.shape, (4, 6))
+        self.assertEqual(dg.amplitude.dtype, np.uint16)
+        self.assertEqual(dg.amplitude[2].tolist(), [2, 102, 202, 302, 402, 502])
+        self.assertEqual(dg.phase[3, 0], -3)
+        self.assertTrue(np.shares_memory(dg.amplitude, np.frombuffer(chunk, dtype=np.uint8)))
+        self.assertAlmostEqual(float(dg.to_db()[1, 1]), 20 * np.log10(101), places=4)
+
+        dg = Data7018(chunk, beam_step=2, sample_step=3)
+        self.assertEqual(dg.amplitude.tolist(), [[0, 300], [2, 302]])
+        self.assertFalse(np.shares_memory(dg.amplitude, np.frombuffer(chunk, dtype=np.uint8)))
+        self.assertRaises(RuntimeError, Data7018, chunk[:-1])
+
+    def test_data7041(self):
+        for flags in (0x00, 0x01):
+            dg = Data7041(make_7041([[1, 2, 3], [4, 5, 6]], flags=flags))
+            self.assertEqual(dg.amplitude.dtype, np.uint16 if flags else np.uint8)
+            self.assertEqual(dg.amplitude.tolist(), [[1, 2, 3], [4, 5, 6]])
+            self.assertEqual(dg.beam_id.tolist(), [0, 1])
+
+        dg = Data7041(make_7041([[1, 2, 3], [4], [5, 6]]), sample_step=2)
+        self.assertEqual(dg.num_samples.tolist(), [3, 1, 2])
+        self.assertEqual(dg.amplitude.tolist(), [[1, 3], [4, 0], [5, 0]])
+        self.assertRaises(RuntimeError, Data7041, make_7041([[1, 2, 3], [4], [5, 6]])[:-1])
+
+    def test_data7042(self):
+        beam_samples = [[10, 20], [30, 40]]
+        dg = Data7042(make_7042(beam_samples))
+        self.assertEqual(dg.amplitude.dtype, np.uint16)
+        self.assertEqual(dg.amplitude.tolist(), beam_samples)
+        self.assertEqual(dg.phase.tolist(), [[-1, -1], [-1, -1]])
+
+        dg = Data7042(make_7042(beam_samples, flags=0x02 | 0x04 | 0x4000))
+        self.assertTrue(dg.is_db)
+        self.assertIsNone(dg.phase)
+        self.assertEqual(dg.amplitude.dtype, np.uint8)
+        self.assertEqual(dg.segment_number.tolist(), [7, 7])
+        self.assertEqual(dg.to_db().tolist(), [[10.0, 20.0], [30.0, 40.0]])
+
+        dg = Data7042(make_7042([[10, 20, 30], [40]], flags=0x04), beam_step=2)
+        self.assertEqual(dg.amplitude.tolist(), [[10, 20, 30]])
+        self.assertEqual(dg.phase.dtype, np.int8)
+
+    def test_data7006(self):
+        dg = Data7006(make_7006(num_beams=5))
+        self.assertEqual(dg.sound_velocity, 1500.0)
+        self.assertEqual(dg.range.dtype, np.float32)
+        self.assertAlmostEqual(float(dg.range[3]), 0.03, places=6)
+        self.assertEqual(dg.intensity.tolist(), [50.0, 51.0, 52.0, 53.0, 54.0])
+        self.assertEqual(dg.detection_type.tolist(), [2] * 5)
+        self.assertEqual(dg.latitude, 0.75)
+        self.assertEqual(dg.depth.tolist(), [10.0, 11.0, 12.0, 13.0, 14.0])
+        self.assertEqual(dg.across_track[0], -2.0)
+
+        dg = Data7006(make_7006(num_beams=5, optional=False))
+        self.assertEqual(dg.max_filter.tolist(), [1.0] * 5)
+        self.assertIsNone(dg.depth)
+        self.assertRaises(RuntimeError, Data7006, make_7006(num_beams=5, optional=False)[:-1])
+
+        beams = make_7006(num_beams=5, optional=False)
+        dg = Data7006(beams + b'\x00' * 4 + make_7006(num_beams=5)[len(beams):], optional_offset=len(beams) + 4)
+        self.assertEqual(dg.longitude, -1.25)
+        self.assertEqual(dg.depth.tolist(), [10.0, 11.0, 12.0, 13.0, 14.0])
+
+    def test_data7008(self):
+        for data_sample_type in (0x002, 0x003, 0x022, 0x033, 0x100, 0x200, 0x232):
+            for row_column in (0, 1):
+                chunk = make_7008(num_beams=3, num_samples=4, data_sample_type=data_sample_type,
+                                  row_column=row_column)
+                dg = Data7008(chunk)
+                expected = (100 * np.arange(3)[:, np.newaxis] + np.arange(4)).tolist()
+                if data_sample_type & 0x0F:
+                    self.assertEqual(dg.amplitude.shape, (3, 4))
+                    self.assertEqual(dg.amplitude.tolist(), expected)
+                    self.assertTrue(np.shares_memory(dg.amplitude, np.frombuffer(chunk, dtype=np.uint8)))
+                else:
+                    self.assertIsNone(dg.amplitude)
+                if data_sample_type & 0xF0:
+                    self.assertEqual(dg.phase.tolist(), (-np.array(expected)).tolist())
+                if data_sample_type & 0xF00:
+                    self.assertEqual(dg.q.tolist(), (-np.array(expected)).tolist())
+                    self.assertEqual(dg.i.dtype, np.int16 if data_sample_type & 0xF00 == 0x100 else np.int32)
+
+        dg = Data7008(make_7008(num_beams=3, num_samples=4, data_sample_type=0x002, row_column=1), beam_step=2,
+                      sample_step=2)
+        self.assertEqual(dg.amplitude.tolist(), [[0, 2], [200, 202]])
+        self.assertEqual(dg.beam_number.tolist(), [0, 2])
+        chunk = make_7008(num_beams=3, num_samples=4, data_sample_type=0x002, row_column=0)
+        self.assertRaises(RuntimeError, Data7008, chunk[:26] + struct.pack('<I', 0x001) + chunk[30:])
+        self.assertRaises(RuntimeError, Data7008, chunk[:-1])
+
+    def test_parse(self):
+        dg = parse(struct.pack('<f', 12.5), ResonDatagrams.HEADING)
+        self.assertIsInstance(dg, Data1013)
+        self.assertEqual(dg.heading, 12.5)
+        self.assertEqual(parse(struct.pack('<f', 12.5), 1013).heading, 12.5)
+        self.assertFalse(hasattr(dg, '__dict__'))
+        self.assertIsNone(parse(b'', 1))
+
+        register_parser(1, Data1013)
+        try:
+            self.assertEqual(parse(struct.pack('<f', 1.0), 1).heading, 1.0)
+        finally:
+            del datagram_parsers[1]
+
+    def test_data1003(self):
+        chunk = struct.pack('<If3d5B', 0, 0.5, 0.7, -1.2, 3.5, 1, 19, 2, 3, 12)
+        dg = Data1003(chunk)
+        self.assertEqual((dg.latency, dg.latitude, dg.longitude, dg.datum_height), (0.5, 0.7, -1.2, 3.5))
+        self.assertEqual((dg.position_flag, dg.utm_zone, dg.qual_flag, dg.position_method, dg.num_of_satelites),
+                         (1, 19, 2, 3, 12))
+        header = np.frombuffer(chunk, dtype=Data1003.header_dtype)
+        self.assertEqual(header['utm_zone'][0], 19)
+
+    def test_data1015(self):
+        dg = Data1015(struct.pack('<B2d6f', 1, 0.7, -1.2, 0.5, 3.0, 0.25, 2.0, 1.5, 1.0))
+        self.assertEqual((dg.vertical_reference, dg.latitude, dg.longitude), (1, 0.7, -1.2))
+        self.assertEqual((dg.speed_over_ground, dg.course_over_ground, dg.heading), (2.0, 1.5, 1.0))
+
+    def test_data1016(self):
+        dg = Data1016(make_1016(3, first=5))
+        self.assertEqual(dg.num_samples, 3)
+        self.assertEqual(dg.time_offset.tolist(), [0, 10, 20])
+        self.assertEqual(dg.roll.tolist(), [5.0, 6.0, 7.0])
+        self.assertAlmostEqual(float(dg.heading[0]), 5.3, places=5)
+        self.assertRaises(RuntimeError, Data1016, make_1016(3)[:-1])
+
+    def test_data7012(self):
+        dg = Data7012(make_7012(4, flags=0x0F))
+        self.assertEqual(dg.pitch, -1.0)
+        self.assertEqual(dg.roll.tolist(), [0.0, 1.0, 2.0, 3.0])
+        self.assertAlmostEqual(float(dg.heave[3]), 3.2, places=5)
+
+        dg = Data7012(make_7012(4, flags=0x08))
+        self.assertIsNone(dg.pitch)
+        self.assertIsNone(dg.roll)
+        self.assertAlmostEqual(float(dg.heave[0]), 0.2, places=5)
+        self.assertRaises(RuntimeError, Data7012, make_7012(4, flags=0x0F)[:-1])
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawResonDgFormats))
+    return s
@@ -0,0 +1,125 @@
+from pathlib import Path
+import unittest
+
+from netCDF4 import Dataset, VLType
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.nc_helper import NetCDFHelper
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams
+from hyo2.openbst.lib.raw.parsers.reson.imports import RawImport
+from hyo2.openbst.lib.raw.parsers.reson.reader import Reson
+from hyo2.openbst.lib.raw.snippets import Snippets
+from tests.lib.raw.test_reson_dg_batch import make_7000, make_7004, make_7010
+from tests.lib.raw.test_reson_dg_formats import make_1016, make_7027, make_7028
+from tests.lib.raw.test_reson_reader import make_heading, make_position, make_record
+
+
+def make_pings(num_pings: int) -> list:
+    records = list()
+    for n in range(num_pings):
+        seconds = float(n)
+        records.append(make_position(seconds=seconds))
+        records.append(make_record(1016, make_1016(num_samples=3, first=n), seconds=seconds + 0.1))
+        records.append(make_heading(seconds=seconds + 0.2, heading=0.1 * n))
+        records.append(make_record(7000, make_7000(ping_number=n, frequency=200000.0 + n), seconds=seconds + 0.3))
+        records.append(make_record(7004, make_7004(num_beams=4 + n), seconds=seconds + 0.3))
+        records.append(make_record(7010, make_7010(num_samples=5 + n), seconds=seconds + 0.3))
+        records.append(make_record(7027, make_7027(range(4 + n), data_field_size=34), seconds=seconds + 0.3))
+        snippets = [(beam, 100 * beam, list(range(beam + n + 1))) for beam in range(2, 4 + n)]
+        records.append(make_record(7028, make_7028(snippets), seconds=seconds + 0.3))
+    # a late ping written ahead of its predecessors: the rows are in time order, not in file order
+    records = records[-8:] + records[:-8]
+    return records
+
+
+class TestLibRawResonImports(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.s7k_path = cls.testing.output_data_folder().joinpath("test_imports.s7k")
+        with open(str(cls.s7k_path), 'wb') as fod:
+            fod.write(b''.join(make_pings(num_pings=7)))
+
+    def import_raw(self, single_pass: bool) -> Dataset:
+        ds = Dataset("test_imports_%s.nc" % single_pass, mode='w', diskless=True)
+        NetCDFHelper.init(ds=ds)
+        with Reson(self.s7k_path) as raw:
+            raw.iter_chunk_size = 5  # slabs mixing the record types
+            raw.data_map()
+            self.assertTrue(RawImport.import_raw(raw=raw, ds=ds, single_pass=single_pass))
+        return ds
+
+    def assert_groups(self, expected: Dataset, actual: Dataset):
+        self.assertEqual(sorted(expected.groups.keys()), sorted(actual.groups.keys()))
+        for name, grp in expected.groups.items():
+            self.assertEqual(list(grp.variables.keys()), list(actual.groups[name].variables.keys()), name)
+            for varname, var in grp.variables.items():
+                other = actual.groups[name].variables[varname]
+                self.assertEqual(var.shape, other.shape, varname)
+                if isinstance(var.datatype, VLType):
+                    for row in range(var.shape[0]):
+                        self.assertTrue(np.array_equal(var[row], other[row]), varname)
+                else:
+                    values, other_values = var[:], other[:]
+                    self.assertTrue(np.array_equal(np.ma.getmaskarray(values), np.ma.getmaskarray(other_values)),
+                                    varname)
+                    np.testing.assert_array_equal(np.ma.getdata(values), np.ma.getdata(other_values), varname)
+
+    def test_single_pass(self):
+        expected = self.import_raw(single_pass=False)
+        actual = self.import_raw(single_pass=True)
+
+        self.assert_groups(expected=expected, actual=actual)
+        self.assertTrue(np.all(np.diff(actual["runtime_settings"].variables["time"][:]) > 0))
+        self.assertTrue(np.array_equal(actual["runtime_settings"].variables["frequency"][:],
+                                       200000.0 + np.arange(7)))
+        self.assertEqual(actual["attitude"].variables["roll"].shape, (21,))
+
+        # the snippets of the late ping are stored in time order (contiguous ragged), with the logged samples only
+        num_samples = sum(beam + n + 1 for n in range(7) for beam in range(2, 4 + n))
+        self.assertEqual(actual["snippets"].variables["snippets"].shape, (num_samples,))
+        self.assertEqual(actual["snippets"].variables["snippets"].dtype, np.uint16)
+        snippet_count = actual["snippets"].variables["snippet_count"][:]
+        self.assertTrue(np.array_equal(actual["snippets"].variables["snippet_start_index"][:],
+                                       np.cumsum(snippet_count) - snippet_count))
+        sample_count = actual["snippets"].variables["sample_count"][:]
+        self.assertTrue(np.array_equal(actual["snippets"].variables["sample_start_index"][:],
+                                       np.cumsum(sample_count) - sample_count))
+        for ping in (0, 6):
+            snippets = Snippets.read_ping(grp=actual["snippets"], ping=ping)
+            self.assertEqual(snippets.time, actual["snippets"].variables["time"][ping])
+            self.assertTrue(np.array_equal(snippets.beam_index, np.arange(2, 4 + ping)))
+            self.assertTrue(np.array_equal(snippets.snippet_start_sample, 100 * np.arange(2, 4 + ping)))
+            for beam, samples in zip(snippets.beam_index.tolist(), snippets.samples):
+                self.assertTrue(np.array_equal(samples, np.arange(beam + ping + 1)))
+        expected.close()
+        actual.close()
+
+    def test_snippet_datatype(self):
+        with Reson(self.s7k_path) as raw:
+            raw.data_map()
+            self.assertEqual(RawImport.snippet_datatype(raw=raw), "u2")
+
+        wide_path = self.testing.output_data_folder().joinpath("test_imports_wide.s7k")
+        with open(str(wide_path), 'wb') as fod:
+            fod.write(make_record(7028, make_7028([(2, 0, [7, 1])]), seconds=0.0))
+            fod.write(make_record(7028, make_7028([(2, 0, [70000, 1])], flags=0x01), seconds=1.0))  # 32-bit
+        with Reson(wide_path) as raw:
+            raw.data_map()
+            self.assertEqual(raw.get_map(ResonDatagrams.SNIPPETDATA)['record_flags'].tolist(), [0, 1])
+            self.assertEqual(RawImport.snippet_datatype(raw=raw), "u4")
+
+            ds = Dataset("test_imports_wide.nc", mode='w', diskless=True)
+            NetCDFHelper.init(ds=ds)
+            self.assertTrue(RawImport.import_raw(raw=raw, ds=ds, single_pass=True))
+            self.assertEqual(ds["snippets"].variables["snippets"].dtype, np.uint32)
+            self.assertEqual(Snippets.read_ping(grp=ds["snippets"], ping=1).samples[0].tolist(), [70000, 1])
+            ds.close()
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawResonImports))
+    return s
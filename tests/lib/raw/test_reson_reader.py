@@ -0,0 +1,328 @@
+import calendar
+from datetime import datetime
+import os
+from pathlib import Path
+import struct
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from hyo2.abc.lib.testing_paths import TestingPaths
+from hyo2.openbst.lib.raw.parsers.reson import dg_index
+from hyo2.openbst.lib.raw.parsers.reson.dg_formats import ResonDatagrams
+from hyo2.openbst.lib.raw.parsers.reson.reader import Reson
+from tests.lib.raw.test_reson_dg_formats import make_7006
+
+
+def make_record(record_type: int, body: bytes, seconds: float = 12.5, device_id: int = 7125,
+                opd_offset: int = 0) -> bytes:
+    size = 64 + len(body) + 4
+    header = struct.pack('<2H4I2Hf2BH2I2HI2H3I', 5, 60, 65535, size, opd_offset, 0, 2019, 100, seconds, 10, 30, 1,
+                         record_type, device_id, 0, 0, 0, 0, 0, 0, 0, 0)
+    return header + body + struct.pack('<I', 0)
+
+
+def make_position(seconds: float) -> bytes:
+    return make_record(1003, struct.pack('<If3d5B', 0, 0.0, 0.75, -1.25, 3.0, 0, 0, 1, 2, 9), seconds=seconds)
+
+
+def make_heading(seconds: float, heading: float, device_id: int = 7125) -> bytes:
+    return make_record(1013, struct.pack('<f', heading), seconds=seconds, device_id=device_id)
+
+
+def make_ping_record(record_type: int, seconds: float, ping_number: int) -> bytes:
+    return make_record(record_type, struct.pack('<QIH', 7125, ping_number, 0) + b'\x00' * 16, seconds=seconds)
+
+
+class TestLibRawResonReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.testing = TestingPaths(root_folder=Path(__file__).parent.parent.parent.parent.resolve())
+        cls.s7k_path = cls.testing.output_data_folder().joinpath("test_reader.s7k")
+        with open(str(cls.s7k_path), 'wb') as fod:
+            for n in range(10):
+                fod.write(make_position(seconds=float(n)))
+                fod.write(make_heading(seconds=n + 0.5, heading=0.1 * n))
+            fod.write(b'\x00\x01\x02')  # garbage between records
+            fod.write(make_heading(seconds=30.0, heading=1.0))
+
+        cls.pings_path = cls.testing.output_data_folder().joinpath("test_reader_pings.s7k")
+        with open(str(cls.pings_path), 'wb') as fod:
+            for n in range(20):
+                fod.write(make_ping_record(7010, seconds=n * 0.5, ping_number=100 + n))
+                fod.write(make_heading(seconds=n * 0.5 + 0.1, heading=0.1, device_id=n % 2))
+
+        cls.corrupted_path = cls.testing.output_data_folder().joinpath("test_reader_corrupted.s7k")
+        with open(str(cls.corrupted_path), 'wb') as fod:
+            fod.write(make_heading(seconds=1.0, heading=0.5))
+            # a payload carrying a sync pattern and a plausible record type
+            fod.write(make_record(7999, b'\x00' * 8 + struct.pack('<2H2I', 5, 60, 65535, 80) + b'\x00' * 20 +
+                                  struct.pack('<I', 1013) + b'\x00' * 64))
+            fod.write(b'\xff' * 5000)  # long corrupted stretch
+            fod.write(make_heading(seconds=2.0, heading=1.5))
+            fod.write(make_position(seconds=3.0)[:-10])  # truncated at the end of file
+
+        cls.empty_path = cls.testing.output_data_folder().joinpath("test_reader_empty.s7k")
+        cls.empty_path.open('wb').close()
+
+    def test_mmap_map_matches_buffered(self):
+        with Reson(self.s7k_path) as buffered, Reson(self.s7k_path, use_mmap=True) as mapped:
+            self.assertFalse(buffered.is_mmapped)
+            self.assertTrue(mapped.is_mmapped)
+            self.assertTrue(np.array_equal(buffered.data_map(), mapped.data_map()))
+
+    def test_mmap_datagrams(self):
+        with Reson(self.s7k_path, use_mmap=True) as raw:
+            headings = raw.get_datagram(ResonDatagrams.HEADING)
+            self.assertEqual(len(headings), 11)
+            self.assertAlmostEqual(headings[3].heading, 0.3, places=6)
+            positions = raw.get_datagram(ResonDatagrams.POSITION)
+            self.assertEqual(positions[0].latitude, 0.75)
+
+    def test_map_table(self):
+        with Reson(self.s7k_path) as raw:
+            dg_map = raw.data_map()
+            self.assertEqual(dg_map.dtype, dg_index.map_dtype)
+            headings = raw.get_map(ResonDatagrams.HEADING)
+            self.assertEqual(headings.size, 11)
+            self.assertTrue(np.all(np.diff(headings['time']) > 0))
+            self.assertTrue(np.all(headings['record_type'] == 1013))
+            self.assertTrue(np.all(headings['ping_number'] == dg_index.no_ping))
+            self.assertEqual(raw.get_map(ResonDatagrams.SNIPPETDATA).size, 0)
+
+    def test_query_map(self):
+        with Reson(self.pings_path) as raw:
+            t0 = raw.get_map(ResonDatagrams.TVG)['time'][0]
+            self.assertEqual(t0, raw.to_map_time(datetime(2019, 4, 10, 10, 30)))
+            tvg = raw.query_map(ResonDatagrams.TVG, dg_time=(t0 + 1000, t0 + 2000))
+            self.assertEqual(tvg['ping_number'].tolist(), [102, 103, 104])
+            tvg = raw.query_map(ResonDatagrams.TVG, dg_time=(None, t0 + 2000), dg_ping_range=(101, 103))
+            self.assertEqual(tvg['ping_number'].tolist(), [101, 102, 103])
+            tvg = raw.query_map(ResonDatagrams.TVG, dg_record_range=range(5), dg_ping_range=(103, None))
+            self.assertEqual(tvg['ping_number'].tolist(), [103, 104])
+            headings = raw.get_datagram(ResonDatagrams.HEADING, dg_time=(t0, t0 + 2000), device_id=1)
+            self.assertEqual(len(headings), 2)
+            self.assertRaises(RuntimeError, raw.query_map, ResonDatagrams.TVG, dg_record_range=[20])
+
+    def test_get_time(self):
+        rng = np.random.RandomState(42)
+        years = rng.randint(1990, 2040, 1000)
+        days = rng.randint(1, 366, 1000)
+        hours = rng.randint(0, 24, 1000)
+        minutes = rng.randint(0, 60, 1000)
+        seconds = (rng.random_sample(1000) * 60).astype(np.float32)
+
+        times = Reson.get_time(years, days, hours, minutes, seconds)
+        for n in range(1000):
+            timestruct = time.strptime('%d, %d, %d, %d' % (years[n], days[n], hours[n], minutes[n]),
+                                       '%Y, %j, %H, %M')
+            expected = (calendar.timegm(timestruct) + float(seconds[n])) * 1000
+            self.assertEqual(times[n], expected)
+            self.assertEqual(Reson.get_time(int(years[n]), int(days[n]), int(hours[n]), int(minutes[n]),
+                                            float(seconds[n])), expected)
+
+    def test_get_batch(self):
+        tvg_path = self.testing.output_data_folder().joinpath("test_reader_tvg.s7k")
+        with open(str(tvg_path), 'wb') as fod:
+            for n in (2, 0, 1):  # records out of time order
+                body = struct.pack('<QIHI8I', 7125, 10 + n, 0, n + 1, *([0] * 8)) + struct.pack('<%df' % (n + 1),
+                                                                                           *range(n + 1))
+                fod.write(make_record(7010, body, seconds=float(n)))
+
+        with Reson(tvg_path) as raw:
+            batch = raw.get_batch(ResonDatagrams.TVG)
+            self.assertEqual(batch['ping_number'].tolist(), [10, 11, 12])
+            self.assertTrue(np.all(np.diff(batch.time) > 0))
+            self.assertEqual(batch.record('tvg_curve', 2).tolist(), [0.0, 1.0, 2.0])
+            self.assertEqual(len(raw.get_batch(ResonDatagrams.TVG, dg_ping_range=(11, None))), 2)
+
+    def test_get_batch_fixed_size(self):
+        heading_path = self.testing.output_data_folder().joinpath("test_reader_heading.s7k")
+        with open(str(heading_path), 'wb') as fod:
+            for n in (3, 0, 2, 1):  # records out of time order
+                fod.write(make_record(1013, struct.pack('<f', 10.0 * n), seconds=float(n)))
+
+        for use_mmap in (False, True):
+            with Reson(heading_path, use_mmap=use_mmap) as raw:
+                batch = raw.get_batch(ResonDatagrams.HEADING)
+                self.assertEqual(batch['heading'].tolist(), [0.0, 10.0, 20.0, 30.0])
+                self.assertTrue(np.all(np.diff(batch.time) > 0))
+                self.assertEqual(len(raw.get_batch(ResonDatagrams.HEADING, dg_record_range=(1, 2))), 2)
+                self.assertEqual(len(raw.get_batch(ResonDatagrams.POSITION)), 0)
+
+    def test_iter_water_column(self):
+        wc_path = self.testing.output_data_folder().joinpath("test_reader_wc.s7k")
+        with open(str(wc_path), 'wb') as fod:
+            for n in range(3):
+                body = struct.pack('<QI2HI8I', 7125, n, 0, 4, 6, *([0] * 8)) + \
+                       np.full(24, n, dtype=[('amplitude', '<u2'), ('phase', '<i2')]).tobytes()
+                fod.write(make_record(7018, body, seconds=float(n)))
+
+        for use_mmap in (False, True):
+            with Reson(wc_path, use_mmap=use_mmap) as raw:
+                pings = list(raw.iter_water_column(ResonDatagrams.BEAMFORMEDDATA, beam_step=2, sample_step=2))
+                self.assertEqual([datapacket.ping_number for datapacket in pings], [0, 1, 2])
+                self.assertEqual(pings[2].amplitude.shape, (2, 3))
+                self.assertTrue(np.all(pings[2].amplitude == 2))
+                self.assertRaises(RuntimeError, next, raw.iter_water_column(ResonDatagrams.HEADING))
+
+    def test_optional_data(self):
+        # padding between the beams and the optional data, located by the opd_offset of the record frame
+        beams = make_7006(num_beams=5, optional=False)
+        optional = make_7006(num_beams=5)[len(beams):]
+        opd_path = self.testing.output_data_folder().joinpath("test_reader_opd.s7k")
+        with open(str(opd_path), 'wb') as fod:
+            fod.write(make_record(7006, beams + b'\x00' * 8 + optional, seconds=0.0,
+                                  opd_offset=64 + len(beams) + 8))
+
+        with Reson(opd_path) as raw:
+            datapacket, = raw.get_datagram(ResonDatagrams.BATHYDATA)
+            self.assertEqual(datapacket.latitude, 0.75)
+            self.assertEqual(datapacket.depth.tolist(), [10.0, 11.0, 12.0, 13.0, 14.0])
+            (_, datapacket), = raw.iter_datagrams(types=ResonDatagrams.BATHYDATA)
+            self.assertEqual(datapacket.across_track[0], -2.0)
+
+    def test_iter_datagrams(self):
+        for use_mmap in (False, True):
+            with Reson(self.s7k_path, use_mmap=use_mmap) as raw:
+                raw.iter_chunk_size = 4
+                records = list(raw.iter_datagrams(types=[ResonDatagrams.POSITION, ResonDatagrams.HEADING]))
+                self.assertEqual(len(records), 21)
+                self.assertEqual([dg_type for dg_type, _ in records[:3]],
+                                 [ResonDatagrams.POSITION, ResonDatagrams.HEADING, ResonDatagrams.POSITION])
+                self.assertAlmostEqual(records[3][1].heading, 0.1, places=6)
+
+                headings = [datapacket for dg_type, datapacket in records if dg_type is ResonDatagrams.HEADING]
+                ahead = list(raw.iter_datagrams(types=ResonDatagrams.HEADING, read_ahead=50))
+                self.assertEqual([datapacket.heading for _, datapacket in ahead],
+                                 [datapacket.heading for datapacket in headings])
+                self.assertEqual([datapacket.time for _, datapacket in ahead],
+                                 [datapacket.time for datapacket in headings])
+
+                batches = list(raw.iter_datagrams(types=[ResonDatagrams.POSITION, ResonDatagrams.HEADING],
+                                                  batch_size=4))
+                self.assertEqual([len(batch) for _, batch in batches], [4, 4, 4, 4, 2, 3])
+
+    def test_plan_reads(self):
+        locations = np.array([0, 10, 20, 100, 110, 500])
+        sizes = np.array([10, 5, 10, 10, 10, 10])
+        starts, ends, firsts = Reson.plan_reads(locations, sizes, max_read_gap=5, max_read_size=1000)
+        self.assertEqual(starts.tolist(), [0, 100, 500])
+        self.assertEqual(ends.tolist(), [30, 120, 510])
+        self.assertEqual(firsts.tolist(), [0, 3, 5])
+        starts, ends, firsts = Reson.plan_reads(locations, sizes, max_read_gap=1000, max_read_size=100)
+        self.assertEqual(starts.tolist(), [0, 100, 500])
+        self.assertEqual(ends.tolist(), [30, 120, 510])
+
+    def test_coalesced_reads(self):
+        with Reson(self.s7k_path) as raw:
+            expected = [datapacket.heading for datapacket in raw.get_datagram(ResonDatagrams.HEADING)]
+            raw.max_read_gap = 0
+            self.assertEqual([datapacket.heading for datapacket in raw.get_datagram(ResonDatagrams.HEADING)],
+                             expected)
+
+            reads = list()
+            read = raw.read
+
+            def counted_read(location, size):
+                reads.append((location, size))
+                return read(location, size)
+
+            raw.read = counted_read
+            raw.max_read_gap = 1024
+            self.assertEqual([datapacket.heading for datapacket in raw.get_datagram(ResonDatagrams.HEADING)],
+                             expected)
+            self.assertEqual(len(reads), 1)
+
+    def test_prefetch(self):
+        with Reson(self.s7k_path) as raw:
+            expected = [datapacket.heading for datapacket in raw.get_datagram(ResonDatagrams.HEADING)]
+            raw.max_read_gap = 0
+            raw.prefetch_buffers = 2
+            self.assertEqual([datapacket.heading for datapacket in raw.get_datagram(ResonDatagrams.HEADING)],
+                             expected)
+            self.assertEqual(raw.prefetch_stats.buffers, 11)
+            self.assertEqual(raw.prefetch_stats.bytes, 11 * 4)  # the heading data sections
+
+            # leaving the iteration early stops the reading thread
+            threads = threading.active_count()
+            for _ in raw.iter_datagrams(types=ResonDatagrams.HEADING):
+                break
+            self.assertEqual(threading.active_count(), threads)
+
+    def test_corrupted_map(self):
+        for use_mmap in (False, True):
+            with Reson(self.corrupted_path, use_mmap=use_mmap) as raw:
+                raw.data_map()
+                self.assertEqual(sorted(raw.map_types.keys()), [1013, 7999])
+                self.assertEqual(raw.get_map(ResonDatagrams.HEADING).size, 2)
+                headings = raw.get_datagram(ResonDatagrams.HEADING)
+                self.assertAlmostEqual(headings[1].heading, 1.5)
+
+    def test_overlap_chain(self):
+        # each record carries a false sync ending at the next record: a long chain of overlapping candidates
+        num_records = 5000
+        candidates = np.zeros(2 * num_records, dtype=dg_index.index_dtype)
+        candidates['offset'][0::2] = 100 * np.arange(num_records)
+        candidates['size'][0::2] = 100
+        candidates['offset'][1::2] = 100 * np.arange(num_records) + 50
+        candidates['size'][1::2] = 50
+        mask = dg_index.select_records(candidates=candidates, file_length=100 * num_records)
+        self.assertTrue(np.array_equal(np.flatnonzero(mask), 2 * np.arange(num_records)))
+
+    def test_small_blocks(self):
+        with Reson(self.s7k_path) as raw:
+            dg_map = raw.data_map()
+        with Reson(self.s7k_path) as raw:
+            raw.block_size = 50
+            self.assertTrue(np.array_equal(raw.data_map(), dg_map))
+
+    def test_parallel_map(self):
+        for path in (self.s7k_path, self.corrupted_path):
+            with Reson(path) as raw:
+                raw.block_size = 64
+                dg_map = raw.data_map()
+                serial_index = raw.index
+            with Reson(path, workers=3) as raw:
+                raw.block_size = 64
+                self.assertTrue(np.array_equal(raw.data_map(), dg_map))
+                self.assertTrue((raw.index == serial_index).all())
+
+    def test_index_sidecar(self):
+        index_path = self.testing.output_data_folder().joinpath("test_reader.idx")
+        if index_path.exists():
+            os.remove(str(index_path))
+
+        with Reson(self.s7k_path, index_path=index_path) as raw:
+            dg_map = raw.data_map()
+        self.assertTrue(index_path.exists())
+
+        with Reson(self.s7k_path, index_path=index_path) as raw:
+            key = dg_index.source_key(read=raw.read, file_length=raw.file_length, file_mtime=raw.file_mtime)
+            self.assertEqual(dg_index.load_index(path=index_path, key=key).size, 21)
+            self.assertTrue(np.array_equal(raw.data_map(), dg_map))
+
+        stale_key = (key[0], key[1] + 1, key[2])
+        self.assertIsNone(dg_index.load_index(path=index_path, key=stale_key))
+
+    def test_mmap_fallback(self):
+        raw = Reson(self.empty_path, use_mmap=True)
+        self.assertTrue(raw.valid)
+        self.assertFalse(raw.is_mmapped)
+        raw.close()
+
+    def test_close(self):
+        raw = Reson(self.s7k_path, use_mmap=True)
+        raw.data_map()
+        raw.close()
+        self.assertFalse(raw.is_mmapped)
+        self.assertIsNone(raw.file)
+
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTests(unittest.TestLoader().loadTestsFromTestCase(TestLibRawResonReader))
+    return s